@@ -0,0 +1,79 @@
+
+# Usage: pipenv run python EncoderNode.py [--host 127.0.0.1] [--port 7010] [--capacity 2] [--encoder FFmpeg --encoder NVEncC]
+
+# KonomiTV のエンコーダーノードを起動する
+# KonomiTV サーバーの config.yaml の tv.encoder_nodes に tcp://(このマシンのホスト名):(ポート) を追加すると、
+# ライブストリームのエンコード (tsreadex + エンコーダー) がこのノードに割り振られるようになる
+# エンコーダーノードを動かすマシンにも、サードパーティーライブラリ (tsreadex・エンコーダー) と config.yaml の配置が必要
+# config.yaml の tv.encoder_node_secret には、KonomiTV サーバーと同じ共有シークレットを設定する必要がある
+# デフォルトではこのマシンからの接続のみ受け付けるため、他の PC の KonomiTV サーバーから使う場合は --host 0.0.0.0 などを指定する
+
+import argparse
+import asyncio
+import logging.config
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+from app.constants import CONFIG, LIBRARY_PATH, LOGGING_CONFIG
+from app.utils import Logging
+from app.utils.EncoderNode import EncoderNodeServer
+
+
+def main():
+
+    # 引数解析
+    parser = argparse.ArgumentParser(
+        formatter_class = argparse.RawTextHelpFormatter,
+        description = 'KonomiTV Encoder Node: runs live encoding pipelines on behalf of KonomiTV servers',
+    )
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=7010, help='port to listen on (default: 7010)')
+    parser.add_argument('--capacity', type=int, default=2, help='maximum number of concurrent encodes (default: 2)')
+    parser.add_argument('--encoder', type=str, action='append', choices=['FFmpeg', 'QSVEncC', 'NVEncC', 'VCEEncC', 'rkmppenc'],
+        help='encoders available on this node (default: FFmpeg and the encoder in config.yaml)')
+    args = parser.parse_args()
+
+    # Uvicorn と同じロギング設定を使う
+    logging.config.dictConfig(LOGGING_CONFIG)
+
+    # KonomiTV サーバーとの通信に使う共有シークレットが設定されているかをチェック
+    ## 共有シークレットなしで起動すると、ネットワーク上の誰からでもエンコードを依頼できてしまう
+    if not CONFIG['tv']['encoder_node_secret']:
+        Logging.error('エンコーダーノードとの通信に使う共有シークレットが設定されていないため、エンコーダーノードを起動できません。')
+        Logging.error('config.yaml の tv.encoder_node_secret に、KonomiTV サーバーと同じ共有シークレットを設定してください。')
+        sys.exit(1)
+
+    # 利用可能なエンコーダー
+    encoders: list[str] = args.encoder if args.encoder is not None else sorted({'FFmpeg', CONFIG['general']['encoder']})
+
+    # tsreadex と指定されたエンコーダーが配置されているかをチェック
+    for library_name in ['tsreadex', *encoders]:
+        if Path(LIBRARY_PATH[library_name]).is_file() is False:
+            Logging.error(f'{library_name} がサードパーティーライブラリとして配置されていないため、エンコーダーノードを起動できません。')
+            sys.exit(1)
+
+    # HWEncC が指定されているときは、--check-hw でハードウェアエンコーダーが利用できるかをチェック
+    for encoder in encoders:
+        if encoder == 'FFmpeg':
+            continue
+        result = subprocess.run([LIBRARY_PATH[encoder], '--check-hw'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        if 'unavailable.' in result.stdout.decode('utf-8'):
+            Logging.error(f'お使いの環境では {encoder} がサポートされていないため、エンコーダーノードを起動できません。')
+            sys.exit(1)
+
+    # エンコーダーノードを起動
+    ## Windows では asyncio.subprocess を使うため ProactorEventLoop (デフォルト) のまま実行する
+    server = EncoderNodeServer(args.capacity, encoders, CONFIG['tv']['encoder_node_secret'])
+    if os.name != 'nt':
+        import uvloop
+        uvloop.install()
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,7 @@ import asyncio
 import atexit
 import logging
 import logging.config
+import multiprocessing
 import os
 import platform
 import psutil
@@ -30,6 +31,34 @@ from app.constants import (
 )
 
 
+def RunAPIWorkers(port: int, workers: int) -> None:
+    """
+    API ワーカープロセスを指定された数だけ起動する (server.workers に 2 以上が指定されているときのみ、別プロセスで実行される)
+    API ワーカーは Akebi からのリクエストを Uvicorn のマルチプロセスモードで並列に処理し、
+    ライブストリーム関連の API はストリーム管理プロセス (ポート + 11) に中継する
+
+    Args:
+        port (int): KonomiTV サーバーのリッスンポート
+        workers (int): API ワーカープロセスの数
+    """
+
+    # この環境変数を引き継いで起動された Uvicorn のワーカープロセスは API ワーカーとして振る舞う
+    os.environ['KONOMITV_API_WORKER'] = '1'
+
+    # Uvicorn をマルチプロセスモードで起動
+    ## Uvicorn のワーカープロセスはすべて同じソケット (ポート + 10) でリクエストを待ち受ける
+    uvicorn.run(
+        app = 'app.app:app',
+        host = '127.0.0.77',
+        port = port + 10,
+        workers = workers,
+        log_config = LOGGING_CONFIG,
+        interface = 'asgi3',
+        http = 'httptools',
+        loop = ('asyncio' if os.name == 'nt' else 'uvloop'),
+    )
+
+
 def main():
 
     # 引数解析
@@ -135,6 +164,10 @@ def main():
         logger.error(f'ポート {port + 10} は他のプロセスで使われているため、KonomiTV を起動できません。')
         logger.error(f'重複して KonomiTV を起動していないか、他のソフトでポート {port + 10} を使っていないかを確認してください。')
         sys.exit(1)
+    if CONFIG['server']['workers'] >= 2 and (port + 11) in used_ports:
+        logger.error(f'ポート {port + 11} は他のプロセスで使われているため、KonomiTV を起動できません。')
+        logger.error(f'重複して KonomiTV を起動していないか、他のソフトでポート {port + 11} を使っていないかを確認してください。')
+        sys.exit(1)
 
     # ***** カスタム HTTPS 証明書/秘密鍵のバリデーション *****
 
@@ -166,6 +199,12 @@ def main():
         logger.error(error)
         sys.exit(1)
 
+    # エンコーダーノードを使う場合は、エンコーダーノードとの通信に使う共有シークレットが必須
+    if len(CONFIG['tv']['encoder_nodes']) > 0 and not CONFIG['tv']['encoder_node_secret']:
+        logger.error('エンコーダーノードとの通信に使う共有シークレットが設定されていないため、KonomiTV を起動できません。')
+        logger.error('config.yaml の tv.encoder_node_secret に、エンコーダーノードと同じ共有シークレットを設定してください。')
+        sys.exit(1)
+
     # ***** ハードウェアエンコーダーのバリデーション *****
 
     # HWEncC が指定されているときのみ、--check-hw でハードウェアエンコーダーが利用できるかをチェック
@@ -260,6 +299,27 @@ def main():
         logger.warning('Python の asyncio の技術的な制約により、Windows では自動リロードモードは事実上利用できません。')
         logger.warning('なお、外部プロセス実行を伴うストリーミング視聴を行わなければ一応 Windows でも機能します。')
 
+    # API ワーカープロセスを起動する (server.workers に 2 以上が指定されているときのみ)
+    ## このプロセスはチューナー・エンコードタスク・ライブストリームを管理するストリーム管理プロセスとして、
+    ## Akebi からは直接アクセスされないポート + 11 でリッスンする
+    ## 自動リロードモードでは API ワーカープロセスを再起動できないため、常に単一プロセスで起動する
+    uvicorn_port = port + 10
+    if CONFIG['server']['workers'] >= 2:
+        if is_reload is True:
+            logger.warning('自動リロードモードでは、API ワーカープロセスは起動されません。')
+        else:
+            api_workers_process = multiprocessing.Process(
+                target = RunAPIWorkers,
+                args = (port, CONFIG['server']['workers']),
+                name = 'KonomiTV-API-Workers',
+            )
+            api_workers_process.start()
+            uvicorn_port = port + 11
+            logger.info(f'Started {CONFIG["server"]["workers"]} API worker processes.')
+
+            # このプロセスが終了されたときに、API ワーカープロセスも一緒に終了する
+            atexit.register(lambda: api_workers_process.terminate())
+
     # Uvicorn の設定
     config = uvicorn.Config(
         # 起動するアプリケーション
@@ -269,8 +329,8 @@ def main():
         ## 混乱を避けるため、容易にアクセスされないだろう 127.0.0.77 のみでリッスンしている
         host = '127.0.0.77',
         # リッスンするポート番号
-        ## 指定されたポートに 10 を足したもの
-        port = port + 10,
+        ## 指定されたポートに 10 を足したもの (API ワーカープロセスを起動したときは 11 を足したもの)
+        port = uvicorn_port,
         # 自動リロードモードモードで起動するか
         reload = is_reload,
         # リロードするフォルダ
@@ -13,15 +13,17 @@ from fastapi.staticfiles import StaticFiles
 from fastapi_utils.tasks import repeat_every
 from pathlib import Path
 
-from app.constants import CONFIG, CLIENT_DIR, DATABASE_CONFIG, QUALITY, VERSION
+from app.constants import CONFIG, CLIENT_DIR, DATABASE_CONFIG, IS_API_WORKER, VERSION
 from app.models import Channel
 from app.models import LiveStream
 from app.models import Program
 from app.models import TwitterAccount
 from app.routers import CapturesRouter
 from app.routers import ChannelsRouter
+from app.routers import LiveStreamsRelayRouter
 from app.routers import LiveStreamsRouter
 from app.routers import MaintenanceRouter
+from app.routers import MetricsRouter
 from app.routers import NiconicoRouter
 from app.routers import SettingsRouter
 from app.routers import TwitterRouter
@@ -29,7 +31,10 @@ from app.routers import UsersRouter
 from app.routers import VersionRouter
 from app.utils import Interlaced
 from app.utils import Logging
+from app.utils import SupervisorClient
 from app.utils.EDCB import EDCBTuner
+from app.utils.Metrics import Metrics
+from app.utils.PreTuner import PreTuner
 
 
 # このアプリケーションの実行中のイベントループ
@@ -58,13 +63,18 @@ app.add_middleware(
 
 # ルーターの追加
 app.include_router(ChannelsRouter.router)
-app.include_router(LiveStreamsRouter.router)
+## API ワーカープロセスでは、ライブストリーム関連の API をストリーム管理プロセスに中継する
+if IS_API_WORKER is True:
+    app.include_router(LiveStreamsRelayRouter.router)
+else:
+    app.include_router(LiveStreamsRouter.router)
 app.include_router(CapturesRouter.router)
 app.include_router(NiconicoRouter.router)
 app.include_router(TwitterRouter.router)
 app.include_router(UsersRouter.router)
 app.include_router(SettingsRouter.router)
 app.include_router(MaintenanceRouter.router)
+app.include_router(MetricsRouter.router)
 app.include_router(VersionRouter.router)
 
 # 静的ファイルの配信
@@ -132,10 +142,11 @@ async def ExceptionHandler(request: Request, exc: Exception):
 tortoise.contrib.fastapi.logging = logging.getLogger('uvicorn')  # type: ignore
 ## Tortoise ORM を登録する
 ## ref: https://tortoise-orm.readthedocs.io/en/latest/contrib/fastapi.html
+## スキーマの生成はストリーム管理プロセスだけで行う (API ワーカーが同時に書き込むとデータベースがロックされるため)
 tortoise.contrib.fastapi.register_tortoise(
     app = app,
     config = DATABASE_CONFIG,
-    generate_schemas = True,
+    generate_schemas = not IS_API_WORKER,
     add_exception_handlers = True,
 )
 
@@ -143,6 +154,13 @@ tortoise.contrib.fastapi.register_tortoise(
 @app.on_event('startup')
 async def Startup():
 
+    # API ワーカープロセスでは、データベースの更新やライブストリームの初期化はストリーム管理プロセスに任せる
+    if IS_API_WORKER is True:
+        return
+
+    # イベントループの遅延の計測を開始
+    asyncio.create_task(Metrics.monitorEventLoopLag())
+
     # チャンネル情報を更新
     await Channel.update()
 
@@ -155,17 +173,14 @@ async def Startup():
     # 登録されている Twitter アカウントの情報を更新
     await TwitterAccount.updateAccountInformation()
 
-    # 全てのチャンネル&品質のライブストリームを初期化する
-    for channel in await Channel.filter(is_watchable=True).order_by('channel_number'):
-        for quality in QUALITY:
-            LiveStream(channel.display_channel_id, quality)
-
 # サーバー設定で指定された時間 (デフォルト: 15分) ごとに1回、チャンネル情報と番組情報を更新する
 # チャンネル情報は頻繁に変わるわけではないけど、手動で再起動しなくても自動で変更が適用されてほしい
 # 番組情報の更新処理はかなり重くストリーム配信などの他の処理に影響してしまうため、マルチプロセスで実行する
 @app.on_event('startup')
 @repeat_every(seconds=CONFIG['general']['program_update_interval'] * 60, wait_first=True, logger=Logging.logger)
 async def UpdateChannelAndProgram():
+    if IS_API_WORKER is True:
+        return
     await Channel.update()
     await Channel.updateJikkyoStatus()
     await Program.update(multiprocess=True)
@@ -174,14 +189,34 @@ async def UpdateChannelAndProgram():
 @app.on_event('startup')
 @repeat_every(seconds=0.5 * 60, wait_first=True, logger=Logging.logger)
 async def UpdateChannelJikkyoStatus():
+    if IS_API_WORKER is True:
+        return
     await Channel.updateJikkyoStatus()
 
 # 1時間に1回、登録されている Twitter アカウントの情報を更新する
 @app.on_event('startup')
 @repeat_every(seconds=60 * 60, wait_first=True, logger=Logging.logger)
 async def UpdateTwitterAccountInformation():
+    if IS_API_WORKER is True:
+        return
     await TwitterAccount.updateAccountInformation()
 
+# 2秒に1回、視聴中のチャンネルに応じて先行選局するチャンネルを見直す
+@app.on_event('startup')
+@repeat_every(seconds=PreTuner.UPDATE_INTERVAL, wait_first=True, logger=Logging.logger)
+async def UpdatePreTunedChannels():
+    if IS_API_WORKER is True:
+        return
+    await PreTuner.update()
+
+# API ワーカープロセスでのみ、ストリーム管理プロセスからチャンネルごとの視聴者数を取得する
+## 1秒に1回呼び出すが、視聴者数が変わらない間は SupervisorClient.updateViewerCounts() 側で取得する間隔を延ばす
+if IS_API_WORKER is True:
+    @app.on_event('startup')
+    @repeat_every(seconds=1, wait_first=False, logger=Logging.logger)
+    async def UpdateLiveStreamViewerCount():
+        await SupervisorClient.updateViewerCounts()
+
 # サーバーの終了時に実行する
 cleanup = False
 @app.on_event('shutdown')
@@ -197,6 +232,9 @@ async def Shutdown():
     for livestream in LiveStream.getAllLiveStreams():
         livestream.setStatus('Offline', 'ライブストリームは Offline です。', True)
 
+    # 先行選局中のチューナーを解放する
+    await PreTuner.releaseAll()
+
     # 全てのチューナーインスタンスを終了する (EDCB バックエンドのみ)
     if CONFIG['general']['backend'] == 'EDCB':
         await EDCBTuner.closeAll()
@@ -25,6 +25,8 @@ DATA_DIR = BASE_DIR / 'data'
 ACCOUNT_ICON_DIR = DATA_DIR / 'account-icons'
 ## サムネイル画像があるディレクトリ
 THUMBNAIL_DIR = DATA_DIR / 'thumbnails'
+## ライブストリームのタイムシフトバッファのファイルを置くディレクトリ
+TIMESHIFT_DIR = DATA_DIR / 'timeshift'
 
 # スタティックディレクトリ
 STATIC_DIR = BASE_DIR / 'static'
@@ -214,6 +216,34 @@ with open(CONFIG_YAML, encoding='utf-8') as file:
         if type(CONFIG['tv']['debug_mode_ts_path']) is str:
             CONFIG['tv']['debug_mode_ts_path'] = docker_fs_prefix + CONFIG['tv']['debug_mode_ts_path']
 
+    # 後から追加された設定項目が config.yaml に存在しない場合は、デフォルト値で補完する
+    ## 既存の config.yaml をそのまま使い続けられるようにするため
+    CONFIG['server'].setdefault('workers', 1)
+    CONFIG['tv'].setdefault('encoder_nodes', [])
+    CONFIG['tv'].setdefault('encoder_node_secret', None)
+    CONFIG['tv'].setdefault('abr_ladder', [])
+    CONFIG['tv'].setdefault('encode_budget', None)
+    CONFIG['tv'].setdefault('encode_costs', {})
+    CONFIG['tv'].setdefault('adaptive_quality', True)
+    CONFIG['tv'].setdefault('pretune_channels', 0)
+    CONFIG['tv'].setdefault('timeshift_duration', 0)
+    CONFIG['tv'].setdefault('timeshift_max_size', 1024)
+
+# API ワーカープロセスとして起動されているかどうか
+## server.workers に 2 以上が指定されているときは、チューナー・エンコードタスク・ライブストリームを一括で管理する
+## ストリーム管理プロセス (supervisor) とは別に、API リクエストを並列に処理する API ワーカープロセスが起動される
+## API ワーカーはライブストリーム関連の API をすべてストリーム管理プロセスに中継する
+IS_API_WORKER: bool = os.environ.get('KONOMITV_API_WORKER') == '1'
+
+# ログイン中のユーザー情報のキャッシュ (UserCache) を無効にするかどうか
+## ベンチマーク (misc/UserCacheBenchmark.py) で、キャッシュの有無による API のスループットの違いを計測するために使う
+IS_USER_CACHE_DISABLED: bool = os.environ.get('KONOMITV_DISABLE_USER_CACHE') == '1'
+
+# ニコニコの各 API のリクエスト先を差し替える URL
+## 指定されている場合は、ニコニコ実況の視聴セッションの取得に使うニコ生・ニコニコ OAuth などの API へのリクエストをすべてこの URL に送る
+## ダミーのニコニコ API (misc/FakeNiconicoAPI.py) に対してテスト (misc/JikkyoSessionTest.py) するために使う
+NICONICO_API_URL_OVERRIDE: str | None = os.environ.get('KONOMITV_NICONICO_API_URL')
+
 # 品質を表す Pydantic モデル
 class Quality(BaseModel):
     is_hevc: bool  # 映像コーデックが HEVC かどうか
@@ -223,9 +253,11 @@ class Quality(BaseModel):
     video_bitrate: str  # 映像のビットレート
     video_bitrate_max: str  # 映像の最大ビットレート
     audio_bitrate: str  # 音声のビットレート
+    is_passthrough: bool = False  # 再エンコードせずに放送波の映像と音声をそのまま配信するかどうか
 
 # 品質の種類 (型定義)
 QUALITY_TYPES = Literal[
+    'original',
     '1080p-60fps',
     '1080p-60fps-hevc',
     '1080p',
@@ -246,6 +278,18 @@ QUALITY_TYPES = Literal[
 
 # 映像と音声の品質
 QUALITY: dict[QUALITY_TYPES, Quality] = {
+    # 再エンコードせず、tsreadex で前処理した放送波の映像と音声をそのまま (MPEG-TS のまま再多重化して) 配信する
+    ## 解像度とビットレートは放送波に依存するため、ここでの値は LL-HLS のマスタープレイリストなどで使う目安 (地デジ相当) でしかない
+    'original': Quality(
+        is_hevc = False,
+        is_60fps = False,
+        width = 1440,
+        height = 1080,
+        video_bitrate = '15000K',
+        video_bitrate_max = '24000K',
+        audio_bitrate = '256K',
+        is_passthrough = True,
+    ),
     '1080p-60fps': Quality(
         is_hevc = False,
         is_60fps = True,
@@ -392,6 +436,11 @@ QUALITY: dict[QUALITY_TYPES, Quality] = {
     ),
 }
 
+# ラジオチャンネルのライブストリームの画質
+## ラジオチャンネルでは映像がなく、音声の品質も画質に関わらず固定のため、どの画質が指定されてもこの画質のライブストリームに集約する
+## こうすることで、異なる画質を選択したクライアント同士でもチューナーとエンコーダーを共有できる
+RADIO_QUALITY: QUALITY_TYPES = '1080p'
+
 # 外部 API に送信するリクエストヘッダー
 ## KonomiTV のユーザーエージェントを指定
 API_REQUEST_HEADERS: dict[str, str] = {
@@ -4,6 +4,7 @@
 from __future__ import annotations
 
 import asyncio
+import copy
 import requests
 import time
 import traceback
@@ -12,14 +13,16 @@ from tortoise import models
 from tortoise import timezone
 from tortoise import transactions
 from tortoise.exceptions import IntegrityError
-from typing import Any, cast, Literal, TYPE_CHECKING
+from types import MappingProxyType
+from typing import Any, cast, ClassVar, Literal, Mapping, TYPE_CHECKING
 
-from app.constants import API_REQUEST_HEADERS, CONFIG
+from app.constants import API_REQUEST_HEADERS, CONFIG, IS_API_WORKER
 from app.utils import Jikkyo
 from app.utils import Logging
 from app.utils import TSInformation
 from app.utils.EDCB import CtrlCmdUtil
 from app.utils.EDCB import EDCBUtil
+from app.utils.Metrics import Metrics
 
 if TYPE_CHECKING:
     from app.models import Program
@@ -85,6 +88,13 @@ class Channel(models.Model):
         except:
             traceback.print_exc()
 
+        # 更新後のチャンネル情報でチャンネルレジストリを作り直す
+        await ChannelRegistry.load()
+
+        # 更新にかかった時間と、更新後のチャンネル数を記録する
+        Metrics.UPDATE_DURATION.observe('channels', value=time.time() - timestamp)
+        Metrics.UPDATE_ROWS.set('channels', value=await Channel.filter(is_watchable=True).count())
+
         Logging.info(f'Channels update complete. ({round(time.time() - timestamp, 3)} sec)')
 
 
@@ -100,6 +110,7 @@ class Channel(models.Model):
             duplicate_channels = {temp.id:temp for temp in await Channel.filter(is_watchable=True)}
 
             # Mirakurun の API からチャンネル情報を取得する
+            request_started_at = time.monotonic()
             try:
                 mirakurun_services_api_url = f'{CONFIG["general"]["mirakurun_url"]}/api/services'
                 mirakurun_services_api_response = await asyncio.to_thread(requests.get,
@@ -107,11 +118,14 @@ class Channel(models.Model):
                     headers = API_REQUEST_HEADERS,
                     timeout = 5,
                 )
+                Metrics.BACKEND_REQUEST_DURATION.observe('Mirakurun', 'GET /api/services', str(mirakurun_services_api_response.status_code),
+                    value = time.monotonic() - request_started_at)
                 if mirakurun_services_api_response.status_code != 200:  # Mirakurun からエラーが返ってきた
                     Logging.error(f'Failed to get channels from Mirakurun. (HTTP Error {mirakurun_services_api_response.status_code})')
                     raise Exception(f'Failed to get channels from Mirakurun. (HTTP Error {mirakurun_services_api_response.status_code})')
                 services = mirakurun_services_api_response.json()
             except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as ex:
+                Metrics.BACKEND_REQUEST_DURATION.observe('Mirakurun', 'GET /api/services', 'error', value=time.monotonic() - request_started_at)
                 Logging.error(f'Failed to get channels from Mirakurun. (Connection Timeout)')
                 raise ex
 
@@ -136,7 +150,7 @@ class Channel(models.Model):
                     continue
 
                 # チャンネル ID
-                channel_id = f'NID{service["onid"]}-SID{service["sid"]:03d}'
+                channel_id = f'NID{service["networkId"]}-SID{service["serviceId"]:03d}'
 
                 # 既にレコードがある場合は更新、ない場合は新規作成
                 duplicate_channel = duplicate_channels.pop(channel_id, None)
@@ -152,7 +166,7 @@ class Channel(models.Model):
                 channel.remocon_id = int(service['remoteControlKeyId']) if ('remoteControlKeyId' in service) else -1
                 channel.type = TSInformation.getNetworkType(channel.network_id)
                 channel.name = TSInformation.formatString(service['name'])
-                channel.jikkyo_force = None
+                channel.jikkyo_force = Jikkyo.getForce(channel.network_id, channel.service_id)  # メモリ上に保持している最新の実況勢い
                 channel.is_watchable = True
 
                 # すでに放送が終了した「FOXスポーツ＆エンターテインメント」「BSスカパー」「Dlife」を除外
@@ -353,7 +367,7 @@ class Channel(models.Model):
                 channel.remocon_id = -1
                 channel.type = TSInformation.getNetworkType(channel.network_id)
                 channel.name = TSInformation.formatString(service['service_name'])
-                channel.jikkyo_force = None
+                channel.jikkyo_force = Jikkyo.getForce(channel.network_id, channel.service_id)  # メモリ上に保持している最新の実況勢い
                 channel.is_watchable = True
 
                 # すでに放送が終了した「FOXスポーツ＆エンターテインメント」「BSスカパー」「Dlife」を除外
@@ -514,22 +528,32 @@ class Channel(models.Model):
         # 全ての実況チャンネルのステータスを更新
         await Jikkyo.updateStatus()
 
-        # 全てのチャンネル情報を取得
-        channels = await Channel.filter(is_watchable=True)
-
-        # チャンネル情報ごとに
-        for channel in channels:
+        # チャンネル情報ごとに、実況勢いが前回から変わったチャンネルだけを集める
+        ## チャンネルレジストリのチャンネル情報は共有されているため、変更するチャンネル情報はコピーしてから変更する
+        changed_channels: list[Channel] = []
+        for channel in await ChannelRegistry.getAll():
+            if channel.is_watchable is False:
+                continue
 
             # 実況チャンネルのステータスを取得
             jikkyo = Jikkyo(channel.network_id, channel.service_id)
             status = await jikkyo.getStatus()
 
             # ステータスが None（実況チャンネル自体が存在しないか、コミュニティの場合で実況枠が存在しない）でなく、force が -1 でなければ
-            if status != None and status['force'] != -1:
+            if status != None and status['force'] != -1 and channel.jikkyo_force != status['force']:
 
                 # ステータスを更新
-                channel.jikkyo_force = status['force']
-                await channel.save()
+                changed_channel = copy.copy(channel)
+                changed_channel.jikkyo_force = status['force']
+                changed_channels.append(changed_channel)
+
+        # 実況勢いが変わったチャンネルだけを、1回のクエリでまとめて保存する
+        ## 変わったチャンネルがなければ、データベースへの書き込みもチャンネルレジストリの作り直しも行わない
+        if len(changed_channels) > 0:
+            await Channel.bulk_update(changed_channels, fields=['jikkyo_force'])
+
+            # 更新後のチャンネル情報でチャンネルレジストリを作り直す
+            await ChannelRegistry.load()
 
 
     async def getCurrentAndNextProgram(self) -> tuple[Program | None, Program | None]:
@@ -561,3 +585,126 @@ class Channel(models.Model):
 
         # 現在の番組情報、次の番組情報のタプルを返す
         return (program_present, program_following)
+
+
+class ChannelRegistry:
+    """
+    データベースに保存されているチャンネル情報を、メモリ上に保持しておくクラス
+    チャンネル情報は Channel.update() (と Channel.updateJikkyoStatus()) でしか変わらないため、
+    ストリームやチャンネル情報へのリクエストのたびにデータベースに問い合わせずに済むようにする
+    チャンネル情報の更新後に丸ごと作り直して差し替えるため、参照中に中身が変わることはない
+    取得したチャンネル情報は他の処理と共有されているため、変更してはならない (変更する場合はコピーしてから変更すること)
+    """
+
+    # API ワーカープロセスでチャンネルレジストリを読み込み直す間隔 (秒)
+    ## チャンネル情報の更新はストリーム管理プロセスでしか行われないため、API ワーカープロセスでは定期的にデータベースから読み込み直す
+    RELOAD_INTERVAL = 60
+
+    # 全てのチャンネル情報が入るタプル (チャンネル番号順)
+    __channels: ClassVar[tuple[Channel, ...] | None] = None
+
+    # チャンネル ID をキーとしたチャンネル情報の辞書
+    __channels_by_id: ClassVar[Mapping[str, Channel]] = MappingProxyType({})
+
+    # (ネットワーク ID, サービス ID) をキーとしたチャンネル情報の辞書
+    __channels_by_service: ClassVar[Mapping[tuple[int, int], Channel]] = MappingProxyType({})
+
+    # チャンネルの種別 (GR・BS・CS・CATV・SKY・STARDIGIO) をキーとした、チャンネル番号順のチャンネル情報のタプルの辞書
+    __channels_by_type: ClassVar[Mapping[str, tuple[Channel, ...]]] = MappingProxyType({})
+
+    # チャンネルレジストリを最後に読み込んだ時刻 (単調増加時間)
+    __loaded_at: ClassVar[float] = 0
+
+
+    @classmethod
+    async def load(cls) -> None:
+        """
+        データベースからチャンネル情報を読み込み、チャンネルレジストリを作り直す
+        """
+
+        channels = tuple(await Channel.all().order_by('channel_number'))
+
+        channels_by_type: dict[str, list[Channel]] = {}
+        for channel in channels:
+            channels_by_type.setdefault(channel.type, []).append(channel)
+
+        # 読み込みが終わってからまとめて差し替える
+        ## 差し替えの間に await を挟まないので、他のタスクから作りかけのチャンネルレジストリが見えることはない
+        cls.__channels_by_id = MappingProxyType({channel.display_channel_id: channel for channel in channels})
+        cls.__channels_by_service = MappingProxyType({(channel.network_id, channel.service_id): channel for channel in channels})
+        cls.__channels_by_type = MappingProxyType({channel_type: tuple(type_channels) for channel_type, type_channels in channels_by_type.items()})
+        cls.__channels = channels
+        cls.__loaded_at = time.monotonic()
+
+
+    @classmethod
+    async def __ensureLoaded(cls) -> None:
+        """
+        チャンネルレジストリがまだ読み込まれていなければ (API ワーカープロセスでは、読み込みから一定時間が経っていれば) 読み込む
+        番組情報の更新用のワーカープロセスなど Channel.update() が実行されないプロセスでは、初回参照時にデータベースから読み込まれる
+        """
+
+        if cls.__channels is None or (IS_API_WORKER is True and time.monotonic() - cls.__loaded_at > cls.RELOAD_INTERVAL):
+            await cls.load()
+
+
+    @classmethod
+    async def getAll(cls) -> tuple[Channel, ...]:
+        """
+        全てのチャンネル情報をチャンネル番号順に取得する
+
+        Returns:
+            tuple[Channel, ...]: 全てのチャンネル情報
+        """
+
+        await cls.__ensureLoaded()
+        return cast(tuple[Channel, ...], cls.__channels)
+
+
+    @classmethod
+    async def get(cls, display_channel_id: str) -> Channel | None:
+        """
+        チャンネル ID からチャンネル情報を取得する
+
+        Args:
+            display_channel_id (str): チャンネル ID
+
+        Returns:
+            Channel | None: チャンネル情報 (存在しない場合は None)
+        """
+
+        await cls.__ensureLoaded()
+        return cls.__channels_by_id.get(display_channel_id)
+
+
+    @classmethod
+    async def getByServiceID(cls, network_id: int, service_id: int) -> Channel | None:
+        """
+        ネットワーク ID とサービス ID からチャンネル情報を取得する
+
+        Args:
+            network_id (int): ネットワーク ID
+            service_id (int): サービス ID
+
+        Returns:
+            Channel | None: チャンネル情報 (存在しない場合は None)
+        """
+
+        await cls.__ensureLoaded()
+        return cls.__channels_by_service.get((network_id, service_id))
+
+
+    @classmethod
+    async def getByType(cls, channel_type: str) -> tuple[Channel, ...]:
+        """
+        チャンネルの種別からチャンネル情報をチャンネル番号順に取得する
+
+        Args:
+            channel_type (str): チャンネルの種別 (GR・BS・CS・CATV・SKY・STARDIGIO)
+
+        Returns:
+            tuple[Channel, ...]: チャンネル情報 (存在しない場合は空のタプル)
+        """
+
+        await cls.__ensureLoaded()
+        return cls.__channels_by_type.get(channel_type, ())
@@ -5,17 +5,37 @@ from __future__ import annotations
 
 import asyncio
 import time
+import weakref
 from fastapi import HTTPException
 from fastapi import status
 from fastapi.responses import Response
 from fastapi.responses import StreamingResponse
 from hashids import Hashids
-from typing import ClassVar, Literal, TypedDict
+from typing import ClassVar, Literal, TYPE_CHECKING, TypedDict
 
-from app.constants import QUALITY_TYPES
-from app.utils import HLSLiveSegmenter
+from app.constants import CONFIG, IS_API_WORKER, QUALITY, QUALITY_TYPES
 from app.utils import Logging
-from app.utils.EDCB import EDCBTuner
+from app.utils.AdmissionController import AdmissionController
+from app.utils.EncoderLogParser import EncoderLogParser
+from app.utils.GOPCache import GOPCache
+from app.utils.Metrics import Metrics
+from app.utils.PreTuner import PreTuner
+from app.utils.StartupTrace import StartupTrace
+from app.utils.TimeshiftBuffer import TimeshiftBuffer
+from app.utils.TunerSession import TunerSessionSubscriber
+
+# HLSLiveSegmenter (biim) は読み込みに時間がかかるため、型ヒントにのみ使う
+## 実際の HLSLiveSegmenter の初期化は、エンコードタスク (LiveEncodingTask) の開始時に行われる
+if TYPE_CHECKING:
+    from app.utils import HLSLiveSegmenter
+
+
+# タイムシフト再生向け API のレスポンスに付ける CORS ヘッダー
+## HLSLiveSegmenter と同様に、デバッグ時のみ有効化する
+TIMESHIFT_CORS_HEADERS: dict[str, str] = {
+    'Access-Control-Allow-Credentials': 'true',
+    'Access-Control-Allow-Origin': '*',
+} if CONFIG['general']['debug'] is True else {}
 
 
 class LiveStreamStatus(TypedDict):
@@ -25,11 +45,15 @@ class LiveStreamStatus(TypedDict):
     started_at: float
     updated_at: float
     client_count: int
+    encode_quality: str
 
 
 class LiveStreamClient():
     """ ライブストリームのクライアントを表すクラス """
 
+    # インスタンスごとに __dict__ を持たないようにし、メモリ使用量と属性アクセスのコストを抑える
+    __slots__ = ('_livestream', 'client_id', 'client_type', 'queue', 'stream_data_read_at')
+
 
     def __init__(self, livestream: LiveStream, client_type: Literal['mpegts', 'll-hls']) -> None:
         """
@@ -92,7 +116,8 @@ class LiveStreamClient():
         response_type: Literal['Playlist', 'Segment', 'PartialSegment', 'InitializationSegment'],
         msn: int | None,
         part: int | None,
-        secondary_audio: bool = False
+        secondary_audio: bool = False,
+        rendition: QUALITY_TYPES | None = None,
     ) -> Response | StreamingResponse:
         """
         LL-HLS クライアント向け API の共通処理 (バリデーションと最終読み取り時刻の更新)
@@ -102,6 +127,7 @@ class LiveStreamClient():
             msn (int | None): LL-HLS プレイリストの msn (Media Sequence Number) インデックス
             part (int | None): LL-HLS プレイリストの part (部分セグメント) インデックス
             secondary_audio (bool, optional): 副音声用セグメントを取得するかどうか. Defaults to False.
+            rendition (QUALITY_TYPES | None, optional): ABR 用の追加の画質のセグメントを取得する場合の画質. Defaults to None.
 
         Returns:
             Response | StreamingResponse: FastAPI のレスポンス
@@ -123,15 +149,26 @@ class LiveStreamClient():
                 detail = 'LL-HLS Segmenter is not running',
             )
 
+        # ABR 用の追加の画質が指定された場合は、その画質の LL-HLS Segmenter を使う
+        segmenter = self._livestream.segmenter
+        if rendition is not None and rendition != self._livestream.quality:
+            if rendition not in self._livestream.rendition_segmenters:
+                Logging.error(f'[LiveStreamClient] Specified rendition is not available [rendition: {rendition}]')
+                raise HTTPException(
+                    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    detail = 'Specified rendition is not available',
+                )
+            segmenter = self._livestream.rendition_segmenters[rendition]
+
         # 指定されたデータのレスポンスを取得
         if response_type == 'Playlist':
-            response = await self._livestream.segmenter.getPlaylist(msn, part, secondary_audio)
+            response = await segmenter.getPlaylist(msn, part, secondary_audio)
         elif response_type == 'Segment':
-            response = await self._livestream.segmenter.getSegment(msn, secondary_audio)
+            response = await segmenter.getSegment(msn, secondary_audio)
         elif response_type == 'PartialSegment':
-            response = await self._livestream.segmenter.getPartialSegment(msn, part, secondary_audio)
+            response = await segmenter.getPartialSegment(msn, part, secondary_audio)
         elif response_type == 'InitializationSegment':
-            response = await self._livestream.segmenter.getInitializationSegment(secondary_audio)
+            response = await segmenter.getInitializationSegment(secondary_audio)
 
         # ストリームデータの最終読み取り時刻を更新
         ## LL-HLS Segmenter からのレスポンス取得後に更新しないとタイムアウト判定が正しく行われない
@@ -140,7 +177,7 @@ class LiveStreamClient():
         return response
 
 
-    async def getPlaylist(self, msn: int | None, part: int | None, secondary_audio: bool = False) -> Response:
+    async def getPlaylist(self, msn: int | None, part: int | None, secondary_audio: bool = False, rendition: QUALITY_TYPES | None = None) -> Response:
         """
         LL-HLS のプレイリスト (m3u8) を FastAPI のレスポンスとして返す
         ref: https://developer.apple.com/documentation/http_live_streaming/enabling_low-latency_http_live_streaming_hls
@@ -149,14 +186,15 @@ class LiveStreamClient():
             msn (int | None): LL-HLS プレイリストの msn (Media Sequence Number) インデックス
             part (int | None): LL-HLS プレイリストの part (部分セグメント) インデックス
             secondary_audio (bool, optional): 副音声用セグメントを取得するかどうか. Defaults to False.
+            rendition (QUALITY_TYPES | None, optional): ABR 用の追加の画質のセグメントを取得する場合の画質. Defaults to None.
 
         Returns:
             Response: プレイリストデータ (m3u8) の FastAPI レスポンス
         """
-        return await self.__commonForLLHLSClient('Playlist', msn, part, secondary_audio)
+        return await self.__commonForLLHLSClient('Playlist', msn, part, secondary_audio, rendition)
 
 
-    async def getSegment(self, msn: int | None, secondary_audio: bool = False) -> Response | StreamingResponse:
+    async def getSegment(self, msn: int | None, secondary_audio: bool = False, rendition: QUALITY_TYPES | None = None) -> Response | StreamingResponse:
         """
         LL-HLS の完全なセグメント (m4s) を FastAPI のレスポンスとして順次返す
         ref: https://developer.apple.com/documentation/http_live_streaming/enabling_low-latency_http_live_streaming_hls
@@ -164,14 +202,15 @@ class LiveStreamClient():
         Args:
             msn (int | None): LL-HLS セグメントの msn (Media Sequence Number) インデックス
             secondary_audio (bool, optional): 副音声用セグメントを取得するかどうか. Defaults to False.
+            rendition (QUALITY_TYPES | None, optional): ABR 用の追加の画質のセグメントを取得する場合の画質. Defaults to None.
 
         Returns:
             Response | StreamingResponse: セグメントデータ (m4s) の FastAPI レスポンス (StreamingResponse)
         """
-        return await self.__commonForLLHLSClient('Segment', msn, None, secondary_audio)
+        return await self.__commonForLLHLSClient('Segment', msn, None, secondary_audio, rendition)
 
 
-    async def getPartialSegment(self, msn: int | None, part: int | None, secondary_audio: bool = False) -> Response | StreamingResponse:
+    async def getPartialSegment(self, msn: int | None, part: int | None, secondary_audio: bool = False, rendition: QUALITY_TYPES | None = None) -> Response | StreamingResponse:
         """
         LL-HLS の部分セグメント (m4s) を FastAPI のレスポンスとして順次返す
         ref: https://developer.apple.com/documentation/http_live_streaming/enabling_low-latency_http_live_streaming_hls
@@ -180,33 +219,227 @@ class LiveStreamClient():
             msn (int | None): LL-HLS セグメントの msn (Media Sequence Number) インデックス
             part (int | None): LL-HLS セグメントの part (部分セグメント) インデックス
             secondary_audio (bool, optional): 副音声用セグメントを取得するかどうか. Defaults to False.
+            rendition (QUALITY_TYPES | None, optional): ABR 用の追加の画質のセグメントを取得する場合の画質. Defaults to None.
 
         Returns:
             Response | StreamingResponse: 部分セグメントデータ (m4s) の FastAPI レスポンス (StreamingResponse)
         """
-        return await self.__commonForLLHLSClient('PartialSegment', msn, part, secondary_audio)
+        return await self.__commonForLLHLSClient('PartialSegment', msn, part, secondary_audio, rendition)
 
 
-    async def getInitializationSegment(self, secondary_audio: bool = False) -> Response:
+    async def getInitializationSegment(self, secondary_audio: bool = False, rendition: QUALITY_TYPES | None = None) -> Response:
         """
         LL-HLS の初期セグメント (init) を FastAPI のレスポンスとして返す
         ref: https://developer.apple.com/documentation/http_live_streaming/enabling_low-latency_http_live_streaming_hls
 
         Args:
             secondary_audio (bool, optional): 副音声用セグメントを取得するかどうか. Defaults to False.
+            rendition (QUALITY_TYPES | None, optional): ABR 用の追加の画質のセグメントを取得する場合の画質. Defaults to None.
 
         Returns:
             Response: 初期セグメントデータ (m4s) の FastAPI レスポンス
         """
-        return await self.__commonForLLHLSClient('InitializationSegment', None, None, secondary_audio)
+        return await self.__commonForLLHLSClient('InitializationSegment', None, None, secondary_audio, rendition)
+
+
+    async def getMasterPlaylist(self, secondary_audio: bool = False) -> Response:
+        """
+        LL-HLS のマスタープレイリスト (m3u8) を FastAPI のレスポンスとして返す
+        視聴中の画質と ABR 用の追加の画質のプレイリストを列挙し、クライアントが通信状況に応じて画質を切り替えられるようにする
+        ref: https://developer.apple.com/documentation/http_live_streaming/example_playlists_for_http_live_streaming/creating_a_multivariant_playlist
+
+        Args:
+            secondary_audio (bool, optional): 副音声用のプレイリストを列挙するかどうか. Defaults to False.
+
+        Returns:
+            Response: マスタープレイリストデータ (m3u8) の FastAPI レスポンス
+        """
+
+        # mpegts クライアントの場合は実行しない
+        if self.client_type == 'mpegts':
+            Logging.error('[LiveStreamClient] This API is only for LL-HLS client')
+            raise HTTPException(
+                status_code = status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail = 'This API is only for LL-HLS client',
+            )
+
+        # LL-HLS Segmenter が None (=Offline) の場合は実行しない
+        if self._livestream.segmenter is None:
+            Logging.error('[LiveStreamClient] LL-HLS Segmenter is not running')
+            raise HTTPException(
+                status_code = status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail = 'LL-HLS Segmenter is not running',
+            )
+
+        # ビットレートの文字列 (ex: 9500K) を bps 単位の整数に変換する
+        def ParseBitrate(bitrate: str) -> int:
+            if bitrate.endswith('M'):
+                return int(float(bitrate[:-1]) * 1000 * 1000)
+            if bitrate.endswith('K'):
+                return int(float(bitrate[:-1]) * 1000)
+            return int(bitrate)
+
+        # 視聴中の画質のプレイリストを先頭に、追加の画質のプレイリストを画質が高い順に列挙する
+        ## プレイリストの URL はマスタープレイリストの URL からの相対パスで指定する
+        audio_type = 'secondary-audio' if secondary_audio is True else 'primary-audio'
+        variants: list[tuple[QUALITY_TYPES, str]] = [(self._livestream.quality, 'playlist.m3u8')]
+        for rendition in self._livestream.rendition_segmenters.keys():
+            variants.append((rendition, f'../renditions/{rendition}/{audio_type}/playlist.m3u8'))
+
+        lines = ['#EXTM3U', '#EXT-X-INDEPENDENT-SEGMENTS']
+        for variant_quality, variant_uri in variants:
+            quality = QUALITY[variant_quality]
+            bandwidth = ParseBitrate(quality.video_bitrate_max) + ParseBitrate(quality.audio_bitrate)
+            average_bandwidth = ParseBitrate(quality.video_bitrate) + ParseBitrate(quality.audio_bitrate)
+            frame_rate = '59.940' if quality.is_60fps is True else '29.970'
+            lines.append(f'#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},AVERAGE-BANDWIDTH={average_bandwidth},'
+                         f'RESOLUTION={quality.width}x{quality.height},FRAME-RATE={frame_rate}')
+            lines.append(variant_uri)
+
+        # ストリームデータの最終読み取り時刻を更新
+        self.stream_data_read_at = time.time()
+
+        return Response(content='\n'.join(lines) + '\n', media_type='application/vnd.apple.mpegurl', headers=self._livestream.segmenter.cors_headers)
+
+
+    def __getTimeshiftBuffer(self) -> TimeshiftBuffer:
+        """
+        タイムシフト再生向け API の共通処理 (バリデーションと最終読み取り時刻の更新)
+        タイムシフト再生中もライブストリームに接続中のクライアントとして扱われるよう、LL-HLS クライアントからのみ利用できる
+
+        Returns:
+            TimeshiftBuffer: ライブストリームのタイムシフトバッファ
+        """
+
+        # mpegts クライアントの場合は実行しない
+        if self.client_type == 'mpegts':
+            Logging.error('[LiveStreamClient] This API is only for LL-HLS client')
+            raise HTTPException(
+                status_code = status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail = 'This API is only for LL-HLS client',
+            )
+
+        # タイムシフトバッファが None (=タイムシフト再生が無効か、Offline) の場合は実行しない
+        if self._livestream.timeshift_buffer is None:
+            Logging.error('[LiveStreamClient] Timeshift buffer is not available')
+            raise HTTPException(
+                status_code = status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail = 'Timeshift buffer is not available',
+            )
+
+        # ストリームデータの最終読み取り時刻を更新
+        self.stream_data_read_at = time.time()
+
+        return self._livestream.timeshift_buffer
+
+
+    def getTimeshiftPlaylist(self) -> Response:
+        """
+        タイムシフトバッファに保持しているセグメントを含む HLS のプレイリスト (m3u8) を FastAPI のレスポンスとして返す
+
+        Returns:
+            Response: プレイリストデータ (m3u8) の FastAPI レスポンス
+        """
+
+        timeshift_buffer = self.__getTimeshiftBuffer()
+        return Response(content=timeshift_buffer.getPlaylist(), media_type='application/vnd.apple.mpegurl', headers=TIMESHIFT_CORS_HEADERS)
+
+
+    def getTimeshiftSegment(self, msn: int) -> Response:
+        """
+        タイムシフトバッファに保持しているセグメント (MPEG-TS) を FastAPI のレスポンスとして返す
+
+        Args:
+            msn (int): セグメントの msn (Media Sequence Number) インデックス
+
+        Returns:
+            Response: セグメントデータ (MPEG-TS) の FastAPI レスポンス
+        """
+
+        timeshift_buffer = self.__getTimeshiftBuffer()
+        segment = timeshift_buffer.getSegment(msn)
+        if segment is None:
+            Logging.error(f'[LiveStreamClient] Specified timeshift segment was not found [msn: {msn}]')
+            raise HTTPException(
+                status_code = status.HTTP_404_NOT_FOUND,
+                detail = 'Specified timeshift segment was not found',
+            )
+        return Response(content=segment, media_type='video/mp2t', headers=TIMESHIFT_CORS_HEADERS)
+
+
+    def getTimeshiftStream(self, seconds_ago: float) -> StreamingResponse:
+        """
+        タイムシフトバッファに保持しているストリームデータを、指定された時間だけ前の時点から mpegts のストリームとして FastAPI のレスポンスで返す
+        保持しているデータの末尾に追いついた後は、ライブストリームに書き込まれたデータを少し遅れて配信し続ける
+
+        Args:
+            seconds_ago (float): 現在から何秒前の時点から配信するか
+
+        Returns:
+            StreamingResponse: MPEG-TS ストリームの FastAPI レスポンス
+        """
+
+        timeshift_buffer = self.__getTimeshiftBuffer()
+        segment = timeshift_buffer.findSegment(seconds_ago)
+        if segment is None:
+            Logging.error('[LiveStreamClient] Timeshift buffer has no stream data yet')
+            raise HTTPException(
+                status_code = status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail = 'Timeshift buffer has no stream data yet',
+            )
+
+        # タイムシフトバッファから読み出したストリームデータを出力するジェネレーター
+        ## 読み出すたびに最終読み取り時刻を更新し、配信中はライブストリームに接続中のクライアントとして扱われるようにする
+        async def generator():
+            async for stream_data in timeshift_buffer.stream(segment):
+                self.stream_data_read_at = time.time()
+                yield stream_data
+
+        return StreamingResponse(generator(), media_type='video/mp2t', headers=TIMESHIFT_CORS_HEADERS)
 
 
 class LiveStream():
     """ ライブストリームを管理するクラス """
 
+    # インスタンスごとに __dict__ を持たないようにし、メモリ使用量と属性アクセスのコストを抑える
+    ## __weakref__ は、インスタンスを弱参照で __instances に登録するために必要
+    __slots__ = (
+        '__weakref__',
+        'livestream_id',
+        'display_channel_id',
+        'quality',
+        'encode_quality',
+        '_clients',
+        '_status',
+        '_detail',
+        '_started_at',
+        '_updated_at',
+        '_stream_data_written_at',
+        '_stream_data_written_bytes',
+        'gop_cache',
+        'timeshift_buffer',
+        'segmenter',
+        'rendition_segmenters',
+        'tuner_subscriber',
+        'encoder_log_parser',
+        'startup_trace',
+    )
+
     # ライブストリームのインスタンスが入る、ライブストリーム ID をキーとした辞書
-    # この辞書にライブストリームに関する全てのデータが格納されている
-    __instances: ClassVar[dict[str, LiveStream]] = {}
+    ## ライブストリームは初めて使われた (取得された) ときに生成される
+    ## 弱参照で登録しているため、Offline のライブストリームはどこからも参照されなくなった時点で自動的に破棄される
+    ## 参照が残っている間は同じインスタンスが返されるので、ライブストリーム ID ごとに1つのインスタンスになることは変わらない
+    __instances: ClassVar[weakref.WeakValueDictionary[str, LiveStream]] = weakref.WeakValueDictionary()
+
+    # Offline 以外のライブストリームのインスタンスが入る、ステータスごとの辞書 (ライブストリーム ID がキー)
+    ## Offline 以外のライブストリームはここから参照されるため、エンコードタスクの実行中などに破棄されることはない
+    ## ステータスごとのライブストリームを、全てのライブストリームを走査せずに取得できるようにする
+    __instances_by_status: ClassVar[dict[str, dict[str, LiveStream]]] = {
+        'Standby': {},
+        'ONAir': {},
+        'Idling': {},
+        'Restart': {},
+    }
 
 
     # 必ずライブストリーム ID ごとに1つのインスタンスになるように (Singleton)
@@ -216,7 +449,8 @@ class LiveStream():
         # まだ同じライブストリーム ID のインスタンスがないときだけ、インスタンスを生成する
         # (チャンネルID)-(映像の品質) で一意な ID になる
         livestream_id = f'{display_channel_id}-{quality}'
-        if livestream_id not in cls.__instances:
+        instance = cls.__instances.get(livestream_id)
+        if instance is None:
 
             # 新しいライブストリームのインスタンスを生成する
             instance = super(LiveStream, cls).__new__(cls)
@@ -228,6 +462,11 @@ class LiveStream():
             instance.display_channel_id = display_channel_id
             instance.quality = quality
 
+            # 実際にエンコードしている映像の品質
+            ## エンコードが実時間に追いつかない場合に、エンコードタスクが一時的に視聴中の品質より低い品質に切り替える
+            ## エンコードタスクが実行されたときに毎回 quality に戻される
+            instance.encode_quality = quality
+
             # ライブストリームクライアントが入るリスト
             ## クライアントの接続が切断された場合、このリストからも削除される
             ## したがって、クライアントの数はこのリストの長さで求められる
@@ -251,21 +490,49 @@ class LiveStream():
             ## エンコーダーがフリーズしたものとみなしてエンコードタスクを再起動する
             instance._stream_data_written_at = 0
 
+            # writeStreamData() で書き込まれたストリームデータの累計バイト数
+            ## ホットパスでのメトリクスの記録を最小限にするため、ただの整数として保持し /api/metrics へのリクエスト時に集計する
+            instance._stream_data_written_bytes = 0
+
+            # 直近のキーフレーム以降のストリームデータのキャッシュ
+            ## ONAir のライブストリームに新しく接続した mpegts クライアントに最初に送り、次のキーフレームを待たずに再生を開始できるようにする
+            ## エンコードタスクが (再) 起動されるたびに破棄される
+            instance.gop_cache = GOPCache()
+
+            # タイムシフト再生用に、直近のストリームデータをディスク上に保持するタイムシフトバッファのインスタンス
+            ## config.yaml の tv.timeshift_duration が設定されている場合のみ、ストリーム開始時に生成され、Offline になったときに破棄される
+            ## エンコードタスクが再起動されても破棄されず、再起動前のストリームデータも引き続き巻き戻して視聴できる
+            instance.timeshift_buffer = None
+
             # LL-HLS Segmenter のインスタンス
             ## iPhone Safari は mpegts.js でのストリーミングに対応していないため、フォールバックとして LL-HLS で配信する必要がある
             ## エンコードタスクが実行されたときに毎回生成され、エンコードタスクが終了したときに破棄される
             instance.segmenter = None
 
-            # EDCB バックエンドのチューナーインスタンス
-            ## Mirakurun バックエンドを使っている場合は None のまま
-            instance.tuner = None
+            # ABR 用の追加の画質の LL-HLS Segmenter のインスタンスが入る、画質をキーとした辞書
+            ## config.yaml の tv.abr_ladder が設定されている場合のみ、エンコードタスクが実行されたときに毎回生成され、エンコードタスクが終了したときに破棄される
+            instance.rendition_segmenters = {}
+
+            # チューナーセッションの購読者のインスタンス
+            ## 同じチャンネルの他の画質のライブストリームとチューナーを共有するため、チューナーを直接ではなく購読者を介して制御する
+            ## エンコードタスクが実行されたときに毎回設定され、エンコードタスクが終了したときに削除される
+            instance.tuner_subscriber = None
+
+            # エンコーダーのログの解析のインスタンス
+            ## エンコードの状況 (フレーム数・fps・ビットレート・GPU 使用率など) をライブストリームの統計として参照するために使う
+            ## エンコードタスクが実行されたときに毎回生成され、次にエンコードタスクが実行されるまで最後のエンコードの状況を保持する
+            instance.encoder_log_parser = None
+
+            # ライブストリームの起動にかかった時間のトレースのインスタンス
+            ## エンコードタスクが実行されたときに毎回生成され、起動が完了するか失敗した時点で終了する
+            instance.startup_trace = None
 
             # 生成したインスタンスを登録する
             ## インスタンスの参照が渡されるので、オブジェクトとしては同一
             cls.__instances[livestream_id] = instance
 
         # 登録されているインスタンスを返す
-        return cls.__instances[livestream_id]
+        return instance
 
 
     def __init__(self, display_channel_id: str, quality: str) -> None:
@@ -282,20 +549,28 @@ class LiveStream():
         self.livestream_id: str
         self.display_channel_id: str
         self.quality: QUALITY_TYPES
+        self.encode_quality: QUALITY_TYPES
         self._clients: list[LiveStreamClient]
         self._status: Literal['Offline', 'Standby', 'ONAir', 'Idling', 'Restart']
         self._detail: str
         self._started_at: float
         self._updated_at: float
         self._stream_data_written_at: float
+        self._stream_data_written_bytes: int
+        self.gop_cache: GOPCache
+        self.timeshift_buffer: TimeshiftBuffer | None
         self.segmenter: HLSLiveSegmenter | None
-        self.tuner: EDCBTuner | None
+        self.rendition_segmenters: dict[QUALITY_TYPES, HLSLiveSegmenter]
+        self.tuner_subscriber: TunerSessionSubscriber | None
+        self.encoder_log_parser: EncoderLogParser | None
+        self.startup_trace: StartupTrace | None
 
 
     @classmethod
     def getAllLiveStreams(cls) -> list[LiveStream]:
         """
         全てのライブストリームのインスタンスを取得する
+        Offline のライブストリームは、まだどこかから参照されていて破棄されていないものだけが含まれる
 
         Returns:
             list[LiveStream]: ライブストリームのインスタンスの入ったリスト
@@ -314,14 +589,7 @@ class LiveStream():
             list[LiveStream]: 現在 ONAir 状態のライブストリームのインスタンスのリスト
         """
 
-        result: list[LiveStream] = []
-
-        # 現在 ONAir 状態のライブストリームに絞り込む
-        for livestream in LiveStream.getAllLiveStreams():
-            if livestream.getStatus()['status'] == 'ONAir':
-                result.append(livestream)
-
-        return result
+        return list(cls.__instances_by_status['ONAir'].values())
 
 
     @classmethod
@@ -333,14 +601,19 @@ class LiveStream():
             list[LiveStream]: 現在 Idling 状態のライブストリームのインスタンスのリスト
         """
 
-        result: list[LiveStream] = []
+        return list(cls.__instances_by_status['Idling'].values())
 
-        # 現在 Idling 状態のライブストリームに絞り込む
-        for livestream in LiveStream.getAllLiveStreams():
-            if livestream.getStatus()['status'] == 'Idling':
-                result.append(livestream)
 
-        return result
+    @classmethod
+    def getStandbyLiveStreams(cls) -> list[LiveStream]:
+        """
+        現在 Standby 状態のライブストリームのインスタンスを取得する
+
+        Returns:
+            list[LiveStream]: 現在 Standby 状態のライブストリームのインスタンスのリスト
+        """
+
+        return list(cls.__instances_by_status['Standby'].values())
 
 
     @classmethod
@@ -355,15 +628,43 @@ class LiveStream():
             int: 視聴者数
         """
 
+        # API ワーカープロセスではライブストリームを持たないため、ストリーム管理プロセスから取得した視聴者数を返す
+        if IS_API_WORKER is True:
+            from app.utils import SupervisorClient
+            return SupervisorClient.getViewerCount(display_channel_id)
+
         # 指定されたチャンネル ID に紐づくライブストリームを探して視聴者数を集計
+        ## クライアントが接続しているのは Offline 以外のライブストリームだけなので、Offline のライブストリームは見なくてよい
         viewer_count = 0
-        for livestream in LiveStream.getAllLiveStreams():
-            if livestream.display_channel_id == display_channel_id:
-                viewer_count += livestream.getStatus()['client_count']
+        for livestreams in cls.__instances_by_status.values():
+            for livestream in livestreams.values():
+                if livestream.display_channel_id == display_channel_id:
+                    viewer_count += len(livestream._clients)
 
         return viewer_count
 
 
+    @classmethod
+    def getViewerCounts(cls) -> dict[str, int]:
+        """
+        視聴者がいるすべてのチャンネルの、ライブストリームの現在の視聴者数を取得する
+        API ワーカープロセスが、ストリーム管理プロセスから視聴者数をまとめて取得するために使う
+
+        Returns:
+            dict[str, int]: チャンネル ID をキーとした視聴者数 (視聴者がいないチャンネルは含まれない)
+        """
+
+        # クライアントが接続しているのは Offline 以外のライブストリームだけなので、Offline のライブストリームは見なくてよい
+        viewer_counts: dict[str, int] = {}
+        for livestreams in cls.__instances_by_status.values():
+            for livestream in livestreams.values():
+                if len(livestream._clients) > 0:
+                    viewer_counts[livestream.display_channel_id] = \
+                        viewer_counts.get(livestream.display_channel_id, 0) + len(livestream._clients)
+
+        return viewer_counts
+
+
     async def connect(self, client_type: Literal['mpegts', 'll-hls']) -> LiveStreamClient:
         """
         ライブストリームに接続して、新しくライブストリームに登録されたクライアントを返す
@@ -389,16 +690,20 @@ class LiveStream():
             for _ in range(8):  # 画質切り替えなどタイミングの問題で Idling なストリームがない事もあるので、8回くらいリトライする
 
                 # 現在 Idling 状態のライブストリームがあれば
-                idling_livestreams = self.getIdlingLiveStreams()
+                ## 最も長く使われていない (Idling に移行した時刻が古い) ライブストリームから終了させる
+                idling_livestreams = sorted(self.getIdlingLiveStreams(), key=lambda livestream: livestream.getStatus()['updated_at'])
                 if len(idling_livestreams) > 0:
                     idling_livestream: LiveStream = idling_livestreams[0]
 
                     # EDCB バックエンドの場合はチューナーをアンロックし、これから開始するエンコードタスクで再利用できるようにする
-                    if idling_livestream.tuner is not None:
-                        idling_livestream.tuner.unlock()
+                    ## 同じチャンネルの他の画質のライブストリームが ONAir の場合は、そのライブストリームのためにロックされたままになる
+                    if idling_livestream.tuner_subscriber is not None:
+                        idling_livestream.tuner_subscriber.setIdling(True)
 
                     # チューナーリソースを解放する
+                    ## エンコードタスクが使っていたエンコード能力の予算も、エンコーダーの終了を待たずに解放する
                     idling_livestream.setStatus('Offline', '新しいライブストリームが開始されたため、チューナーリソースを解放しました。')
+                    AdmissionController.release(idling_livestream.livestream_id)
                     break
 
                 # 現在 ONAir 状態のライブストリームがなく、リトライした所で Idling なライブストリームが取得できる見込みがない
@@ -422,9 +727,22 @@ class LiveStream():
 
         # ライブストリームクライアントのインスタンスを生成・登録する
         client = LiveStreamClient(self, client_type)
+
+        # ライブストリームが ONAir (または Idling) で GOP キャッシュがあれば、mpegts クライアントの Queue に先に書き込む
+        ## 次のキーフレームが来るまで待たずに、直近のキーフレームから再生を開始できる
+        ## クライアントの登録までの間に await を挟まないので、キャッシュとその後に書き込まれるストリームデータの間に欠落や重複は生じない
+        if client_type == 'mpegts' and (current_status == 'ONAir' or current_status == 'Idling'):
+            gop_cache_data = self.gop_cache.getData()
+            if gop_cache_data is not None:
+                client.queue.put_nowait(gop_cache_data)
+                Metrics.LIVESTREAM_GOP_CACHE_HITS.inc(self.livestream_id)
+
         self._clients.append(client)
         Logging.info(f'[Live: {self.livestream_id}] Client Connected. Client ID: {client.client_id}')
 
+        # チャンネルの視聴が始まったことを記録し、次に切り替えられそうなチャンネルの先行選局に役立てる
+        PreTuner.recordWatch(self.display_channel_id)
+
         # ***** アイドリングからの復帰 *****
 
         # ライブストリームが Idling 状態な場合、ONAir 状態に戻す（アイドリングから復帰）
@@ -507,6 +825,7 @@ class LiveStream():
             'started_at': self._started_at,  # ライブストリームが開始された (ステータスが Offline or Restart → Standby に移行した) 時刻
             'updated_at': self._updated_at,  # ライブストリームのステータスが最後に更新された時刻
             'client_count': client_count,  # ライブストリームに接続中のクライアント数
+            'encode_quality': self.encode_quality,  # 実際にエンコードしている映像の品質
         }
 
 
@@ -541,13 +860,60 @@ class LiveStream():
             self._started_at = time.time()
             self._stream_data_written_at = time.time()
 
+        # エンコーダーのホットリスタート (ONAir or Idling → Standby) 時、stream_data_written_at を更新する
+        ## 停止したエンコーダーの最終書き込み時刻のままだと、再起動したエンコーダーが起動を終える前にフリーズしたとみなされてしまう
+        if (self._status == 'ONAir' or self._status == 'Idling') and status == 'Standby':
+            self._stream_data_written_at = time.time()
+
+        # ストリーム開始時と Offline への移行時は、前回のエンコードタスクの GOP キャッシュを破棄する
+        ## エンコーダーが変わるとタイムスタンプなどが連続しなくなるため、新しいクライアントに古いデータを送らないようにする
+        if status == 'Offline' or ((self._status == 'Offline' or self._status == 'Restart') and status == 'Standby'):
+            self.gop_cache.reset()
+
+        # ストリーム開始時はタイムシフトバッファを生成し、エンコードタスクの再起動後であれば以降のデータが連続しないことを記録する
+        ## Offline への移行時は、保持しているストリームデータごとタイムシフトバッファを破棄する
+        if (self._status == 'Offline' or self._status == 'Restart') and status == 'Standby' and CONFIG['tv']['timeshift_duration'] > 0:
+            if self.timeshift_buffer is None:
+                self.timeshift_buffer = TimeshiftBuffer(
+                    self.livestream_id,
+                    max_duration = CONFIG['tv']['timeshift_duration'] * 60,
+                    max_size = CONFIG['tv']['timeshift_max_size'] * 1024 * 1024,
+                )
+            else:
+                self.timeshift_buffer.markDiscontinuity()
+        if status == 'Offline' and self.timeshift_buffer is not None:
+            self.timeshift_buffer.close()
+            self.timeshift_buffer = None
+
         # ステータス変更のログを出力
         if quiet is False:
             Logging.info(f'[Live: {self.livestream_id}] [Status: {status}] {detail}')
 
         # ストリーム起動完了時 (Standby → ONAir) 時のみ、ストリームの起動にかかった時間も出力
+        ## エンコーダーのホットリスタートからの復帰時は、ホットリスタートの開始からの時間を出力する
         if self._status == 'Standby' and status == 'ONAir':
-            Logging.info(f'[Live: {self.livestream_id}] Startup complete. ({round(time.time() - self._started_at, 2)} sec)')
+            if self.startup_trace is not None and self.startup_trace.kind == 'HotRestart':
+                Logging.info(f'[Live: {self.livestream_id}] Hot restart complete. ({round(self.startup_trace.getElapsedTime(), 2)} sec)')
+            else:
+                Logging.info(f'[Live: {self.livestream_id}] Startup complete. ({round(time.time() - self._started_at, 2)} sec)')
+
+        # エンコードタスクの再起動回数を、再起動の理由 (ステータス詳細) ごとに記録する
+        if status == 'Restart':
+            Metrics.LIVESTREAM_RESTARTS.inc(self.livestream_id, detail)
+
+        # 起動中のトレースがあれば、ONAir への移行でエンコーダーのウォームアップの終了を、Offline or Restart への移行で起動の失敗を記録する
+        if self.startup_trace is not None and self.startup_trace.finished is False:
+            if status == 'ONAir':
+                self.startup_trace.end('encoder_warmup')
+            elif status == 'Offline' or status == 'Restart':
+                self.startup_trace.finish(status)
+
+        # ステータスごとのライブストリームの辞書を更新する
+        ## Offline になったライブストリームは辞書から外れ、どこからも参照されなくなった時点で破棄される
+        if self._status != 'Offline':
+            LiveStream.__instances_by_status[self._status].pop(self.livestream_id, None)
+        if status != 'Offline':
+            LiveStream.__instances_by_status[status][self.livestream_id] = self
 
         # ログ出力を待ってからステータスと詳細をライブストリームにセット
         self._status = status
@@ -556,16 +922,48 @@ class LiveStream():
         # 最終更新のタイムスタンプを更新
         self._updated_at = time.time()
 
-        # チューナーインスタンスが存在する場合 (= EDCB バックエンド利用時) のみ
-        if self.tuner is not None:
+        # チューナーセッションを購読している場合のみ
+        ## 実際にチューナーがロック/アンロックされるのは EDCB バックエンド利用時のみ
+        if self.tuner_subscriber is not None:
 
             # Idling への切り替え時、チューナーをアンロックして再利用できるように
+            ## 同じチャンネルの他の画質のライブストリームが ONAir の場合は、そのライブストリームのためにロックされたままになる
             if self._status == 'Idling':
-                self.tuner.unlock()
+                self.tuner_subscriber.setIdling(True)
 
             # ONAir への切り替え（復帰）時、再びチューナーをロックして制御を横取りされないように
             if self._status == 'ONAir':
-                self.tuner.lock()
+                self.tuner_subscriber.setIdling(False)
+
+
+    def collectMetrics(self) -> None:
+        """
+        ライブストリームの現在の状態をメトリクスに反映する (/api/metrics へのリクエスト時に呼ばれる)
+        """
+
+        now = time.time()
+
+        # 書き込まれたストリームデータの累計バイト数
+        Metrics.LIVESTREAM_WRITTEN_BYTES.set(self.livestream_id, value=self._stream_data_written_bytes)
+
+        # GOP キャッシュのサイズ
+        Metrics.LIVESTREAM_GOP_CACHE_BYTES.set(self.livestream_id, value=self.gop_cache.getSize())
+
+        # タイムシフトバッファに保持しているストリームデータの再生時間
+        if self.timeshift_buffer is not None:
+            Metrics.LIVESTREAM_TIMESHIFT_SECONDS.set(self.livestream_id, value=self.timeshift_buffer.getBufferedDuration())
+
+        # クライアントの種別ごとの接続数
+        for client_type in ('mpegts', 'll-hls'):
+            Metrics.LIVESTREAM_CLIENTS.set(self.livestream_id, client_type,
+                value=sum(1 for client in self._clients if client.client_type == client_type))
+
+        # クライアントの Queue に溜まっているストリームデータの最大数と、最終読み取り時刻からの最大の経過時間
+        if len(self._clients) > 0:
+            Metrics.LIVESTREAM_CLIENT_QUEUE_DEPTH.set(self.livestream_id,
+                value=max(client.queue.qsize() for client in self._clients))
+            Metrics.LIVESTREAM_CLIENT_LAG.set(self.livestream_id,
+                value=max(now - client.stream_data_read_at for client in self._clients))
 
 
     def getStreamDataWrittenAt(self) -> float:
@@ -601,12 +999,26 @@ class LiveStream():
             ## 主にネットワークが切断されたなどの理由で発生する
             if now - client.stream_data_read_at > timeout:
                 self._clients.remove(client)
+                Metrics.LIVESTREAM_TIMEOUT_EVICTIONS.inc(self.livestream_id)
                 Logging.info(f'[Live: {self.livestream_id}] Client Disconnected (Timeout). Client ID: {client.client_id}')
 
             # ストリームデータを書き込む (クライアント種別が mpegts の場合のみ)
             if client.client_type == 'mpegts':
                 await client.queue.put(stream_data)
 
-        # ストリームデータが空でなければ、最終書き込み時刻を更新
+        # ストリームデータが空でなければ、最終書き込み時刻と累計バイト数を更新
         if stream_data != b'':
             self._stream_data_written_at = now
+            self._stream_data_written_bytes += len(stream_data)
+
+            # GOP キャッシュにストリームデータを追加する
+            keyframe_position = self.gop_cache.push(stream_data)
+
+            # タイムシフトバッファにストリームデータを追加する
+            ## キーフレームが見つかった場合は、そこから始まるセグメントの先頭に付ける PAT・PMT も渡す
+            if self.timeshift_buffer is not None:
+                self.timeshift_buffer.push(stream_data, keyframe_position, self.gop_cache.getPSI() if keyframe_position is not None else None)
+
+            # 起動中のトレースがあれば、最初のストリームデータを書き込んだ時刻を記録する
+            if self.startup_trace is not None and self.startup_trace.finished is False:
+                self.startup_trace.end('first_byte')
@@ -19,10 +19,12 @@ from typing import Any
 
 from app.constants import API_REQUEST_HEADERS, CONFIG, DATABASE_CONFIG
 from app.models import Channel
+from app.models import ChannelRegistry
 from app.utils import Logging
 from app.utils import TSInformation
 from app.utils.EDCB import CtrlCmdUtil
 from app.utils.EDCB import EDCBUtil
+from app.utils.Metrics import Metrics
 
 
 class Program(models.Model):
@@ -109,6 +111,10 @@ class Program(models.Model):
             except:
                 traceback.print_exc()
 
+        # 更新にかかった時間と、更新後の番組数を記録する
+        Metrics.UPDATE_DURATION.observe('programs', value=time.time() - timestamp)
+        Metrics.UPDATE_ROWS.set('programs', value=await Program.all().count())
+
         Logging.info(f'Programs update complete. ({round(time.time() - timestamp, 3)} sec)')
 
 
@@ -200,6 +206,8 @@ class Program(models.Model):
                     CONFIG['general']['mirakurun_url'] = CONFIG['general']['mirakurun_url'].rstrip('/')
 
                 # Mirakurun の API から番組情報を取得する
+                ## マルチプロセスで実行されている場合、子プロセスで記録したメトリクスは出力されない
+                request_started_at = time.monotonic()
                 try:
                     mirakurun_programs_api_url = f'{CONFIG["general"]["mirakurun_url"]}/api/programs'
                     mirakurun_programs_api_response = await asyncio.to_thread(requests.get,
@@ -207,11 +215,14 @@ class Program(models.Model):
                         headers = API_REQUEST_HEADERS,
                         timeout = 10,  # 10秒後にタイムアウト (SPHD や CATV も映る環境だと時間がかかるので、少し伸ばす)
                     )
+                    Metrics.BACKEND_REQUEST_DURATION.observe('Mirakurun', 'GET /api/programs', str(mirakurun_programs_api_response.status_code),
+                        value = time.monotonic() - request_started_at)
                     if mirakurun_programs_api_response.status_code != 200:  # Mirakurun からエラーが返ってきた
                         Logging.error(f'Failed to get programs from Mirakurun. (HTTP Error {mirakurun_programs_api_response.status_code})')
                         raise Exception(f'Failed to get programs from Mirakurun. (HTTP Error {mirakurun_programs_api_response.status_code})')
                     programs: list[dict[str, Any]] = mirakurun_programs_api_response.json()
                 except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as ex:
+                    Metrics.BACKEND_REQUEST_DURATION.observe('Mirakurun', 'GET /api/programs', 'error', value=time.monotonic() - request_started_at)
                     Logging.error(f'Failed to get programs from Mirakurun. (Connection Timeout)')
                     raise ex
 
@@ -510,7 +521,7 @@ class Program(models.Model):
                     tsid = int(program_service['service_info']['tsid'])
 
                     # チャンネル情報を取得
-                    channel = await Channel.filter(network_id=nid, service_id=sid).first()
+                    channel = await ChannelRegistry.getByServiceID(nid, sid)
                     if channel is None:  # 登録されていないチャンネルの番組を弾く（ワンセグやデータ放送など）
                         continue
 
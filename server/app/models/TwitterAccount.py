@@ -1,13 +1,18 @@
 
 import asyncio
 import json
-import tweepy
 from requests.cookies import RequestsCookieJar
 from tortoise import fields
 from tortoise import models
-from tweepy_authlib import CookieSessionUserHandler
+from typing import TYPE_CHECKING
 
 from app.models import User
+from app.utils.UserCache import UserCache
+
+# tweepy は読み込みに時間がかかるため、実際に Twitter API を利用するときに遅延インポートする
+if TYPE_CHECKING:
+    import tweepy
+    from tweepy_authlib import CookieSessionUserHandler
 
 
 class TwitterAccount(models.Model):
@@ -37,6 +42,8 @@ class TwitterAccount(models.Model):
     async def updateAccountInformation(cls):
         """ Twitter のアカウント情報を更新する """
 
+        import tweepy
+
         # 登録されているすべての Twitter アカウントの情報を更新する
         for twitter_account in await TwitterAccount.all():
 
@@ -64,8 +71,11 @@ class TwitterAccount(models.Model):
             # 更新したアカウント情報を保存
             await twitter_account.save()
 
+        # キャッシュされているユーザー情報の Twitter アカウントの情報も古くなっているため、すべてのキャッシュを破棄する
+        UserCache.invalidate()
+
 
-    def getTweepyAuthHandler(self) -> tweepy.OAuth1UserHandler | CookieSessionUserHandler:
+    def getTweepyAuthHandler(self) -> 'tweepy.OAuth1UserHandler | CookieSessionUserHandler':
         """
         tweepy の認証ハンドラーを取得する
 
@@ -73,6 +83,9 @@ class TwitterAccount(models.Model):
             tweepy.OAuth1UserHandler | CookieSessionUserHandler: tweepy の認証ハンドラー
         """
 
+        import tweepy
+        from tweepy_authlib import CookieSessionUserHandler
+
         # パスワード認証 (Cookie セッション) の場合
         ## Cookie セッションでは access_token フィールドが "COOKIE_SESSION" の固定値になっている
         if self.access_token == 'COOKIE_SESSION':
@@ -99,7 +112,7 @@ class TwitterAccount(models.Model):
         return auth_handler
 
 
-    def getTweepyAPI(self) -> tweepy.API:
+    def getTweepyAPI(self) -> 'tweepy.API':
         """
         tweepy の API インスタンスを取得する
 
@@ -107,5 +120,7 @@ class TwitterAccount(models.Model):
             tweepy.API: tweepy の API インスタンス
         """
 
+        import tweepy
+
         # auth_handler で初期化した tweepy.API インスタンスを返す
         return tweepy.API(auth=self.getTweepyAuthHandler())
@@ -1,8 +1,34 @@
 
+import importlib
+
 # モデルをモジュールとして登録
 from .Channel import Channel
-from .LiveStream import LiveStream
-from .LiveStream import LiveStreamClient
+from .Channel import ChannelRegistry
 from .Program import Program
 from .TwitterAccount import TwitterAccount
 from .User import User
+
+# 初回参照時に遅延インポートするクラスと、その定義元のサブモジュール名
+## LiveStream は FastAPI や biim (HLSLiveSegmenter) などの重いモジュールに依存しているが、番組情報更新用の
+## ワーカープロセスではモデルとバックエンドのクライアントしか使わないため、実際に参照されるまで読み込まない
+__LAZY_IMPORTS = {
+    'LiveStream': 'LiveStream',
+    'LiveStreamClient': 'LiveStream',
+}
+
+
+def __getattr__(name: str):
+    """
+    遅延インポート対象のクラスを初回参照時にインポートして返す
+    ref: https://peps.python.org/pep-0562/
+    """
+
+    if name not in __LAZY_IMPORTS:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+    # サブモジュールとクラス名が同じ場合、インポート時にサブモジュールがパッケージの属性にセットされてしまうため、
+    # インポート後にクラスで上書きする
+    module = importlib.import_module(f'{__name__}.{__LAZY_IMPORTS[name]}')
+    value = getattr(module, name)
+    globals()[name] = value
+    return value
@@ -2,7 +2,6 @@
 import asyncio
 import errno
 import os
-import puremagic
 import shutil
 from fastapi import APIRouter
 from fastapi import File
@@ -36,6 +35,9 @@ async def CaptureUploadAPI(
     アップロードされた画像は、サーバー設定で指定されたフォルダに保存される。
     """
 
+    # puremagic はこの API でしか使わないため、サーバー起動時ではなくここでインポートする
+    import puremagic
+
     # 画像が JPEG または PNG かをチェック
     ## 万が一悪意ある攻撃者から危険なファイルを送り込まれないように
     mimetype: str = puremagic.magic_stream(image.file)[0].mime_type
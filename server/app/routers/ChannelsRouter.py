@@ -1,5 +1,6 @@
 
 import asyncio
+import copy
 import json
 import pathlib
 import requests
@@ -21,6 +22,7 @@ from typing import Any
 from app import schemas
 from app.constants import API_REQUEST_HEADERS, CONFIG, LOGO_DIR
 from app.models import Channel
+from app.models import ChannelRegistry
 from app.models import LiveStream
 from app.routers.UsersRouter import GetCurrentUser
 from app.utils import Jikkyo
@@ -39,8 +41,8 @@ router = APIRouter(
 # チャンネル ID からチャンネル情報を取得する
 async def GetChannel(display_channel_id: str = Path(..., description='チャンネル ID 。ex:gr011')) -> Channel:
 
-    # チャンネル情報を取得
-    channel = await Channel.filter(display_channel_id=display_channel_id).get_or_none()
+    # チャンネルレジストリからチャンネル情報を取得
+    channel = await ChannelRegistry.get(display_channel_id)
 
     # 指定されたチャンネル ID が存在しない
     if channel is None:
@@ -50,7 +52,8 @@ async def GetChannel(display_channel_id: str = Path(..., description='チャン
             detail = 'Specified display_channel_id was not found',
         )
 
-    return channel
+    # チャンネルレジストリのチャンネル情報は他のリクエストと共有されているため、番組情報などをセットできるようにコピーして返す
+    return copy.copy(channel)
 
 
 @router.get(
@@ -364,7 +367,11 @@ async def ChannelLogoAPI(
 
         # メインチャンネルの情報を取得
         # ネットワーク ID が同じチャンネルのうち、一番サービス ID が若いチャンネルを探す
-        main_channel = await Channel.filter(network_id=channel.network_id).order_by('service_id').first()
+        main_channel = min(
+            [temp for temp in await ChannelRegistry.getByType(channel.type) if temp.network_id == channel.network_id],
+            key = lambda temp: temp.service_id,
+            default = None,
+        )
 
         # メインチャンネルが存在し、ロゴも存在する
         if main_channel is not None and pathlib.Path.exists(LOGO_DIR / f'{main_channel.id}.png'):
@@ -383,7 +390,7 @@ async def ChannelLogoAPI(
             main_service_id = int(channel.channel_number[0:2] + '1')
 
         # メインチャンネルの情報を取得
-        main_channel = await Channel.filter(network_id=channel.network_id, service_id=main_service_id).first()
+        main_channel = await ChannelRegistry.getByServiceID(channel.network_id, main_service_id)
 
         # メインチャンネルが存在し、ロゴも存在する
         if main_channel is not None and pathlib.Path.exists(LOGO_DIR / f'{main_channel.id}.png'):
@@ -0,0 +1,33 @@
+
+from fastapi import APIRouter
+from fastapi import Request
+
+from app.utils import SupervisorClient
+
+
+# ルーター
+## API ワーカープロセス (server.workers >= 2) でのみ、LiveStreamsRouter の代わりに登録される
+router = APIRouter(
+    tags = ['Streams'],
+    prefix = '/api/streams/live',
+)
+
+
+@router.api_route(
+    '',
+    methods = ['GET'],
+    include_in_schema = False,
+)
+@router.api_route(
+    '/{path:path}',
+    methods = ['GET', 'POST', 'DELETE'],
+    include_in_schema = False,
+)
+async def LiveStreamsRelayAPI(request: Request):
+    """
+    ライブストリーム関連の API リクエストを、ストリーム管理プロセスにそのまま中継する。<br>
+    ライブストリームの状態やストリームデータはストリーム管理プロセスにしか存在しないため、
+    どの API ワーカーが受け取ったリクエストでも同じライブストリームにアクセスできるようにする。
+    """
+
+    return await SupervisorClient.relay(request)
@@ -12,14 +12,15 @@ from fastapi.requests import Request
 from fastapi.responses import Response
 from fastapi.responses import StreamingResponse
 from sse_starlette.sse import EventSourceResponse
-from typing import cast
+from typing import cast, Literal
 
 from app import schemas
-from app.constants import QUALITY, QUALITY_TYPES
-from app.models import Channel
+from app.constants import QUALITY, QUALITY_TYPES, RADIO_QUALITY
+from app.models import ChannelRegistry
 from app.models import LiveStream
 from app.models import LiveStreamClient
 from app.utils import Logging
+from app.utils.AdmissionController import AdmissionController
 
 
 # ルーター
@@ -31,7 +32,7 @@ router = APIRouter(
 
 # チャンネル ID のバリデーション
 async def ValidateChannelID(display_channel_id: str = Path(..., description='チャンネル ID 。ex:gr011')) -> str:
-    if await Channel.filter(display_channel_id=display_channel_id).get_or_none() is None:
+    if await ChannelRegistry.get(display_channel_id) is None:
         Logging.error(f'[LiveStreamsRouter][ValidateChannelID] Specified display_channel_id was not found [display_channel_id: {display_channel_id}]')
         raise HTTPException(
             status_code = status.HTTP_422_UNPROCESSABLE_ENTITY,
@@ -40,15 +41,33 @@ async def ValidateChannelID(display_channel_id: str = Path(..., description='チ
     return display_channel_id
 
 # 品質のバリデーション
-async def ValidateQuality(quality: str = Path(..., description='映像の品質。ex:1080p')) -> QUALITY_TYPES:
+## ラジオチャンネルでは、指定された品質に関わらずラジオチャンネル用の品質 (RADIO_QUALITY) に集約する
+## 同じラジオチャンネルを異なる品質で視聴しているクライアントが、すべて同じライブストリームに接続されるようにするため
+async def ValidateQuality(
+    display_channel_id: str = Depends(ValidateChannelID),
+    quality: str = Path(..., description='映像の品質。ex:1080p'),
+) -> QUALITY_TYPES:
     if quality not in QUALITY:
         Logging.error(f'[LiveStreamsRouter][ValidateQuality] Specified quality was not found [quality: {quality}]')
         raise HTTPException(
             status_code = status.HTTP_422_UNPROCESSABLE_ENTITY,
             detail = 'Specified quality was not found',
         )
+    channel = await ChannelRegistry.get(display_channel_id)
+    if channel is not None and channel.is_radiochannel is True:
+        return RADIO_QUALITY
     return quality
 
+# ABR 用の追加の画質のバリデーション
+async def ValidateRendition(rendition: str = Path(..., description='ABR 用の追加の画質。ex:720p')) -> QUALITY_TYPES:
+    if rendition not in QUALITY:
+        Logging.error(f'[LiveStreamsRouter][ValidateRendition] Specified rendition was not found [rendition: {rendition}]')
+        raise HTTPException(
+            status_code = status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail = 'Specified rendition was not found',
+        )
+    return rendition
+
 # クライアント ID からライブストリームクライアントのインスタンスを取得する
 async def GetLiveStreamClient(
     display_channel_id: str = Depends(ValidateChannelID),
@@ -79,7 +98,8 @@ async def GetLiveStreamClient(
 )
 async def LiveStreamsAPI():
     """
-    すべてのライブストリームの状態を Offline・Standby・ONAir・Idling・Restart の各ステータスごとに取得する。
+    すべてのライブストリームの状態を Offline・Standby・ONAir・Idling・Restart の各ステータスごとに取得する。<br>
+    ライブストリームは最初に使われたときに生成され、Offline になってから使われなくなると破棄されるため、Offline には直近まで使われていたライブストリームだけが入る。
     """
 
     # 返却するデータ
@@ -101,6 +121,36 @@ async def LiveStreamsAPI():
     return result
 
 
+@router.get(
+    '/admission',
+    summary = 'ライブストリーム アドミッション制御 API',
+    response_description = 'エンコードタスクの同時実行数を制御するアドミッション制御の状態。',
+    response_model = schemas.LiveStreamAdmission,
+)
+async def LiveStreamAdmissionAPI():
+    """
+    サーバーのエンコード能力 (予算) に応じて新しいエンコードタスクの開始を制御する、アドミッション制御の状態を取得する。<br>
+    予算と使用中のコスト (いずれも CPU コア数換算)・実行中と順番待ちのエンコードタスク・計測したエンコードのコスト・直近の判定結果 (新しい順) が入る。
+    """
+
+    return AdmissionController.getStatus()
+
+
+@router.get(
+    '/viewer-counts',
+    summary = 'ライブストリーム視聴者数 API',
+    response_description = 'チャンネルごとのライブストリームの視聴者数。',
+    response_model = schemas.LiveStreamViewerCounts,
+)
+async def LiveStreamViewerCountsAPI():
+    """
+    視聴者がいるすべてのチャンネルの、ライブストリームの現在の視聴者数を取得する。<br>
+    視聴者がいないチャンネルは含まれない。API ワーカープロセスが、ライブストリーム API の代わりに視聴者数だけを定期的に取得するために使う。
+    """
+
+    return {'viewer_counts': LiveStream.getViewerCounts()}
+
+
 @router.get(
     '/{display_channel_id}/{quality}',
     summary = 'ライブストリーム API',
@@ -124,6 +174,38 @@ async def LiveStreamAPI(
     return livestream.getStatus()
 
 
+@router.get(
+    '/{display_channel_id}/{quality}/stats',
+    summary = 'ライブストリーム統計 API',
+    response_description = 'エンコーダーの進捗ログから取得した、ライブストリームのエンコードの状況。',
+    response_model = schemas.LiveStreamStats,
+)
+async def LiveStreamStatsAPI(
+    display_channel_id: str = Depends(ValidateChannelID),
+    quality: QUALITY_TYPES = Depends(ValidateQuality),
+):
+    """
+    ライブストリームのエンコードの状況 (フレーム数・fps・ビットレート・GPU 使用率など) を取得する。<br>
+    直近のエンコーダーの進捗ログから取得した値が古い順に samples に入る。一度もエンコードタスクが実行されていない場合、samples は空になる。
+    """
+
+    # ライブストリームを取得
+    # エンコードの状況を取得したいだけなので、接続はしない
+    livestream = LiveStream(display_channel_id, quality)
+
+    # まだエンコードタスクが実行されていない
+    if livestream.encoder_log_parser is None:
+        return {
+            'encoder_type': None,
+            'latest': None,
+            'average_fps': None,
+            'average_bitrate': None,
+            'samples': [],
+        }
+
+    return livestream.encoder_log_parser.getStats()
+
+
 @router.get(
     '/{display_channel_id}/{quality}/events',
     summary = 'ライブストリーム イベント API',
@@ -148,8 +230,9 @@ async def LiveStreamEventAPI(
     - ステータスの更新を示す **status_update**
     - ステータス詳細の更新を示す **detail_update**
     - クライアント数の更新を示す **clients_update**
+    - エンコードが実時間に追いつかないなどの理由で、実際にエンコードしている画質 (encode_quality) が変わったことを示す **quality_update**
 
-    の4種類がある。
+    の5種類がある。
 
     どのイベントでも配信される JSON 構造は同じ。<br>
     ステータスが Offline になった、あるいは既にそうなっている時は、status_update イベントが配信された後に接続を終了する。
@@ -188,6 +271,14 @@ async def LiveStreamEventAPI(
             # 以前の結果と異なっている場合のみレスポンスを返す
             if previous_status != status:
 
+                # 実際にエンコードしている画質が以前と異なる
+                ## 画質の切り替え中はステータスも同時に変わるため、他のイベントとは別に配信する
+                if previous_status['encode_quality'] != status['encode_quality']:
+                    yield {
+                        'event': 'quality_update',  # quality_update イベントを設定
+                        'data': json.dumps(status, ensure_ascii=False),
+                    }
+
                 # ステータスが以前と異なる
                 if previous_status['status'] != status['status']:
                     yield {
@@ -515,3 +606,191 @@ async def LiveLLHLSSecondaryAudioInitializationSegmentAPI(
 ):
     # クライアントから LL-HLS 初期セグメントデータのレスポンスを取得してそのまま返す
     return await livestream_client.getInitializationSegment(secondary_audio=True)
+
+
+# ***** LL-HLS ストリーミング API (ABR) *****
+
+
+@router.get(
+    '/{display_channel_id}/{quality}/ll-hls/{client_id}/{audio_type}/master.m3u8',
+    summary = 'ライブ LL-HLS M3U8 マスタープレイリスト API',
+    response_class = Response,
+    responses = {
+        status.HTTP_200_OK: {
+            'description': '視聴中の画質と ABR 用の追加の画質のプレイリストを列挙した、LL-HLS の M3U8 マスタープレイリスト。',
+            'content': {'application/vnd.apple.mpegurl': {}},
+        }
+    }
+)
+async def LiveLLHLSMasterPlaylistAPI(
+    livestream_client: LiveStreamClient = Depends(GetLiveStreamClient),
+    audio_type: Literal['primary-audio', 'secondary-audio'] = Path(..., description='音声の種別。ex:primary-audio'),
+):
+    """
+    LL-HLS のマスタープレイリストを取得する。<br>
+    config.yaml の tv.abr_ladder が設定されている場合、視聴中の画質に加えて、1つのエンコーダーで同時にエンコードされている
+    追加の画質のプレイリストが列挙され、クライアントは通信状況に応じて画質を切り替えられる。
+    """
+
+    # クライアントから LL-HLS マスタープレイリストのレスポンスを取得してそのまま返す
+    return await livestream_client.getMasterPlaylist(secondary_audio=(audio_type == 'secondary-audio'))
+
+
+@router.get(
+    '/{display_channel_id}/{quality}/ll-hls/{client_id}/renditions/{rendition}/{audio_type}/playlist.m3u8',
+    summary = 'ライブ LL-HLS M3U8 プレイリスト API (ABR 用の追加の画質)',
+    response_class = Response,
+    responses = {
+        status.HTTP_200_OK: {
+            'description': 'LL-HLS の M3U8 プレイリスト。',
+            'content': {'application/vnd.apple.mpegurl': {}},
+        }
+    }
+)
+async def LiveLLHLSRenditionPlaylistAPI(
+    livestream_client: LiveStreamClient = Depends(GetLiveStreamClient),
+    rendition: QUALITY_TYPES = Depends(ValidateRendition),
+    audio_type: Literal['primary-audio', 'secondary-audio'] = Path(..., description='音声の種別。ex:primary-audio'),
+    _HLS_msn: int | None = Query(None, description='LL-HLS プレイリストの msn (Media Sequence Number) インデックス。'),
+    _HLS_part: int | None = Query(None, description='LL-HLS プレイリストの part (部分セグメント) インデックス。'),
+):
+    # クライアントから LL-HLS プレイリストのレスポンスを取得してそのまま返す
+    return await livestream_client.getPlaylist(_HLS_msn, _HLS_part, secondary_audio=(audio_type == 'secondary-audio'), rendition=rendition)
+
+
+@router.get(
+    '/{display_channel_id}/{quality}/ll-hls/{client_id}/renditions/{rendition}/{audio_type}/segment',
+    summary = 'ライブ LL-HLS セグメントデータ API (ABR 用の追加の画質)',
+    response_class = Response,
+    responses = {
+        status.HTTP_200_OK: {
+            'description': 'LL-HLS のセグメントデータ (m4s) 。',
+            'content': {'video/mp4': {}},
+        }
+    }
+)
+async def LiveLLHLSRenditionSegmentAPI(
+    livestream_client: LiveStreamClient = Depends(GetLiveStreamClient),
+    rendition: QUALITY_TYPES = Depends(ValidateRendition),
+    audio_type: Literal['primary-audio', 'secondary-audio'] = Path(..., description='音声の種別。ex:primary-audio'),
+    msn: int | None = Query(None, description='LL-HLS セグメントの msn (Media Sequence Number) インデックス。'),
+):
+    # クライアントから LL-HLS セグメントデータのレスポンスを取得してそのまま返す
+    return await livestream_client.getSegment(msn, secondary_audio=(audio_type == 'secondary-audio'), rendition=rendition)
+
+
+@router.get(
+    '/{display_channel_id}/{quality}/ll-hls/{client_id}/renditions/{rendition}/{audio_type}/part',
+    summary = 'ライブ LL-HLS 部分セグメントデータ API (ABR 用の追加の画質)',
+    response_class = Response,
+    responses = {
+        status.HTTP_200_OK: {
+            'description': 'LL-HLS の部分セグメントデータ (m4s) 。',
+            'content': {'video/mp4': {}},
+        }
+    }
+)
+async def LiveLLHLSRenditionPartialSegmentAPI(
+    livestream_client: LiveStreamClient = Depends(GetLiveStreamClient),
+    rendition: QUALITY_TYPES = Depends(ValidateRendition),
+    audio_type: Literal['primary-audio', 'secondary-audio'] = Path(..., description='音声の種別。ex:primary-audio'),
+    msn: int | None = Query(None, description='LL-HLS セグメントの msn (Media Sequence Number) インデックス。'),
+    part: int | str | None = Query(None, description='LL-HLS セグメントの part (部分セグメント) インデックス。'),
+):
+    # part が空文字列の場合は 0 に変換する
+    if part == '':
+        part = 0
+    part = cast(int | None, part)
+
+    # クライアントから LL-HLS 部分セグメントデータのレスポンスを取得してそのまま返す
+    return await livestream_client.getPartialSegment(msn, part, secondary_audio=(audio_type == 'secondary-audio'), rendition=rendition)
+
+
+@router.get(
+    '/{display_channel_id}/{quality}/ll-hls/{client_id}/renditions/{rendition}/{audio_type}/init',
+    summary = 'ライブ LL-HLS 初期セグメントデータ API (ABR 用の追加の画質)',
+    response_class = Response,
+    responses = {
+        status.HTTP_200_OK: {
+            'description': 'LL-HLS の初期セグメントデータ (m4s) 。',
+            'content': {'video/mp4': {}},
+        }
+    }
+)
+async def LiveLLHLSRenditionInitializationSegmentAPI(
+    livestream_client: LiveStreamClient = Depends(GetLiveStreamClient),
+    rendition: QUALITY_TYPES = Depends(ValidateRendition),
+    audio_type: Literal['primary-audio', 'secondary-audio'] = Path(..., description='音声の種別。ex:primary-audio'),
+):
+    # クライアントから LL-HLS 初期セグメントデータのレスポンスを取得してそのまま返す
+    return await livestream_client.getInitializationSegment(secondary_audio=(audio_type == 'secondary-audio'), rendition=rendition)
+
+
+# ***** タイムシフト再生 API *****
+
+
+@router.get(
+    '/{display_channel_id}/{quality}/ll-hls/{client_id}/timeshift/playlist.m3u8',
+    summary = 'ライブタイムシフト M3U8 プレイリスト API',
+    response_class = Response,
+    responses = {
+        status.HTTP_200_OK: {
+            'description': 'タイムシフトバッファに保持しているセグメントを含む M3U8 プレイリスト。',
+            'content': {'application/vnd.apple.mpegurl': {}},
+        }
+    }
+)
+async def LiveTimeshiftPlaylistAPI(
+    livestream_client: LiveStreamClient = Depends(GetLiveStreamClient),
+):
+    """
+    タイムシフトバッファに保持している直近のストリームデータを、MPEG-TS セグメントの HLS プレイリストとして返す。<br>
+    タイムシフト再生が有効 (server.timeshift_duration が 0 より大きい) な場合のみ利用できる。<br>
+    LL-HLS クライアントとして接続中のクライアント ID を指定する必要があり、タイムシフト再生中もライブストリームへの接続が維持される。
+    """
+
+    # クライアントからタイムシフトのプレイリストのレスポンスを取得してそのまま返す
+    return livestream_client.getTimeshiftPlaylist()
+
+
+@router.get(
+    '/{display_channel_id}/{quality}/ll-hls/{client_id}/timeshift/segment',
+    summary = 'ライブタイムシフトセグメントデータ API',
+    response_class = Response,
+    responses = {
+        status.HTTP_200_OK: {
+            'description': 'タイムシフトバッファに保持しているセグメントデータ (MPEG-TS) 。',
+            'content': {'video/mp2t': {}},
+        }
+    }
+)
+async def LiveTimeshiftSegmentAPI(
+    livestream_client: LiveStreamClient = Depends(GetLiveStreamClient),
+    msn: int = Query(..., description='タイムシフトのセグメントの msn (Media Sequence Number) インデックス。'),
+):
+    # クライアントからタイムシフトのセグメントデータのレスポンスを取得してそのまま返す
+    return livestream_client.getTimeshiftSegment(msn)
+
+
+@router.get(
+    '/{display_channel_id}/{quality}/ll-hls/{client_id}/timeshift/mpegts',
+    summary = 'ライブタイムシフト MPEG-TS ストリーム API',
+    response_class = StreamingResponse,
+    responses = {
+        status.HTTP_200_OK: {
+            'description': '指定された時間だけ前の時点から配信される MPEG-TS ストリーム。',
+            'content': {'video/mp2t': {}},
+        }
+    }
+)
+async def LiveTimeshiftMPEGTSStreamAPI(
+    livestream_client: LiveStreamClient = Depends(GetLiveStreamClient),
+    seconds_ago: float = Query(0, ge=0, description='現在から何秒前の時点から配信するか。保持している範囲より前を指定した場合は、最も古い時点から配信する。'),
+):
+    """
+    タイムシフトバッファに保持しているストリームデータを、指定された時間だけ前の時点のキーフレームから MPEG-TS ストリームとして配信する。<br>
+    保持しているデータの末尾に追いついた後は、ライブストリームを少し遅れて配信し続ける。
+    """
+
+    # クライアントからタイムシフトの MPEG-TS ストリームのレスポンスを取得してそのまま返す
+    return livestream_client.getTimeshiftStream(seconds_ago)
@@ -2,14 +2,17 @@
 from fastapi import APIRouter
 from fastapi import BackgroundTasks
 from fastapi import Depends
+from fastapi import Request
 from fastapi import status
 
+from app.constants import IS_API_WORKER
 from app.models import Channel
 from app.models import Program
 from app.models import TwitterAccount
 from app.models import User
 from app.routers.UsersRouter import GetCurrentAdminUser
 from app.utils import ServerManager
+from app.utils import SupervisorClient
 
 
 # ルーター
@@ -45,6 +48,7 @@ async def UpdateDatabaseAPI(
     status_code = status.HTTP_204_NO_CONTENT,
 )
 async def ServerShutdownAPI(
+    request: Request,
     background_tasks: BackgroundTasks,
     current_user: User = Depends(GetCurrentAdminUser),
 ):
@@ -53,6 +57,11 @@ async def ServerShutdownAPI(
     JWT エンコードされたアクセストークンがリクエストの Authorization: Bearer に設定されていて、かつ管理者アカウントでないとアクセスできない。
     """
 
+    # API ワーカープロセスでは、サーバー全体を管理しているストリーム管理プロセスにリクエストを中継する
+    ## ストリーム管理プロセスが終了すると、API ワーカープロセスも一緒に終了する
+    if IS_API_WORKER is True:
+        return await SupervisorClient.relay(request)
+
     # バックグラウンドでサーバーのシャットダウンを行う
     background_tasks.add_task(ServerManager.shutdown)
 
@@ -63,6 +72,7 @@ async def ServerShutdownAPI(
     status_code = status.HTTP_204_NO_CONTENT,
 )
 async def ServerRestartAPI(
+    request: Request,
     background_tasks: BackgroundTasks,
     current_user: User = Depends(GetCurrentAdminUser),
 ):
@@ -71,5 +81,10 @@ async def ServerRestartAPI(
     JWT エンコードされたアクセストークンがリクエストの Authorization: Bearer に設定されていて、かつ管理者アカウントでないとアクセスできない。
     """
 
+    # API ワーカープロセスでは、ストリーム管理プロセスにリクエストを中継する
+    ## API ワーカープロセスはライブストリームなどの状態を持たないため、再起動する必要はない
+    if IS_API_WORKER is True:
+        return await SupervisorClient.relay(request)
+
     # バックグラウンドでサーバーの再起動を行う
     background_tasks.add_task(ServerManager.restart)
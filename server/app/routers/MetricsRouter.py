@@ -0,0 +1,89 @@
+from fastapi import APIRouter
+from fastapi import Depends
+from fastapi import Request
+from fastapi import status
+from fastapi.responses import Response
+
+from app import schemas
+from app.constants import IS_API_WORKER
+from app.models import LiveStream
+from app.models import User
+from app.routers.UsersRouter import GetCurrentAdminUser
+from app.utils import SupervisorClient
+from app.utils.AdmissionController import AdmissionController
+from app.utils.Metrics import Metrics
+from app.utils.StartupTrace import StartupTrace
+
+
+# ルーター
+router = APIRouter(
+    tags = ['Metrics'],
+    prefix = '/api/metrics',
+)
+
+
+@router.get(
+    '',
+    summary = 'メトリクス API',
+    response_class = Response,
+    responses = {
+        status.HTTP_200_OK: {
+            'description': 'Prometheus のテキスト形式のメトリクス。',
+            'content': {'text/plain; version=0.0.4': {}},
+        }
+    }
+)
+async def MetricsAPI(request: Request):
+    """
+    ライブストリーム・LL-HLS Segmenter・チャンネル情報と番組情報の更新・Mirakurun / EDCB への外部呼び出し・イベントループの遅延に関する
+    メトリクスを、Prometheus のテキスト形式で取得する。
+    """
+
+    # API ワーカープロセスでは、ライブストリームやデータベースの更新はストリーム管理プロセスにしか存在しないため、
+    # ストリーム管理プロセスにそのまま中継する
+    if IS_API_WORKER is True:
+        return await SupervisorClient.relay(request)
+
+    # ライブストリームごとのメトリクスを集計する
+    ## 接続中のクライアントがいなくなったライブストリームの値が残らないよう、一旦クリアしてから集計する
+    Metrics.LIVESTREAM_CLIENT_QUEUE_DEPTH.clear()
+    Metrics.LIVESTREAM_CLIENT_LAG.clear()
+    for livestream in LiveStream.getAllLiveStreams():
+        livestream.collectMetrics()
+
+    # エンコードタスクのアドミッション制御の状態を反映する
+    admission_status = AdmissionController.getStatus()
+    Metrics.ADMISSION_BUDGET.set(value=admission_status['budget'])
+    Metrics.ADMISSION_BUDGET_USED.set(value=admission_status['used'])
+    Metrics.ADMISSION_QUEUE_LENGTH.set(value=len(admission_status['queue']))
+
+    return Response(content=Metrics.render(), media_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@router.get(
+    '/startup-traces',
+    summary = 'ライブストリーム起動トレース API',
+    response_description = 'ライブストリームの起動にかかった時間のフェーズごとの統計と、直近のトレース。',
+    response_model = schemas.LiveStreamStartupTraces,
+)
+async def StartupTracesAPI(
+    request: Request,
+    current_user: User = Depends(GetCurrentAdminUser),
+):
+    """
+    ライブストリームの起動 (エンコードタスクの開始から最初のストリームデータの書き込みまで) にかかった時間を、
+    チャンネル情報の取得・エンコード能力の空き待ち・エンコーダーの起動・チューナーの起動・エンコーダーのウォームアップ・最初のストリームデータの書き込みの各フェーズに分けて取得する。<br>
+    エンコーダーのホットリスタートからの復帰にかかった時間も、kind が HotRestart のトレースとして記録される。<br>
+    summary にはトレースの種類・バックエンド・エンコーダー・画質・フェーズの組み合わせごとの p50・p90・p99・最大値が、traces には直近のトレースが新しい順に入る。<br>
+    JWT エンコードされたアクセストークンがリクエストの Authorization: Bearer に設定されていて、かつ管理者アカウントでないとアクセスできない。
+    """
+
+    # API ワーカープロセスでは、ライブストリームはストリーム管理プロセスにしか存在しないため、
+    # ストリーム管理プロセスにそのまま中継する
+    if IS_API_WORKER is True:
+        return await SupervisorClient.relay(request)
+
+    return {
+        'summary': StartupTrace.getSummary(),
+        'traces': StartupTrace.getTraces(),
+    }
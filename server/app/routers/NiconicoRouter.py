@@ -20,6 +20,7 @@ from app.routers.UsersRouter import GetCurrentUser
 from app.utils import Interlaced
 from app.utils import Logging
 from app.utils import OAuthCallbackResponse
+from app.utils.UserCache import UserCache
 
 
 # ルーター
@@ -230,6 +231,7 @@ async def NiconicoAuthCallbackAPI(
 
     # 変更をデータベースに保存
     await current_user.save()
+    UserCache.invalidate(current_user.id)
 
     # OAuth 連携が正常に完了したことを伝える
     return OAuthCallbackResponse(
@@ -259,3 +261,4 @@ async def NiconicoAccountLogoutAPI(
     current_user.niconico_access_token = None
     current_user.niconico_refresh_token = None
     await current_user.save()
+    UserCache.invalidate(current_user.id)
@@ -6,6 +6,7 @@ from fastapi import status
 
 from app import schemas
 from app.models import User
+from app.utils.UserCache import UserCache
 from app.routers.UsersRouter import GetCurrentUser
 
 
@@ -52,3 +53,4 @@ async def ClientSettingsUpdateAPI(
 
     # レコードを保存する
     await current_user.save()
+    UserCache.invalidate(current_user.id)
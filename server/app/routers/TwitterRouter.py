@@ -3,8 +3,6 @@ import asyncio
 import json
 import pytz
 import re
-import tweepy
-import tweepy.models
 from fastapi import APIRouter
 from fastapi import Body
 from fastapi import Depends
@@ -16,8 +14,7 @@ from fastapi import Query
 from fastapi import Request
 from fastapi import status
 from fastapi import UploadFile
-from tweepy_authlib import CookieSessionUserHandler
-from typing import Any, cast, Coroutine
+from typing import Any, cast, Coroutine, TYPE_CHECKING
 
 from app import schemas
 from app.models import TwitterAccount
@@ -25,6 +22,18 @@ from app.models import User
 from app.routers.UsersRouter import GetCurrentUser
 from app.utils import Logging
 from app.utils import OAuthCallbackResponse
+from app.utils.TweetCache import TweetCache
+from app.utils.UserCache import UserCache
+
+# tweepy は読み込みに時間がかかるため、実際に Twitter API を利用するときに遅延インポートする
+## FastAPI は依存関係を受け取る引数の型アノテーションを実行時に評価するため、tweepy.API の代わりに TweepyAPI を使う
+if TYPE_CHECKING:
+    import tweepy
+    import tweepy.models
+    from tweepy import API as TweepyAPI
+    from tweepy_authlib import CookieSessionUserHandler
+else:
+    TweepyAPI = Any
 
 
 # ルーター
@@ -61,7 +70,7 @@ error_messages = {
 
 
 # Twitter API のエラーコードからエラーメッセージを生成して HTTPException を発生させる
-def RaiseHTTPException(ex: tweepy.HTTPException) -> None:
+def RaiseHTTPException(ex: 'tweepy.HTTPException') -> None:
     if len(ex.api_codes) > 0 and len(ex.api_messages) > 0:
         error_message = f'Code: {ex.api_codes[0]}, Message: {error_messages.get(ex.api_codes[0], ex.api_messages[0])}'
     else:
@@ -95,7 +104,7 @@ async def GetCurrentTwitterAccount(
 
 
 # 現在ログイン中のユーザーに紐づく Twitter アカウントの Tweepy インスタンスを取得する
-def GetCurrentTwitterAccountAPI(twitter_account: TwitterAccount = Depends(GetCurrentTwitterAccount)) -> tweepy.API:
+def GetCurrentTwitterAccountAPI(twitter_account: TwitterAccount = Depends(GetCurrentTwitterAccount)) -> TweepyAPI:
     return twitter_account.getTweepyAPI()
 
 
@@ -116,6 +125,8 @@ async def TwitterAuthURLAPI(
     JWT エンコードされたアクセストークンがリクエストの Authorization: Bearer に設定されていないとアクセスできない。<br>
     """
 
+    import tweepy
+
     # クライアント (フロントエンド) の URL を Origin ヘッダーから取得
     ## Origin ヘッダーがリクエストに含まれていない場合はこの API サーバーの URL を使う
     client_url = cast(str, request.headers.get('Origin', f'https://{request.url.netloc}')).rstrip('/') + '/'
@@ -160,6 +171,7 @@ async def TwitterAuthURLAPI(
         access_token = oauth_handler.request_token['oauth_token'],  # 暫定的に oauth_token を格納 (認証 URL の ?oauth_token= と同じ値)
         access_token_secret = oauth_handler.request_token['oauth_token_secret'],  # 暫定的に oauth_token_secret を格納
     )
+    UserCache.invalidate(current_user.id)
 
     return {'authorization_url': authorization_url}
 
@@ -180,6 +192,8 @@ async def TwitterAuthCallbackAPI(
     Twitter の OAuth 認証のコールバックを受け取り、ログイン中のユーザーアカウントと Twitter アカウントを紐づける。
     """
 
+    import tweepy
+
     # スマホ・タブレット向けのリダイレクト先 URL を生成
     redirect_url = f'{client.rstrip("/")}/settings/twitter'
 
@@ -192,6 +206,7 @@ async def TwitterAuthCallbackAPI(
         twitter_account = await TwitterAccount.filter(access_token=denied).get_or_none()
         if twitter_account:
             await twitter_account.delete()
+            UserCache.invalidate(cast(Any, twitter_account).user_id)
 
         # 401 エラーを送出
         Logging.error('[TwitterRouter][TwitterAuthCallbackAPI] Authorization was denied by user')
@@ -280,6 +295,9 @@ async def TwitterAuthCallbackAPI(
         await twitter_account_existing[0].save()
         await twitter_account.delete()
 
+    # ユーザーアカウントに紐づく Twitter アカウントが変わったので、キャッシュされているユーザー情報を破棄する
+    UserCache.invalidate(cast(Any, twitter_account).user_id)
+
     # OAuth 連携が正常に完了したことを伝える
     return OAuthCallbackResponse(
         status_code = status.HTTP_200_OK,
@@ -301,6 +319,9 @@ async def TwitterPasswordAuthAPI(
     tweepy-authlib を利用してパスワード認証で Twitter 連携を行い、ログイン中のユーザーアカウントと Twitter アカウントを紐づける。
     """
 
+    import tweepy
+    from tweepy_authlib import CookieSessionUserHandler
+
     # 万が一スクリーンネームに @ が含まれていた場合は事前に削除する
     password_auth_request.screen_name = password_auth_request.screen_name.replace('@', '')
 
@@ -385,6 +406,9 @@ async def TwitterPasswordAuthAPI(
         await twitter_account_existing[0].save()
         await twitter_account.delete()
 
+    # ユーザーアカウントに紐づく Twitter アカウントが変わったので、キャッシュされているユーザー情報を破棄する
+    UserCache.invalidate(cast(Any, twitter_account).user_id)
+
 
 @router.delete(
     '/accounts/{screen_name}',
@@ -399,10 +423,12 @@ async def TwitterAccountDeleteAPI(
     JWT エンコードされたアクセストークンがリクエストの Authorization: Bearer に設定されていないとアクセスできない。
     """
 
+    import tweepy
+
     # Cookie セッションでは、明示的にログアウト処理を行う
     ## 単に Cookie を削除するだけだと Twitter 側にログインセッションが残り続けてしまう
     if twitter_account.access_token == 'COOKIE_SESSION':
-        auth_handler = cast(CookieSessionUserHandler, twitter_account.getTweepyAuthHandler())
+        auth_handler = cast('CookieSessionUserHandler', twitter_account.getTweepyAuthHandler())
         try:
             await asyncio.to_thread(auth_handler.logout)
         except tweepy.HTTPException as ex:
@@ -428,6 +454,8 @@ async def TwitterAccountDeleteAPI(
     # 指定された Twitter アカウントのレコードを削除
     ## アクセストークンなどが保持されたレコードを削除することで連携解除とする
     await twitter_account.delete()
+    UserCache.invalidate(cast(Any, twitter_account).user_id)
+    TweetCache.invalidate(twitter_account.id)
 
 
 @router.post(
@@ -439,7 +467,7 @@ async def TwitterAccountDeleteAPI(
 async def TwitterTweetAPI(
     tweet: str = Form('', description='ツイートの本文（基本的には140文字まで）。'),
     images: list[UploadFile] | None = File(None, description='ツイートに添付する画像（4枚まで）。'),
-    twitter_account_api: tweepy.API = Depends(GetCurrentTwitterAccountAPI),
+    twitter_account_api: TweepyAPI = Depends(GetCurrentTwitterAccountAPI),
 ):
     """
     Twitter にツイートを送信する。<br>
@@ -448,6 +476,8 @@ async def TwitterTweetAPI(
     JWT エンコードされたアクセストークンがリクエストの Authorization: Bearer に設定されていないとアクセスできない。
     """
 
+    import tweepy
+
     # 画像が4枚を超えている
     if images is None:
         images = []
@@ -508,7 +538,8 @@ async def TwitterTweetAPI(
 )
 async def TwitterRetweetAPI(
     tweet_id: str = Path(..., description='リツイートするツイートの ID。'),
-    twitter_account_api: tweepy.API = Depends(GetCurrentTwitterAccountAPI),
+    twitter_account: TwitterAccount = Depends(GetCurrentTwitterAccount),
+    twitter_account_api: TweepyAPI = Depends(GetCurrentTwitterAccountAPI),
 ):
     """
     指定されたツイートをリツイートする。<br>
@@ -517,12 +548,17 @@ async def TwitterRetweetAPI(
     JWT エンコードされたアクセストークンがリクエストの Authorization: Bearer に設定されていないとアクセスできない。
     """
 
+    import tweepy
+
     # ツイートをリツイート
     try:
         await asyncio.to_thread(twitter_account_api.retweet, tweet_id)
     except tweepy.HTTPException as ex:
         RaiseHTTPException(ex)
 
+    # キャッシュしたホームタイムライン・検索結果のリツイート済み・いいね済みかどうかが古くなるため、破棄する
+    TweetCache.invalidate(twitter_account.id)
+
 
 @router.delete(
     '/accounts/{screen_name}/tweets/{tweet_id}/retweet',
@@ -531,7 +567,8 @@ async def TwitterRetweetAPI(
 )
 async def TwitterRetweetCancelAPI(
     tweet_id: str = Path(..., description='リツイートを取り消すツイートの ID。'),
-    twitter_account_api: tweepy.API = Depends(GetCurrentTwitterAccountAPI),
+    twitter_account: TwitterAccount = Depends(GetCurrentTwitterAccount),
+    twitter_account_api: TweepyAPI = Depends(GetCurrentTwitterAccountAPI),
 ):
     """
     指定されたツイートのリツイートを取り消す。<br>
@@ -540,12 +577,17 @@ async def TwitterRetweetCancelAPI(
     JWT エンコードされたアクセストークンがリクエストの Authorization: Bearer に設定されていないとアクセスできない。
     """
 
+    import tweepy
+
     # ツイートのリツイートを取り消し
     try:
         await asyncio.to_thread(twitter_account_api.unretweet, tweet_id)
     except tweepy.HTTPException as ex:
         RaiseHTTPException(ex)
 
+    # キャッシュしたホームタイムライン・検索結果のリツイート済み・いいね済みかどうかが古くなるため、破棄する
+    TweetCache.invalidate(twitter_account.id)
+
 
 @router.put(
     '/accounts/{screen_name}/tweets/{tweet_id}/favorite',
@@ -554,7 +596,8 @@ async def TwitterRetweetCancelAPI(
 )
 async def TwitterFavoriteAPI(
     tweet_id: str = Path(..., description='いいねするツイートの ID。'),
-    twitter_account_api: tweepy.API = Depends(GetCurrentTwitterAccountAPI),
+    twitter_account: TwitterAccount = Depends(GetCurrentTwitterAccount),
+    twitter_account_api: TweepyAPI = Depends(GetCurrentTwitterAccountAPI),
 ):
     """
     指定されたツイートをいいねする。<br>
@@ -563,12 +606,17 @@ async def TwitterFavoriteAPI(
     JWT エンコードされたアクセストークンがリクエストの Authorization: Bearer に設定されていないとアクセスできない。
     """
 
+    import tweepy
+
     # ツイートをいいね
     try:
         await asyncio.to_thread(twitter_account_api.create_favorite, tweet_id)
     except tweepy.HTTPException as ex:
         RaiseHTTPException(ex)
 
+    # キャッシュしたホームタイムライン・検索結果のリツイート済み・いいね済みかどうかが古くなるため、破棄する
+    TweetCache.invalidate(twitter_account.id)
+
 
 @router.delete(
     '/accounts/{screen_name}/tweets/{tweet_id}/favorite',
@@ -577,7 +625,8 @@ async def TwitterFavoriteAPI(
 )
 async def TwitterFavoriteCancelAPI(
     tweet_id: str = Path(..., description='いいねを取り消すツイートの ID。'),
-    twitter_account_api: tweepy.API = Depends(GetCurrentTwitterAccountAPI),
+    twitter_account: TwitterAccount = Depends(GetCurrentTwitterAccount),
+    twitter_account_api: TweepyAPI = Depends(GetCurrentTwitterAccountAPI),
 ):
     """
     指定されたツイートのいいねを取り消す。<br>
@@ -585,12 +634,74 @@ async def TwitterFavoriteCancelAPI(
 
     JWT エンコードされたアクセストークンがリクエストの Authorization: Bearer に設定されていないとアクセスできない。
     """
+
+    import tweepy
     # ツイートのいいねを取り消し
     try:
         await asyncio.to_thread(twitter_account_api.destroy_favorite, tweet_id)
     except tweepy.HTTPException as ex:
         RaiseHTTPException(ex)
 
+    # キャッシュしたホームタイムライン・検索結果のリツイート済み・いいね済みかどうかが古くなるため、破棄する
+    TweetCache.invalidate(twitter_account.id)
+
+
+# tweepy のツイートオブジェクトからレスポンス用のツイートモデルを作成する
+def GenerateTweet(tweet: 'tweepy.models.Status') -> schemas.Tweet:
+
+    # リツイートがある場合は、リツイート元のツイートの情報を取得
+    retweeted_tweet = None
+    if hasattr(tweet, 'retweeted_status'):
+        retweeted_tweet = GenerateTweet(tweet.retweeted_status)
+
+    # 引用リツイートがある場合は、引用リツイート元のツイートの情報を取得
+    quoted_tweet = None
+    if hasattr(tweet, 'quoted_status'):
+        quoted_tweet = GenerateTweet(tweet.quoted_status)
+
+    # 画像の URL を取得
+    image_urls = []
+    movie_url = None
+    if hasattr(tweet, 'extended_entities'):
+        for media in tweet.extended_entities['media']:
+            if media['type'] == 'photo':
+                image_urls.append(media['media_url_https'])
+            elif media['type'] in ['video', 'animated_gif']:
+                movie_url = media['video_info']['variants'][0]['url']  # bitrate が最も高いものを取得
+
+    # t.co の URL を展開した URL に置換
+    expanded_text = tweet.full_text
+    if hasattr(tweet, 'entities') and 'urls' in tweet.entities:
+        for url_entity in tweet.entities['urls']:
+            expanded_text = expanded_text.replace(url_entity['url'], url_entity['expanded_url'])
+
+    # 残った t.co の URL を削除
+    if len(image_urls) > 0 or movie_url:
+        expanded_text = re.sub(r'\s*https://t\.co/\w+$', '', expanded_text)
+
+    return schemas.Tweet(
+        id = tweet.id_str,
+        created_at = tweet.created_at.astimezone(pytz.timezone('Asia/Tokyo')),
+        user = schemas.TweetUser(
+            id = tweet.user.id_str,
+            name = tweet.user.name,
+            screen_name = tweet.user.screen_name,
+            # (ランダムな文字列)_normal.jpg だと画像サイズが小さいので、(ランダムな文字列).jpg に置換
+            icon_url = tweet.user.profile_image_url_https.replace('_normal', ''),
+        ),
+        text = expanded_text,
+        lang = tweet.lang,
+        via = re.sub(r'<.+?>', '', tweet.source),
+        image_urls = image_urls if len(image_urls) > 0 else None,
+        movie_url = movie_url,
+        retweet_count = tweet.retweet_count,
+        favorite_count = tweet.favorite_count,
+        retweeted = tweet.retweeted,
+        favorited = tweet.favorited,
+        retweeted_tweet = retweeted_tweet,
+        quoted_tweet = quoted_tweet,
+    )
+
 
 @router.get(
     '/accounts/{screen_name}/timeline',
@@ -600,102 +711,77 @@ async def TwitterFavoriteCancelAPI(
 )
 async def TwitterTimelineAPI(
     since_tweet_id: str | None = Query(None, description='このツイート ID 以降のツイートを取得する。'),
-    twitter_account_api: tweepy.API = Depends(GetCurrentTwitterAccountAPI),
+    twitter_account: TwitterAccount = Depends(GetCurrentTwitterAccount),
+    twitter_account_api: TweepyAPI = Depends(GetCurrentTwitterAccountAPI),
 ):
     """
     ホームタイムラインを取得する。<br>
-    ホームタイムラインの取得には screen_name で指定したスクリーンネームに紐づく Twitter アカウントが利用される。
+    ホームタイムラインの取得には screen_name で指定したスクリーンネームに紐づく Twitter アカウントが利用される。<br>
+    取得したホームタイムラインは Twitter アカウントごとに短時間キャッシュされ、キャッシュの有効期間が過ぎた後は新しいツイートの差分だけを取得する。
 
     JWT エンコードされたアクセストークンがリクエストの Authorization: Bearer に設定されていないとアクセスできない。
     """
 
-    try:
+    import tweepy
 
-        # ホームタイムラインを取得
+    # ホームタイムラインを取得し、レスポンス用に情報を整形する
+    ## tweepy の API 呼び出しは同期的に HTTP リクエストを行うため、イベントループ (ライブストリームの配信など) を止めないよう
+    ## ツイートの整形も含めてスレッド上で実行する
+    def FetchTimeline(since_id: str | None) -> list[schemas.Tweet]:
         tweets = twitter_account_api.home_timeline(
             count = 200,
-            since_id = since_tweet_id,
+            since_id = since_id,
             trim_user = False,
             exclude_replies = True,
             include_entities = True,
             tweet_mode = 'extended',
         )
+        return [GenerateTweet(tweet) for tweet in tweets]
 
-        def GenerateTweet(tweet) -> schemas.Tweet:
-
-            # リツイートがある場合は、リツイート元のツイートの情報を取得
-            retweeted_tweet = None
-            if hasattr(tweet, 'retweeted_status'):
-                retweeted_tweet = GenerateTweet(tweet.retweeted_status)
-
-            # 引用リツイートがある場合は、引用リツイート元のツイートの情報を取得
-            quoted_tweet = None
-            if hasattr(tweet, 'quoted_status'):
-                quoted_tweet = GenerateTweet(tweet.quoted_status)
-
-            # 画像の URL を取得
-            image_urls = []
-            movie_url = None
-            if hasattr(tweet, 'extended_entities'):
-                for media in tweet.extended_entities['media']:
-                    if media['type'] == 'photo':
-                        image_urls.append(media['media_url_https'])
-                    elif media['type'] in ['video', 'animated_gif']:
-                        movie_url = media['video_info']['variants'][0]['url']  # bitrate が最も高いものを取得
-
-            # t.co の URL を展開した URL に置換
-            expanded_text = tweet.full_text
-            if hasattr(tweet, 'entities') and 'urls' in tweet.entities:
-                for url_entity in tweet.entities['urls']:
-                    expanded_text = expanded_text.replace(url_entity['url'], url_entity['expanded_url'])
-
-            # 残った t.co の URL を削除
-            if len(image_urls) > 0 or movie_url:
-                expanded_text = re.sub(r'\s*https://t\.co/\w+$', '', expanded_text)
-
-            return schemas.Tweet(
-                id = tweet.id_str,
-                created_at = tweet.created_at.astimezone(pytz.timezone('Asia/Tokyo')),
-                user = schemas.TweetUser(
-                    id = tweet.user.id_str,
-                    name = tweet.user.name,
-                    screen_name = tweet.user.screen_name,
-                    # (ランダムな文字列)_normal.jpg だと画像サイズが小さいので、(ランダムな文字列).jpg に置換
-                    icon_url = tweet.user.profile_image_url_https.replace('_normal', ''),
-                ),
-                text = expanded_text,
-                lang = tweet.lang,
-                via = re.sub(r'<.+?>', '', tweet.source),
-                image_urls = image_urls if len(image_urls) > 0 else None,
-                movie_url = movie_url,
-                retweet_count = tweet.retweet_count,
-                favorite_count = tweet.favorite_count,
-                retweeted = tweet.retweeted,
-                favorited = tweet.favorited,
-                retweeted_tweet = retweeted_tweet,
-                quoted_tweet = quoted_tweet,
-            )
-
-        # レスポンス用に情報を整形
-        formatted_tweets: list[schemas.Tweet] = []
-        for tweet in tweets:
-
-            # 最終的なツイートモデルを作成
-            formatted_tweets.append(GenerateTweet(tweet))
-
-        return formatted_tweets
-
+    try:
+        return await TweetCache.getTimeline(
+            twitter_account.id,
+            since_tweet_id,
+            lambda since_id: asyncio.to_thread(FetchTimeline, since_id),
+        )
     except tweepy.HTTPException as ex:
         RaiseHTTPException(ex)
 
 
 @router.get(
-    '/search',
+    '/accounts/{screen_name}/search',
     summary = 'ツイート検索 API',
+    response_description = '検索結果のツイートのリスト。',
+    response_model = schemas.Tweets,
 )
 async def TwitterSearchAPI(
-    current_user: User = Depends(GetCurrentUser),
+    query: str = Query(..., description='検索クエリ。'),
+    twitter_account: TwitterAccount = Depends(GetCurrentTwitterAccount),
+    twitter_account_api: TweepyAPI = Depends(GetCurrentTwitterAccountAPI),
 ):
     """
-    API 実装中…（モックアップ）
+    ツイートを検索する。<br>
+    ツイートの検索には screen_name で指定したスクリーンネームに紐づく Twitter アカウントが利用される。<br>
+    検索結果は Twitter アカウントごとに短時間キャッシュされ、同じアカウントで同じ検索クエリを検索したときに使い回される (他のアカウントとは共有されない)。
+
+    JWT エンコードされたアクセストークンがリクエストの Authorization: Bearer に設定されていないとアクセスできない。
     """
+
+    import tweepy
+
+    # ツイートを検索し、レスポンス用に情報を整形する
+    ## ホームタイムラインと同様に、イベントループを止めないようスレッド上で実行する
+    def SearchTweets() -> list[schemas.Tweet]:
+        tweets = twitter_account_api.search_tweets(
+            q = query,
+            result_type = 'recent',
+            count = 100,
+            include_entities = True,
+            tweet_mode = 'extended',
+        )
+        return [GenerateTweet(tweet) for tweet in tweets]
+
+    try:
+        return await TweetCache.search(twitter_account.id, query, lambda: asyncio.to_thread(SearchTweets))
+    except tweepy.HTTPException as ex:
+        RaiseHTTPException(ex)
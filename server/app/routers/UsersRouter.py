@@ -19,7 +19,6 @@ from fastapi.security import OAuth2PasswordRequestForm
 from jose import jwt
 from jose import JWTError
 from passlib.context import CryptContext
-from PIL import Image
 from tortoise import timezone
 from typing import BinaryIO
 
@@ -28,6 +27,7 @@ from app.constants import ACCOUNT_ICON_DIR, ACCOUNT_ICON_DEFAULT_DIR, JWT_SECRET
 from app.models import TwitterAccount
 from app.models import User
 from app.utils import Logging
+from app.utils.UserCache import UserCache
 
 
 # ルーター
@@ -51,6 +51,9 @@ async def TrimSquareAndResizeAndSave(file: BinaryIO, save_path: pathlib.Path, re
         resize_width_and_height (int, optional): リサイズする幅と高さ. Defaults to 400.
     """
 
+    ## Pillow はアイコン画像のアップロード時にしか使わないため、サーバー起動時ではなくここでインポートする
+    from PIL import Image
+
     ## 画像を開く
     pillow_image = await asyncio.to_thread(Image.open, file)
 
@@ -95,6 +98,11 @@ async def GetCurrentUser(token: str = Depends(OAuth2PasswordBearer(tokenUrl='use
         )
 
     # JWT トークンに刻まれたユーザー ID に紐づくユーザー情報を取得
+    ## 直近に取得したユーザー情報がキャッシュされていれば、データベースに問い合わせずにそれを使う
+    current_user = UserCache.get(user_id)
+    if current_user is not None:
+        return current_user
+    generation = UserCache.getGeneration()
     current_user = await User.filter(id=user_id).prefetch_related('twitter_accounts').get_or_none()
 
     # そのユーザー ID のユーザーが存在しない
@@ -106,6 +114,9 @@ async def GetCurrentUser(token: str = Depends(OAuth2PasswordBearer(tokenUrl='use
             headers = {'WWW-Authenticate': 'Bearer'},
         )
 
+    # 取得したユーザー情報をキャッシュする
+    UserCache.set(current_user, generation)
+
     return current_user
 
 # 現在ログイン中の管理者ユーザーを取得する
@@ -297,6 +308,7 @@ async def UserMeAPI(
     ## Twitter 連携では途中で連携をキャンセルした場合に仮のアカウントデータが残置されてしまうので、それを取り除く
     if await TwitterAccount.filter(icon_url='Temporary').count() > 0:
         await TwitterAccount.filter(icon_url='Temporary').delete()
+        UserCache.invalidate()  # 仮のアカウントデータはどのユーザーに紐づいていてもおかしくないので、すべてのキャッシュを破棄する
         current_user = await User.filter(id=current_user.id).prefetch_related('twitter_accounts').get()  # current_user のデータを更新
 
     return current_user
@@ -351,6 +363,7 @@ async def UserUpdateMeAPI(
 
     # レコードを保存する
     await current_user.save()
+    UserCache.invalidate(current_user.id)
 
 
 @router.get(
@@ -443,6 +456,9 @@ async def UserDeleteMeAPI(
         id_young_user.is_admin = True
         await id_young_user.save()
 
+    # 他のユーザーに管理者権限が付与されている可能性もあるため、すべてのキャッシュを破棄する
+    UserCache.invalidate()
+
 
 # ***** 指定ユーザーアカウント情報 API (管理者用) *****
 
@@ -517,6 +533,7 @@ async def UserUpdateAPI(
 
     # レコードを保存する
     await user.save()
+    UserCache.invalidate(user.id)
 
 
 @router.get(
@@ -607,3 +624,6 @@ async def UserDeleteAPI(
         id_young_user = await User.all().order_by('id').first()
         id_young_user.is_admin = True
         await id_young_user.save()
+
+    # 他のユーザーに管理者権限が付与されている可能性もあるため、すべてのキャッシュを破棄する
+    UserCache.invalidate()
@@ -1,9 +1,11 @@
 
 from datetime import datetime
-from pydantic import AnyHttpUrl, BaseModel, confloat, DirectoryPath, Field, FilePath, PositiveInt
+from pydantic import AnyHttpUrl, BaseModel, confloat, conint, DirectoryPath, Field, FilePath, PositiveInt
 from pydantic.networks import stricturl
 from tortoise.contrib.pydantic import PydanticModel
-from typing import Literal, Union
+from typing import Any, Literal, Union
+
+from app.constants import QUALITY_TYPES
 
 
 # クライアント設定を表す Pydantic モデル (クライアント設定同期用 API で利用)
@@ -64,9 +66,19 @@ class ServerSettings(BaseModel):
         port: PositiveInt
         custom_https_certificate: FilePath | None
         custom_https_private_key: FilePath | None
+        workers: PositiveInt
     class TV(BaseModel):
         max_alive_time: PositiveInt
         debug_mode_ts_path: FilePath | None
+        encoder_nodes: list[stricturl(allowed_schemes={'tcp'}, tld_required=False)]  # type: ignore
+        encoder_node_secret: str | None
+        abr_ladder: list[QUALITY_TYPES]
+        encode_budget: confloat(gt=0) | None  # type: ignore
+        encode_costs: dict[QUALITY_TYPES, confloat(gt=0)]  # type: ignore
+        adaptive_quality: bool
+        pretune_channels: conint(ge=0)  # type: ignore
+        timeshift_duration: confloat(ge=0)  # type: ignore
+        timeshift_max_size: conint(ge=16)  # type: ignore
     class Capture(BaseModel):
         upload_folder: DirectoryPath
     class Twitter(BaseModel):
@@ -135,6 +147,91 @@ class LiveStream(BaseModel):
     started_at: float
     updated_at: float
     client_count: int
+    encode_quality: str
+
+class LiveStreamAdmissionActive(BaseModel):
+    livestream_id: str
+    encoder_type: str
+    cost: float
+    admitted_at: float
+
+class LiveStreamAdmissionWaiting(BaseModel):
+    livestream_id: str
+    cost: float
+    queued_at: float
+
+class LiveStreamAdmissionMeasuredCost(BaseModel):
+    encoder_type: str
+    quality: str
+    cost: float
+
+class LiveStreamAdmissionDecision(BaseModel):
+    livestream_id: str
+    decision: Literal['Admitted', 'Queued', 'Preempted', 'Rejected', 'Cancelled']
+    cost: float
+    used: float
+    budget: float
+    time: float
+    detail: str
+
+class LiveStreamAdmission(BaseModel):
+    budget: float
+    is_auto_budget: bool
+    used: float
+    active: list[LiveStreamAdmissionActive]
+    queue: list[LiveStreamAdmissionWaiting]
+    measured_costs: list[LiveStreamAdmissionMeasuredCost]
+    decisions: list[LiveStreamAdmissionDecision]
+
+class LiveStreamEncoderSample(BaseModel):
+    time: float
+    frames: int
+    fps: float
+    bitrate: float | None
+    speed: float | None
+    gpu_usage: int | None
+    video_encoder_usage: int | None
+    video_decoder_usage: int | None
+
+class LiveStreamStats(BaseModel):
+    encoder_type: Literal['FFmpeg', 'QSVEncC', 'NVEncC', 'VCEEncC', 'rkmppenc'] | None
+    latest: LiveStreamEncoderSample | None
+    average_fps: float | None
+    average_bitrate: float | None
+    samples: list[LiveStreamEncoderSample]
+
+class LiveStreamStartupTraceSpan(BaseModel):
+    name: str
+    start: float
+    end: float | None
+
+class LiveStreamStartupTrace(BaseModel):
+    kind: str
+    livestream_id: str
+    backend: str
+    encoder_type: str
+    quality: str
+    result: str
+    started_at: float
+    total_duration: float
+    spans: list[LiveStreamStartupTraceSpan]
+    attributes: dict[str, Any]
+
+class LiveStreamStartupPhaseSummary(BaseModel):
+    kind: str
+    backend: str
+    encoder_type: str
+    quality: str
+    phase: str
+    count: int
+    p50: float
+    p90: float
+    p99: float
+    max: float
+
+class LiveStreamStartupTraces(BaseModel):
+    summary: list[LiveStreamStartupPhaseSummary]
+    traces: list[LiveStreamStartupTrace]
 
 class TwitterAccount(PydanticModel):
     id: int
@@ -199,6 +296,9 @@ class LiveStreams(BaseModel):
     Standby: dict[str, LiveStream]
     Offline: dict[str, LiveStream]
 
+class LiveStreamViewerCounts(BaseModel):
+    viewer_counts: dict[str, int]
+
 class LiveStreamLLHLSClientID(BaseModel):
     client_id: str
 
@@ -1,24 +1,28 @@
 
 import asyncio
 import os
-import re
-import requests
-import socket
 import subprocess
-import threading
 import time
 from datetime import datetime
 from io import TextIOWrapper
 from tortoise import timezone
-from typing import BinaryIO, cast, Iterator, Literal
+from typing import cast, Literal
 
-from app.constants import API_REQUEST_HEADERS, CONFIG, LIBRARY_PATH, LOGS_DIR, QUALITY, QUALITY_TYPES
-from app.models import Channel
+from app.constants import CONFIG, LIBRARY_PATH, LOGS_DIR, QUALITY, QUALITY_TYPES
+from app.models import ChannelRegistry
 from app.models import LiveStream
 from app.models import Program
 from app.utils import HLSLiveSegmenter
 from app.utils import Logging
-from app.utils.EDCB import EDCBTuner
+from app.utils.AdaptiveQuality import AdaptiveQuality
+from app.utils.AdmissionController import AdmissionController
+from app.utils.EncoderLogParser import EncoderLogParser
+from app.utils.EncoderNode import EncoderNodeUtil
+from app.utils.EncoderNode import RemoteEncoder
+from app.utils.Metrics import Metrics
+from app.utils.PreTuner import PreTuner
+from app.utils.StartupTrace import StartupTrace
+from app.utils.TunerSession import TunerSession
 
 
 class LiveEncodingTask:
@@ -29,6 +33,10 @@ class LiveEncodingTask:
     # H.265 再生時のエンコード後のストリームの GOP 長 (秒)
     GOP_LENGTH_SECOND_H265 = 2
 
+    # 無変換 (original) 再生時のストリームの GOP 長 (秒)
+    ## 再エンコードしないため放送波の GOP 長がそのまま使われる (MPEG-2 では 0.5 秒程度だが、H.264 のチャンネルではより長いこともある)
+    GOP_LENGTH_SECOND_PASSTHROUGH = 2
+
     # チューナーから放送波 TS を読み取る際のタイムアウト (秒)
     TUNER_TS_READ_TIMEOUT = 15
 
@@ -40,6 +48,13 @@ class LiveEncodingTask:
     ENCODER_TS_READ_TIMEOUT_ONAIR = 5
     ENCODER_TS_READ_TIMEOUT_ONAIR_VCEENCC = 10
 
+    # エンコーダーのホットリスタート時に、停止したエンコーダーの出力の読み込みタスクが終了するのを待つ最大時間 (秒)
+    HOT_RESTART_TEARDOWN_TIMEOUT = 5
+
+    # エンコーダーのホットリスタート後に、discontinuity_indicator を立てたパケットを挿入する対象とする TS パケットの数
+    ## 再起動後のエンコーダーの出力の先頭から、この数のパケットの間に現れた PID にだけ挿入する
+    DISCONTINUITY_MARKER_PACKETS = 4096
+
 
     def __init__(self, livestream: LiveStream) -> None:
         """
@@ -61,6 +76,25 @@ class LiveEncodingTask:
         self._max_retry_count = 5  # 5 回まで
 
 
+    @classmethod
+    def forEncoderNode(cls, retry_count: int) -> 'LiveEncodingTask':
+        """
+        エンコーダーノードで tsreadex・エンコーダーのオプションを組み立てるための、ライブストリームに紐付かないインスタンスを作成する
+        このインスタンスではオプションの組み立て (build*Options()) のみ利用でき、run() は利用できない
+
+        Args:
+            retry_count (int): 依頼元のエンコードタスクのリトライ回数 (エンコードオプションに反映される)
+
+        Returns:
+            LiveEncodingTask: オプションの組み立てにのみ使えるインスタンス
+        """
+
+        task = cls.__new__(cls)
+        task._retry_count = retry_count
+        task._max_retry_count = 0
+        return task
+
+
     def isFullHDChannel(self, network_id: int, service_id: int) -> bool:
         """
         ネットワーク ID とサービス ID から、そのチャンネルでフル HD 放送が行われているかを返す
@@ -90,10 +124,97 @@ class LiveEncodingTask:
         return False
 
 
+    def getABRRenditions(self, quality: QUALITY_TYPES) -> list[QUALITY_TYPES]:
+        """
+        ABR ラダー (config.yaml の tv.abr_ladder) のうち、指定された画質と同時にエンコードする追加の画質を返す
+        1つのフィルターグラフを共有するため、指定された画質より低い画質のうち、コーデックとフレームレートが同じ画質のみを返す
+
+        Args:
+            quality (QUALITY_TYPES): 視聴中の映像の品質
+
+        Returns:
+            list[QUALITY_TYPES]: 同時にエンコードする追加の画質のリスト (画質が高い順)
+        """
+
+        # 無変換 (original) の場合はエンコードを行わないため、追加の画質もエンコードしない
+        if QUALITY[quality].is_passthrough is True:
+            return []
+
+        # QUALITY は画質が高い順に定義されている
+        quality_order: list[QUALITY_TYPES] = list(QUALITY.keys())
+
+        renditions: list[QUALITY_TYPES] = []
+        for rendition in quality_order:
+            if (rendition in CONFIG['tv']['abr_ladder'] and
+                quality_order.index(rendition) > quality_order.index(quality) and
+                QUALITY[rendition].is_hevc == QUALITY[quality].is_hevc and
+                QUALITY[rendition].is_60fps == QUALITY[quality].is_60fps):
+                renditions.append(rendition)
+
+        return renditions
+
+
+    def buildTsreadexOptions(self, service_id: int | None) -> list:
+        """
+        tsreadex (放送波の前処理を行い、エンコードを安定させるツール) に渡すオプションを組み立てる
+        オプション内容は https://github.com/xtne6f/tsreadex を参照
+
+        Args:
+            service_id (int | None): 視聴対象のチャンネルのサービス ID (None の場合はデバッグ用の TS ファイル (tv.debug_mode_ts_path) を読み込む)
+
+        Returns:
+            list: tsreadex に渡すオプションが連なる配列
+        """
+
+        tsreadex_options = [
+            # 取り除く TS パケットの10進数の PID
+            ## EIT の PID を指定
+            '-x', '18/38/39',
+            # 特定サービスのみを選択して出力するフィルタを有効にする
+            ## 有効にすると、特定のストリームのみ PID を固定して出力される
+            ## 視聴対象のチャンネルのサービス ID を指定する
+            '-n', f'{service_id}' if service_id is not None else '-1',
+            # 主音声ストリームが常に存在する状態にする
+            ## ストリームが存在しない場合、無音の AAC ストリームが出力される
+            ## 音声がモノラルであればステレオにする
+            ## デュアルモノを2つのモノラル音声に分離し、右チャンネルを副音声として扱う
+            '-a', '13',
+            # 副音声ストリームが常に存在する状態にする
+            ## ストリームが存在しない場合、無音の AAC ストリームが出力される
+            ## 音声がモノラルであればステレオにする
+            '-b', '5',
+            # 字幕ストリームが常に存在する状態にする
+            ## ストリームが存在しない場合、PMT の項目が補われて出力される
+            '-c', '1',
+            # 文字スーパーストリームが常に存在する状態にする
+            ## ストリームが存在しない場合、PMT の項目が補われて出力される
+            '-u', '1',
+            # 字幕と文字スーパーを aribb24.js が解釈できる ID3 timed-metadata に変換する
+            ## +4: FFmpeg のバグを打ち消すため、変換後のストリームに規格外の5バイトのデータを追加する
+            ## +8: FFmpeg のエラーを防ぐため、変換後のストリームの PTS が単調増加となるように調整する
+            '-d', '13',
+        ]
+
+        if service_id is not None:
+            # 通常は標準入力を指定
+            tsreadex_options.append('-')
+        else:
+            # デバッグモード: 指定された TS ファイルを読み込む
+            ## 読み込み速度を 2350KB/s (18.8Mbps) に制限
+            ## 1倍速に近い値だが、TS のビットレートはチャンネルや番組、シーンによって変動するため完全な1倍速にはならない
+            tsreadex_options += [
+                '-l', '2350',
+                CONFIG['tv']['debug_mode_ts_path']
+            ]
+
+        return tsreadex_options
+
+
     def buildFFmpegOptions(self,
         quality: QUALITY_TYPES,
         is_fullhd_channel: bool = False,
         is_sphd_channel: bool = False,
+        renditions: list[tuple[QUALITY_TYPES, int]] | None = None,
     ) -> list:
         """
         FFmpeg に渡すオプションを組み立てる
@@ -102,6 +223,7 @@ class LiveEncodingTask:
             quality (QUALITY_TYPES): 映像の品質
             is_fullhd_channel (bool): フル HD 放送が実施されているチャンネルかどうか
             is_sphd_channel (bool): スカパー！プレミアムサービスのチャンネルかどうか
+            renditions (list[tuple[QUALITY_TYPES, int]] | None): 同時にエンコードする追加の画質と、その出力先のファイルディスクリプタのリスト (ABR 用)
 
         Returns:
             list: FFmpeg に渡すオプションが連なる配列
@@ -121,57 +243,85 @@ class LiveEncodingTask:
         ## -analyzeduration をつけることで、ストリームの分析時間を短縮できる
         options.append(f'-f mpegts -analyzeduration {analyzeduration} -i pipe:0')
 
-        # ストリームのマッピング
-        ## 音声切り替えのため、主音声・副音声両方をエンコード後の TS に含む
-        ## 副音声が検出できない場合にエラーにならないよう、? をつけておく
-        options.append('-map 0:v:0 -map 0:a:0 -map 0:a:1 -map 0:d? -ignore_unknown')
-
-        # フラグ
-        ## 主に FFmpeg の起動を高速化するための設定
-        max_interleave_delta = round(1 + self._retry_count) * 100
-        options.append(f'-fflags nobuffer -flags low_delay -max_delay 250000 -max_interleave_delta {max_interleave_delta}K -threads auto')
-
-        # 映像
-        ## コーデック
-        if QUALITY[quality].is_hevc is True:
-            options.append('-vcodec libx265')  # H.265/HEVC (通信節約モード)
-        else:
-            options.append('-vcodec libx264')  # H.264
-
-        ## ビットレートと品質
-        options.append(f'-flags +cgop -vb {QUALITY[quality].video_bitrate} -maxrate {QUALITY[quality].video_bitrate_max}')
-        options.append('-profile:v main -preset veryfast -aspect 16:9')
+        # 出力する画質と、その出力先のファイルディスクリプタのリスト
+        ## 通常は指定された画質を標準出力 (pipe:1) に出力するだけだが、ABR 用の追加の画質が指定されている場合は、
+        ## 1回のデコード結果から複数の画質をエンコードし、それぞれ指定されたファイルディスクリプタに出力する
+        outputs: list[tuple[QUALITY_TYPES, int]] = [(quality, 1), *(renditions if renditions is not None else [])]
+        is_abr = len(outputs) > 1
 
         ## フル HD 放送が行われているチャンネルかつ、指定された品質の解像度が 1440×1080 (1080p) の場合のみ、
         ## 特別に縦解像度を 1920 に変更してフル HD (1920×1080) でエンコードする
-        video_width = QUALITY[quality].width
-        video_height = QUALITY[quality].height
-        if video_width == 1440 and video_height == 1080 and is_fullhd_channel is True:
-            video_width = 1920
-
-        ## 最大 GOP 長 (秒)
-        ## 30fps なら ×30 、 60fps なら ×60 された値が --gop-len で使われる
-        gop_length_second = self.GOP_LENGTH_SECOND_H264
-        if QUALITY[quality].is_hevc is True:
-            ## H.265/HEVC では高圧縮化のため、最大 GOP 長を長くする
-            gop_length_second = self.GOP_LENGTH_SECOND_H265
-
-        ## インターレース解除 (60i → 60p (フレームレート: 60fps))
-        if QUALITY[quality].is_60fps is True:
-            options.append(f'-r 60000/1001 -g {int(gop_length_second * 60)}')
-            options.append(f'-vf yadif=mode=1:parity=-1:deint=1,scale={video_width}:{video_height}')
-        ## インターレース解除 (60i → 30p (フレームレート: 30fps))
-        else:
-            options.append(f'-r 30000/1001 -g {int(gop_length_second * 30)}')
-            options.append(f'-vf yadif=mode=0:parity=-1:deint=1,scale={video_width}:{video_height}')
+        def GetVideoResolution(output_quality: QUALITY_TYPES) -> tuple[int, int]:
+            video_width = QUALITY[output_quality].width
+            video_height = QUALITY[output_quality].height
+            if video_width == 1440 and video_height == 1080 and is_fullhd_channel is True:
+                video_width = 1920
+            return (video_width, video_height)
+
+        ## インターレース解除のモード (60i → 60p (フレームレート: 60fps) なら 1 、60i → 30p (フレームレート: 30fps) なら 0)
+        yadif_mode = 1 if QUALITY[quality].is_60fps is True else 0
+
+        # ABR 用のフィルターグラフ
+        ## インターレース解除までを全画質で共有し、リサイズだけを画質ごとに行う
+        ## 追加の画質は視聴中の画質とフレームレートが同じものに限られているため、インターレース解除の結果をそのまま使い回せる
+        if is_abr is True:
+            filters = [f'[0:v:0]yadif=mode={yadif_mode}:parity=-1:deint=1,split={len(outputs)}' + ''.join(f'[v{index}]' for index in range(len(outputs)))]
+            for index, (output_quality, _) in enumerate(outputs):
+                video_width, video_height = GetVideoResolution(output_quality)
+                filters.append(f'[v{index}]scale={video_width}:{video_height}[o{index}]')
+            options.append(f'-filter_complex {";".join(filters)}')
+
+        for index, (output_quality, output_fd) in enumerate(outputs):
+
+            # ストリームのマッピング
+            ## 音声切り替えのため、主音声・副音声両方をエンコード後の TS に含む
+            ## 副音声が検出できない場合にエラーにならないよう、? をつけておく
+            video_map = f'[o{index}]' if is_abr is True else '0:v:0'
+            options.append(f'-map {video_map} -map 0:a:0 -map 0:a:1 -map 0:d? -ignore_unknown')
+
+            # フラグ
+            ## 主に FFmpeg の起動を高速化するための設定
+            max_interleave_delta = round(1 + self._retry_count) * 100
+            options.append(f'-fflags nobuffer -flags low_delay -max_delay 250000 -max_interleave_delta {max_interleave_delta}K -threads auto')
+
+            # 映像
+            ## コーデック
+            if QUALITY[output_quality].is_hevc is True:
+                options.append('-vcodec libx265')  # H.265/HEVC (通信節約モード)
+            else:
+                options.append('-vcodec libx264')  # H.264
+
+            ## ビットレートと品質
+            options.append(f'-flags +cgop -vb {QUALITY[output_quality].video_bitrate} -maxrate {QUALITY[output_quality].video_bitrate_max}')
+            options.append('-profile:v main -preset veryfast -aspect 16:9')
+
+            ## 最大 GOP 長 (秒)
+            ## 30fps なら ×30 、 60fps なら ×60 された値が --gop-len で使われる
+            gop_length_second = self.GOP_LENGTH_SECOND_H264
+            if QUALITY[output_quality].is_hevc is True:
+                ## H.265/HEVC では高圧縮化のため、最大 GOP 長を長くする
+                gop_length_second = self.GOP_LENGTH_SECOND_H265
+
+            ## インターレース解除 (60i → 60p (フレームレート: 60fps))
+            ## ABR 時はフィルターグラフでインターレース解除とリサイズを済ませているので、-vf は指定しない
+            video_width, video_height = GetVideoResolution(output_quality)
+            if QUALITY[output_quality].is_60fps is True:
+                options.append(f'-r 60000/1001 -g {int(gop_length_second * 60)}')
+                if is_abr is False:
+                    options.append(f'-vf yadif=mode=1:parity=-1:deint=1,scale={video_width}:{video_height}')
+            ## インターレース解除 (60i → 30p (フレームレート: 30fps))
+            else:
+                options.append(f'-r 30000/1001 -g {int(gop_length_second * 30)}')
+                if is_abr is False:
+                    options.append(f'-vf yadif=mode=0:parity=-1:deint=1,scale={video_width}:{video_height}')
 
-        # 音声
-        ## 音声が 5.1ch かどうかに関わらず、ステレオにダウンミックスする
-        options.append(f'-acodec aac -aac_coder twoloop -ac 2 -ab {QUALITY[quality].audio_bitrate} -ar 48000 -af volume=2.0')
+            # 音声
+            ## 音声が 5.1ch かどうかに関わらず、ステレオにダウンミックスする
+            options.append(f'-acodec aac -aac_coder twoloop -ac 2 -ab {QUALITY[output_quality].audio_bitrate} -ar 48000 -af volume=2.0')
 
-        # 出力
-        options.append('-y -f mpegts')  # MPEG-TS 出力ということを明示
-        options.append('pipe:1')  # 標準入力へ出力
+            # 出力
+            options.append('-y -f mpegts')  # MPEG-TS 出力ということを明示
+            options.append(f'pipe:{output_fd}')  # 標準出力 (ABR 用の追加の画質は指定されたファイルディスクリプタ) へ出力
 
         # オプションをスペースで区切って配列にする
         result = []
@@ -224,6 +374,50 @@ class LiveEncodingTask:
         return result
 
 
+    def buildFFmpegOptionsForPassthrough(self) -> list:
+        """
+        FFmpeg に渡すオプションを組み立てる（無変換 (original) 向け）
+        映像と音声を再エンコードせずに MPEG-TS に再多重化するだけなので、エンコーダーの設定に関わらず FFmpeg を使う
+        音声は tsreadex の前処理で既にステレオ化・デュアルモノの分離が済んでいるため、そのままコピーする
+
+        Returns:
+            list: FFmpeg に渡すオプションが連なる配列
+        """
+
+        # オプションの入る配列
+        options = []
+
+        # 入力
+        ## -analyzeduration をつけることで、ストリームの分析時間を短縮できる
+        analyzeduration = round(500000 + (self._retry_count * 200000))  # リトライ回数に応じて少し増やす
+        options.append(f'-f mpegts -analyzeduration {analyzeduration} -i pipe:0')
+
+        # ストリームのマッピング
+        ## 音声切り替えのため、主音声・副音声両方を出力後の TS に含む
+        ## 副音声が検出できない場合にエラーにならないよう、? をつけておく
+        options.append('-map 0:v:0 -map 0:a:0 -map 0:a:1 -map 0:d? -ignore_unknown')
+
+        # フラグ
+        ## 主に FFmpeg の起動を高速化するための設定
+        max_interleave_delta = round(1 + self._retry_count) * 100
+        options.append(f'-fflags nobuffer -flags low_delay -max_delay 250000 -max_interleave_delta {max_interleave_delta}K -threads auto')
+
+        # 映像・音声・データ
+        ## 全てのストリームを再エンコードせずにそのままコピーする
+        options.append('-c copy')
+
+        # 出力
+        options.append('-y -f mpegts')  # MPEG-TS 出力ということを明示
+        options.append('pipe:1')  # 標準出力へ出力
+
+        # オプションをスペースで区切って配列にする
+        result = []
+        for option in options:
+            result += option.split(' ')
+
+        return result
+
+
     def buildHWEncCOptions(self,
         quality: QUALITY_TYPES,
         encoder_type: Literal['QSVEncC', 'NVEncC', 'VCEEncC', 'rkmppenc'],
@@ -374,6 +568,31 @@ class LiveEncodingTask:
         return result
 
 
+    def buildDiscontinuityPacket(self, packet: bytes) -> bytes:
+        """
+        指定された TS パケットと同じ PID の、discontinuity_indicator を立てたアダプテーションフィールドのみの TS パケットを生成する
+        エンコーダーのホットリスタート後の最初のパケットの前に挿入し、連続性カウンタや PCR (時刻基準) が不連続になることを示す
+
+        Args:
+            packet (bytes): 直後に続く TS パケット
+
+        Returns:
+            bytes: discontinuity_indicator を立てた TS パケット
+        """
+
+        # ペイロードを持たないパケットでは連続性カウンタを進めないため、直後のパケットの1つ前の値にしておく
+        continuity_counter = ((packet[3] & 0x0f) - 1) & 0x0f
+
+        return bytes([
+            0x47,
+            packet[1] & 0x1f,  # payload_unit_start_indicator を下ろし、PID の上位 5 ビットだけを残す
+            packet[2],
+            0x20 | continuity_counter,  # adaptation_field_control = 0b10 (アダプテーションフィールドのみ)
+            183,  # adaptation_field_length
+            0x80,  # discontinuity_indicator
+        ]) + b'\xff' * 182
+
+
     async def run(self) -> None:
         """
         エンコードタスクを実行する
@@ -384,10 +603,20 @@ class LiveEncodingTask:
         if not (self.livestream.getStatus()['status'] == 'Standby' and self.livestream.getStatus()['detail'] == 'エンコードタスクを起動しています…'):
             self.livestream.setStatus('Standby', 'エンコードタスクを起動しています…')
 
-        # LL-HLS Segmenter に渡す今回のエンコードタスクの GOP 長 (H.264 と H.265 で異なる)
+        # 前回のエンコードタスクで画質を自動で下げていた場合は、視聴中の画質に戻す
+        self.livestream.encode_quality = self.livestream.quality
+
+        # ライブストリームの起動にかかる時間のトレースを開始する
+        ## エンコーダーの種類はチャンネル情報を取得した後に確定するため、ここでは設定値を仮に入れておく
+        startup_trace = StartupTrace(self.livestream.livestream_id, CONFIG['general']['backend'], CONFIG['general']['encoder'], self.livestream.quality)
+        self.livestream.startup_trace = startup_trace
+
+        # LL-HLS Segmenter に渡す今回のエンコードタスクの GOP 長 (H.264 と H.265 と無変換で異なる)
         gop_length_second = self.GOP_LENGTH_SECOND_H264
         if QUALITY[self.livestream.quality].is_hevc is True:
             gop_length_second = self.GOP_LENGTH_SECOND_H265
+        if QUALITY[self.livestream.quality].is_passthrough is True:
+            gop_length_second = self.GOP_LENGTH_SECOND_PASSTHROUGH
 
         # LL-HLS Segmenter を初期化
         ## iPhone Safari は mpegts.js でのストリーミングに対応していないため、フォールバックとして LL-HLS で配信する必要がある
@@ -396,10 +625,18 @@ class LiveEncodingTask:
         self.livestream.segmenter = HLSLiveSegmenter(gop_length_second)
 
         # チャンネル情報からサービス ID とネットワーク ID を取得する
-        channel = await Channel.filter(display_channel_id=self.livestream.display_channel_id).first()
+        startup_trace.begin('channel_query')
+        channel = await ChannelRegistry.get(self.livestream.display_channel_id)
+
+        # 無変換 (original) の場合、放送波の映像コーデックが H.264 のチャンネル (スカパー！プレミアムサービス) でなければ LL-HLS Segmenter を破棄する
+        ## 地デジ・BS・CS の映像コーデックは MPEG-2 で、LL-HLS Segmenter が扱える H.264 / H.265 ではないため
+        if QUALITY[self.livestream.quality].is_passthrough is True and channel.type != 'SKY':
+            self.livestream.segmenter.destroy()
+            self.livestream.segmenter = None
 
         # 現在の番組情報を取得する
         program_present = (await channel.getCurrentAndNextProgram())[0]
+        startup_trace.end('channel_query')
 
         # 現在の番組情報が取得できなかった場合、「番組情報がありません」という仮の番組情報を入れておく（実装上の都合）
         ## このデータは UI 上には表示されないし、データベースにも保存されない
@@ -422,62 +659,8 @@ class LiveEncodingTask:
         Logging.info(f'[Live: {self.livestream.livestream_id}] Title:{program_present.title}')
 
         # tsreadex のオプション
-        ## 放送波の前処理を行い、エンコードを安定させるツール
-        ## オプション内容は https://github.com/xtne6f/tsreadex を参照
-        tsreadex_options = [
-            # 取り除く TS パケットの10進数の PID
-            ## EIT の PID を指定
-            '-x', '18/38/39',
-            # 特定サービスのみを選択して出力するフィルタを有効にする
-            ## 有効にすると、特定のストリームのみ PID を固定して出力される
-            ## 視聴対象のチャンネルのサービス ID を指定する
-            '-n', f'{channel.service_id}' if CONFIG['tv']['debug_mode_ts_path'] is None else '-1',
-            # 主音声ストリームが常に存在する状態にする
-            ## ストリームが存在しない場合、無音の AAC ストリームが出力される
-            ## 音声がモノラルであればステレオにする
-            ## デュアルモノを2つのモノラル音声に分離し、右チャンネルを副音声として扱う
-            '-a', '13',
-            # 副音声ストリームが常に存在する状態にする
-            ## ストリームが存在しない場合、無音の AAC ストリームが出力される
-            ## 音声がモノラルであればステレオにする
-            '-b', '5',
-            # 字幕ストリームが常に存在する状態にする
-            ## ストリームが存在しない場合、PMT の項目が補われて出力される
-            '-c', '1',
-            # 文字スーパーストリームが常に存在する状態にする
-            ## ストリームが存在しない場合、PMT の項目が補われて出力される
-            '-u', '1',
-            # 字幕と文字スーパーを aribb24.js が解釈できる ID3 timed-metadata に変換する
-            ## +4: FFmpeg のバグを打ち消すため、変換後のストリームに規格外の5バイトのデータを追加する
-            ## +8: FFmpeg のエラーを防ぐため、変換後のストリームの PTS が単調増加となるように調整する
-            '-d', '13',
-        ]
-
-        if CONFIG['tv']['debug_mode_ts_path'] is None:
-            # 通常は標準入力を指定
-            tsreadex_options.append('-')
-        else:
-            # デバッグモード: 指定された TS ファイルを読み込む
-            ## 読み込み速度を 2350KB/s (18.8Mbps) に制限
-            ## 1倍速に近い値だが、TS のビットレートはチャンネルや番組、シーンによって変動するため完全な1倍速にはならない
-            tsreadex_options += [
-                '-l', '2350',
-                CONFIG['tv']['debug_mode_ts_path']
-            ]
-
-        # tsreadex の読み込み用パイプと書き込み用パイプを作成
-        tsreadex_read_pipe, tsreadex_write_pipe = os.pipe()
-
-        # tsreadex の起動
-        ## Reader だけ同期関数なので、asyncio.subprocess ではなく通常の subprocess を使っている (苦肉の策)
-        tsreadex: subprocess.Popen = subprocess.Popen(
-            [LIBRARY_PATH['tsreadex'], *tsreadex_options],
-            stdin = asyncio.subprocess.PIPE,  # 受信した放送波を書き込む
-            stdout = tsreadex_write_pipe,  # エンコーダーに繋ぐ
-        )
-
-        # tsreadex の書き込み用パイプを閉じる
-        os.close(tsreadex_write_pipe)
+        ## デバッグモードでは、受信した放送波の代わりにデバッグ用の TS ファイルを読み込む
+        tsreadex_options = self.buildTsreadexOptions(channel.service_id if CONFIG['tv']['debug_mode_ts_path'] is None else None)
 
         # ***** エンコーダープロセスの作成と実行 *****
 
@@ -491,217 +674,230 @@ class LiveEncodingTask:
         # エンコーダーの種類を取得
         encoder_type: Literal['FFmpeg', 'QSVEncC', 'NVEncC', 'VCEEncC', 'rkmppenc'] = CONFIG['general']['encoder']
         ## ラジオチャンネルでは HW エンコードの意味がないため、FFmpeg に固定する
-        if channel.is_radiochannel is True:
+        ## 無変換 (original) では再エンコードを行わず再多重化だけを行うため、HW エンコーダーが利用できない環境でも FFmpeg で配信できる
+        if channel.is_radiochannel is True or QUALITY[self.livestream.quality].is_passthrough is True:
             encoder_type = 'FFmpeg'
+        startup_trace.encoder_type = encoder_type
+
+        # ***** エンコードタスクの開始の許可 *****
+
+        # サーバーのエンコード能力 (予算) に空きがあるかを確認し、足りなければ Idling のライブストリームを終了させるか、空くまで待つ
+        ## 予算が空かなかった場合や、待っている間にクライアントがいなくなった場合は、ライブストリームは既に Offline に設定されている
+        startup_trace.begin('admission')
+        is_admitted = await AdmissionController.acquire(self.livestream, encoder_type, channel.is_radiochannel)
+        startup_trace.end('admission')
+        if is_admitted is False or self.livestream.getStatus()['status'] == 'Offline':
+
+            # 順番待ちの間に別の要因で Offline にされた場合は、割り当てられた予算を解放する
+            AdmissionController.release(self.livestream.livestream_id)
+
+            # すべての視聴中クライアントのライブストリームへの接続を切断する
+            self.livestream.disconnectAll()
+
+            # LL-HLS Segmenter を破棄する
+            if self.livestream.segmenter is not None:
+                self.livestream.segmenter.destroy()
+                self.livestream.segmenter = None
+
+            # エンコードタスクを停止する
+            return
+
+        # ABR 用に同時にエンコードする追加の画質のリスト
+        ## FFmpeg の追加の出力先としてパイプのファイルディスクリプタを引き継ぐ必要があるため、Windows では利用できない
+        renditions: list[QUALITY_TYPES] = []
+        if encoder_type == 'FFmpeg' and channel.is_radiochannel is False and os.name != 'nt':
+            renditions = self.getABRRenditions(self.livestream.quality)
+
+        # ABR 用の追加の画質ごとに LL-HLS Segmenter を初期化
+        ## 追加の画質は視聴中の画質とコーデックが同じなので、GOP 長も同じになる
+        for rendition in renditions:
+            self.livestream.rendition_segmenters[rendition] = HLSLiveSegmenter(gop_length_second)
+
+        # エンコードが実時間に追いつかないときに、画質を自動で下げる
+        ## ラジオチャンネルと無変換 (original) では映像をエンコードしないため、画質を下げても負荷は変わらない
+        ## ABR 用の追加の画質は視聴中の画質とフィルターグラフを共有していて、コーデックやフレームレートだけを変えられないため、ABR 時も行わない
+        adaptive_quality: AdaptiveQuality | None = None
+        if (CONFIG['tv']['adaptive_quality'] is True and channel.is_radiochannel is False and
+            QUALITY[self.livestream.quality].is_passthrough is False and len(renditions) == 0):
+            adaptive_quality = AdaptiveQuality(self.livestream.quality, encoder_type)
+
+        async def SpawnEncoder() -> tuple[subprocess.Popen | RemoteEncoder, asyncio.subprocess.Process | RemoteEncoder, list[tuple[QUALITY_TYPES, int]]]:
+            """
+            tsreadex とエンコーダーを起動する (エンコーダーのホットリスタート時にも呼ばれる)
+            リトライ回数に応じてエンコードオプションが変わるため、エンコードオプションは起動のたびに組み立てる
+
+            Returns:
+                tuple[subprocess.Popen | RemoteEncoder, asyncio.subprocess.Process | RemoteEncoder, list[tuple[QUALITY_TYPES, int]]]:
+                    tsreadex・エンコーダーと、ABR 用の追加の画質の出力を受け取るパイプ (画質, 読み込み用) のリスト
+            """
+
+            # ABR 用の追加の画質の出力を受け取るパイプ (画質, 読み込み用, 書き込み用) のリスト
+            rendition_pipes: list[tuple[QUALITY_TYPES, int, int]] = []
+            for rendition in renditions:
+                rendition_read_pipe, rendition_write_pipe = os.pipe()
+                rendition_pipes.append((rendition, rendition_read_pipe, rendition_write_pipe))
+
+            # FFmpeg
+            if encoder_type == 'FFmpeg':
+
+                # オプションを取得
+                # ラジオチャンネルかどうか・無変換 (original) かどうかでエンコードオプションを切り替え
+                if channel.is_radiochannel is True:
+                    encoder_options = self.buildFFmpegOptionsForRadio()
+                elif QUALITY[self.livestream.quality].is_passthrough is True:
+                    encoder_options = self.buildFFmpegOptionsForPassthrough()
+                else:
+                    encoder_options = self.buildFFmpegOptions(self.livestream.encode_quality, is_fullhd_channel, channel.type == 'SKY',
+                        [(rendition, rendition_write_pipe) for rendition, _, rendition_write_pipe in rendition_pipes])
+                Logging.info(f'[Live: {self.livestream.livestream_id}] FFmpeg Commands:\nffmpeg {" ".join(encoder_options)}')
 
-        # FFmpeg
-        if encoder_type == 'FFmpeg':
-
-            # オプションを取得
-            # ラジオチャンネルかどうかでエンコードオプションを切り替え
-            if channel.is_radiochannel is True:
-                encoder_options = self.buildFFmpegOptionsForRadio()
+            # HWEncC
             else:
-                encoder_options = self.buildFFmpegOptions(self.livestream.quality, is_fullhd_channel, channel.type == 'SKY')
-            Logging.info(f'[Live: {self.livestream.livestream_id}] FFmpeg Commands:\nffmpeg {" ".join(encoder_options)}')
 
-            # プロセスを非同期で作成・実行
-            encoder: asyncio.subprocess.Process = await asyncio.subprocess.create_subprocess_exec(
-                *[LIBRARY_PATH['FFmpeg'], *encoder_options],
-                stdin = tsreadex_read_pipe,  # tsreadex からの入力
-                stdout = asyncio.subprocess.PIPE,  # ストリーム出力
-                stderr = asyncio.subprocess.PIPE,  # ログ出力
-            )
+                # オプションを取得
+                encoder_options = self.buildHWEncCOptions(self.livestream.encode_quality, encoder_type, is_fullhd_channel, channel.type == 'SKY')
+                Logging.info(f'[Live: {self.livestream.livestream_id}] {encoder_type} Commands:\n{encoder_type} {" ".join(encoder_options)}')
+
+            # エンコーダーノードが設定されていれば、空きのあるエンコーダーノードで tsreadex とエンコーダーを実行する
+            ## デバッグ用の TS ファイルはこの PC にしかないため、デバッグモードでは常にこの PC でエンコードする
+            ## RemoteEncoder はローカルの tsreadex・エンコーダーと同じインターフェイスを持つため、以降の処理はそのまま共通化できる
+            ## ABR 用の追加の画質の出力はエンコーダーノードから受け取れないため、ABR 時は常にこの PC でエンコードする
+            ## 無変換 (original) では再多重化だけで負荷がほとんどかからないため、わざわざエンコーダーノードに割り振らない
+            if (len(CONFIG['tv']['encoder_nodes']) > 0 and CONFIG['tv']['debug_mode_ts_path'] is None and len(rendition_pipes) == 0 and
+                QUALITY[self.livestream.quality].is_passthrough is False):
+                remote_encoder = await EncoderNodeUtil.openRemoteEncoder(
+                    livestream_id = self.livestream.livestream_id,
+                    encoder_type = encoder_type,
+                    quality = self.livestream.encode_quality,
+                    service_id = channel.service_id,
+                    is_fullhd_channel = is_fullhd_channel,
+                    is_sphd_channel = channel.type == 'SKY',
+                    is_radiochannel = channel.is_radiochannel,
+                    retry_count = self._retry_count,
+                )
+                if remote_encoder is not None:
+                    return remote_encoder, remote_encoder, []
+
+            # エンコーダーノードが設定されていないか、どのエンコーダーノードにも空きがない場合は、この PC でエンコードする
+
+            # tsreadex の読み込み用パイプと書き込み用パイプを作成
+            tsreadex_read_pipe, tsreadex_write_pipe = os.pipe()
 
-        # HWEncC
-        elif encoder_type == 'QSVEncC' or encoder_type == 'NVEncC' or encoder_type == 'VCEEncC' or encoder_type == 'rkmppenc':
+            # tsreadex の起動
+            ## チューナーセッションからの書き込みは同期関数 (別スレッド) で行うので、asyncio.subprocess ではなく通常の subprocess を使っている (苦肉の策)
+            tsreadex = subprocess.Popen(
+                [LIBRARY_PATH['tsreadex'], *tsreadex_options],
+                stdin = asyncio.subprocess.PIPE,  # 受信した放送波を書き込む
+                stdout = tsreadex_write_pipe,  # エンコーダーに繋ぐ
+            )
 
-            # オプションを取得
-            encoder_options = self.buildHWEncCOptions(self.livestream.quality, encoder_type, is_fullhd_channel, channel.type == 'SKY')
-            Logging.info(f'[Live: {self.livestream.livestream_id}] {encoder_type} Commands:\n{encoder_type} {" ".join(encoder_options)}')
+            # tsreadex の書き込み用パイプを閉じる
+            os.close(tsreadex_write_pipe)
 
-            # プロセスを非同期で作成・実行
-            encoder: asyncio.subprocess.Process = await asyncio.subprocess.create_subprocess_exec(
+            # エンコーダーのプロセスを非同期で作成・実行
+            encoder = await asyncio.subprocess.create_subprocess_exec(
                 *[LIBRARY_PATH[encoder_type], *encoder_options],
                 stdin = tsreadex_read_pipe,  # tsreadex からの入力
                 stdout = asyncio.subprocess.PIPE,  # ストリーム出力
                 stderr = asyncio.subprocess.PIPE,  # ログ出力
+                pass_fds = [rendition_write_pipe for _, _, rendition_write_pipe in rendition_pipes],  # ABR 用の追加の画質の出力
             )
 
-        # tsreadex の読み込み用パイプを閉じる
-        os.close(tsreadex_read_pipe)
-
-        # ***** チューナーの起動と接続 *****
-
-        # エンコードタスクが稼働中かどうか
-        is_running: bool = True
-
-        # EDCB のチューナーインスタンス (Mirakurun バックエンド利用時は常に None)
-        tuner: EDCBTuner | None = None
-
-        # Mirakurun バックエンド
-        if CONFIG['general']['backend'] == 'Mirakurun':
-
-            # Mirakurun 形式のサービス ID
-            # NID と SID を 5 桁でゼロ埋めした上で int に変換する
-            mirakurun_service_id = int(str(channel.network_id).zfill(5) + str(channel.service_id).zfill(5))
-            # Mirakurun API の URL を作成
-            mirakurun_stream_api_url = f'{CONFIG["general"]["mirakurun_url"]}/api/services/{mirakurun_service_id}/stream'
-
-            # Mirakurun の Service Stream API へ HTTP リクエストを開始
-            ## stream=True を設定することで、レスポンスの返却を待たずに処理を進められる
-            try:
-                self.livestream.setStatus('Standby', 'チューナーを起動しています…')
-                response = await asyncio.to_thread(requests.get,
-                    url = mirakurun_stream_api_url,
-                    headers = {**API_REQUEST_HEADERS, 'X-Mirakurun-Priority': '0'},
-                    stream = True,
-                    timeout = 15,
-                )
-            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
-                # 番組名に「放送休止」などが入っていれば停波によるものとみなし、そうでないならチューナーへの接続に失敗したものとする
-                if program_present.isOffTheAirProgram():
-                    self.livestream.setStatus('Offline', 'この時間は放送を休止しています。')
-                else:
-                    self.livestream.setStatus('Offline', 'チューナーへの接続に失敗しました。チューナー側に何らかの問題があるかもしれません。')
+            # tsreadex の読み込み用パイプを閉じる
+            os.close(tsreadex_read_pipe)
 
-                # すべての視聴中クライアントのライブストリームへの接続を切断する
-                self.livestream.disconnectAll()
+            # ABR 用の追加の画質の書き込み用パイプを閉じる
+            for _, _, rendition_write_pipe in rendition_pipes:
+                os.close(rendition_write_pipe)
 
-                # LL-HLS Segmenter を破棄する
-                if self.livestream.segmenter is not None:
-                    self.livestream.segmenter.destroy()
-                    self.livestream.segmenter = None
+            return tsreadex, encoder, [(rendition, rendition_read_pipe) for rendition, rendition_read_pipe, _ in rendition_pipes]
 
-                # エンコードタスクを停止する
-                return
+        startup_trace.begin('encoder_spawn')
+        tsreadex, encoder, rendition_read_pipes = await SpawnEncoder()
+        startup_trace.end('encoder_spawn')
+        startup_trace.attributes['encoder_node'] = isinstance(encoder, RemoteEncoder)
 
-        # EDCB バックエンド
-        elif CONFIG['general']['backend'] == 'EDCB':
+        # エンコーダーノードでエンコードする場合は、この PC のエンコード能力の予算をほとんど使わない
+        if isinstance(encoder, RemoteEncoder):
+            AdmissionController.setRemote(self.livestream.livestream_id)
 
-            # チューナーインスタンスを初期化
-            tuner = EDCBTuner(channel.network_id, channel.service_id, cast(int, channel.transport_stream_id))
-
-            # チューナーを起動する
-            # アンロック状態のチューナーインスタンスがあれば、自動的にそのチューナーが再利用される
-            self.livestream.setStatus('Standby', 'チューナーを起動しています…')
-            is_tuner_opened = await tuner.open()
+        # ***** チューナーの起動と接続 *****
 
-            # チューナーの起動に失敗した
-            # ほとんどがチューナー不足によるものなので、ステータス詳細でもそのように表示する
-            # 成功時は tuner.close() するか予約などに割り込まれるまで起動しつづけるので注意
-            if is_tuner_opened is False:
+        # チャンネルのチューナーセッションを取得する
+        ## 同じチャンネルを別の画質で視聴中であれば、既に起動しているチューナーセッションが返される
+        tuner_session = TunerSession.get(channel.network_id, channel.service_id, cast(int, channel.transport_stream_id))
+
+        # チューナーセッションの購読を開始する
+        ## チューナーがまだ起動していなければ起動し、受信した放送波を tsreadex の標準入力に随時書き込む
+        ## 既に同じチャンネルのチューナーが起動していれば、チューナーを新たに起動することなく放送波の書き込みが始まる
+        self.livestream.setStatus('Standby', 'チューナーを起動しています…')
+        startup_trace.attributes['tuner_reused'] = tuner_session.state == 'Running'
+        startup_trace.attributes['pretuned'] = tuner_session.isPretuned()
+        startup_trace.begin('tuner_open')
+        tuner_subscriber = await tuner_session.subscribe(tsreadex.stdin)
+
+        # チューナー不足でチューナーの起動に失敗したが、先行選局中のチューナーがあった場合は、それらを解放してからもう一度だけ起動を試みる
+        ## 先行選局は視聴中のチャンネルより優先度が低いため、視聴者のチューナーが足りないときは先行選局をやめてチューナーを譲る
+        if tuner_subscriber is None and tuner_session.error == 'TunerShortage' and await PreTuner.releaseAll() is True:
+            Logging.info(f'[Live: {self.livestream.livestream_id}] Released the pre-tuned tuners and retrying to open the tuner.')
+            tuner_session = TunerSession.get(channel.network_id, channel.service_id, cast(int, channel.transport_stream_id))
+            tuner_subscriber = await tuner_session.subscribe(tsreadex.stdin)
+        startup_trace.end('tuner_open')
+
+        # チューナーの起動に失敗した
+        if tuner_subscriber is None:
+
+            # チューナー不足 (EDCB でチューナーを起動できなかった or Mirakurun から 503 が返された)
+            if tuner_session.error == 'TunerShortage':
                 self.livestream.setStatus('Offline', 'チューナーの起動に失敗しました。チューナー不足が原因かもしれません。')
 
-                # チューナーを閉じる
-                await tuner.close()
-
-                # すべての視聴中クライアントのライブストリームへの接続を切断する
-                self.livestream.disconnectAll()
-
-                # LL-HLS Segmenter を破棄する
-                if self.livestream.segmenter is not None:
-                    self.livestream.segmenter.destroy()
-                    self.livestream.segmenter = None
-
-                # エンコードタスクを停止する
-                return
+            # Mirakurun の Service Stream API から 503 以外のエラーが返された
+            elif tuner_session.error == 'UnknownError':
+                self.livestream.setStatus('Offline', 'チューナーで不明なエラーが発生しました。Mirakurun 側に問題があるかもしれません。')
 
-            # チューナーをロックする
-            # ロックしないと途中でチューナーの制御を横取りされてしまう
-            tuner.lock()
-
-            # チューナーに接続する
-            # 放送波が送信される TCP ソケットまたは名前付きパイプを取得する
-            self.livestream.setStatus('Standby', 'チューナーに接続しています…')
-            pipe_or_socket: BinaryIO | socket.socket | None = await tuner.connect()
-
-            # チューナーへの接続に失敗した
-            if pipe_or_socket is None:
+            # 番組名に「放送休止」などが入っていれば停波によるものとみなし、そうでないならチューナーへの接続に失敗したものとする
+            elif program_present.isOffTheAirProgram():
+                self.livestream.setStatus('Offline', 'この時間は放送を休止しています。')
+            else:
                 self.livestream.setStatus('Offline', 'チューナーへの接続に失敗しました。チューナー側に何らかの問題があるかもしれません。')
 
-                # チューナーを閉じる
-                await tuner.close()
-
-                # すべての視聴中クライアントのライブストリームへの接続を切断する
-                self.livestream.disconnectAll()
-
-                # LL-HLS Segmenter を破棄する
-                if self.livestream.segmenter is not None:
-                    self.livestream.segmenter.destroy()
-                    self.livestream.segmenter = None
+            # すべての視聴中クライアントのライブストリームへの接続を切断する
+            self.livestream.disconnectAll()
 
-                # エンコードタスクを停止する
-                return
+            # LL-HLS Segmenter を破棄する
+            if self.livestream.segmenter is not None:
+                self.livestream.segmenter.destroy()
+                self.livestream.segmenter = None
+            for rendition_segmenter in self.livestream.rendition_segmenters.values():
+                rendition_segmenter.destroy()
+            self.livestream.rendition_segmenters = {}
 
-            # ライブストリームにチューナーインスタンスを設定する
-            # Idling への切り替え、ONAir への復帰時に LiveStream 側でチューナーのアンロック/ロックが行われる
-            self.livestream.tuner = tuner
-
-        # ***** チューナーからの出力の読み込み → tsreadex・エンコーダーへの書き込み *****
-
-        # チューナーからの放送波 TS の最終読み取り時刻 (単調増加時間)
-        ## 単に時刻を比較する用途でしか使わないので、time.monotonic() から取得した単調増加時間が入る
-        ## Unix Time とかではないので注意
-        tuner_ts_read_at: float = time.monotonic()
-        tuner_ts_read_at_lock = threading.Lock()
-
-        # Reader だけ同期関数に依存しているので、別スレッドで実行する
-        def Reader():
-
-            nonlocal tuner_ts_read_at
-
-            # 受信した放送波が入るイテレータ
-            # R/W バッファ: 188B (TS Packet Size) * 256 = 48128B
-            ## EDCB
-            if CONFIG['general']['backend'] == 'EDCB':
-                if type(pipe_or_socket) is socket.socket:
-                    # EDCB の TCP ソケットから受信
-                    stream_iterator = iter(lambda: cast(socket.socket, pipe_or_socket).recv(48128), b'')
-                else:
-                    # EDCB の名前付きパイプから受信
-                    stream_iterator = iter(lambda: cast(BinaryIO, pipe_or_socket).read(48128), b'')
-            ## Mirakurun
-            elif CONFIG['general']['backend'] == 'Mirakurun':
-                # Mirakurun の HTTP API から受信
-                stream_iterator: Iterator[bytes] = response.iter_content(chunk_size=48128)
-
-            # EDCB / Mirakurun から受信した放送波を随時 tsreadex の入力に書き込む
+            # tsreadex・エンコーダーを終了する
+            ## エンコーダーノードで実行中の場合は、エンコーダーノードの空きも解放される
             try:
-                for chunk in stream_iterator:  # type: ignore
+                tsreadex.kill()
+                encoder.kill()
+            except:
+                pass
 
-                    # チューナーからの放送波 TS の最終読み取り時刻を更新
-                    with tuner_ts_read_at_lock:
-                        tuner_ts_read_at = time.monotonic()
+            # エンコード能力の予算を解放する
+            AdmissionController.release(self.livestream.livestream_id)
 
-                    # ストリームデータを tsreadex の標準入力に書き込む
-                    ## BrokenPipeError や OSError が発生した場合は回復不可能なため、タスクを終了
-                    try:
-                        tsreadex.stdin.write(bytes(chunk))
-                    except BrokenPipeError:
-                        break
-                    except OSError:
-                        break
+            # ABR 用の追加の画質の読み込み用パイプを閉じる
+            for _, rendition_read_pipe in rendition_read_pipes:
+                os.close(rendition_read_pipe)
 
-                    # エンコードタスクが終了しているか既にエンコーダープロセスが終了していたら、タスクを終了
-                    if is_running is False or tsreadex.returncode is not None or encoder.returncode is not None:
-                        break
-
-            except OSError:
-                pass
+            # エンコードタスクを停止する
+            return
 
-            # タスクを終える前に、チューナーとの接続を明示的に閉じる
-            try:
-                tsreadex.stdin.close()
-            except OSError:
-                pass
-            if CONFIG['general']['backend'] == 'EDCB':
-                pipe_or_socket.close()
-            elif CONFIG['general']['backend'] == 'Mirakurun':
-                response.close()
+        # チューナーに接続した時点から、エンコーダーが最初の進捗ログを出力するまで・最初のストリームデータを書き込むまでの時間を計測する
+        ## それぞれ LiveStream.setStatus() で ONAir に移行したとき・LiveStream.writeStreamData() で最初に書き込んだときに終了する
+        startup_trace.begin('encoder_warmup')
+        startup_trace.begin('first_byte')
 
-        # threading を使うのが重要、asyncio.to_thread() を使うとボトルネックになる
-        threading.Thread(target=Reader).start()
+        # ライブストリームにチューナーセッションの購読者を設定する
+        # Idling への切り替え、ONAir への復帰時に LiveStream 側でチューナーのアンロック/ロックが行われる
+        self.livestream.tuner_subscriber = tuner_subscriber
 
         # ***** tsreadex・エンコーダーからの出力の読み込み → ライブストリームへの書き込み *****
 
@@ -719,10 +915,22 @@ class LiveEncodingTask:
         ## そうしないと稀にパケロスするらしく、ブラウザ側で突如再生できなくなることがある
         writer_lock = asyncio.Lock()
 
-        async def Writer():
+        # 以下の非同期タスクは、エンコーダーのホットリスタート時に tsreadex・エンコーダーごと作り直される
+        ## 再起動前のタスクが再起動後の tsreadex・エンコーダーを参照しないよう、tsreadex・エンコーダーは引数として渡す
+        ## タスクを終了させるためのイベント (stopped) も、StartTasks() で開始するタスクの世代ごとに作り直して引数として渡す
+        ## 再起動後のタスクのためにイベントを作り直しても、再起動前のタスクが終了させられたままになるようにするため
+
+        async def Writer(tsreadex: subprocess.Popen | RemoteEncoder, encoder: asyncio.subprocess.Process | RemoteEncoder,
+            stopped: asyncio.Event, is_hot_restarted: bool):
 
             nonlocal chunk_buffer, chunk_written_at, writer_lock
 
+            # エンコーダーのホットリスタート後は、PID ごとに最初の TS パケットの前に discontinuity_indicator を立てたパケットを挿入する
+            ## mpegts クライアントへの出力は途切れずに続くため、再起動前後で連続性カウンタや PCR が不連続になることを明示する
+            ## 全ての PID に挿入し終えるか、DISCONTINUITY_MARKER_PACKETS 個のパケットを読み取ったら挿入をやめる
+            marked_pids: set[int] | None = set() if is_hot_restarted is True else None
+            marker_packet_count = 0
+
             while True:
                 try:
 
@@ -738,6 +946,16 @@ class LiveEncodingTask:
                     # 同時に chunk_buffer / chunk_written_at にアクセスするタスクが1つだけであることを保証する (排他ロック)
                     async with writer_lock:
 
+                        # エンコーダーのホットリスタート後、まだ discontinuity_indicator を立てたパケットを挿入していない PID なら挿入する
+                        if marked_pids is not None:
+                            pid = ((chunk[1] & 0x1f) << 8) | chunk[2]
+                            if pid not in marked_pids and pid != 0x1fff:
+                                marked_pids.add(pid)
+                                chunk_buffer.extend(self.buildDiscontinuityPacket(chunk))
+                            marker_packet_count += 1
+                            if marker_packet_count >= self.DISCONTINUITY_MARKER_PACKETS:
+                                marked_pids = None
+
                         # 188 bytes ごとに区切られた、エンコーダーの出力のチャンクをバッファに貯める
                         chunk_buffer.extend(chunk)
 
@@ -759,20 +977,25 @@ class LiveEncodingTask:
                     break
 
                 # エンコードタスクが終了しているか既にエンコーダープロセスが終了していたら、タスクを終了
-                if is_running is False or tsreadex.returncode is not None or encoder.returncode is not None:
+                if stopped.is_set() is True or tsreadex.returncode is not None or encoder.returncode is not None:
                     break
 
         # 前回のチャンク書き込みから 0.025 秒以上経ったもののチャンクが 64KB に達していない際に Writer に代わってチャンク書き込みを行うタスク
         ## ラジオチャンネルは通常のチャンネルと比べてデータ量が圧倒的に少ないため、64KB に達することは稀で SubWriter でのチャンク書き込みがメインになる
-        async def SubWriter():
+        async def SubWriter(tsreadex: subprocess.Popen | RemoteEncoder, encoder: asyncio.subprocess.Process | RemoteEncoder, stopped: asyncio.Event):
 
-            nonlocal tuner_ts_read_at, tuner_ts_read_at_lock, chunk_buffer, chunk_written_at, writer_lock
+            nonlocal chunk_buffer, chunk_written_at, writer_lock
 
             while True:
 
                 # チャンクバッファを 0.025 秒間隔でチェックする
                 await asyncio.sleep(0.025)
 
+                # エンコードタスクが終了しているか既にエンコーダープロセスが終了していたら、タスクを終了
+                ## 停止したエンコーダーの出力の残りを、再起動後のエンコーダーの出力と混ぜないように書き込む前に確認する
+                if stopped.is_set() is True or tsreadex.returncode is not None or encoder.returncode is not None:
+                    break
+
                 # 同時に chunk_buffer / chunk_written_at にアクセスするタスクが1つだけであることを保証する (排他ロック)
                 async with writer_lock:
 
@@ -790,24 +1013,78 @@ class LiveEncodingTask:
                         # チャンクの最終書き込み時刻を更新
                         chunk_written_at = time.monotonic()
 
-                # エンコードタスクが終了しているか既にエンコーダープロセスが終了していたら、タスクを終了
-                if is_running is False or tsreadex.returncode is not None or encoder.returncode is not None:
-                    break
+        # ABR 用の追加の画質の出力を読み取り、それぞれの LL-HLS Segmenter に渡すタスク
+        ## 追加の画質は LL-HLS でのみ配信するため、ライブストリームの Queue には書き込まない
+        async def RenditionWriter(encoder: asyncio.subprocess.Process | RemoteEncoder, stopped: asyncio.Event, rendition: QUALITY_TYPES, rendition_read_pipe: int):
 
-        # タスクを非同期で実行
-        asyncio.create_task(Writer())
-        asyncio.create_task(SubWriter())
+            # 読み込み用パイプを asyncio の StreamReader として扱えるようにする
+            loop = asyncio.get_running_loop()
+            reader = asyncio.StreamReader()
+            transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(rendition_read_pipe, 'rb', 0))
+
+            try:
+                while True:
+                    try:
+
+                        # エンコーダーからの出力を読み取る
+                        ## TS パケットのサイズが 188 bytes なので、1回の readexactly() で 188 bytes ずつ読み取る
+                        chunk = await reader.readexactly(188)
+
+                        # 受け取った TS パケットを追加の画質の LL-HLS Segmenter に渡す
+                        rendition_segmenter = self.livestream.rendition_segmenters.get(rendition)
+                        if rendition_segmenter is not None:
+                            rendition_segmenter.pushTSPacketData(chunk)
+
+                    # もし 188 bytes に満たないデータが返ってきたら、エンコーダーが終了したと判断してタスクを終了
+                    except asyncio.IncompleteReadError:
+                        break
+
+                    # エンコードタスクが終了しているか既にエンコーダープロセスが終了していたら、タスクを終了
+                    if stopped.is_set() is True or encoder.returncode is not None:
+                        break
+
+            # タスクを終える前に (キャンセルされた場合も)、読み込み用パイプを閉じる
+            finally:
+                transport.close()
 
         # ***** エンコーダーの状態監視 *****
 
-        # エンコーダーの出力ログのリスト
-        lines: list[str] = []
+        # エンコーダーのログの解析
+        ## エンコードの状況はライブストリームの統計 API から参照できるよう、ライブストリームにも設定する
+        encoder_log_parser = EncoderLogParser(encoder_type)
+        self.livestream.encoder_log_parser = encoder_log_parser
+
+        # エンコーダーのホットリスタートが要求されたときの理由 (ステータス詳細)
+        ## ホットリスタートが要求されていなければ None
+        hot_restart_detail: str | None = None
+
+        # 画質の自動調整によってホットリスタートが要求されたときの、切り替え後の画質と、画質を戻すのか下げるのか
+        ## 画質の切り替えが要求されていなければ None
+        next_encode_quality: tuple[QUALITY_TYPES, Literal['Up', 'Down']] | None = None
 
-        async def EncoderObServer():
+        def RequestRestart(detail: str) -> None:
+            """
+            エンコーダーの再起動を要求する
+            チューナーが使える状態のままであれば、ステータスを Restart にせず (クライアントの接続を維持したまま) エンコーダーだけを再起動する
+            そうでなければ、ステータスを Restart に設定してエンコードタスク全体を再起動する
+
+            Args:
+                detail (str): 再起動の理由 (ステータス詳細)
+            """
+
+            nonlocal hot_restart_detail
+
+            if (self._retry_count < self._max_retry_count and tuner_session.state == 'Running' and
+                tuner_session.isDisconnected() is False and self.livestream.getStatus()['status'] in ('Standby', 'ONAir', 'Idling')):
+                hot_restart_detail = detail
+            else:
+                self.livestream.setStatus('Restart', detail)
+
+        async def EncoderObServer(tsreadex: subprocess.Popen | RemoteEncoder, encoder: asyncio.subprocess.Process | RemoteEncoder, stopped: asyncio.Event):
 
             # 1つ上のスコープ (Enclosing Scope) の変数を書き替えるために必要
             # ref: https://excel-ubara.com/python/python014.html#sec04
-            nonlocal lines, program_present
+            nonlocal program_present
 
             # 既にエンコーダーのログファイルが存在していた場合は上書きしないようにリネーム
             ## ref: https://note.nkmk.me/python-pathlib-name-suffix-parent/
@@ -822,164 +1099,89 @@ class LiveEncodingTask:
             if CONFIG['general']['debug_encoder'] is True:
                 encoder_log = open(encoder_log_path, mode='w', encoding='utf-8')
 
-            # エンコーダーの出力結果を取得
-            while True:
+            try:
+                # エンコーダーの出力結果を行ごとに随時取得
+                ## 空のデータが返ってきたら、エンコーダーが終了したと判断してタスクを終了
+                async for line in encoder_log_parser.readLines(encoder.stderr):
+
+                    # ログとして残す行であれば、ログを出力する
+                    ## エンコード進捗のログは、正規表現で余計なゴミを取り除いたものが返される
+                    parsed_line = encoder_log_parser.parse(line)
+                    if parsed_line is not None:
+                        line = parsed_line
+
+                        # ストリーム関連のログを表示
+                        ## エンコーダーのログ出力が有効なら、ストリーム関連に限らずすべてのログを出力する
+                        if 'Stream #0:' in line or CONFIG['general']['debug_encoder'] is True:
+                            Logging.debug_simple(f'[Live: {self.livestream.livestream_id}] [{encoder_type}] ' + line)
+
+                        # エンコーダーのログ出力が有効なら、エンコーダーのログファイルに書き込む
+                        if encoder_log is not None:
+                            encoder_log.write(line + '\n')
+                            encoder_log.flush()
+
+                    # エンコードの進捗を判定し、ステータスを更新する
+                    # 誤作動防止のため、ステータスが Standby の間のみ更新できるようにする
+                    if self.livestream.getStatus()['status'] == 'Standby':
+                        transition = encoder_log_parser.matchStatusTransition(line)
+                        if transition is not None:
+                            self.livestream.setStatus(*transition)
+                            # エラーから回復した場合は、エンコードタスクの再起動回数のカウントをリセットする
+                            if transition[0] == 'ONAir' and self._retry_count > 0:
+                                self._retry_count = 0
 
-                # 行ごとに随時読み込む
-                ## 1バイトずつ読み込み、\r か \n が来たら行としてデコード
-                ## FFmpeg はコンソールの行を上書きするために frame= の進捗ログで \r しか出力しないため、readline() を使うと
-                ## 進捗ログを取得できずに永遠に Standby から ONAir に移行しない不具合が発生する
-                buffer = bytearray()
-                while True:
-                    byte = await encoder.stderr.read(1)
-                    buffer += byte
-                    if byte == b'\r' or byte == b'\n':
-                        break
-                    if byte == b'':
+                    # 特定のエラーログが出力されている場合は回復が見込めないため、エンコーダーを終了する
+                    ## エンコーダーを再起動することで回復が期待できる場合は、エンコーダーの再起動を要求する
+                    error = encoder_log_parser.matchError(line)
+                    if error is not None:
+                        error_status, error_detail = error
+                        if error_status == 'NoInput':
+                            # 何らかの要因で tsreadex から放送波が受信できなかったことによるエラーのため、エンコーダーの再起動は行わない
+                            ## 番組名に「放送休止」などが入っていれば停波によるものとみなし、そうでないなら放送波の受信に失敗したものとする
+                            if program_present.isOffTheAirProgram():
+                                self.livestream.setStatus('Offline', 'この時間は放送を休止しています。')
+                            else:
+                                self.livestream.setStatus('Offline', 'チューナーからの放送波の受信に失敗したため、エンコードを開始できません。')
+                        elif error_status == 'Offline':
+                            self.livestream.setStatus('Offline', error_detail)
+                        else:
+                            RequestRestart(error_detail)
+                            # 直近のログを表示
+                            for log in encoder_log_parser.getRecentLines():
+                                Logging.warning(log)
+
+                    # エンコードタスクが終了しているか既にエンコーダープロセスが終了していたら、タスクを終了
+                    if stopped.is_set() is True or tsreadex.returncode is not None or encoder.returncode is not None:
                         break
 
-                # 空のデータが返ってきたら、エンコーダーが終了したと判断してタスクを終了
-                if len(buffer) == 0:
-                    break
+            # タスクを終える前に (キャンセルされた場合も)、エンコーダーのログファイルを閉じる
+            finally:
+                if encoder_log is not None:
+                    encoder_log.close()
 
-                try:
-                    line = buffer.decode('utf-8').strip()
-                except UnicodeDecodeError:
-                    continue
-
-                # エンコード進捗のログだったら、正規表現で余計なゴミを取り除く
-                ## HWEncC は内部で使われている FFmpeg 側の大量に出るデバッグログと衝突してログがごちゃまぜになりがち…
-                ## FFmpeg 側のログ（ゴミ）と完全に混ざっていると完全に除去できずに frames: の数値が桁が飛んだような出力になるけどご愛嬌…
-                match1 = re.fullmatch(r'^.*?([1-9][0-9]+ frames: [0-9\.]+ fps, [0-9]+ kb/s, GPU [0-9]+%, VE [0-9]+%, VD [0-9]+%)$', line)
-                match2 = re.fullmatch(r'^.*?([1-9][0-9]+ frames: [0-9\.]+ fps, [0-9]+ kb/s, GPU [0-9]+%, VD [0-9]+%)$', line)
-                match3 = re.fullmatch(r'^.*?([1-9][0-9]+ frames: [0-9\.]+ fps, [0-9]+ kb/s)$', line)
-                if match1 is not None:
-                    line = match1.groups()[0]
-                elif match2 is not None:
-                    line = match2.groups()[0]
-                elif match3 is not None:
-                    line = match3.groups()[0]
-
-                # 山ほど出力されるメッセージと空行をログから除外
-                ## 元は "Delay between the first packet and last packet in the muxing queue is xxxxxx > 1: forcing output" と
-                ## "removing 2 bytes from input bitstream not read by decoder." という2つのメッセージで、実害はない
-                ## FFmpeg と HWEncC のログが衝突して行の先頭が欠けることがあるので、できるだけ多く弾けるように部分一致にしている
-                if (('removing 2 bytes from input bitstream not read by decoder.' not in line) and
-                    ('Delay between the' not in line) and
-                    ('packet in the muxing queue' not in line) and ('ing output' not in line) and
-                    ('ng output' != line) and ('g output' != line) and (' output' != line) and ('output' != line) and
-                    ('utput' != line) and ('tput' != line) and ('put' != line) and ('ut' != line) and ('t' != line) and
-                    ('' != line)):
-
-                    # ログリストに行単位で追加
-                    lines.append(line)
-
-                    # ストリーム関連のログを表示
-                    ## エンコーダーのログ出力が有効なら、ストリーム関連に限らずすべてのログを出力する
-                    if 'Stream #0:' in line or CONFIG['general']['debug_encoder'] is True:
-                        Logging.debug_simple(f'[Live: {self.livestream.livestream_id}] [{encoder_type}] ' + line)
-
-                    # エンコーダーのログ出力が有効なら、エンコーダーのログファイルに書き込む
-                    if CONFIG['general']['debug_encoder'] is True:
-                        encoder_log.write(line.strip('\r\n') + '\n')
-                        encoder_log.flush()
+        def StartTasks(is_hot_restarted: bool) -> tuple[list[asyncio.Task[None]], asyncio.Event]:
+            """
+            tsreadex・エンコーダーからの出力の読み込みと、エンコーダーの状態監視の非同期タスクを開始する
 
-                # ライブストリームのステータスを取得
-                livestream_status = self.livestream.getStatus()
+            Args:
+                is_hot_restarted (bool): エンコーダーのホットリスタート後に呼ばれたかどうか
 
-                # エンコードの進捗を判定し、ステータスを更新する
-                # 誤作動防止のため、ステータスが Standby の間のみ更新できるようにする
-                if livestream_status['status'] == 'Standby':
-                    # FFmpeg
-                    if encoder_type == 'FFmpeg':
-                        if 'arib parser was created' in line or 'Invalid frame dimensions 0x0.' in line:
-                            self.livestream.setStatus('Standby', 'エンコードを開始しています…')
-                        elif 'frame=    1 fps=0.0 q=0.0' in line or 'size=       0kB time=00:00' in line:
-                            self.livestream.setStatus('Standby', 'バッファリングしています…')
-                        elif 'frame=' in line or 'bitrate=' in line:
-                            self.livestream.setStatus('ONAir', 'ライブストリームは ONAir です。')
-                            # エラーから回復した場合は、エンコードタスクの再起動回数のカウントをリセットする
-                            if self._retry_count > 0:
-                                self._retry_count = 0
-                    ## HWEncC
-                    elif encoder_type == 'QSVEncC' or encoder_type == 'NVEncC' or encoder_type == 'VCEEncC' or encoder_type == 'rkmppenc':
-                        if 'opened file "pipe:0"' in line:
-                            self.livestream.setStatus('Standby', 'エンコードを開始しています…')
-                        elif 'starting output thread...' in line:
-                            self.livestream.setStatus('Standby', 'バッファリングしています…')
-                        elif 'Encode Thread:' in line:
-                            self.livestream.setStatus('Standby', 'バッファリングしています…')
-                        elif ' frames: ' in line:
-                            self.livestream.setStatus('ONAir', 'ライブストリームは ONAir です。')
-                            # エラーから回復した場合は、エンコードタスクの再起動回数のカウントをリセットする
-                            if self._retry_count > 0:
-                                self._retry_count = 0
+            Returns:
+                tuple[list[asyncio.Task[None]], asyncio.Event]: 開始した非同期タスクのリストと、それらのタスクを終了させるためのイベント
+            """
 
-                # 特定のエラーログが出力されている場合は回復が見込めないため、エンコーダーを終了する
-                ## エンコーダーを再起動することで回復が期待できる場合は、ステータスを Restart に設定しエンコードタスクを再起動する
-                ## FFmpeg
-                if encoder_type == 'FFmpeg':
-                    if 'Stream map \'0:v:0\' matches no streams.' in line:
-                        # 何らかの要因で tsreadex から放送波が受信できなかったことによるエラーのため、エンコーダーの再起動は行わない
-                        ## 番組名に「放送休止」などが入っていれば停波によるものとみなし、そうでないなら放送波の受信に失敗したものとする
-                        if program_present.isOffTheAirProgram():
-                            self.livestream.setStatus('Offline', 'この時間は放送を休止しています。')
-                        else:
-                            self.livestream.setStatus('Offline', 'チューナーからの放送波の受信に失敗したため、エンコードを開始できません。')
-                    elif 'Conversion failed!' in line:
-                        # 捕捉されないエラー
-                        ## エンコーダーの再起動で復帰できる可能性があるので、エンコードタスクを再起動する
-                        self.livestream.setStatus('Restart', 'エンコード中に予期しないエラーが発生しました。エンコードタスクを再起動します。')
-                        # 直近 50 件のログを表示
-                        for log in lines[-51:-1]:
-                            Logging.warning(log)
-                ## HWEncC
-                elif encoder_type == 'QSVEncC' or encoder_type == 'NVEncC' or encoder_type == 'VCEEncC' or encoder_type == 'rkmppenc':
-                    if 'error finding stream information.' in line:
-                        # 何らかの要因で tsreadex から放送波が受信できなかったことによるエラーのため、エンコーダーの再起動は行わない
-                        ## 番組名に「放送休止」などが入っていれば停波によるものとみなし、そうでないなら放送波の受信に失敗したものとする
-                        if program_present.isOffTheAirProgram():
-                            self.livestream.setStatus('Offline', 'この時間は放送を休止しています。')
-                        else:
-                            self.livestream.setStatus('Offline', 'チューナーからの放送波の受信に失敗したため、エンコードを開始できません。')
-                    elif encoder_type == 'NVEncC' and 'due to the NVIDIA\'s driver limitation.' in line:
-                        # NVEncC で、同時にエンコードできるセッション数 (Geforceだと5つ) を全て使い果たしている時のエラー
-                        self.livestream.setStatus('Offline', 'NVENC のエンコードセッションが不足しているため、エンコードを開始できません。')
-                    elif encoder_type == 'QSVEncC' and ('unable to decode by qsv.' in line or 'No device found for QSV encoding!' in line):
-                        # QSVEncC 非対応の環境
-                        self.livestream.setStatus('Offline', 'お使いの PC 環境は QSVEncC エンコーダーに対応していません。')
-                    elif encoder_type == 'QSVEncC' and 'iHD_drv_video.so init failed' in line:
-                        # QSVEncC 非対応の環境 (Linux かつ第5世代以前の Intel CPU)
-                        self.livestream.setStatus('Offline', 'お使いの PC 環境は Linux 版 QSVEncC エンコーダーに対応していません。第5世代以前の古い CPU をお使いの可能性があります。')
-                    elif encoder_type == 'NVEncC' and 'CUDA not available.' in line:
-                        # NVEncC 非対応の環境
-                        self.livestream.setStatus('Offline', 'お使いの PC 環境は NVEncC エンコーダーに対応していません。')
-                    elif encoder_type == 'VCEEncC' and \
-                        ('Failed to initalize VCE factory:' in line or 'Assertion failed:Init() failed to vkCreateInstance' in line):
-                        # VCEEncC 非対応の環境
-                        self.livestream.setStatus('Offline', 'お使いの PC 環境は VCEEncC エンコーダーに対応していません。')
-                    elif 'Consider increasing the value for the --input-analyze and/or --input-probesize!' in line:
-                        # --input-probesize or --input-analyze の期間内に入力ストリームの解析が終わらなかった
-                        ## エンコーダーの再起動で復帰できる可能性があるので、エンコードタスクを再起動する
-                        self.livestream.setStatus('Restart', '入力ストリームの解析に失敗しました。エンコードタスクを再起動します。')
-                    elif 'finished with error!' in line:
-                        # 捕捉されないエラー
-                        ## エンコーダーの再起動で復帰できる可能性があるので、エンコードタスクを再起動する
-                        self.livestream.setStatus('Restart', 'エンコード中に予期しないエラーが発生しました。エンコードタスクを再起動します。')
-                        # 直近 150 件のログを表示
-                        for log in lines[-151:-1]:
-                            Logging.warning(log)
-
-                # エンコードタスクが終了しているか既にエンコーダープロセスが終了していたら、タスクを終了
-                if is_running is False or tsreadex.returncode is not None or encoder.returncode is not None:
-                    break
-
-            # タスクを終える前にエンコーダーのログファイルを閉じる
-            if CONFIG['general']['debug_encoder'] is True:
-                encoder_log.close()
+            stopped = asyncio.Event()
+            tasks = [
+                asyncio.create_task(Writer(tsreadex, encoder, stopped, is_hot_restarted)),
+                asyncio.create_task(SubWriter(tsreadex, encoder, stopped)),
+                asyncio.create_task(EncoderObServer(tsreadex, encoder, stopped)),
+            ]
+            for rendition, rendition_read_pipe in rendition_read_pipes:
+                tasks.append(asyncio.create_task(RenditionWriter(encoder, stopped, rendition, rendition_read_pipe)))
+            return tasks, stopped
 
         # タスクを非同期で実行
-        asyncio.create_task(EncoderObServer())
+        stream_tasks, stream_tasks_stopped = StartTasks(is_hot_restarted=False)
 
         # ***** エンコードタスク全体の制御 *****
 
@@ -987,13 +1189,38 @@ class LiveEncodingTask:
 
             # 1つ上のスコープ (Enclosing Scope) の変数を書き替えるために必要
             # ref: https://excel-ubara.com/python/python014.html#sec04
-            nonlocal lines, program_present
+            nonlocal program_present, hot_restart_detail, next_encode_quality
+
+            # エンコーダーの CPU 使用率の最終計測時刻 (単調増加時間)
+            measured_at: float = 0
+
+            # 画質の自動調整の最終判定時刻 (単調増加時間)
+            evaluated_at: float = 0
 
             while True:
 
                 # ライブストリームのステータスを取得
                 livestream_status = self.livestream.getStatus()
 
+                # ONAir の間は定期的にこの PC で動いている tsreadex・エンコーダーの CPU 使用率を計測し、エンコードのコストの見積もりに反映する
+                if (livestream_status['status'] == 'ONAir' and isinstance(encoder, asyncio.subprocess.Process) and
+                    time.monotonic() - measured_at > AdmissionController.MEASURE_INTERVAL):
+                    AdmissionController.measure(self.livestream.livestream_id, [cast(subprocess.Popen, tsreadex).pid, encoder.pid])
+                    measured_at = time.monotonic()
+
+                # ONAir の間は1秒ごとにエンコーダーのフレームレートを確認し、実時間に追いついていなければ画質を下げる
+                ## 余裕が戻っていれば、1段階ずつ視聴中の画質に戻す
+                ## 画質の切り替えは、クライアントの接続を維持したままエンコーダーをホットリスタートすることで行う
+                if (adaptive_quality is not None and livestream_status['status'] == 'ONAir' and hot_restart_detail is None and
+                    time.monotonic() - evaluated_at >= 1):
+                    evaluated_at = time.monotonic()
+                    next_encode_quality = adaptive_quality.evaluate(encoder_log_parser.samples)
+                    if next_encode_quality is not None:
+                        if next_encode_quality[1] == 'Up':
+                            hot_restart_detail = f'エンコードに余裕ができたため、{next_encode_quality[0]} に戻しています…'
+                        else:
+                            hot_restart_detail = f'エンコードが追いつかないため、{next_encode_quality[0]} に切り替えています…'
+
                 # 現在放送中の番組が終了した際に program_present に保存している現在の番組情報を新しいものに更新する
                 if program_present is not None and time.time() > program_present.end_time.timestamp():
 
@@ -1022,25 +1249,15 @@ class LiveEncodingTask:
 
                 # 前回チューナーからの放送波 TS を読み取ってから TUNER_TS_READ_TIMEOUT 秒以上経過していたら、
                 # 停波中もしくはチューナーからの放送波 TS の送信が停止したと判断して Offline に移行
-                with tuner_ts_read_at_lock:
-                    if (time.monotonic() - tuner_ts_read_at) > self.TUNER_TS_READ_TIMEOUT:
+                if (time.monotonic() - tuner_session.getTSReadAt()) > self.TUNER_TS_READ_TIMEOUT:
 
-                        # 番組名に「放送休止」などが入っていれば停波の可能性が高い
-                        if program_present.isOffTheAirProgram():
-                            self.livestream.setStatus('Offline', 'この時間は放送を休止しています。')
-
-                        # それ以外なら、チューナーへの接続に失敗したものとする
-                        else:
-                            self.livestream.setStatus('Offline', 'チューナーへの接続に失敗しました。チューナー側に何らかの問題があるかもしれません。')
+                    # 番組名に「放送休止」などが入っていれば停波の可能性が高い
+                    if program_present.isOffTheAirProgram():
+                        self.livestream.setStatus('Offline', 'この時間は放送を休止しています。')
 
-                # Mirakurun の Service Stream API からエラーが返された場合
-                if CONFIG['general']['backend'] == 'Mirakurun' and response.status_code is not None and response.status_code != 200:
-                    # Offline にしてエンコードタスクを停止する
-                    if response.status_code == 503:
-                        self.livestream.setStatus('Offline', 'チューナーの起動に失敗しました。チューナー不足が原因かもしれません。')
+                    # それ以外なら、チューナーへの接続に失敗したものとする
                     else:
-                        self.livestream.setStatus('Offline', 'チューナーで不明なエラーが発生しました。Mirakurun 側に問題があるかもしれません。')
-                    break
+                        self.livestream.setStatus('Offline', 'チューナーへの接続に失敗しました。チューナー側に何らかの問題があるかもしれません。')
 
                 # ***** 異常処理 (エンコードタスク再起動による回復が可能) *****
 
@@ -1061,90 +1278,198 @@ class LiveEncodingTask:
                     if program_present.isOffTheAirProgram():
                         self.livestream.setStatus('Offline', 'この時間は放送を休止しています。')
 
-                    # それ以外なら、エンコーダーの再起動で復帰できる可能性があるのでエンコードタスクを再起動する
+                    # それ以外なら、エンコーダーの再起動で復帰できる可能性があるのでエンコーダーの再起動を要求する
                     else:
 
                         # できるだけエンコーダーのエラーメッセージを拾ってログを出力してから終了したいので、1秒間実行を待機する
                         await asyncio.sleep(1)
 
-                        # エンコードタスクを再起動
-                        self.livestream.setStatus('Restart', 'エンコードが途中で停止しました。エンコードタスクを再起動します。')
+                        # エンコーダーの再起動を要求する
+                        RequestRestart('エンコードが途中で停止しました。エンコードタスクを再起動します。')
 
                         # エンコーダーのログを表示 (FFmpeg は最後の50行、HWEncC は最後の150行を表示)
-                        if encoder_type == 'FFmpeg':
-                            for log in lines[-51:-1]:
-                                Logging.warning(log)
-                        elif encoder_type == 'QSVEncC' or encoder_type == 'NVEncC' or encoder_type == 'VCEEncC' or encoder_type == 'rkmppenc':
-                            for log in lines[-151:-1]:
-                                Logging.warning(log)
+                        for log in encoder_log_parser.getRecentLines():
+                            Logging.warning(log)
 
                 # チューナーとの接続が切断された場合
-                ## ref: https://stackoverflow.com/a/45251241/17124142
-                if ((CONFIG['general']['backend'] == 'Mirakurun' and response.raw.closed is True) or
-                    (CONFIG['general']['backend'] == 'EDCB' and type(pipe_or_socket) is socket.socket and pipe_or_socket.fileno() < 0) or
-                    (CONFIG['general']['backend'] == 'EDCB' and type(pipe_or_socket) is BinaryIO and pipe_or_socket.closed is True)):
+                if tuner_session.isDisconnected() is True:
 
                     # エンコードタスクを再起動
+                    ## チューナーを開き直す必要があるため、エンコーダーのホットリスタートではなくエンコードタスク全体を再起動する
                     self.livestream.setStatus('Restart', 'チューナーとの接続が切断されました。エンコードタスクを再起動します。')
 
                 # エンコーダーが意図せず終了した場合
-                if encoder.returncode is not None:
+                if encoder.returncode is not None and hot_restart_detail is None:
 
                     # 複数 GPU が搭載されていてかつ片方のみ H.265/HEVC でのエンコードに対応している環境も考えられるので、
                     # H.265/HEVC でのエンコードに非対応かは実際にエンコーダーが落ちた後に確認する
                     # もし H.265/HEVC 非対応なのが原因で落ちていた場合は復帰の見込みはないので、エンコードタスクを停止する
                     # 基本的にこれらのエラーでリトライが発生することはないので、初回のみチェックする (偽陽性を減らす意味合いもある)
-                    if self._retry_count == 0:
-                        for line in lines:
-                            # QSVEncC: H.265/HEVC でのエンコードに非対応の環境
-                            if encoder_type == 'QSVEncC' and 'HEVC encoding is not supported on current platform.' in line:
-                                self.livestream.setStatus('Offline', 'お使いの Intel GPU は H.265/HEVC でのエンコードに対応していません。')
-                                break
-                            # NVEncC: H.265/HEVC でのエンコードに非対応の環境
-                            elif encoder_type == 'NVEncC' and 'does not support H.265/HEVC encoding.' in line:
-                                # 他の行に available for encode. という文字列が含まれている場合は除外
-                                available_for_encode = False
-                                for line2 in lines:
-                                    if 'available for encode.' in line2:
-                                        available_for_encode = True
-                                        break
-                                if not available_for_encode:
-                                    self.livestream.setStatus('Offline', 'お使いの NVIDIA GPU は H.265/HEVC でのエンコードに対応していません。')
-                                    break
-                            # VCEEncC: H.265/HEVC でのエンコードに非対応の環境
-                            elif encoder_type == 'VCEEncC' and 'HW Acceleration of H.265/HEVC is not supported on this platform.' in line:
-                                self.livestream.setStatus('Offline', 'お使いの AMD GPU は H.265/HEVC でのエンコードに対応していません。')
-                                break
-
-                    # それ以外なら、エンコーダーの再起動で復帰できる可能性があるのでエンコードタスクを再起動する
-                    if self.livestream.getStatus()['status'] == 'Offline':
-
-                        # エンコードタスクを再起動
-                        self.livestream.setStatus('Restart', 'エンコーダーが強制終了されました。エンコードタスクを再起動します。')
+                    if self._retry_count == 0 and encoder_log_parser.isHEVCUnsupported() is True:
+                        if encoder_type == 'QSVEncC':
+                            self.livestream.setStatus('Offline', 'お使いの Intel GPU は H.265/HEVC でのエンコードに対応していません。')
+                        elif encoder_type == 'NVEncC':
+                            self.livestream.setStatus('Offline', 'お使いの NVIDIA GPU は H.265/HEVC でのエンコードに対応していません。')
+                        elif encoder_type == 'VCEEncC':
+                            self.livestream.setStatus('Offline', 'お使いの AMD GPU は H.265/HEVC でのエンコードに対応していません。')
+
+                    # それ以外なら、エンコーダーの再起動で復帰できる可能性があるのでエンコーダーの再起動を要求する
+                    if self.livestream.getStatus()['status'] != 'Offline':
+
+                        # エンコーダーの再起動を要求する
+                        RequestRestart('エンコーダーが強制終了されました。エンコードタスクを再起動します。')
 
                         # エンコーダーのログを表示 (FFmpeg は最後の50行、HWEncC は最後の150行を表示)
-                        if encoder_type == 'FFmpeg':
-                            for log in lines[-51:-1]:
-                                Logging.warning(log)
-                        elif encoder_type == 'QSVEncC' or encoder_type == 'NVEncC' or encoder_type == 'VCEEncC' or encoder_type == 'rkmppenc':
-                            for log in lines[-151:-1]:
-                                Logging.warning(log)
+                        for log in encoder_log_parser.getRecentLines():
+                            Logging.warning(log)
 
                 # この時点で最新のライブストリームのステータスが Offline か Restart に変更されていたら、エンコードタスクの終了処理に移る
                 livestream_status = self.livestream.getStatus()  # 更新されているかもしれないので再取得
                 if livestream_status['status'] == 'Offline' or livestream_status['status'] == 'Restart':
                     break
 
+                # エンコーダーのホットリスタートが要求されていたら、エンコーダーの再起動処理に移る
+                if hot_restart_detail is not None:
+                    break
+
                 # ビジーにならないように 0.1 秒待機
                 await asyncio.sleep(0.1)
 
-        # エンコードタスクの終了を待つ
-        await Controller()
+        while True:
+
+            # エンコードタスクの終了か、エンコーダーのホットリスタートの要求を待つ
+            await Controller()
+
+            # ステータスが Offline か Restart に変更されていたら、エンコードタスクの終了処理に移る
+            ## ホットリスタートの要求と同時に Offline に変更された場合 (Idling のタイムアウトなど) も、終了処理を優先する
+            livestream_status = self.livestream.getStatus()
+            if hot_restart_detail is None or livestream_status['status'] == 'Offline' or livestream_status['status'] == 'Restart':
+                break
+
+            # ***** エンコーダーのホットリスタート *****
+
+            # クライアントの接続・チューナーセッションの購読はそのままに、tsreadex とエンコーダーだけを再起動する
+            ## エンコードタスク全体を再起動するとチャンネル情報の取得やチューナーの起動からやり直しになる上、
+            ## すべてのクライアントの接続が切断され、クライアント側でプレイヤーを再起動する必要がある
+            detail = hot_restart_detail
+            hot_restart_detail = None
+
+            # 画質の自動調整による切り替えであれば、エンコードする画質を変更する
+            ## エラーからの回復ではないため、再起動回数には数えない
+            is_quality_change = next_encode_quality is not None
+            if next_encode_quality is not None:
+                next_quality, direction = next_encode_quality
+                next_encode_quality = None
+                Logging.info(f'[Live: {self.livestream.livestream_id}] Encode quality changed. '
+                             f'({self.livestream.encode_quality} -> {next_quality})')
+                self.livestream.encode_quality = next_quality
+                Metrics.LIVESTREAM_QUALITY_CHANGES.inc(self.livestream.livestream_id, direction, self.livestream.encode_quality)
+                AdmissionController.changeQuality(self.livestream.livestream_id, self.livestream.encode_quality)
+
+                # コーデックが変わった場合は、LL-HLS Segmenter に渡す GOP 長も変わる
+                gop_length_second = self.GOP_LENGTH_SECOND_H264
+                if QUALITY[self.livestream.encode_quality].is_hevc is True:
+                    gop_length_second = self.GOP_LENGTH_SECOND_H265
+
+            else:
+                self._retry_count += 1
+                Metrics.LIVESTREAM_HOT_RESTARTS.inc(self.livestream.livestream_id, detail)
+                Logging.warning(f'[Live: {self.livestream.livestream_id}] {detail} '
+                                f'Hot restarting the encoder. (Retry {self._retry_count}/{self._max_retry_count})')
+
+            # ホットリスタートからの復帰にかかる時間のトレースを開始する
+            ## 起動時のトレースがまだ終了していなければ (Standby の間に停止した場合)、ここで終了させる
+            if self.livestream.startup_trace is not None:
+                self.livestream.startup_trace.finish('HotRestart')
+            restart_trace = StartupTrace(self.livestream.livestream_id, CONFIG['general']['backend'], encoder_type,
+                self.livestream.encode_quality, kind='HotRestart')
+            restart_trace.attributes['reason'] = detail
+            restart_trace.attributes['retry_count'] = self._retry_count
+            self.livestream.startup_trace = restart_trace
+
+            # ステータスを Standby に設定
+            ## Restart とは異なり、クライアント側ではプレイヤーを再起動せずにそのまま再生を待つ
+            ## 画質の切り替えの場合は、切り替え先の画質をステータス詳細に表示する
+            self.livestream.setStatus('Standby', detail if is_quality_change is True else 'エンコーダーを再起動しています…')
+
+            # 停止した tsreadex・エンコーダーを終了し、出力の読み込み・状態監視のタスクが終了するのを待つ
+            restart_trace.begin('encoder_teardown')
+            stream_tasks_stopped.set()
+            try:
+                tsreadex.kill()
+                encoder.kill()
+            except:
+                pass
+            _, pending_tasks = await asyncio.wait(stream_tasks, timeout=self.HOT_RESTART_TEARDOWN_TIMEOUT)
+
+            # 時間内に終了しなかったタスクはキャンセルし、キャンセルが完了するまで待つ
+            ## 停止したエンコーダーのタスクが、再起動後のエンコーダーのタスクと並行して動き続けないようにする
+            for pending_task in pending_tasks:
+                pending_task.cancel()
+            await asyncio.gather(*pending_tasks, return_exceptions=True)
+            restart_trace.end('encoder_teardown')
+
+            # 停止したエンコーダーの出力の残りを破棄する
+            async with writer_lock:
+                chunk_buffer = bytearray()
+
+            # LL-HLS Segmenter を作り直す
+            ## 再起動後のエンコーダーの出力はタイムスタンプが連続しないため、同じ LL-HLS Segmenter では扱えない
+            if self.livestream.segmenter is not None:
+                self.livestream.segmenter.destroy()
+                self.livestream.segmenter = HLSLiveSegmenter(gop_length_second)
+            for rendition, rendition_segmenter in list(self.livestream.rendition_segmenters.items()):
+                rendition_segmenter.destroy()
+                self.livestream.rendition_segmenters[rendition] = HLSLiveSegmenter(gop_length_second)
+
+            # 停止したエンコーダーの出力から作られた GOP キャッシュを破棄する
+            self.livestream.gop_cache.reset()
+
+            # タイムシフトバッファに、再起動後のエンコーダーの出力とはタイムスタンプが連続しないことを記録する
+            if self.livestream.timeshift_buffer is not None:
+                self.livestream.timeshift_buffer.markDiscontinuity()
+
+            # tsreadex とエンコーダーを起動する
+            restart_trace.begin('encoder_spawn')
+            tsreadex, encoder, rendition_read_pipes = await SpawnEncoder()
+            restart_trace.end('encoder_spawn')
+            restart_trace.attributes['encoder_node'] = isinstance(encoder, RemoteEncoder)
+            if isinstance(encoder, RemoteEncoder):
+                AdmissionController.setRemote(self.livestream.livestream_id)
+
+            # チューナーセッションの購読者を、まだ tsreadex に書き込まれていない放送波ごと新しい tsreadex に切り替える
+            new_tuner_subscriber = tuner_session.resubscribe(tuner_subscriber, tsreadex.stdin)
+
+            # 切り替えている間にチューナーとの接続が切断された場合は、エンコードタスク全体を再起動する
+            if new_tuner_subscriber is None:
+                try:
+                    tsreadex.kill()
+                    encoder.kill()
+                except:
+                    pass
+                for _, rendition_read_pipe in rendition_read_pipes:
+                    os.close(rendition_read_pipe)
+                self.livestream.setStatus('Restart', 'チューナーとの接続が切断されました。エンコードタスクを再起動します。')
+                break
+
+            tuner_subscriber = new_tuner_subscriber
+            self.livestream.tuner_subscriber = tuner_subscriber
+            restart_trace.begin('encoder_warmup')
+            restart_trace.begin('first_byte')
+
+            # エンコーダーのログの解析を作り直し、出力の読み込み・状態監視のタスクを再開する
+            encoder_log_parser = EncoderLogParser(encoder_type)
+            self.livestream.encoder_log_parser = encoder_log_parser
+            stream_tasks, stream_tasks_stopped = StartTasks(is_hot_restarted=True)
+
+            # 再起動したエンコーダーが落ち着くまで、画質の自動調整の判定を待つ
+            if adaptive_quality is not None:
+                adaptive_quality.reset()
 
         # ***** エンコードタスクの終了処理 *****
 
-        # 稼働中フラグをオフにし、Reader・Writer・SubWriter・EncoderObServer のすべての非同期タスクを終了させる
-        is_running = False
+        # Writer・SubWriter・EncoderObServer のすべての非同期タスクを終了させる
+        stream_tasks_stopped.set()
 
         # 明示的にエンコーダープロセスを終了する
         ## 何らかの理由で既に終了している場合は何もしない
@@ -1154,6 +1479,10 @@ class LiveEncodingTask:
         except:
             pass
 
+        # エンコード能力の予算を解放する
+        ## 順番待ちのエンコードタスクがあれば、ここで開始される
+        AdmissionController.release(self.livestream.livestream_id)
+
         # すべての視聴中クライアントのライブストリームへの接続を切断する
         self.livestream.disconnectAll()
 
@@ -1161,15 +1490,21 @@ class LiveEncodingTask:
         if self.livestream.segmenter is not None:
             self.livestream.segmenter.destroy()
             self.livestream.segmenter = None
+        for rendition_segmenter in self.livestream.rendition_segmenters.values():
+            rendition_segmenter.destroy()
+        self.livestream.rendition_segmenters = {}
+
+        # ライブストリームからチューナーセッションの購読者の設定を削除する
+        self.livestream.tuner_subscriber = None
 
         # エンコードタスクを再起動する（エンコーダーの再起動が必要な場合）
         if self.livestream.getStatus()['status'] == 'Restart':
 
-            # チューナーをアンロックする (EDCB バックエンドのみ)
-            ## 新しいエンコードタスクが今回立ち上げたチューナーを再利用できるようにする
+            # チューナーセッションの購読を終了する
+            ## 新しいエンコードタスクが今回のチューナーセッションを猶予時間内に購読し、チューナーを再利用できるようにする
             ## エンコーダーの再起動が必要なだけでチューナー自体はそのまま使えるし、わざわざ閉じてからもう一度開くのは無駄
-            if CONFIG['general']['backend'] == 'EDCB':
-                tuner.unlock()
+            ## 猶予時間が経過するまで待つと再起動が遅れるため、購読の終了はバックグラウンドで行う
+            asyncio.create_task(tuner_session.unsubscribe(tuner_subscriber))
 
             # 再起動回数が最大再起動回数に達していなければ、再起動する
             if self._retry_count < self._max_retry_count:
@@ -1188,24 +1523,10 @@ class LiveEncodingTask:
                     # 有料番組（契約されていないことが原因の可能性が高いため、そのように表示する）
                     self.livestream.setStatus('Offline', 'ライブストリームの再起動に失敗しました。契約されていないため視聴できません。')
 
-                # チューナーを終了する (EDCB バックエンドのみ)
-                ## tuner.close() した時点でそのチューナーインスタンスは意味をなさなくなるので、LiveStream インスタンスのプロパティからも削除する
-                if CONFIG['general']['backend'] == 'EDCB':
-                    await tuner.close()
-                    self.livestream.tuner = None
-
         # 通常終了
         else:
 
-            # EDCB バックエンドのみ
-            if CONFIG['general']['backend'] == 'EDCB':
-
-                # チャンネル切り替え時にチューナーが再利用されるように、3秒ほど待つ
-                # 3秒間の間にチューナーの制御権限が新しいエンコードタスクに委譲されれば、下記の通り実際にチューナーが閉じられることはない
-                await asyncio.sleep(3)
-
-                # チューナーを終了する（まだ制御を他のチューナーインスタンスに委譲していない場合）
-                # Idling に移行しアンロック状態になっている間にチューナーが再利用された場合、制御権限をもう持っていないため実際には何も起こらない
-                ## tuner.close() した時点でそのチューナーインスタンスは意味をなさなくなるので、LiveStream インスタンスのプロパティからも削除する
-                await tuner.close()
-                self.livestream.tuner = None
+            # チューナーセッションの購読を終了する
+            # 他の画質で同じチャンネルを視聴中でなければ、猶予時間 (3秒) の経過後にチューナーが終了される
+            # 猶予時間の間にチューナーの制御権限が新しいエンコードタスクに委譲されれば (EDCB バックエンドのみ)、実際にチューナーが閉じられることはない
+            await tuner_session.unsubscribe(tuner_subscriber)
@@ -0,0 +1,197 @@
+# Type Hints を指定できるように
+# ref: https://stackoverflow.com/a/33533514/17124142
+from __future__ import annotations
+
+import time
+from typing import Iterable, Literal
+
+from app.constants import QUALITY, QUALITY_TYPES
+from app.utils.EncoderLogParser import EncoderSample
+
+
+class AdaptiveQuality:
+    """
+    エンコーダーの進捗ログから得たフレームレートを直近の一定期間で目標のフレームレートと比較し、
+    エンコードが実時間に追いつかない状態が続いたら画質を1段階下げ、余裕が戻ったら1段階ずつ元の画質に戻すクラス
+    画質の変更自体は行わず、変更すべき画質を返すだけで、実際の変更 (エンコーダーのホットリスタート) はエンコードタスク側で行う
+    """
+
+    # 達成したフレームレートの判定に使う、直近のエンコードの状況の期間 (秒)
+    WINDOW = 10
+
+    # 直近の期間の平均フレームレートが、目標のフレームレートのこの割合を下回ったら画質を下げる
+    DOWNGRADE_RATIO = 0.9
+
+    # 直近の期間の平均フレームレートが、目標のフレームレートのこの割合以上であれば実時間でエンコードできているとみなす
+    REALTIME_RATIO = 0.98
+
+    # エンコーダーの起動・画質の変更から、判定を始めるまでの時間 (秒)
+    ## 起動直後はバッファに溜まった放送波をまとめてエンコードするため、フレームレートが目標より高く (あるいは低く) なりがち
+    SETTLE_TIME = 15
+
+    # 実時間でエンコードできている状態がこの時間続いたら、画質を1段階戻す (秒)
+    ## 画質を戻した直後にまた追いつかなくなった場合は、画質を戻すまでの時間を2倍にしていく (最大 MAX_UPGRADE_HOLD_TIME 秒)
+    UPGRADE_HOLD_TIME = 120
+    MAX_UPGRADE_HOLD_TIME = 1800
+
+    # HWEncC で GPU・ビデオエンコーダーの使用率が取得できる場合、この値 (%) 未満でなければ画質を戻さない
+    UPGRADE_MAX_ENCODER_USAGE = 80
+
+
+    def __init__(self, quality: QUALITY_TYPES, encoder_type: Literal['FFmpeg', 'QSVEncC', 'NVEncC', 'VCEEncC', 'rkmppenc']) -> None:
+        """
+        画質の自動調整を初期化する
+
+        Args:
+            quality (QUALITY_TYPES): 視聴中の (クライアントが要求した) 映像の品質
+            encoder_type (Literal['FFmpeg', 'QSVEncC', 'NVEncC', 'VCEEncC', 'rkmppenc']): エンコーダーの種類
+        """
+
+        # 画質を下げていく順に並べた画質のリスト (先頭は視聴中の画質)
+        self.__ladder: list[QUALITY_TYPES] = [quality]
+        while True:
+            lower_quality = self.getLowerQuality(self.__ladder[-1], encoder_type)
+            if lower_quality is None:
+                break
+            self.__ladder.append(lower_quality)
+
+        # 現在エンコードしている画質の、ラダー上の位置
+        self.__index: int = 0
+
+        # エンコーダーの起動・画質の変更を行った時刻 (単調増加時間)
+        self.__changed_at: float = time.monotonic()
+
+        # 最後に画質を戻したかどうか (戻した直後に追いつかなくなったら、画質を戻すまでの時間を延ばす)
+        self.__is_last_change_upgrade: bool = False
+
+        # 画質を戻すまでに実時間でエンコードできている必要がある時間 (秒)
+        self.__upgrade_hold_time: float = self.UPGRADE_HOLD_TIME
+
+        # 実時間でエンコードできている状態が始まった時刻 (単調増加時間)
+        self.__realtime_since: float | None = None
+
+
+    @staticmethod
+    def getLowerQuality(quality: QUALITY_TYPES, encoder_type: str) -> QUALITY_TYPES | None:
+        """
+        指定された画質より1段階エンコードの負荷が低い画質を返す
+        60fps の画質ならまず同じ解像度の 30fps に、FFmpeg (ソフトウェアエンコード) で H.265/HEVC の画質なら同じ解像度の H.264 に、
+        それ以外なら同じコーデックで1段階解像度の低い画質に下げる
+        HW エンコーダーでは H.264 と H.265/HEVC のどちらも同じエンコーダー回路で処理されるため、コーデックを変えても負荷はほとんど変わらない
+
+        Args:
+            quality (QUALITY_TYPES): 映像の品質
+            encoder_type (str): エンコーダーの種類
+
+        Returns:
+            QUALITY_TYPES | None: 1段階負荷が低い画質 (これ以上下げられない場合や、無変換 (original) の場合は None)
+        """
+
+        current = QUALITY[quality]
+        if current.is_passthrough is True:
+            return None
+
+        # 60fps なら同じ解像度・コーデックの 30fps に、FFmpeg で H.265/HEVC なら同じ解像度の H.264 に下げる
+        ## H.265/HEVC の画質は同じ解像度の H.264 の画質より後に定義されているため、すべての画質から探す
+        if current.is_60fps is True or (encoder_type == 'FFmpeg' and current.is_hevc is True):
+            is_hevc = current.is_hevc if current.is_60fps is True else False
+            for candidate, target in QUALITY.items():
+                if (target.is_passthrough is False and target.is_60fps is False and
+                    (target.width, target.height, target.is_hevc) == (current.width, current.height, is_hevc)):
+                    return candidate
+            return None
+
+        # それ以外なら、同じコーデックで1段階解像度の低い画質に下げる
+        ## QUALITY は画質が高い順に定義されている
+        quality_order: list[QUALITY_TYPES] = list(QUALITY.keys())
+        for candidate in quality_order[quality_order.index(quality) + 1:]:
+            target = QUALITY[candidate]
+            if (target.is_passthrough is False and target.is_60fps is False and
+                target.is_hevc == current.is_hevc and target.height < current.height):
+                return candidate
+
+        return None
+
+
+    def getQuality(self) -> QUALITY_TYPES:
+        """
+        現在エンコードすべき画質を取得する
+
+        Returns:
+            QUALITY_TYPES: 現在エンコードすべき画質
+        """
+
+        return self.__ladder[self.__index]
+
+
+    def reset(self) -> None:
+        """
+        エンコーダーが再起動された際に、判定を始めるまでの時間を数え直す
+        """
+
+        self.__changed_at = time.monotonic()
+        self.__realtime_since = None
+
+
+    def evaluate(self, samples: Iterable[EncoderSample]) -> tuple[QUALITY_TYPES, Literal['Up', 'Down']] | None:
+        """
+        直近のエンコードの状況から、画質を変更すべきかを判定する
+        FFmpeg・HWEncC の進捗ログの fps はエンコード開始からの平均値のため、直近の期間のフレーム数の増分から平均フレームレートを求める
+
+        Args:
+            samples (Iterable[EncoderSample]): エンコーダーのログの解析で得られたエンコードの状況 (古い順)
+
+        Returns:
+            tuple[QUALITY_TYPES, Literal['Up', 'Down']] | None: 変更すべき画質と、画質を戻すのか下げるのか (変更しない場合は None)
+        """
+
+        now = time.monotonic()
+        if now - self.__changed_at < self.SETTLE_TIME:
+            return None
+
+        # 直近の期間のエンコードの状況に絞り込む
+        ## 期間の大半をカバーできるだけのエンコードの状況がなければ判定しない
+        window_started_at = time.time() - self.WINDOW
+        window = [sample for sample in samples if sample['time'] >= window_started_at]
+        if len(window) < 2 or window[-1]['time'] - window[0]['time'] < self.WINDOW * 0.8:
+            return None
+
+        # 直近の期間の平均フレームレートを目標のフレームレートと比較する
+        ## HWEncC のログは FFmpeg 側のログと混ざってフレーム数の桁が飛ぶことがあるため、明らかにおかしい値は無視する
+        target_fps = 60000 / 1001 if QUALITY[self.getQuality()].is_60fps is True else 30000 / 1001
+        achieved_fps = (window[-1]['frames'] - window[0]['frames']) / (window[-1]['time'] - window[0]['time'])
+        if achieved_fps < 0 or achieved_fps > target_fps * 2:
+            return None
+        ratio = achieved_fps / target_fps
+
+        # 実時間に追いついていなければ、画質を1段階下げる
+        if ratio < self.DOWNGRADE_RATIO:
+            if self.__index + 1 >= len(self.__ladder):
+                return None
+            # 画質を戻した直後に追いつかなくなったので、次に画質を戻すまでの時間を延ばす
+            if self.__is_last_change_upgrade is True:
+                self.__upgrade_hold_time = min(self.__upgrade_hold_time * 2, self.MAX_UPGRADE_HOLD_TIME)
+            self.__index += 1
+            self.__is_last_change_upgrade = False
+            self.__changed_at = now
+            self.__realtime_since = None
+            return (self.getQuality(), 'Down')
+
+        # 実時間でエンコードできていて、GPU・ビデオエンコーダーにも余裕があれば、その状態が続いた時間を数える
+        latest = window[-1]
+        encoder_usages = [usage for usage in (latest['gpu_usage'], latest['video_encoder_usage']) if usage is not None]
+        if ratio < self.REALTIME_RATIO or any(usage >= self.UPGRADE_MAX_ENCODER_USAGE for usage in encoder_usages):
+            self.__realtime_since = None
+            return None
+        if self.__realtime_since is None:
+            self.__realtime_since = now
+
+        # 余裕のある状態が一定時間続いたら、画質を1段階戻す
+        if self.__index > 0 and now - self.__realtime_since >= self.__upgrade_hold_time:
+            self.__index -= 1
+            self.__is_last_change_upgrade = True
+            self.__changed_at = now
+            self.__realtime_since = None
+            return (self.getQuality(), 'Up')
+
+        return None
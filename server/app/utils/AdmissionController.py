@@ -0,0 +1,487 @@
+# Type Hints を指定できるように
+# ref: https://stackoverflow.com/a/33533514/17124142
+from __future__ import annotations
+
+import asyncio
+import os
+import psutil
+import time
+from collections import deque
+from typing import Any, ClassVar, Literal, TYPE_CHECKING, TypedDict
+
+from app.constants import CONFIG, QUALITY, QUALITY_TYPES
+from app.utils import Logging
+from app.utils.Metrics import Metrics
+
+if TYPE_CHECKING:
+    from app.models import LiveStream
+
+
+class AdmissionDecision(TypedDict):
+    """ エンコードタスクの開始の可否の判定結果を表す辞書の型定義 """
+    livestream_id: str
+    decision: Literal['Admitted', 'Queued', 'Preempted', 'Rejected', 'Cancelled']
+    cost: float
+    used: float
+    budget: float
+    time: float
+    detail: str
+
+
+class AdmissionController:
+    """
+    同時に実行するエンコードタスクの数を、サーバーのエンコード能力 (予算) に応じて制限するクラス
+    画質・エンコーダーごとのエンコードのコスト (CPU コア数換算) を見積もり、実行中のエンコードタスクのコストの合計が予算を超える場合は、
+    Idling のライブストリームを最も長く使われていないものから順に終了させるか、予算が空くまでエンコードタスクの開始を待たせる
+    コストの見積もりは、実際に動いているエンコーダーの CPU 使用率の計測値で随時補正される
+    """
+
+    # 予算が空くのを待つ最大時間 (秒)
+    ## この時間が経過しても予算が空かなければ、エンコードタスクの開始を拒否する
+    QUEUE_TIMEOUT = 30
+
+    # エンコーダーの CPU 使用率を計測する間隔 (秒)
+    MEASURE_INTERVAL = 5
+
+    # 計測したコストを見積もりに反映する割合 (指数移動平均の係数)
+    MEASURE_SMOOTHING = 0.2
+
+    # エンコーダーノードで実行されるエンコードタスクのコスト
+    ## この PC ではチューナーからの放送波の転送とストリームデータの配信しか行わないため、ほとんど負荷がかからない
+    REMOTE_ENCODER_COST = 0.05
+
+    # 1440×1080 (30fps) の映像を1本エンコードするときの、エンコーダーごとのコストの初期値 (CPU コア数換算)
+    ## HW エンコーダーではエンコード自体は GPU で行われるが、tsreadex や音声のエンコードなどで多少 CPU を使う
+    BASE_COSTS: ClassVar[dict[str, float]] = {
+        'FFmpeg': 2.5,
+        'QSVEncC': 0.4,
+        'NVEncC': 0.4,
+        'VCEEncC': 0.4,
+        'rkmppenc': 0.6,
+    }
+
+    # ソフトウェアエンコード時の H.265 の H.264 に対するコストの倍率
+    SOFTWARE_HEVC_COST_MULTIPLIER = 2.5
+
+    # 無変換 (original) とラジオチャンネルのコスト (再多重化と音声のエンコードのみ)
+    PASSTHROUGH_COST = 0.2
+    RADIO_COST = 0.1
+
+    # 保持する直近の判定結果の最大数
+    MAX_DECISIONS = 50
+
+    # 実行中のエンコードタスクのコスト (ライブストリーム ID をキーとした辞書)
+    __active: ClassVar[dict[str, float]] = {}
+
+    # 実行中のエンコードタスクのエンコーダーの種類・画質と、開始が許可された時刻
+    __active_info: ClassVar[dict[str, tuple[str, QUALITY_TYPES, float]]] = {}
+
+    # 予算が空くのを待っているエンコードタスクのリスト (先頭から順に開始される)
+    ## (ライブストリーム ID, コスト, 待ち始めた時刻, 予算が空いたときに結果がセットされる Future)
+    __queue: ClassVar[list[tuple[str, float, float, asyncio.Future[bool]]]] = []
+
+    # エンコーダーの種類・画質ごとの、計測した CPU 使用率から求めたコスト
+    __measured_costs: ClassVar[dict[tuple[str, QUALITY_TYPES], float]] = {}
+
+    # CPU 使用率の計測対象のプロセス (ライブストリーム ID をキーとした辞書)
+    ## psutil.Process.cpu_percent() は前回の呼び出しからの CPU 使用率を返すため、同じインスタンスを使い回す必要がある
+    __processes: ClassVar[dict[str, list[psutil.Process]]] = {}
+
+    # 直近の判定結果のリスト (古い順)
+    __decisions: ClassVar[deque[AdmissionDecision]] = deque(maxlen=MAX_DECISIONS)
+
+
+    @classmethod
+    def getBudget(cls) -> float:
+        """
+        同時に実行できるエンコードタスクのコストの合計の上限 (予算) を取得する
+        config.yaml の tv.encode_budget が設定されていない場合は、この PC の CPU コア数になる
+
+        Returns:
+            float: 予算 (CPU コア数換算)
+        """
+
+        if CONFIG['tv']['encode_budget'] is not None:
+            return float(CONFIG['tv']['encode_budget'])
+        return float(os.cpu_count() or 1)
+
+
+    @classmethod
+    def getUsed(cls) -> float:
+        """
+        実行中のエンコードタスクのコストの合計を取得する
+
+        Returns:
+            float: 実行中のエンコードタスクのコストの合計
+        """
+
+        return sum(cls.__active.values())
+
+
+    @classmethod
+    def estimateCost(cls, encoder_type: str, quality: QUALITY_TYPES, is_radiochannel: bool = False) -> float:
+        """
+        エンコードタスクのコストを見積もる
+        config.yaml の tv.encode_costs で画質ごとのコストが指定されていればその値を、実際に計測したコストがあればその値を、
+        どちらもなければ解像度とフレームレートから推定した値を返す
+
+        Args:
+            encoder_type (str): エンコーダーの種類
+            quality (QUALITY_TYPES): 映像の品質
+            is_radiochannel (bool): ラジオチャンネルかどうか
+
+        Returns:
+            float: コスト (CPU コア数換算)
+        """
+
+        if is_radiochannel is True:
+            return cls.RADIO_COST
+
+        # config.yaml で指定されたコスト
+        configured_cost = CONFIG['tv']['encode_costs'].get(quality)
+        if configured_cost is not None:
+            return float(configured_cost)
+
+        # 実際に計測したコスト
+        measured_cost = cls.__measured_costs.get((encoder_type, quality))
+        if measured_cost is not None:
+            return measured_cost
+
+        # 解像度とフレームレートから推定したコスト
+        if QUALITY[quality].is_passthrough is True:
+            return cls.PASSTHROUGH_COST
+        pixel_ratio = (QUALITY[quality].width * QUALITY[quality].height) / (1440 * 1080)
+        if QUALITY[quality].is_60fps is True:
+            pixel_ratio *= 2
+        cost = cls.BASE_COSTS.get(encoder_type, cls.BASE_COSTS['FFmpeg'])
+        if encoder_type == 'FFmpeg':
+            # ソフトウェアエンコードでは、エンコードの負荷がほぼ画素数に比例する
+            cost *= pixel_ratio
+            if QUALITY[quality].is_hevc is True:
+                cost *= cls.SOFTWARE_HEVC_COST_MULTIPLIER
+        else:
+            # HW エンコーダーでは、CPU の負荷は画素数にあまり依存しない
+            cost *= 0.5 + 0.5 * pixel_ratio
+        return round(cost, 2)
+
+
+    @classmethod
+    async def acquire(cls, livestream: LiveStream, encoder_type: str, is_radiochannel: bool = False) -> bool:
+        """
+        エンコードタスクの開始の許可を得る
+        予算が足りない場合は、Idling のライブストリームを最も長く使われていないものから順に終了させて予算を空ける
+        それでも足りない場合は、予算が空くまで (最大 QUEUE_TIMEOUT 秒) 待つ
+        待っている間は、ライブストリームのステータス詳細に順番待ちの状況を表示する
+
+        Args:
+            livestream (LiveStream): エンコードタスクを開始するライブストリーム
+            encoder_type (str): エンコーダーの種類
+            is_radiochannel (bool): ラジオチャンネルかどうか
+
+        Returns:
+            bool: 開始が許可されたかどうか (False の場合、ライブストリームは Offline に設定されている)
+        """
+
+        livestream_id = livestream.livestream_id
+        cost = cls.estimateCost(encoder_type, livestream.quality, is_radiochannel)
+
+        # エンコードタスクの再起動時など、既に許可を得ている場合はそのまま許可する
+        if livestream_id in cls.__active:
+            cls.__active[livestream_id] = cost
+            return True
+
+        # 予算が足りていて順番待ちもいなければ、そのまま許可する
+        if len(cls.__queue) == 0 and cls.__fits(cost) is True:
+            cls.__admit(livestream_id, encoder_type, livestream.quality, cost)
+            return True
+
+        # Idling のライブストリームを最も長く使われていないものから順に終了させ、予算を空ける
+        if len(cls.__queue) == 0:
+            cls.__preempt(livestream_id, cost)
+            if cls.__fits(cost) is True:
+                cls.__admit(livestream_id, encoder_type, livestream.quality, cost)
+                return True
+
+        # 予算が空くまで待つ
+        future: asyncio.Future[bool] = asyncio.get_running_loop().create_future()
+        entry = (livestream_id, cost, time.time(), future)
+        cls.__queue.append(entry)
+        cls.__record(livestream_id, 'Queued', cost, f'Waiting for {cost} of the encode budget. (Position: {len(cls.__queue)})')
+        try:
+            while True:
+
+                # 順番待ちの状況をステータス詳細に表示する
+                position = cls.__queue.index(entry) + 1 if entry in cls.__queue else 0
+                livestream.setStatus('Standby', f'他のライブストリームのエンコードが終わるのを待っています… ({position} 番目)', quiet=True)
+
+                # 1 秒ごとに、予算が空いたか・クライアントがいなくなっていないか・待ち時間を超えていないかを確認する
+                try:
+                    await asyncio.wait_for(asyncio.shield(future), timeout=1)
+                except asyncio.TimeoutError:
+                    pass
+                if future.done() is True:
+                    cls.__admit(livestream_id, encoder_type, livestream.quality, cost)
+                    return True
+
+                # 視聴しているクライアントがいなくなった (順番待ちの間に視聴をやめた)
+                if livestream.getStatus()['client_count'] == 0:
+                    cls.__record(livestream_id, 'Cancelled', cost, 'All clients left while waiting for the encode budget.')
+                    livestream.setStatus('Offline', 'ライブストリームは Offline です。')
+                    return False
+
+                # 待ち時間を超えたので、エンコードタスクの開始を拒否する
+                if time.time() - entry[2] > cls.QUEUE_TIMEOUT:
+                    cls.__record(livestream_id, 'Rejected', cost, f'The encode budget was not freed within {cls.QUEUE_TIMEOUT} seconds.')
+                    livestream.setStatus('Offline', '同時にエンコードできるライブストリームの上限に達しているため、ライブストリームを開始できません。')
+                    return False
+
+        finally:
+            if entry in cls.__queue:
+                cls.__queue.remove(entry)
+                # 先頭が抜けたことで、後ろのエンコードタスクが開始できるようになったかもしれない
+                cls.__dispatch()
+
+
+    @classmethod
+    def release(cls, livestream_id: str) -> None:
+        """
+        エンコードタスクの終了時に、使っていた予算を解放する
+        予算が空いたら、順番待ちのエンコードタスクを先頭から順に開始させる
+
+        Args:
+            livestream_id (str): ライブストリーム ID
+        """
+
+        if cls.__active.pop(livestream_id, None) is None:
+            return
+        cls.__active_info.pop(livestream_id, None)
+        cls.__processes.pop(livestream_id, None)
+        Metrics.ADMISSION_BUDGET_USED.set(value=cls.getUsed())
+        cls.__dispatch()
+
+
+    @classmethod
+    def setRemote(cls, livestream_id: str) -> None:
+        """
+        エンコードタスクがエンコーダーノードで実行されることになった場合に、この PC で使う予算を減らす
+
+        Args:
+            livestream_id (str): ライブストリーム ID
+        """
+
+        if livestream_id not in cls.__active:
+            return
+        cls.__active[livestream_id] = cls.REMOTE_ENCODER_COST
+        Metrics.ADMISSION_BUDGET_USED.set(value=cls.getUsed())
+        cls.__dispatch()
+
+
+    @classmethod
+    def changeQuality(cls, livestream_id: str, quality: QUALITY_TYPES) -> None:
+        """
+        エンコードタスクがエンコードする画質を切り替えた場合に、コストの見積もりと計測の対象を切り替える
+
+        Args:
+            livestream_id (str): ライブストリーム ID
+            quality (QUALITY_TYPES): 切り替え後の映像の品質
+        """
+
+        info = cls.__active_info.get(livestream_id)
+        if info is None:
+            return
+        encoder_type, _, admitted_at = info
+        cls.__active_info[livestream_id] = (encoder_type, quality, admitted_at)
+
+        # エンコーダーノードで実行している場合は、この PC で使う予算は変わらない
+        if cls.__active[livestream_id] != cls.REMOTE_ENCODER_COST:
+            cls.__active[livestream_id] = cls.estimateCost(encoder_type, quality)
+        Metrics.ADMISSION_BUDGET_USED.set(value=cls.getUsed())
+        cls.__dispatch()
+
+
+    @classmethod
+    def measure(cls, livestream_id: str, pids: list[int]) -> None:
+        """
+        エンコードタスクの tsreadex・エンコーダーの CPU 使用率を計測し、コストの見積もりに反映する
+        MEASURE_INTERVAL 秒ごとにエンコードタスク側から呼び出す (初回の呼び出しでは計測を開始するだけ)
+
+        Args:
+            livestream_id (str): ライブストリーム ID
+            pids (list[int]): 計測するプロセスの PID のリスト
+        """
+
+        info = cls.__active_info.get(livestream_id)
+        if info is None:
+            return
+
+        # 計測対象のプロセスが変わった (エンコーダーが再起動された) 場合は、計測をやり直す
+        processes = cls.__processes.get(livestream_id)
+        if processes is None or [process.pid for process in processes] != pids:
+            try:
+                processes = [psutil.Process(pid) for pid in pids]
+                for process in processes:
+                    process.cpu_percent(None)
+            except psutil.Error:
+                return
+            cls.__processes[livestream_id] = processes
+            return
+
+        # 前回の呼び出しからの CPU 使用率の合計を、CPU コア数換算のコストに変換する
+        try:
+            measured_cost = sum(process.cpu_percent(None) for process in processes) / 100
+        except psutil.Error:
+            cls.__processes.pop(livestream_id, None)
+            return
+
+        # 指数移動平均でエンコーダーの種類・画質ごとのコストの見積もりを更新し、実行中のエンコードタスクのコストにも反映する
+        encoder_type, quality, _ = info
+        previous_cost = cls.__measured_costs.get((encoder_type, quality))
+        if previous_cost is None:
+            estimated_cost = measured_cost
+        else:
+            estimated_cost = previous_cost + (measured_cost - previous_cost) * cls.MEASURE_SMOOTHING
+        cls.__measured_costs[(encoder_type, quality)] = round(max(estimated_cost, 0.01), 2)
+        if CONFIG['tv']['encode_costs'].get(quality) is None:
+            cls.__active[livestream_id] = round(max(measured_cost, 0.01), 2)
+        Metrics.ADMISSION_BUDGET_USED.set(value=cls.getUsed())
+
+
+    @classmethod
+    def getStatus(cls) -> dict[str, Any]:
+        """
+        予算の使用状況・順番待ちのエンコードタスク・コストの見積もり・直近の判定結果を取得する
+
+        Returns:
+            dict[str, Any]: アドミッション制御の状態
+        """
+
+        return {
+            'budget': cls.getBudget(),
+            'is_auto_budget': CONFIG['tv']['encode_budget'] is None,
+            'used': round(cls.getUsed(), 2),
+            'active': [{
+                'livestream_id': livestream_id,
+                'encoder_type': cls.__active_info[livestream_id][0],
+                'cost': cost,
+                'admitted_at': cls.__active_info[livestream_id][2],
+            } for livestream_id, cost in cls.__active.items() if livestream_id in cls.__active_info],
+            'queue': [{
+                'livestream_id': livestream_id,
+                'cost': cost,
+                'queued_at': queued_at,
+            } for livestream_id, cost, queued_at, _ in cls.__queue],
+            'measured_costs': [{
+                'encoder_type': encoder_type,
+                'quality': quality,
+                'cost': cost,
+            } for (encoder_type, quality), cost in sorted(cls.__measured_costs.items())],
+            'decisions': list(reversed(cls.__decisions)),
+        }
+
+
+    @classmethod
+    def __fits(cls, cost: float) -> bool:
+        """
+        指定されたコストのエンコードタスクを、予算内で開始できるかどうかを判定する
+        実行中のエンコードタスクがなければ、予算を超えるコストでも開始できる (どのみち開始できなくなってしまうため)
+
+        Args:
+            cost (float): コスト
+
+        Returns:
+            bool: 予算内で開始できるかどうか
+        """
+
+        return len(cls.__active) == 0 or cls.getUsed() + cost <= cls.getBudget()
+
+
+    @classmethod
+    def __admit(cls, livestream_id: str, encoder_type: str, quality: QUALITY_TYPES, cost: float) -> None:
+        """
+        エンコードタスクの開始を許可し、予算を割り当てる
+
+        Args:
+            livestream_id (str): ライブストリーム ID
+            encoder_type (str): エンコーダーの種類
+            quality (QUALITY_TYPES): 映像の品質
+            cost (float): コスト
+        """
+
+        cls.__active[livestream_id] = cost
+        cls.__active_info[livestream_id] = (encoder_type, quality, time.time())
+        cls.__record(livestream_id, 'Admitted', cost, f'Admitted with {cost} of the encode budget.')
+        Metrics.ADMISSION_BUDGET_USED.set(value=cls.getUsed())
+
+
+    @classmethod
+    def __preempt(cls, livestream_id: str, cost: float) -> None:
+        """
+        予算が足りるまで、Idling のライブストリームを最も長く使われていないもの (Idling に移行した時刻が古いもの) から順に終了させる
+
+        Args:
+            livestream_id (str): 予算を必要としているライブストリームの ID
+            cost (float): 必要なコスト
+        """
+
+        # 相互に依存し合っているため、モジュールの初回参照時にインポートされないようにする
+        from app.models import LiveStream
+
+        idling_livestreams = sorted(LiveStream.getIdlingLiveStreams(), key=lambda livestream: livestream.getStatus()['updated_at'])
+        for idling_livestream in idling_livestreams:
+            if cls.__fits(cost) is True:
+                break
+            if idling_livestream.livestream_id not in cls.__active:
+                continue
+
+            # Idling のライブストリームを終了させ、使っていた予算をすぐに解放する
+            ## エンコーダーが実際に終了するのはエンコードタスクが Offline を検知した後 (最大 0.1 秒後) だが、待つ必要はない
+            preempted_cost = cls.__active[idling_livestream.livestream_id]
+            if idling_livestream.tuner_subscriber is not None:
+                idling_livestream.tuner_subscriber.setIdling(True)
+            idling_livestream.setStatus('Offline', '新しいライブストリームが開始されたため、エンコードを終了しました。')
+            cls.__record(idling_livestream.livestream_id, 'Preempted', preempted_cost, f'Preempted for {livestream_id}.')
+            Logging.info(f'[AdmissionController] Preempted {idling_livestream.livestream_id} to free {preempted_cost} of the encode budget.')
+            cls.release(idling_livestream.livestream_id)
+
+
+    @classmethod
+    def __dispatch(cls) -> None:
+        """
+        予算が空いていれば、順番待ちのエンコードタスクを先頭から順に開始させる
+        """
+
+        reserved = 0.0
+        for _, cost, _, future in cls.__queue:
+            if future.done() is True:
+                reserved += cost
+                continue
+            if not (len(cls.__active) == 0 and reserved == 0) and cls.getUsed() + reserved + cost > cls.getBudget():
+                break
+            future.set_result(True)
+            reserved += cost
+
+
+    @classmethod
+    def __record(cls, livestream_id: str, decision: Literal['Admitted', 'Queued', 'Preempted', 'Rejected', 'Cancelled'], cost: float, detail: str) -> None:
+        """
+        判定結果を記録する
+
+        Args:
+            livestream_id (str): ライブストリーム ID
+            decision (Literal['Admitted', 'Queued', 'Preempted', 'Rejected', 'Cancelled']): 判定結果
+            cost (float): コスト
+            detail (str): 判定結果の詳細
+        """
+
+        cls.__decisions.append({
+            'livestream_id': livestream_id,
+            'decision': decision,
+            'cost': cost,
+            'used': round(cls.getUsed(), 2),
+            'budget': cls.getBudget(),
+            'time': time.time(),
+            'detail': detail,
+        })
+        Metrics.ADMISSION_DECISIONS.inc(decision)
+        if decision != 'Admitted':
+            Logging.info(f'[AdmissionController] [{livestream_id}] [{decision}] {detail}')
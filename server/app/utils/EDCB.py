@@ -11,6 +11,7 @@ import urllib.parse
 from typing import BinaryIO, Callable, cast, ClassVar
 
 from app.constants import CONFIG
+from app.utils.Metrics import Metrics
 
 
 class EDCBTuner:
@@ -21,7 +22,7 @@ class EDCBTuner:
     __instances: ClassVar[list[EDCBTuner | None]] = []
 
 
-    def __new__(cls, network_id: int, service_id: int, transport_stream_id: int) -> EDCBTuner:
+    def __new__(cls, network_id: int, service_id: int, transport_stream_id: int, reuse: bool = True) -> EDCBTuner:
 
         # 新しいチューナーインスタンスを生成する
         instance = super(EDCBTuner, cls).__new__(cls)
@@ -33,7 +34,7 @@ class EDCBTuner:
         return instance
 
 
-    def __init__(self, network_id: int, service_id: int, transport_stream_id: int) -> None:
+    def __init__(self, network_id: int, service_id: int, transport_stream_id: int, reuse: bool = True) -> None:
         """
         チューナーインスタンスを初期化する
 
@@ -41,6 +42,7 @@ class EDCBTuner:
             network_id (int): ネットワーク ID
             service_id (int): サービス ID
             transport_stream_id (int): トランスポートストリーム ID
+            reuse (bool): アンロック状態のチューナーがあれば再利用するかどうか (False の場合は常に新しいチューナーを起動する)
         """
 
         # NID・SID・TSID を設定
@@ -59,18 +61,21 @@ class EDCBTuner:
         # このチューナーインスタンス固有の NetworkTV ID を取得
         ## NetworkTV ID は NetworkTV モードの EpgDataCap_Bon を識別するために割り当てられる ID
         ## アンロック状態のチューナーがあれば、その NetworkTV ID を使い起動中の EpgDataCap_Bon を再利用する
-        self.edcb_networktv_id: int = self.__getNetworkTVID()
+        self.edcb_networktv_id: int = self.__getNetworkTVID(reuse)
 
         # EpgDataCap_Bon のプロセス ID
         ## プロセス ID が None のときはチューナーが起動されていないものとして扱う
         self.edcb_process_id: int | None = None
 
 
-    def __getNetworkTVID(self) -> int:
+    def __getNetworkTVID(self, reuse: bool) -> int:
         """
         EpgDataCap_Bon の NetworkTV ID を取得する
         アンロック状態のチューナーインスタンスがあれば、それを削除した上でそのチューナーインスタンスの NetworkTV ID を返す
 
+        Args:
+            reuse (bool): アンロック状態のチューナーインスタンスを再利用するかどうか
+
         Returns:
             int: 取得した EpgDataCap_Bon の NetworkTV ID
         """
@@ -84,6 +89,10 @@ class EDCBTuner:
         ## さらに登録されているチューナーインスタンスの数を足す（とりあえず被らなければいいのでこれで）
         edcb_networktv_id = 500 + len(EDCBTuner.__instances)
 
+        # 再利用しない場合は、新しい NetworkTV ID をそのまま返す
+        if reuse is False:
+            return edcb_networktv_id
+
         # インスタンスごとに
         for instance in EDCBTuner.__instances:
 
@@ -659,6 +668,14 @@ class CtrlCmdUtil:
     __CMD_EPG_SRV_FILE_COPY2 = 2060
 
     async def __sendAndReceive(self, buf: bytearray):
+        # CtrlCmd インターフェイスの呼び出しにかかった時間をコマンドごとに記録する
+        started_at = time.monotonic()
+        ret, rbuf = await self.__sendAndReceiveRaw(buf)
+        Metrics.BACKEND_REQUEST_DURATION.observe('EDCB', f'CtrlCmd {int.from_bytes(buf[0:4], "little", signed=True)}',
+            str(ret) if ret is not None else 'error', value=time.monotonic() - started_at)
+        return ret, rbuf
+
+    async def __sendAndReceiveRaw(self, buf: bytearray):
         to = time.monotonic() + self.__connect_timeout_sec
         ret: int | bool | None = 0
         size: int = 0
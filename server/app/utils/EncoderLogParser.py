@@ -0,0 +1,322 @@
+# Type Hints を指定できるように
+# ref: https://stackoverflow.com/a/33533514/17124142
+from __future__ import annotations
+
+import asyncio
+import re
+import time
+from collections import deque
+from typing import AsyncIterator, ClassVar, Literal, TypedDict
+
+
+class EncoderSample(TypedDict):
+    """ エンコーダーの進捗ログから取得したエンコードの状況を表す辞書の型定義 """
+    time: float
+    frames: int
+    fps: float
+    bitrate: float | None
+    speed: float | None
+    gpu_usage: int | None
+    video_encoder_usage: int | None
+    video_decoder_usage: int | None
+
+
+class EncoderLogParser:
+    """
+    エンコーダー (FFmpeg・HWEncC) のログを1行ずつ解析するクラス
+    エンコーダーの種類ごとに定義したテーブルに従い、進捗ログからのエンコードの状況の取得・ステータスの遷移・エラーの判定を行う
+    """
+
+    # エンコーダーのログとして残さない行
+    ## 元は "Delay between the first packet and last packet in the muxing queue is xxxxxx > 1: forcing output" と
+    ## "removing 2 bytes from input bitstream not read by decoder." という2つのメッセージで、実害はない
+    ## FFmpeg と HWEncC のログが衝突して行の先頭が欠けることがあるので、できるだけ多く弾けるように部分一致にしている
+    IGNORED_SUBSTRINGS: ClassVar[tuple[str, ...]] = (
+        'removing 2 bytes from input bitstream not read by decoder.',
+        'Delay between the',
+        'packet in the muxing queue',
+        'ing output',
+    )
+    IGNORED_LINES: ClassVar[frozenset[str]] = frozenset([
+        'ng output', 'g output', ' output', 'output', 'utput', 'tput', 'put', 'ut', 't', '',
+    ])
+
+    # エンコードの進捗ログの正規表現
+    ## HWEncC は内部で使われている FFmpeg 側の大量に出るデバッグログと衝突してログがごちゃまぜになりがち…
+    ## 進捗ログより前に混ざった FFmpeg 側のログ（ゴミ）は取り除くが、完全に混ざっていると除去できずに frames: の数値が桁が飛んだような出力になるけどご愛嬌…
+    PROGRESS_PATTERNS: ClassVar[dict[str, re.Pattern[str]]] = {
+        'FFmpeg': re.compile(
+            r'frame=\s*(?P<frames>[0-9]+)\s+fps=\s*(?P<fps>[0-9\.]+).*?bitrate=\s*(?:(?P<bitrate>[0-9\.]+)kbits/s|N/A)'
+            r'(?:.*?speed=\s*(?P<speed>[0-9\.]+)x)?'),
+        'HWEncC': re.compile(
+            r'(?P<frames>[1-9][0-9]+) frames: (?P<fps>[0-9\.]+) fps, (?P<bitrate>[0-9]+) kb/s'
+            r'(?:, GPU (?P<gpu_usage>[0-9]+)%)?(?:, VE (?P<video_encoder_usage>[0-9]+)%)?(?:, VD (?P<video_decoder_usage>[0-9]+)%)?$'),
+    }
+
+    # ステータスが Standby の間に、エンコードの進捗に応じて遷移するステータス
+    ## 上から順に判定し、最初に一致したものを適用する
+    STATUS_TRANSITIONS: ClassVar[dict[str, list[tuple[tuple[str, ...], Literal['Standby', 'ONAir'], str]]]] = {
+        'FFmpeg': [
+            (('arib parser was created', 'Invalid frame dimensions 0x0.'), 'Standby', 'エンコードを開始しています…'),
+            (('frame=    1 fps=0.0 q=0.0', 'size=       0kB time=00:00'), 'Standby', 'バッファリングしています…'),
+            (('frame=', 'bitrate='), 'ONAir', 'ライブストリームは ONAir です。'),
+        ],
+        'HWEncC': [
+            (('opened file "pipe:0"',), 'Standby', 'エンコードを開始しています…'),
+            (('starting output thread...', 'Encode Thread:'), 'Standby', 'バッファリングしています…'),
+            ((' frames: ',), 'ONAir', 'ライブストリームは ONAir です。'),
+        ],
+    }
+
+    # 特定のエラーログが出力された場合に遷移するステータス
+    ## 上から順に判定し、最初に一致したものを適用する
+    ## 対象のエンコーダー (FFmpeg / HWEncC / 個別のエンコーダー名)・エラーログ・遷移するステータス・ステータスの詳細の順
+    ## NoInput は何らかの要因で tsreadex から放送波が受信できなかったことによるエラーで、停波中かどうかに応じて呼び出し元で Offline の詳細を決める
+    ## Restart はエンコーダーの再起動で復帰できる可能性があるエラーで、エンコードタスクを再起動する
+    ERRORS: ClassVar[list[tuple[str, tuple[str, ...], Literal['Offline', 'Restart', 'NoInput'], str]]] = [
+        ('FFmpeg', ('Stream map \'0:v:0\' matches no streams.',), 'NoInput', ''),
+        ('FFmpeg', ('Conversion failed!',), 'Restart', 'エンコード中に予期しないエラーが発生しました。エンコードタスクを再起動します。'),
+        ('HWEncC', ('error finding stream information.',), 'NoInput', ''),
+        # NVEncC で、同時にエンコードできるセッション数 (Geforceだと5つ) を全て使い果たしている時のエラー
+        ('NVEncC', ('due to the NVIDIA\'s driver limitation.',), 'Offline',
+            'NVENC のエンコードセッションが不足しているため、エンコードを開始できません。'),
+        # QSVEncC 非対応の環境
+        ('QSVEncC', ('unable to decode by qsv.', 'No device found for QSV encoding!'), 'Offline',
+            'お使いの PC 環境は QSVEncC エンコーダーに対応していません。'),
+        # QSVEncC 非対応の環境 (Linux かつ第5世代以前の Intel CPU)
+        ('QSVEncC', ('iHD_drv_video.so init failed',), 'Offline',
+            'お使いの PC 環境は Linux 版 QSVEncC エンコーダーに対応していません。第5世代以前の古い CPU をお使いの可能性があります。'),
+        # NVEncC 非対応の環境
+        ('NVEncC', ('CUDA not available.',), 'Offline', 'お使いの PC 環境は NVEncC エンコーダーに対応していません。'),
+        # VCEEncC 非対応の環境
+        ('VCEEncC', ('Failed to initalize VCE factory:', 'Assertion failed:Init() failed to vkCreateInstance'), 'Offline',
+            'お使いの PC 環境は VCEEncC エンコーダーに対応していません。'),
+        # --input-probesize or --input-analyze の期間内に入力ストリームの解析が終わらなかった
+        ('HWEncC', ('Consider increasing the value for the --input-analyze and/or --input-probesize!',), 'Restart',
+            '入力ストリームの解析に失敗しました。エンコードタスクを再起動します。'),
+        # 捕捉されないエラー
+        ('HWEncC', ('finished with error!',), 'Restart', 'エンコード中に予期しないエラーが発生しました。エンコードタスクを再起動します。'),
+    ]
+
+    # H.265/HEVC でのエンコードに非対応の環境であることを示すログ
+    ## NVEncC では、他の行に available for encode. という文字列が含まれている場合は除外する
+    HEVC_UNSUPPORTED: ClassVar[dict[str, str]] = {
+        'QSVEncC': 'HEVC encoding is not supported on current platform.',
+        'NVEncC': 'does not support H.265/HEVC encoding.',
+        'VCEEncC': 'HW Acceleration of H.265/HEVC is not supported on this platform.',
+    }
+    HEVC_AVAILABLE: ClassVar[dict[str, str]] = {
+        'NVEncC': 'available for encode.',
+    }
+
+    # エラー時に表示するエンコーダーのログの行数 (FFmpeg は最後の50行、HWEncC は最後の150行を表示)
+    RECENT_LINES_COUNT: ClassVar[dict[str, int]] = {
+        'FFmpeg': 50,
+        'HWEncC': 150,
+    }
+
+    # 保持するエンコードの状況の最大数
+    ## 進捗ログはおおむね 0.5 ~ 1 秒ごとに出力されるため、直近 5 分程度を保持する
+    MAX_SAMPLES = 300
+
+    # 行の区切りが来ないまま溜め込める最大バイト数
+    MAX_LINE_LENGTH = 65536
+
+
+    def __init__(self, encoder_type: Literal['FFmpeg', 'QSVEncC', 'NVEncC', 'VCEEncC', 'rkmppenc']) -> None:
+        """
+        エンコーダーのログの解析を初期化する
+
+        Args:
+            encoder_type (Literal['FFmpeg', 'QSVEncC', 'NVEncC', 'VCEEncC', 'rkmppenc']): エンコーダーの種類
+        """
+
+        # エンコーダーの種類
+        self.encoder_type: Literal['FFmpeg', 'QSVEncC', 'NVEncC', 'VCEEncC', 'rkmppenc'] = encoder_type
+
+        # エンコーダーの系統 (FFmpeg か HWEncC か)
+        family = 'FFmpeg' if encoder_type == 'FFmpeg' else 'HWEncC'
+
+        # このエンコーダーで使うテーブルを選んでおく
+        self.__progress_pattern = self.PROGRESS_PATTERNS[family]
+        self.__status_transitions = self.STATUS_TRANSITIONS[family]
+        self.__errors = [(substrings, status, detail) for target, substrings, status, detail in self.ERRORS if target in (family, encoder_type)]
+        self.__hevc_unsupported = self.HEVC_UNSUPPORTED.get(encoder_type)
+        self.__hevc_available = self.HEVC_AVAILABLE.get(encoder_type)
+        self.__recent_lines_count = self.RECENT_LINES_COUNT[family]
+
+        # 直近のエンコーダーのログ
+        ## エラー時に表示する行数 + 1 行 (エラーが出力された行) だけ保持する
+        self.__lines: deque[str] = deque(maxlen=self.__recent_lines_count + 1)
+
+        # エンコードの状況のリングバッファ
+        self.samples: deque[EncoderSample] = deque(maxlen=self.MAX_SAMPLES)
+
+        # H.265/HEVC でのエンコードに関するログが出力されたかどうか
+        self.__hevc_unsupported_found: bool = False
+        self.__hevc_available_found: bool = False
+
+
+    async def readLines(self, stream: asyncio.StreamReader) -> AsyncIterator[str]:
+        """
+        エンコーダーの出力を行ごとに随時読み込む
+        FFmpeg はコンソールの行を上書きするために frame= の進捗ログで \\r しか出力しないため、\\r と \\n のどちらも行の区切りとして扱う
+        (readline() を使うと進捗ログを取得できずに永遠に Standby から ONAir に移行しない不具合が発生する)
+
+        Args:
+            stream (asyncio.StreamReader): エンコーダーの標準エラー出力
+
+        Yields:
+            str: 前後の空白を取り除いた行 (UTF-8 としてデコードできない行は読み飛ばす)
+        """
+
+        buffer = b''
+        while True:
+
+            # 届いている分をまとめて読み込む
+            ## 空のデータが返ってきたら、エンコーダーが終了したと判断して終了
+            data = await stream.read(self.MAX_LINE_LENGTH)
+            if data == b'':
+                break
+            buffer += data
+
+            # 最後の行の区切りまでを行として切り出し、残りは次に読み込んだデータと繋げる
+            ## 行の区切りが来ないまま MAX_LINE_LENGTH を超えた場合は、そこまでを1行として扱う
+            end = max(buffer.rfind(b'\r'), buffer.rfind(b'\n'))
+            if end == -1:
+                if len(buffer) < self.MAX_LINE_LENGTH:
+                    continue
+                end = len(buffer) - 1
+            complete, buffer = buffer[:end + 1], buffer[end + 1:]
+
+            for raw_line in complete.splitlines():
+                try:
+                    yield raw_line.decode('utf-8').strip()
+                except UnicodeDecodeError:
+                    continue
+
+        # 最後に行の区切りなしで残っていた行
+        if buffer != b'':
+            try:
+                yield buffer.decode('utf-8').strip()
+            except UnicodeDecodeError:
+                pass
+
+
+    def parse(self, line: str) -> str | None:
+        """
+        エンコーダーのログを1行解析し、エンコードの進捗ログであればエンコードの状況をリングバッファに追加する
+
+        Args:
+            line (str): エンコーダーのログの行
+
+        Returns:
+            str | None: ログとして残す行 (進捗ログは余計なゴミを取り除いたもの) 、ログとして残さない行の場合は None
+        """
+
+        # エンコードの進捗ログだったら、エンコードの状況を取得して余計なゴミを取り除く
+        ## 進捗ログでなければ、H.265/HEVC でのエンコードに関するログかどうかを記録する
+        match = self.__progress_pattern.search(line)
+        if match is not None:
+            groups = match.groupdict()
+            self.samples.append({
+                'time': time.time(),
+                'frames': int(groups['frames']),
+                'fps': float(groups['fps']),
+                'bitrate': float(groups['bitrate']) if groups.get('bitrate') is not None else None,
+                'speed': float(groups['speed']) if groups.get('speed') is not None else None,
+                'gpu_usage': int(groups['gpu_usage']) if groups.get('gpu_usage') is not None else None,
+                'video_encoder_usage': int(groups['video_encoder_usage']) if groups.get('video_encoder_usage') is not None else None,
+                'video_decoder_usage': int(groups['video_decoder_usage']) if groups.get('video_decoder_usage') is not None else None,
+            })
+            if self.encoder_type != 'FFmpeg':
+                line = match.group(0)
+        else:
+            if self.__hevc_unsupported is not None and self.__hevc_unsupported in line:
+                self.__hevc_unsupported_found = True
+            if self.__hevc_available is not None and self.__hevc_available in line:
+                self.__hevc_available_found = True
+
+        # 山ほど出力されるメッセージと空行をログから除外
+        if line in self.IGNORED_LINES or any(substring in line for substring in self.IGNORED_SUBSTRINGS):
+            return None
+
+        # 直近のログに追加
+        self.__lines.append(line)
+        return line
+
+
+    def matchStatusTransition(self, line: str) -> tuple[Literal['Standby', 'ONAir'], str] | None:
+        """
+        エンコードの進捗に応じて遷移するステータスを取得する
+
+        Args:
+            line (str): エンコーダーのログの行
+
+        Returns:
+            tuple[Literal['Standby', 'ONAir'], str] | None: 遷移するステータスとステータスの詳細 (該当しない場合は None)
+        """
+
+        for substrings, status, detail in self.__status_transitions:
+            if any(substring in line for substring in substrings):
+                return (status, detail)
+        return None
+
+
+    def matchError(self, line: str) -> tuple[Literal['Offline', 'Restart', 'NoInput'], str] | None:
+        """
+        エラーログに応じて遷移するステータスを取得する
+
+        Args:
+            line (str): エンコーダーのログの行
+
+        Returns:
+            tuple[Literal['Offline', 'Restart', 'NoInput'], str] | None: 遷移するステータスとステータスの詳細 (該当しない場合は None)
+        """
+
+        for substrings, status, detail in self.__errors:
+            if any(substring in line for substring in substrings):
+                return (status, detail)
+        return None
+
+
+    def isHEVCUnsupported(self) -> bool:
+        """
+        H.265/HEVC でのエンコードに非対応の環境であることを示すログが出力されたかどうかを取得する
+
+        Returns:
+            bool: H.265/HEVC でのエンコードに非対応の環境かどうか
+        """
+
+        return self.__hevc_unsupported_found is True and self.__hevc_available_found is False
+
+
+    def getRecentLines(self) -> list[str]:
+        """
+        エラー時に表示する直近のエンコーダーのログを取得する (最後に出力された行は除く)
+
+        Returns:
+            list[str]: 直近のエンコーダーのログ
+        """
+
+        return list(self.__lines)[:-1]
+
+
+    def getStats(self) -> dict:
+        """
+        エンコードの状況の統計を取得する
+
+        Returns:
+            dict: エンコーダーの種類・最新のエンコードの状況・平均値・直近のエンコードの状況のリスト
+        """
+
+        samples = list(self.samples)
+        bitrates = [sample['bitrate'] for sample in samples if sample['bitrate'] is not None]
+
+        return {
+            'encoder_type': self.encoder_type,
+            'latest': samples[-1] if len(samples) > 0 else None,
+            'average_fps': sum(sample['fps'] for sample in samples) / len(samples) if len(samples) > 0 else None,
+            'average_bitrate': sum(bitrates) / len(bitrates) if len(bitrates) > 0 else None,
+            'samples': samples,
+        }
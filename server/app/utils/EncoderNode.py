@@ -0,0 +1,600 @@
+# Type Hints を指定できるように
+# ref: https://stackoverflow.com/a/33533514/17124142
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+import hmac
+import json
+import os
+import socket
+import struct
+import threading
+import urllib.parse
+from typing import Any, ClassVar, Literal
+
+from app.constants import CONFIG, LIBRARY_PATH, QUALITY, QUALITY_TYPES, VERSION
+from app.utils import Logging
+
+
+class EncoderNodeUtil:
+    """
+    エンコーダーノードとの通信プロトコルに関するユーティリティ
+
+    エンコーダーノードは、KonomiTV サーバーから受け取った放送波 TS を tsreadex とエンコーダーで処理し、
+    エンコード後の TS を KonomiTV サーバーに返す別マシン (または別プロセス) のワーカー
+    1回のエンコードごとに1本の TCP 接続を使い、以下の手順で通信する
+
+    1. KonomiTV サーバーが JSON 1行 (改行終端) のリクエストを送信する
+       - すべてのリクエストに、config.yaml の tv.encoder_node_secret に設定された共有シークレット ("secret") を含める
+       - {"type": "status"}: ノードの状態 (capacity・running・encoders) を JSON 1行で返して接続を閉じる
+       - {"type": "encode", "livestream_id": ..., "encoder_type": ..., "quality": ..., "service_id": ..., "is_fullhd_channel": ...,
+          "is_sphd_channel": ..., "is_radiochannel": ..., "retry_count": ...}
+         tsreadex とエンコーダーのオプションは、エンコーダーノードがこれらのパラメーターから LiveEncodingTask と同じ方法で組み立てる
+         (依頼元から任意のコマンドライン引数を渡せないようにするため)
+    2. エンコーダーノードが {"result": "accepted"} または {"result": "rejected", "reason": ...} を JSON 1行で返す
+       - 共有シークレットが一致しないリクエストには何も返さずに接続を閉じる
+    3. 以降は双方向にフレーム (種別 1 バイト + ペイロード長 4 バイト (ビッグエンディアン) + ペイロード) をやり取りする
+       - KonomiTV サーバー → ノード: FRAME_INPUT (放送波 TS) / FRAME_INPUT_END (入力の終端)
+       - ノード → KonomiTV サーバー: FRAME_STDOUT (エンコード後の TS) / FRAME_STDERR (エンコーダーのログ) / FRAME_EXIT (終了コード)
+    4. どちらかが接続を閉じた時点でエンコードを終了する (ノード側では tsreadex とエンコーダーが強制終了される)
+    """
+
+    # フレームの種別
+    FRAME_INPUT: ClassVar[int] = 0x01
+    FRAME_INPUT_END: ClassVar[int] = 0x02
+    FRAME_STDOUT: ClassVar[int] = 0x11
+    FRAME_STDERR: ClassVar[int] = 0x12
+    FRAME_EXIT: ClassVar[int] = 0x13
+
+    # フレームヘッダーの構造 (種別 1 バイト + ペイロード長 4 バイト)
+    FRAME_HEADER: ClassVar[struct.Struct] = struct.Struct('>BI')
+
+    # エンコーダーノードへの接続・状態取得のタイムアウト (秒)
+    CONNECT_TIMEOUT: ClassVar[float] = 3
+
+
+    @classmethod
+    def encodeFrame(cls, frame_type: int, payload: bytes) -> bytes:
+        """ フレームヘッダーを付加したフレームを返す """
+        return cls.FRAME_HEADER.pack(frame_type, len(payload)) + payload
+
+
+    @staticmethod
+    def parseNodeURL(node_url: str) -> tuple[str, int]:
+        """
+        エンコーダーノードの URL (tcp://host:port) からホスト名とポートを取得する
+
+        Args:
+            node_url (str): エンコーダーノードの URL
+
+        Returns:
+            tuple[str, int]: ホスト名とポート
+        """
+        node_url_parse = urllib.parse.urlparse(node_url)
+        return (node_url_parse.hostname or 'localhost', node_url_parse.port or 7010)
+
+
+    @classmethod
+    async def getNodeStatus(cls, node_url: str) -> dict[str, Any] | None:
+        """
+        エンコーダーノードの状態を取得する
+
+        Args:
+            node_url (str): エンコーダーノードの URL
+
+        Returns:
+            dict[str, Any] | None: capacity (同時エンコード数の上限)・running (実行中のエンコード数)・encoders (利用可能なエンコーダー) を含む辞書
+                (接続できなかった場合は None を返す)
+        """
+
+        host, port = cls.parseNodeURL(node_url)
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), cls.CONNECT_TIMEOUT)
+            try:
+                writer.write(json.dumps({'type': 'status', 'secret': CONFIG['tv']['encoder_node_secret']}).encode('utf-8') + b'\n')
+                await writer.drain()
+                return json.loads(await asyncio.wait_for(reader.readline(), cls.CONNECT_TIMEOUT))
+            finally:
+                writer.close()
+        except (OSError, asyncio.TimeoutError, json.JSONDecodeError):
+            return None
+
+
+    @classmethod
+    async def openRemoteEncoder(cls,
+        livestream_id: str,
+        encoder_type: Literal['FFmpeg', 'QSVEncC', 'NVEncC', 'VCEEncC', 'rkmppenc'],
+        quality: QUALITY_TYPES,
+        service_id: int,
+        is_fullhd_channel: bool,
+        is_sphd_channel: bool,
+        is_radiochannel: bool,
+        retry_count: int,
+    ) -> RemoteEncoder | None:
+        """
+        設定されたエンコーダーノードのうち、空きが最も多いノードでエンコードを開始する
+        指定されたエンコーダーが使えるノードに空きがない場合は None を返す (呼び出し元でローカルでのエンコードにフォールバックする)
+
+        Args:
+            livestream_id (str): ライブストリーム ID (ログ用)
+            encoder_type (Literal['FFmpeg', 'QSVEncC', 'NVEncC', 'VCEEncC', 'rkmppenc']): エンコーダーの種類
+            quality (QUALITY_TYPES): エンコードする映像の品質
+            service_id (int): 視聴対象のチャンネルのサービス ID
+            is_fullhd_channel (bool): フル HD 放送が実施されているチャンネルかどうか
+            is_sphd_channel (bool): スカパー！プレミアムサービスのチャンネルかどうか
+            is_radiochannel (bool): ラジオチャンネルかどうか
+            retry_count (int): エンコードタスクのリトライ回数
+
+        Returns:
+            RemoteEncoder | None: エンコーダーノード上で実行中のエンコーダー
+        """
+
+        # すべてのエンコーダーノードの状態を並列に取得する
+        node_urls: list[str] = CONFIG['tv']['encoder_nodes']
+        node_statuses = await asyncio.gather(*[cls.getNodeStatus(node_url) for node_url in node_urls])
+
+        # 指定されたエンコーダーが使えて、かつ空きのあるノードを空きが多い順に並べる
+        candidates: list[tuple[int, str]] = []
+        for node_url, node_status in zip(node_urls, node_statuses):
+            if node_status is None or encoder_type not in node_status['encoders']:
+                continue
+            available = node_status['capacity'] - node_status['running']
+            if available > 0:
+                candidates.append((available, node_url))
+        candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+
+        # 空きが多いノードから順にエンコードを依頼する
+        ## 状態を取得してから依頼するまでの間に他のサーバーに空きを取られる可能性があるため、断られたら次のノードを試す
+        request = {
+            'type': 'encode',
+            'secret': CONFIG['tv']['encoder_node_secret'],
+            'livestream_id': livestream_id,
+            'encoder_type': encoder_type,
+            'quality': quality,
+            'service_id': service_id,
+            'is_fullhd_channel': is_fullhd_channel,
+            'is_sphd_channel': is_sphd_channel,
+            'is_radiochannel': is_radiochannel,
+            'retry_count': retry_count,
+        }
+        for _, node_url in candidates:
+            sock = await asyncio.to_thread(cls.__submit, node_url, request)
+            if sock is not None:
+                Logging.info(f'[Live: {livestream_id}] Encoding on encoder node {node_url}')
+                return RemoteEncoder(sock)
+
+        return None
+
+
+    @classmethod
+    def __submit(cls, node_url: str, request: dict[str, Any]) -> socket.socket | None:
+        """ エンコーダーノードにエンコードを依頼し、受け付けられた場合は接続済みのソケットを返す """
+
+        host, port = cls.parseNodeURL(node_url)
+        try:
+            sock = socket.create_connection((host, port), timeout=cls.CONNECT_TIMEOUT)
+        except OSError:
+            return None
+        try:
+            sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+            response = json.loads(sock.makefile('rb', buffering=0).readline())
+        except (OSError, json.JSONDecodeError):
+            sock.close()
+            return None
+        if response.get('result') != 'accepted':
+            Logging.warning(f'[EncoderNodeUtil] Encoder node {node_url} rejected the request. reason: {response.get("reason")}')
+            sock.close()
+            return None
+
+        # 以降はブロッキングで送受信する
+        sock.settimeout(None)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+
+class RemoteEncoder:
+    """
+    エンコーダーノード上で実行中の tsreadex + エンコーダー
+    LiveEncodingTask からはローカルの tsreadex (stdin・returncode・kill()) と
+    エンコーダー (stdout・stderr・returncode・kill()) の両方として扱えるように、同じインターフェイスを持たせている
+    """
+
+    class Stdin:
+        """ tsreadex の標準入力の代わりに、放送波 TS をエンコーダーノードに送信する (Reader スレッドから同期的に呼ばれる) """
+
+        def __init__(self, remote_encoder: RemoteEncoder) -> None:
+            self.remote_encoder = remote_encoder
+
+        def write(self, data: bytes) -> None:
+            self.remote_encoder.send(EncoderNodeUtil.FRAME_INPUT, data)
+
+        def close(self) -> None:
+            self.remote_encoder.send(EncoderNodeUtil.FRAME_INPUT_END, b'')
+
+
+    class StdoutTransport(asyncio.ReadTransport):
+        """
+        エンコーダーの標準出力の代わりの StreamReader に紐付けるトランスポート
+        StreamReader はバッファが上限を超えると pause_reading() を、読み出されて上限を下回ると resume_reading() を呼ぶため、
+        それに合わせて受信スレッドがエンコーダーノードからの受信を一時停止・再開できるようにする
+        """
+
+        def __init__(self) -> None:
+            super().__init__()
+            # 受信を続けてよいときにセットされるイベント
+            self.resumed = threading.Event()
+            self.resumed.set()
+
+        def pause_reading(self) -> None:
+            self.resumed.clear()
+
+        def resume_reading(self) -> None:
+            self.resumed.set()
+
+        def is_reading(self) -> bool:
+            return self.resumed.is_set()
+
+
+    # 受信スレッドが、受信したフレームがイベントループ上で StreamReader に渡されるのを待つ間隔 (フレーム数)
+    ## 受信スレッドはイベントループとは非同期に動くため、定期的に待たないと StreamReader の pause_reading() が間に合わず、
+    ## イベントループや Writer が遅れている間に、受信したエンコード後の TS がメモリ上に際限なく溜まってしまう
+    ## エンコーダーノードは最大 64KiB ずつ送ってくるため、StreamReader に渡されていないデータは最大でも 1MiB 程度に収まる
+    STDOUT_SYNC_INTERVAL: ClassVar[int] = 16
+
+    # 受信スレッドが、イベントループ上でフレームが処理されるのを待つ間に kill() されたかを確認する間隔 (秒)
+    ## 終了処理中などでイベントループが止まっていたり詰まっていたりしても、受信スレッドが終了できなくならないようにする
+    STDOUT_SYNC_TIMEOUT: ClassVar[float] = 1.0
+
+
+    def __init__(self, sock: socket.socket) -> None:
+        """
+        エンコードを受け付けたエンコーダーノードとの接続から RemoteEncoder を初期化する
+
+        Args:
+            sock (socket.socket): エンコーダーノードとの接続済みソケット
+        """
+
+        self.__socket = sock
+        self.__send_lock = threading.Lock()
+        self.__loop = asyncio.get_running_loop()
+
+        # kill() で接続が閉じられたかどうか
+        self.__killed = threading.Event()
+
+        # エンコーダーの終了コード (実行中は None)
+        self.returncode: int | None = None
+
+        # tsreadex の標準入力・エンコーダーの標準出力・標準エラー出力に相当するストリーム
+        self.stdin = RemoteEncoder.Stdin(self)
+        ## 標準出力のバッファが上限 (limit の2倍) を超えている間は受信を止め、TCP のフロー制御でエンコーダーノードからの送信を待たせる
+        self.stdout = asyncio.StreamReader(limit=2 ** 20)
+        self.__stdout_transport = RemoteEncoder.StdoutTransport()
+        self.stdout.set_transport(self.__stdout_transport)
+        self.stderr = asyncio.StreamReader()
+
+        # エンコーダーノードからのフレームを受信するスレッドを開始
+        threading.Thread(target=self.__receive, daemon=True).start()
+
+
+    def send(self, frame_type: int, payload: bytes) -> None:
+        """
+        エンコーダーノードにフレームを送信する
+        送信に失敗した場合は OSError (BrokenPipeError など) が送出される
+
+        Args:
+            frame_type (int): フレームの種別
+            payload (bytes): ペイロード
+        """
+        with self.__send_lock:
+            self.__socket.sendall(EncoderNodeUtil.encodeFrame(frame_type, payload))
+
+
+    def kill(self) -> None:
+        """ エンコーダーノードとの接続を閉じ、エンコーダーノード上の tsreadex とエンコーダーを終了させる """
+        # 標準出力のバッファが空くのを待っている受信スレッドを終了させる
+        self.__killed.set()
+        self.__stdout_transport.resume_reading()
+        try:
+            self.__socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.__socket.close()
+
+
+    def __receive(self) -> None:
+        """ エンコーダーノードからフレームを受信し、標準出力・標準エラー出力に振り分ける (別スレッドで実行される) """
+
+        def receive_exactly(size: int) -> bytes:
+            buffer = bytearray()
+            while len(buffer) < size:
+                data = self.__socket.recv(size - len(buffer))
+                if data == b'':
+                    raise ConnectionError('Connection closed by the encoder node.')
+                buffer += data
+            return bytes(buffer)
+
+        # イベントループ上でこれまでに渡したフレームが処理されるのを待つためのコルーチン
+        async def Sync() -> None:
+            pass
+
+        returncode = -1
+        stdout_frames = 0
+        try:
+            while True:
+                frame_type, length = EncoderNodeUtil.FRAME_HEADER.unpack(receive_exactly(EncoderNodeUtil.FRAME_HEADER.size))
+                payload = receive_exactly(length) if length > 0 else b''
+                if frame_type == EncoderNodeUtil.FRAME_STDOUT:
+                    self.__loop.call_soon_threadsafe(self.stdout.feed_data, payload)
+                    # 一定数のフレームごとに、イベントループ上で StreamReader に渡し終わるのを待ってから、
+                    # 標準出力のバッファが上限を下回るまで (=エンコードタスクが読み出すまで) 次の受信を止める
+                    stdout_frames += 1
+                    if stdout_frames % self.STDOUT_SYNC_INTERVAL == 0:
+                        ## イベントループが止まっているとコルーチンがいつまでも完了しないため、kill() されたら待つのをやめてキャンセルする
+                        future = asyncio.run_coroutine_threadsafe(Sync(), self.__loop)
+                        while self.__killed.is_set() is False:
+                            try:
+                                future.result(timeout=self.STDOUT_SYNC_TIMEOUT)
+                                break
+                            except concurrent.futures.TimeoutError:
+                                pass
+                        if self.__killed.is_set():
+                            future.cancel()
+                            break
+                    while self.__stdout_transport.resumed.wait(timeout=1) is False:
+                        if self.__killed.is_set():
+                            break
+                    if self.__killed.is_set():
+                        break
+                elif frame_type == EncoderNodeUtil.FRAME_STDERR:
+                    self.__loop.call_soon_threadsafe(self.stderr.feed_data, payload)
+                elif frame_type == EncoderNodeUtil.FRAME_EXIT:
+                    returncode = struct.unpack('>i', payload)[0]
+                    break
+        except (OSError, RuntimeError, struct.error, concurrent.futures.CancelledError):
+            # RuntimeError: イベントループが既に終了している
+            # CancelledError: イベントループの終了時に、処理を待っていたコルーチンがキャンセルされた
+            pass
+
+        # 接続が切断された場合もエンコーダーが終了したものとして扱う
+        def finish():
+            self.stdout.feed_eof()
+            self.stderr.feed_eof()
+            self.returncode = returncode
+        try:
+            self.__loop.call_soon_threadsafe(finish)
+        except RuntimeError:
+            # イベントループが既に終了している
+            pass
+
+
+class EncoderNodeServer:
+    """ エンコーダーノードとして、KonomiTV サーバーからのエンコード依頼を受け付けるサーバー """
+
+    def __init__(self, capacity: int, encoders: list[str], secret: str) -> None:
+        """
+        エンコーダーノードを初期化する
+
+        Args:
+            capacity (int): 同時に実行できるエンコードの数
+            encoders (list[str]): このノードで利用できるエンコーダー
+            secret (str): KonomiTV サーバーとの通信に使う共有シークレット (config.yaml の tv.encoder_node_secret)
+        """
+
+        self.capacity = capacity
+        self.encoders = encoders
+        self.running = 0
+        self.__secret = secret
+
+
+    async def serve(self, host: str, port: int) -> None:
+        """
+        エンコーダーノードを起動し、終了するまでリクエストを待ち受ける
+
+        Args:
+            host (str): リッスンするアドレス
+            port (int): リッスンするポート
+        """
+
+        server = await asyncio.start_server(self.__handle, host, port)
+        Logging.info(f'[EncoderNodeServer] KonomiTV {VERSION} encoder node is listening on {host}:{port} '
+                     f'(capacity: {self.capacity}, encoders: {", ".join(self.encoders)})')
+        async with server:
+            await server.serve_forever()
+
+
+    async def __handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """ KonomiTV サーバーからの接続を処理する """
+
+        try:
+            request = json.loads(await asyncio.wait_for(reader.readline(), EncoderNodeUtil.CONNECT_TIMEOUT))
+        except (asyncio.TimeoutError, json.JSONDecodeError, UnicodeDecodeError, ConnectionError):
+            writer.close()
+            return
+
+        # 共有シークレットが一致しないリクエストは、何も返さずに接続を閉じる
+        ## タイミング攻撃で共有シークレットを推測されないよう、hmac.compare_digest() で比較する
+        secret = request.get('secret') if type(request) is dict else None
+        if type(secret) is not str or hmac.compare_digest(secret.encode('utf-8'), self.__secret.encode('utf-8')) is False:
+            peer = writer.get_extra_info('peername')
+            Logging.warning(f'[EncoderNodeServer] Rejected a request with an invalid secret. (peer: {peer})')
+            writer.close()
+            return
+
+        # ノードの状態を返す
+        if request.get('type') == 'status':
+            writer.write(json.dumps({
+                'version': VERSION,
+                'capacity': self.capacity,
+                'running': self.running,
+                'encoders': self.encoders,
+            }).encode('utf-8') + b'\n')
+            await writer.drain()
+            writer.close()
+            return
+
+        # エンコードを受け付ける
+        if request.get('type') == 'encode':
+            if request.get('encoder_type') not in self.encoders:
+                await self.__reject(writer, 'unsupported encoder')
+                return
+            try:
+                tsreadex_options, encoder_options = self.__buildOptions(request)
+            except (KeyError, TypeError, ValueError) as ex:
+                await self.__reject(writer, f'invalid request ({ex})')
+                return
+            if self.running >= self.capacity:
+                await self.__reject(writer, 'capacity exceeded')
+                return
+            self.running += 1
+            try:
+                await self.__encode(request, tsreadex_options, encoder_options, reader, writer)
+            finally:
+                self.running -= 1
+            return
+
+        writer.close()
+
+
+    async def __reject(self, writer: asyncio.StreamWriter, reason: str) -> None:
+        """ エンコードの依頼を断る """
+        writer.write(json.dumps({'result': 'rejected', 'reason': reason}).encode('utf-8') + b'\n')
+        await writer.drain()
+        writer.close()
+
+
+    def __buildOptions(self, request: dict[str, Any]) -> tuple[list[str], list[str]]:
+        """
+        エンコードの依頼に含まれるパラメーターから、tsreadex とエンコーダーに渡すオプションを LiveEncodingTask と同じ方法で組み立てる
+        依頼元から渡されたコマンドライン引数をそのまま実行すると、任意のファイルの読み書きなどができてしまうため、必ずこのノード自身で組み立てる
+
+        Args:
+            request (dict[str, Any]): エンコードの依頼
+
+        Returns:
+            tuple[list[str], list[str]]: tsreadex に渡すオプションと、エンコーダーに渡すオプション
+
+        Raises:
+            KeyError | TypeError | ValueError: パラメーターが不足しているか、不正な値の場合
+        """
+
+        # LiveEncodingTask は KonomiTV サーバー側でこのモジュールをインポートしているため、循環参照にならないようここでインポートする
+        from app.tasks.LiveEncodingTask import LiveEncodingTask
+
+        encoder_type = request['encoder_type']
+        quality = request['quality']
+        service_id = request['service_id']
+        retry_count = request['retry_count']
+        is_fullhd_channel = request['is_fullhd_channel']
+        is_sphd_channel = request['is_sphd_channel']
+        is_radiochannel = request['is_radiochannel']
+        if quality not in QUALITY or QUALITY[quality].is_passthrough is True:
+            raise ValueError(f'unsupported quality: {quality}')
+        ## サービス ID の -1 は、tsreadex で最初のサービスを選ぶことを表す (テスト用)
+        if type(service_id) is not int or not (-1 <= service_id <= 0xFFFF):
+            raise ValueError(f'invalid service_id: {service_id}')
+        if type(retry_count) is not int or not (0 <= retry_count <= 10):
+            raise ValueError(f'invalid retry_count: {retry_count}')
+        if type(is_fullhd_channel) is not bool or type(is_sphd_channel) is not bool or type(is_radiochannel) is not bool:
+            raise TypeError('channel flags must be bool')
+        if is_radiochannel is True and encoder_type != 'FFmpeg':
+            raise ValueError('radio channels must be encoded with FFmpeg')
+
+        task = LiveEncodingTask.forEncoderNode(retry_count)
+        tsreadex_options = task.buildTsreadexOptions(service_id)
+        if encoder_type == 'FFmpeg':
+            if is_radiochannel is True:
+                encoder_options = task.buildFFmpegOptionsForRadio()
+            else:
+                encoder_options = task.buildFFmpegOptions(quality, is_fullhd_channel, is_sphd_channel)
+        else:
+            encoder_options = task.buildHWEncCOptions(quality, encoder_type, is_fullhd_channel, is_sphd_channel)
+
+        return tsreadex_options, encoder_options
+
+
+    async def __encode(self,
+        request: dict[str, Any],
+        tsreadex_options: list[str],
+        encoder_options: list[str],
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ) -> None:
+        """ tsreadex とエンコーダーを起動し、受信した放送波 TS をエンコードして返す """
+
+        livestream_id = str(request.get('livestream_id'))
+        encoder_type: str = request['encoder_type']
+        Logging.info(f'[Live: {livestream_id}] Encoding with {encoder_type} ({self.running}/{self.capacity})')
+        Logging.info(f'[Live: {livestream_id}] {encoder_type} Commands:\n{encoder_type} {" ".join(encoder_options)}')
+
+        # tsreadex とエンコーダーを起動する (LiveEncodingTask と同じく、tsreadex の出力をパイプでエンコーダーに繋ぐ)
+        tsreadex_read_pipe, tsreadex_write_pipe = os.pipe()
+        tsreadex = await asyncio.subprocess.create_subprocess_exec(
+            *[LIBRARY_PATH['tsreadex'], *tsreadex_options],
+            stdin = asyncio.subprocess.PIPE,
+            stdout = tsreadex_write_pipe,
+        )
+        os.close(tsreadex_write_pipe)
+        encoder = await asyncio.subprocess.create_subprocess_exec(
+            *[LIBRARY_PATH[encoder_type], *encoder_options],
+            stdin = tsreadex_read_pipe,
+            stdout = asyncio.subprocess.PIPE,
+            stderr = asyncio.subprocess.PIPE,
+        )
+        os.close(tsreadex_read_pipe)
+
+        writer.write(json.dumps({'result': 'accepted'}).encode('utf-8') + b'\n')
+        await writer.drain()
+
+        # KonomiTV サーバーから受信した放送波 TS を tsreadex の標準入力に書き込む
+        async def Input():
+            assert tsreadex.stdin is not None
+            try:
+                while True:
+                    frame_type, length = EncoderNodeUtil.FRAME_HEADER.unpack(await reader.readexactly(EncoderNodeUtil.FRAME_HEADER.size))
+                    payload = await reader.readexactly(length) if length > 0 else b''
+                    if frame_type == EncoderNodeUtil.FRAME_INPUT:
+                        tsreadex.stdin.write(payload)
+                        await tsreadex.stdin.drain()
+                    elif frame_type == EncoderNodeUtil.FRAME_INPUT_END:
+                        tsreadex.stdin.close()
+                        return
+            except (asyncio.IncompleteReadError, ConnectionError, BrokenPipeError):
+                pass
+            # KonomiTV サーバーとの接続が切断されたら、tsreadex とエンコーダーを終了する
+            for process in (tsreadex, encoder):
+                try:
+                    process.kill()
+                except ProcessLookupError:
+                    pass
+
+        # エンコーダーの標準出力・標準エラー出力を KonomiTV サーバーに送信する
+        async def Output(stream: asyncio.StreamReader, frame_type: int):
+            try:
+                while True:
+                    chunk = await stream.read(65536)
+                    if chunk == b'':
+                        break
+                    writer.write(EncoderNodeUtil.encodeFrame(frame_type, chunk))
+                    await writer.drain()
+            except ConnectionError:
+                pass
+
+        input_task = asyncio.create_task(Input())
+        assert encoder.stdout is not None and encoder.stderr is not None
+        await asyncio.gather(Output(encoder.stdout, EncoderNodeUtil.FRAME_STDOUT), Output(encoder.stderr, EncoderNodeUtil.FRAME_STDERR))
+
+        # エンコーダーの終了を待ち、終了コードを送信して接続を閉じる
+        returncode = await encoder.wait()
+        try:
+            tsreadex.kill()
+        except ProcessLookupError:
+            pass
+        input_task.cancel()
+        try:
+            writer.write(EncoderNodeUtil.encodeFrame(EncoderNodeUtil.FRAME_EXIT, struct.pack('>i', returncode)))
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+        Logging.info(f'[Live: {livestream_id}] Encoding finished. (returncode: {returncode})')
@@ -0,0 +1,222 @@
+# Type Hints を指定できるように
+# ref: https://stackoverflow.com/a/33533514/17124142
+from __future__ import annotations
+
+from typing import ClassVar
+
+
+class GOPCache:
+    """
+    ライブストリームに書き込まれた MPEG-TS のうち、直近のキーフレーム (IDR フレーム) 以降のデータと最新の PAT・PMT を保持するクラス
+    ONAir のライブストリームに新しく接続した mpegts クライアントに、キャッシュしたデータを先に送ることで、
+    次のキーフレームが来るまで (最大で GOP 長) 待たずに映像を表示できるようにする
+    """
+
+    # TS パケットのサイズ
+    TS_PACKET_SIZE = 188
+
+    # キャッシュするデータの最大サイズ (バイト)
+    ## 通常は1 GOP 分 (H.264 で 1080p-60fps でも 2MB 程度) しか溜まらないが、キーフレームが検出できないストリームで
+    ## メモリを使い続けないよう、上限を超えたら次のキーフレームまでキャッシュを破棄する
+    MAX_SIZE = 8 * 1024 * 1024
+
+    # 映像ストリームの stream_type (MPEG-2 Video・H.264・H.265)
+    VIDEO_STREAM_TYPES: ClassVar[frozenset[int]] = frozenset([0x02, 0x1b, 0x24])
+
+    # キーフレームの先頭に置かれるヘッダーの開始コード (stream_type ごと)
+    ## エンコーダーがアダプテーションフィールドの random_access_indicator を立てていない場合 (無変換で放送波をそのまま配信する場合など) に、
+    ## PES の先頭パケットにこれらが含まれているかでキーフレームを判定する
+    ## MPEG-2 Video: シーケンスヘッダー / H.264: SPS / H.265: VPS
+    KEYFRAME_START_CODES: ClassVar[dict[int, tuple[bytes, ...]]] = {
+        0x02: (b'\x00\x00\x01\xb3',),
+        0x1b: (b'\x00\x00\x01\x67', b'\x00\x00\x01\x27', b'\x00\x00\x01\x47'),
+        0x24: (b'\x00\x00\x01\x40\x01',),
+    }
+
+
+    def __init__(self) -> None:
+        """
+        GOP キャッシュを初期化する
+        """
+
+        # PMT の PID と、映像ストリームの PID・stream_type
+        self.__pmt_pid: int | None = None
+        self.__video_pid: int | None = None
+        self.__video_stream_type: int | None = None
+
+        # 最新の PAT・PMT の TS パケット
+        self.__pat_packet: bytes | None = None
+        self.__pmt_packet: bytes | None = None
+
+        # 直近のキーフレーム以降のチャンクのリスト (キーフレームが見つかるまでは None)
+        ## ライブストリームに書き込まれたチャンクをそのまま参照するため、キーフレームを含むチャンク以外はコピーしない
+        self.__chunks: list[bytes] | None = None
+        self.__size: int = 0
+
+
+    def reset(self) -> None:
+        """
+        キャッシュを破棄する (エンコードタスクの再起動時などに、異なるストリームのデータが混ざらないようにするため)
+        """
+
+        self.__init__()
+
+
+    def push(self, chunk: bytes) -> int | None:
+        """
+        ライブストリームに書き込まれたチャンクを追加する
+        チャンクは TS パケット (188 バイト) の境界で区切られている必要がある
+
+        Args:
+            chunk (bytes): ライブストリームに書き込まれたチャンク
+
+        Returns:
+            int | None: チャンク内で最後に見つかったキーフレームの TS パケットの位置 (見つからなかった場合は None)
+        """
+
+        # チャンク内で最後に見つかったキーフレームの TS パケットの位置
+        keyframe_position: int | None = None
+
+        video_pid = self.__video_pid
+        for position in range(0, len(chunk) - self.TS_PACKET_SIZE + 1, self.TS_PACKET_SIZE):
+
+            # payload_unit_start_indicator が立っていないパケットは、PES やセクションの途中なので見る必要がない
+            if chunk[position] != 0x47 or (chunk[position + 1] & 0x40) == 0:
+                continue
+            pid = ((chunk[position + 1] & 0x1f) << 8) | chunk[position + 2]
+
+            if pid == video_pid:
+                if self.__isKeyframePacket(chunk, position):
+                    keyframe_position = position
+            elif pid == 0x0000:
+                self.__pat_packet = chunk[position:position + self.TS_PACKET_SIZE]
+                self.__parsePAT(self.__pat_packet)
+            elif pid == self.__pmt_pid:
+                self.__pmt_packet = chunk[position:position + self.TS_PACKET_SIZE]
+                self.__parsePMT(self.__pmt_packet)
+                video_pid = self.__video_pid
+
+        # キーフレームが見つかったら、キーフレーム以降のデータでキャッシュを置き換える
+        if keyframe_position is not None:
+            keyframe_chunk = chunk[keyframe_position:] if keyframe_position > 0 else chunk
+            self.__chunks = [keyframe_chunk]
+            self.__size = len(keyframe_chunk)
+
+        # キーフレームが見つかっていれば、チャンクをそのままキャッシュに追加する
+        elif self.__chunks is not None:
+            self.__chunks.append(chunk)
+            self.__size += len(chunk)
+
+            # 上限を超えたら、次のキーフレームが見つかるまでキャッシュを破棄する
+            if self.__size > self.MAX_SIZE:
+                self.__chunks = None
+                self.__size = 0
+
+        return keyframe_position
+
+
+    def getData(self) -> bytes | None:
+        """
+        新しく接続したクライアントに最初に送るデータ (PAT・PMT・直近のキーフレーム以降のデータ) を取得する
+
+        Returns:
+            bytes | None: 送るデータ (まだキーフレームや PAT・PMT が見つかっていない場合は None)
+        """
+
+        if self.__chunks is None or self.__pat_packet is None or self.__pmt_packet is None:
+            return None
+        return b''.join([self.__pat_packet, self.__pmt_packet, *self.__chunks])
+
+
+    def getPSI(self) -> bytes | None:
+        """
+        最新の PAT・PMT の TS パケットを取得する
+        ストリームの途中から再生を始めるクライアントに、データの前に送るために使う
+
+        Returns:
+            bytes | None: PAT と PMT の TS パケットを連結したデータ (まだ PAT・PMT が見つかっていない場合は None)
+        """
+
+        if self.__pat_packet is None or self.__pmt_packet is None:
+            return None
+        return self.__pat_packet + self.__pmt_packet
+
+
+    def getSize(self) -> int:
+        """
+        キャッシュしているデータのサイズを取得する
+
+        Returns:
+            int: キャッシュしているデータのサイズ (バイト)
+        """
+
+        return self.__size
+
+
+    def __isKeyframePacket(self, chunk: bytes, position: int) -> bool:
+        """
+        映像ストリームの PES の先頭パケットがキーフレームかどうかを判定する
+
+        Args:
+            chunk (bytes): チャンク
+            position (int): TS パケットの位置
+
+        Returns:
+            bool: キーフレームかどうか
+        """
+
+        # アダプテーションフィールドの random_access_indicator が立っていればキーフレーム
+        adaptation_field_control = (chunk[position + 3] >> 4) & 0x03
+        payload_start = position + 4
+        if adaptation_field_control & 0x02:
+            adaptation_field_length = chunk[position + 4]
+            if adaptation_field_length > 0 and (chunk[position + 5] & 0x40):
+                return True
+            payload_start += 1 + adaptation_field_length
+
+        # random_access_indicator が立っていない場合は、PES の先頭パケットにキーフレームのヘッダーが含まれているかで判定する
+        start_codes = self.KEYFRAME_START_CODES.get(self.__video_stream_type or 0, ())
+        payload = chunk[payload_start:position + self.TS_PACKET_SIZE]
+        return any(start_code in payload for start_code in start_codes)
+
+
+    def __parsePAT(self, packet: bytes) -> None:
+        """
+        PAT から最初の番組の PMT の PID を取得する
+
+        Args:
+            packet (bytes): PAT の TS パケット
+        """
+
+        section = packet[5 + packet[4]:]
+        if len(section) < 12 or section[0] != 0x00:
+            return
+        section_end = min(3 + (((section[1] & 0x0f) << 8) | section[2]) - 4, len(section))
+        for position in range(8, section_end - 3, 4):
+            program_number = (section[position] << 8) | section[position + 1]
+            if program_number != 0:
+                self.__pmt_pid = ((section[position + 2] & 0x1f) << 8) | section[position + 3]
+                return
+
+
+    def __parsePMT(self, packet: bytes) -> None:
+        """
+        PMT から映像ストリームの PID と stream_type を取得する
+
+        Args:
+            packet (bytes): PMT の TS パケット
+        """
+
+        section = packet[5 + packet[4]:]
+        if len(section) < 16 or section[0] != 0x02:
+            return
+        section_end = min(3 + (((section[1] & 0x0f) << 8) | section[2]) - 4, len(section))
+        position = 12 + (((section[10] & 0x0f) << 8) | section[11])
+        while position + 5 <= section_end:
+            stream_type = section[position]
+            elementary_pid = ((section[position + 1] & 0x1f) << 8) | section[position + 2]
+            if stream_type in self.VIDEO_STREAM_TYPES:
+                self.__video_pid = elementary_pid
+                self.__video_stream_type = stream_type
+                return
+            position += 5 + (((section[position + 3] & 0x0f) << 8) | section[position + 4])
@@ -20,6 +20,7 @@ from typing import cast
 
 from app.constants import CONFIG
 from app.utils import Logging
+from app.utils.Metrics import Metrics
 
 from biim.mpeg2ts import ts
 from biim.mpeg2ts.pat import PATSection
@@ -137,6 +138,10 @@ class HLSLiveSegmenter:
         # 部分セグメントの開始 PTS (Packet Time Stamp) (のはず…)
         self._partial_begin_timestamp: int | None = None
 
+        # 直前の部分セグメント・セグメントが生成された時刻 (メトリクスの記録用)
+        self._last_partial_monotonic_time: float | None = None
+        self._last_segment_monotonic_time: float | None = None
+
 
     async def getPlaylist(self, msn: int | None, part: int | None, secondary_audio: bool = False) -> Response:
         """
@@ -423,12 +428,14 @@ class HLSLiveSegmenter:
                     self._partial_begin_timestamp = begin_timestamp
                     self._primary_audio_m3u8.continuousSegment(self._partial_begin_timestamp, True, begin_program_date_time)
                     self._secondary_audio_m3u8.continuousSegment(self._partial_begin_timestamp, True, begin_program_date_time)
+                    self._recordPartial(is_segment=True)
                 elif self._partial_begin_timestamp is not None:
                     PART_DIFF = begin_timestamp - self._partial_begin_timestamp
                     if self.PART_DURATION * ts.HZ <= PART_DIFF:
                         self._partial_begin_timestamp = int(begin_timestamp - max(0, PART_DIFF - self.PART_DURATION * ts.HZ))
                         self._primary_audio_m3u8.continuousPartial(self._partial_begin_timestamp)
                         self._secondary_audio_m3u8.continuousPartial(self._partial_begin_timestamp)
+                        self._recordPartial(is_segment=False)
 
                 while self._emsg_fragments:
                     data = self._emsg_fragments.popleft()
@@ -555,12 +562,14 @@ class HLSLiveSegmenter:
                     self._partial_begin_timestamp = begin_timestamp
                     self._primary_audio_m3u8.continuousSegment(self._partial_begin_timestamp, True, begin_program_date_time)
                     self._secondary_audio_m3u8.continuousSegment(self._partial_begin_timestamp, True, begin_program_date_time)
+                    self._recordPartial(is_segment=True)
                 elif self._partial_begin_timestamp is not None:
                     PART_DIFF = begin_timestamp - self._partial_begin_timestamp
                     if self.PART_DURATION * ts.HZ <= PART_DIFF:
                         self._partial_begin_timestamp = int(begin_timestamp - max(0, PART_DIFF - self.PART_DURATION * ts.HZ))
                         self._primary_audio_m3u8.continuousPartial(self._partial_begin_timestamp)
                         self._secondary_audio_m3u8.continuousPartial(self._partial_begin_timestamp)
+                        self._recordPartial(is_segment=False)
 
                 while self._emsg_fragments:
                     data = self._emsg_fragments.popleft()
@@ -715,6 +724,27 @@ class HLSLiveSegmenter:
             self._LATEST_PCR_VALUE = PCR_VALUE
 
 
+    def _recordPartial(self, is_segment: bool) -> None:
+        """
+        部分セグメント・セグメントの生成をメトリクスに記録する
+
+        Args:
+            is_segment (bool): 新しいセグメントの開始 (IDR フレーム) かどうか
+        """
+
+        now = time.monotonic()
+        Metrics.SEGMENTER_PARTS.inc()
+        if self._last_partial_monotonic_time is not None:
+            Metrics.SEGMENTER_PART_INTERVAL.observe(value=now - self._last_partial_monotonic_time)
+        self._last_partial_monotonic_time = now
+
+        if is_segment is True:
+            Metrics.SEGMENTER_SEGMENTS.inc()
+            if self._last_segment_monotonic_time is not None:
+                Metrics.SEGMENTER_SEGMENT_INTERVAL.observe(value=now - self._last_segment_monotonic_time)
+            self._last_segment_monotonic_time = now
+
+
     def destroy(self) -> None:
         """
         インスタンス変数をすべて破棄し、メモリを解放する
@@ -8,15 +8,30 @@ import html
 import json
 import re
 import requests
+import time
+import weakref
 import xml.etree.ElementTree as ET
 from typing import Any, cast, ClassVar
 
-from app.constants import API_REQUEST_HEADERS, JIKKYO_CHANNELS_PATH, NICONICO_OAUTH_CLIENT_ID
+from app.constants import API_REQUEST_HEADERS, JIKKYO_CHANNELS_PATH, NICONICO_API_URL_OVERRIDE, NICONICO_OAUTH_CLIENT_ID
 from app.models import User
+from app.utils.UserCache import UserCache
 
 
 class Jikkyo:
 
+    # ニコニコの各 API のベース URL
+    ## NICONICO_API_URL_OVERRIDE が指定されている場合は、すべての API のリクエストをダミーのニコニコ API に送る
+    NICONICO_LIVE_URL = NICONICO_API_URL_OVERRIDE or 'https://live.nicovideo.jp'
+    NICONICO_LIVE_API_URL = NICONICO_API_URL_OVERRIDE or 'https://api.live2.nicovideo.jp'
+    NICONICO_OAUTH_URL = NICONICO_API_URL_OVERRIDE or 'https://oauth.nicovideo.jp'
+    NICONICO_NVAPI_URL = NICONICO_API_URL_OVERRIDE or 'https://nvapi.nicovideo.jp'
+
+    # ニコ生の視聴ページから取得した番組情報をキャッシュする時間 (秒)
+    ## 同じチャンネルを複数のクライアントで同時に開いたときに、重い視聴ページへのリクエストを一度で済ませるためのもの
+    ## 番組が切り替わってからキャッシュが切れるまでは、前の番組の情報が返る点に注意
+    WATCH_PAGE_CACHE_TTL = 5
+
     # 実況 ID とサービス ID (SID)・ネットワーク ID (NID) の対照表
     ## NicoJK の jkch.sh.txt (https://github.com/xtne6f/NicoJK/blob/master/jkch.sh.txt) を情報を更新の上で JSON に変換したもの
     with open(JIKKYO_CHANNELS_PATH, encoding='utf-8') as file:
@@ -26,6 +41,33 @@ class Jikkyo:
     ## getchannels API のリクエスト結果をキャッシュする
     jikkyo_channels_status: ClassVar[dict[str, dict[str, int]]] = {}
 
+    # getchannels API のレスポンスの ETag と Last-Modified
+    ## 次のリクエストで条件付きリクエストを行い、ステータスが変わっていなければ 304 Not Modified を返してもらう
+    __getchannels_etag: ClassVar[str | None] = None
+    __getchannels_last_modified: ClassVar[str | None] = None
+
+    # jikkyo_channels から作成した、(NID, SID) をキーとした実況 ID の対照表
+    ## 値は jikkyo_channels での定義順と実況 ID のタプルで、複数の定義に一致する場合は先に定義されている方を使う
+    ## 初回参照時に一度だけ作成する
+    __jikkyo_ids: ClassVar[dict[tuple[int, int], tuple[int, str]] | None] = None
+
+    # jikkyo_channels から作成した、地上波の SID をキーとした実況 ID の対照表
+    ## jikkyo_channels.json 記載の地上波の NID はなぜか 15 で固定なので、地上波はサービス ID のみで特定する
+    __terrestrial_jikkyo_ids: ClassVar[dict[int, tuple[int, str]]] = {}
+
+    # ニコ生上の実況チャンネル/コミュニティ ID をキーとした、視聴ページから取得した番組情報 (またはエラーメッセージ) と、
+    # 取得した時刻 (単調増加時間) のタプルの辞書
+    __watch_page_cache: ClassVar[dict[str, tuple[float, dict[str, bool | str]]]] = {}
+
+    # ニコ生上の実況チャンネル/コミュニティ ID をキーとした、実行中の視聴ページの取得タスクの辞書
+    ## 同じチャンネルの視聴ページを同時に取得しようとした場合は、後から来た方は実行中のタスクの結果を待つ
+    __watch_page_tasks: ClassVar[dict[str, asyncio.Task[dict[str, bool | str]]]] = {}
+
+    # ユーザー ID をキーとした、アクセストークンの更新を直列化するためのロックの辞書
+    ## 同じユーザーのアクセストークンを同時に更新すると、先に更新された方でリフレッシュトークンが無効になり、後の更新が失敗してしまう
+    ## ロックを待っているリクエストがなくなったら自動的に破棄されるよう、弱参照で保持する
+    __refresh_locks: ClassVar[weakref.WeakValueDictionary[int, asyncio.Lock]] = weakref.WeakValueDictionary()
+
     # 実況 ID と実況チャンネル/コミュニティ ID の対照表
     jikkyo_nicolive_id_table: ClassVar[dict[str, dict[str, str]]] = {
         'jk1': {'type': 'channel', 'id': 'ch2646436', 'name': 'NHK総合'},
@@ -80,59 +122,7 @@ class Jikkyo:
         self.jikkyo_nicolive_id: str | None
 
         # 実況 ID を取得する
-        for jikkyo_channel in Jikkyo.jikkyo_channels:
-
-            # マッチ条件が複雑すぎるので、絞り込みのための関数を定義する
-            def match() -> bool:
-
-                # jikkyo_channels.json に定義されている NID と SID
-                jikkyo_network_id = jikkyo_channel['network_id']
-                jikkyo_service_id = int(jikkyo_channel['service_id'], 0)  # 16進数の文字列を数値に変換
-
-                # NID と SID が一致する
-                # BS・CS の場合はこれだけで OK
-                if self.network_id == jikkyo_network_id and self.service_id == jikkyo_service_id:
-                    return True
-
-                # NID が地上波の ID 範囲 (0x7880 ～ 0x7fef) で、かつ jikkyo_channels.json 記載の NID が 15（地上波）であれば
-                # jikkyo_channels.json 記載の地上波の NID はなぜか 15 で固定なので、地上波で絞り込めたら後はサービス ID のみで特定する
-                if 0x7880 <= self.network_id <= 0x7fef and jikkyo_network_id == 15:
-
-                    # サービス ID が一致する
-                    if self.service_id == jikkyo_service_id:
-                        return True
-
-                    # サブチャンネル用で、jikkyo_channels.json にはサブチャンネルは定義されていないため必要
-                    # 地上波の場合はサービス ID は別チャンネルと隣合わせにならないようになっているはず
-                    # 地上波のサブチャンネルはおそらく最大3つなのでこれでカバーしきれるはず
-
-                    # 1つ前のサービス ID なら一致する
-                    # たとえば SID が 1025 (NHK総合2・東京) の場合、1つ前の 1024 (NHK総合1・東京) であれば定義があるので一致する
-                    if self.service_id - 1 == jikkyo_service_id:
-                        return True
-
-                    # 2つ前のサービス ID なら一致する
-                    # たとえば SID が 1034 (NHKEテレ3東京) の場合、2つ前の 1032 (NHKEテレ1東京) であれば定義があるので一致する
-                    if self.service_id - 2 == jikkyo_service_id:
-                        return True
-
-                # ここまでの条件に一致しなかったら False を返す
-                # CATV・SKY・STARDIGIO は実況チャンネル/コミュニティ自体が存在しない
-                return False
-
-            # 上記の条件に一致する場合のみ
-            if match():
-
-                # 実況 ID が -1 なら jk0 に
-                if jikkyo_channel['jikkyo_id'] == -1:
-                    self.jikkyo_id = 'jk0'
-                else:
-                    self.jikkyo_id = 'jk' + str(jikkyo_channel['jikkyo_id'])
-                break
-
-        # この時点で実況 ID を設定できていないなら (jikkyo_channels.json に未定義のチャンネル) jk0 を設定する
-        if hasattr(self, 'jikkyo_id') is False:
-            self.jikkyo_id = 'jk0'
+        self.jikkyo_id = Jikkyo.getJikkyoID(self.network_id, self.service_id)
 
         # ニコ生上の実況チャンネル/コミュニティ ID を取得する
         if self.jikkyo_id != 'jk0':
@@ -146,94 +136,218 @@ class Jikkyo:
             self.jikkyo_nicolive_id = None
 
 
+    @classmethod
+    def getJikkyoID(cls, network_id: int, service_id: int) -> str:
+        """
+        NID と SID から実況 ID を取得する
+
+        Args:
+            network_id (int): ネットワーク ID
+            service_id (int): サービス ID
+
+        Returns:
+            str: 実況 ID (実況チャンネル/コミュニティが存在しない場合は jk0)
+        """
+
+        # 初回のみ、jikkyo_channels から対照表を作成する
+        if cls.__jikkyo_ids is None:
+            jikkyo_ids: dict[tuple[int, int], tuple[int, str]] = {}
+            for index, jikkyo_channel in enumerate(cls.jikkyo_channels):
+                jikkyo_network_id = jikkyo_channel['network_id']
+                jikkyo_service_id = int(jikkyo_channel['service_id'], 0)  # 16進数の文字列を数値に変換
+                # 実況 ID が -1 なら jk0 に
+                jikkyo_id = 'jk0' if jikkyo_channel['jikkyo_id'] == -1 else 'jk' + str(jikkyo_channel['jikkyo_id'])
+                jikkyo_ids.setdefault((jikkyo_network_id, jikkyo_service_id), (index, jikkyo_id))
+                if jikkyo_network_id == 15:
+                    cls.__terrestrial_jikkyo_ids.setdefault(jikkyo_service_id, (index, jikkyo_id))
+            cls.__jikkyo_ids = jikkyo_ids
+
+        # NID と SID が一致する
+        # BS・CS の場合はこれだけで OK
+        candidates = [cls.__jikkyo_ids.get((network_id, service_id))]
+
+        # NID が地上波の ID 範囲 (0x7880 ～ 0x7fef) であれば、サービス ID のみで特定する
+        if 0x7880 <= network_id <= 0x7fef:
+            candidates.append(cls.__terrestrial_jikkyo_ids.get(service_id))
+
+            # サブチャンネル用で、jikkyo_channels.json にはサブチャンネルは定義されていないため必要
+            # 地上波の場合はサービス ID は別チャンネルと隣合わせにならないようになっているはず
+            # 地上波のサブチャンネルはおそらく最大3つなのでこれでカバーしきれるはず
+            ## たとえば SID が 1025 (NHK総合2・東京) の場合、1つ前の 1024 (NHK総合1・東京) であれば定義があるので一致する
+            ## たとえば SID が 1034 (NHKEテレ3東京) の場合、2つ前の 1032 (NHKEテレ1東京) であれば定義があるので一致する
+            candidates.append(cls.__terrestrial_jikkyo_ids.get(service_id - 1))
+            candidates.append(cls.__terrestrial_jikkyo_ids.get(service_id - 2))
+
+        # 一致した定義のうち、jikkyo_channels で先に定義されている方の実況 ID を返す
+        # どれにも一致しなければ (jikkyo_channels.json に未定義のチャンネル) jk0 を返す
+        ## CATV・SKY・STARDIGIO は実況チャンネル/コミュニティ自体が存在しない
+        matched = [candidate for candidate in candidates if candidate is not None]
+        if len(matched) == 0:
+            return 'jk0'
+        return min(matched)[1]
+
+
+    @classmethod
+    def getForce(cls, network_id: int, service_id: int) -> int | None:
+        """
+        NID と SID から、メモリ上に保持している最新の実況勢いを取得する (ステータス更新は updateStatus() で行う)
+
+        Args:
+            network_id (int): ネットワーク ID
+            service_id (int): サービス ID
+
+        Returns:
+            int | None: 実況勢い (実況チャンネル/コミュニティが存在しないか、ステータスがまだ取得できていない場合は None)
+        """
+
+        status = cls.jikkyo_channels_status.get(cls.getJikkyoID(network_id, service_id))
+        if status is None or status['force'] == -1:
+            return None
+        return status['force']
+
+
     async def refreshNiconicoAccessToken(self, current_user: User) -> None:
         """
         指定されたユーザーに紐づくニコニコアカウントのアクセストークンを、リフレッシュトークンで更新する
+        同じユーザーのアクセストークンの更新は直列化され、更新を待っている間に他のリクエストで更新された場合は、更新後のアクセストークンを使う
 
         Args:
             user (User): ログイン中のユーザーのモデルオブジェクト
         """
 
-        try:
+        # 更新しようとしている (有効期限が切れた) アクセストークン
+        expired_access_token = current_user.niconico_access_token
+
+        # 同じユーザーのアクセストークンの更新が終わるまで待つ
+        lock = self.__refresh_locks.get(current_user.id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self.__refresh_locks[current_user.id] = lock
+        async with lock:
+
+            # 待っている間に他のリクエストでアクセストークンが更新されていれば、データベースから更新後のアクセストークンを取得して使う
+            ## 同じリフレッシュトークンで再度更新しようとすると、既に無効になっているため失敗する
+            await current_user.refresh_from_db(fields=[
+                'niconico_user_name',
+                'niconico_user_premium',
+                'niconico_access_token',
+                'niconico_refresh_token',
+            ])
+            if current_user.niconico_access_token != expired_access_token:
+                return
 
-            # リフレッシュトークンを使い、ニコニコ OAuth のアクセストークンとリフレッシュトークンを更新
-            from app.utils import Interlaced
-            token_api_url = 'https://oauth.nicovideo.jp/oauth2/token'
-            token_api_response = await asyncio.to_thread(
-                requests.post,
-                url = token_api_url,
-                data = {
-                    'grant_type': 'refresh_token',
-                    'client_id': NICONICO_OAUTH_CLIENT_ID,
-                    'client_secret': Interlaced(3),
-                    'refresh_token': current_user.niconico_refresh_token,
-                },
-                headers = {**API_REQUEST_HEADERS, 'Content-Type': 'application/x-www-form-urlencoded'},
-                timeout = 3,  # 3秒応答がなかったらタイムアウト
-            )
-
-            # ステータスコードが 200 以外
-            if token_api_response.status_code != 200:
-                error_code = ''
-                try:
-                    error_code = f' ({token_api_response.json()["error"]})'
-                except requests.JSONDecodeError:
-                    pass
-                raise Exception(f'アクセストークンの更新に失敗しました。(HTTP Error {token_api_response.status_code}{error_code})')
-
-            token_api_response_json = token_api_response.json()
-
-        # 接続エラー（サーバーメンテナンスやタイムアウトなど）
-        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
-            raise Exception('アクセストークンの更新リクエストがタイムアウトしました。')
+            try:
 
-        # 取得したアクセストークンとリフレッシュトークンをユーザーアカウントに設定
-        ## 仕様上リフレッシュトークンに有効期限はないが、一応このタイミングでリフレッシュトークンも更新することが推奨されている
-        current_user.niconico_access_token = str(token_api_response_json['access_token'])
-        current_user.niconico_refresh_token = str(token_api_response_json['refresh_token'])
+                # リフレッシュトークンを使い、ニコニコ OAuth のアクセストークンとリフレッシュトークンを更新
+                from app.utils import Interlaced
+                token_api_url = f'{self.NICONICO_OAUTH_URL}/oauth2/token'
+                token_api_response = await asyncio.to_thread(
+                    requests.post,
+                    url = token_api_url,
+                    data = {
+                        'grant_type': 'refresh_token',
+                        'client_id': NICONICO_OAUTH_CLIENT_ID,
+                        'client_secret': Interlaced(3),
+                        'refresh_token': current_user.niconico_refresh_token,
+                    },
+                    headers = {**API_REQUEST_HEADERS, 'Content-Type': 'application/x-www-form-urlencoded'},
+                    timeout = 3,  # 3秒応答がなかったらタイムアウト
+                )
 
-        try:
+                # ステータスコードが 200 以外
+                if token_api_response.status_code != 200:
+                    error_code = ''
+                    try:
+                        error_code = f' ({token_api_response.json()["error"]})'
+                    except requests.JSONDecodeError:
+                        pass
+                    raise Exception(f'アクセストークンの更新に失敗しました。(HTTP Error {token_api_response.status_code}{error_code})')
+
+                token_api_response_json = token_api_response.json()
 
-            # ついでなので、このタイミングでユーザー情報を取得し直す
-            ## 頻繁に変わるものでもないとは思うけど、一応再ログインせずとも同期されるようにしておきたい
-            ## 3秒応答がなかったらタイムアウト
-            user_api_url = f'https://nvapi.nicovideo.jp/v1/users/{current_user.niconico_user_id}'
-            user_api_headers = {**API_REQUEST_HEADERS, 'X-Frontend-Id': '6'}  # X-Frontend-Id がないと INVALID_PARAMETER になる
-            user_api_response = await asyncio.to_thread(requests.get, user_api_url, headers=user_api_headers, timeout=3)
+            # 接続エラー（サーバーメンテナンスやタイムアウトなど）
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                raise Exception('アクセストークンの更新リクエストがタイムアウトしました。')
 
-            if user_api_response.status_code == 200:
-                # ユーザー名
-                current_user.niconico_user_name = str(user_api_response.json()['data']['user']['nickname'])
-                # プレミアム会員かどうか
-                current_user.niconico_user_premium = bool(user_api_response.json()['data']['user']['isPremium'])
+            # 取得したアクセストークンとリフレッシュトークンをユーザーアカウントに設定
+            ## 仕様上リフレッシュトークンに有効期限はないが、一応このタイミングでリフレッシュトークンも更新することが推奨されている
+            current_user.niconico_access_token = str(token_api_response_json['access_token'])
+            current_user.niconico_refresh_token = str(token_api_response_json['refresh_token'])
 
-        # 接続エラー（サーバー再起動やタイムアウトなど）
-        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
-            pass  # 取れなくてもセッション取得に支障はないのでパス
+            try:
 
-        # 変更をデータベースに保存
-        await current_user.save()
+                # ついでなので、このタイミングでユーザー情報を取得し直す
+                ## 頻繁に変わるものでもないとは思うけど、一応再ログインせずとも同期されるようにしておきたい
+                ## 3秒応答がなかったらタイムアウト
+                user_api_url = f'{self.NICONICO_NVAPI_URL}/v1/users/{current_user.niconico_user_id}'
+                user_api_headers = {**API_REQUEST_HEADERS, 'X-Frontend-Id': '6'}  # X-Frontend-Id がないと INVALID_PARAMETER になる
+                user_api_response = await asyncio.to_thread(requests.get, user_api_url, headers=user_api_headers, timeout=3)
 
+                if user_api_response.status_code == 200:
+                    # ユーザー名
+                    current_user.niconico_user_name = str(user_api_response.json()['data']['user']['nickname'])
+                    # プレミアム会員かどうか
+                    current_user.niconico_user_premium = bool(user_api_response.json()['data']['user']['isPremium'])
 
-    async def fetchJikkyoSession(self, current_user: User | None = None) -> dict[str, bool | str]:
+            # 接続エラー（サーバー再起動やタイムアウトなど）
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                pass  # 取れなくてもセッション取得に支障はないのでパス
+
+            # 変更をデータベースに保存
+            await current_user.save()
+            UserCache.invalidate(current_user.id)
+
+
+    @classmethod
+    async def getWatchPageInfo(cls, jikkyo_nicolive_id: str) -> dict[str, bool | str]:
         """
-        ニコニコ実況（ニコ生）の視聴セッション情報を取得する
+        ニコ生の視聴ページから、現在放送中の番組の番組 ID と (ログインなしの) 視聴セッションの WebSocket URL を取得する
+        取得結果は WATCH_PAGE_CACHE_TTL 秒間キャッシュし、同じチャンネルの視聴ページを同時に取得しようとした場合は1回のリクエストにまとめる
 
         Args:
-            current_user (User | None): ログイン中のユーザーのモデルオブジェクト or None
+            jikkyo_nicolive_id (str): ニコ生上の実況チャンネル/コミュニティ ID
 
         Returns:
-            dict[str, bool | str]: 視聴セッション情報 or エラーメッセージが含まれる辞書
+            dict[str, bool | str]: 番組 ID (program_id) と視聴セッションの WebSocket URL (session) or エラーメッセージが含まれる辞書
         """
 
-        # 廃止されたなどの理由でニコ生上の実況チャンネル/コミュニティ ID が取得できていない
-        if self.jikkyo_nicolive_id is None:
-            return {'is_success': False, 'detail': 'このチャンネルはニコニコ実況に対応していません。'}
+        # キャッシュの有効期間内であれば、キャッシュした取得結果を返す
+        cached = cls.__watch_page_cache.get(jikkyo_nicolive_id)
+        if cached is not None and time.monotonic() - cached[0] <= cls.WATCH_PAGE_CACHE_TTL:
+            return cached[1]
+
+        # 同じチャンネルの視聴ページを取得中であればその結果を待ち、そうでなければ新たに取得を始める
+        task = cls.__watch_page_tasks.get(jikkyo_nicolive_id)
+        if task is None:
+            async def fetchAndCache() -> dict[str, bool | str]:
+                result = await cls.__fetchWatchPageInfo(jikkyo_nicolive_id)
+                cls.__watch_page_cache[jikkyo_nicolive_id] = (time.monotonic(), result)
+                return result
+            task = asyncio.create_task(fetchAndCache())
+            cls.__watch_page_tasks[jikkyo_nicolive_id] = task
+            task.add_done_callback(lambda _: cls.__watch_page_tasks.pop(jikkyo_nicolive_id, None))
+
+        # 待っているリクエストがキャンセルされても、同じタスクを待っている他のリクエストに影響しないようにする
+        return await asyncio.shield(task)
+
+
+    @classmethod
+    async def __fetchWatchPageInfo(cls, jikkyo_nicolive_id: str) -> dict[str, bool | str]:
+        """
+        ニコ生の視聴ページを取得し、現在放送中の番組の番組 ID と視聴セッションの WebSocket URL を取得する
+        getWatchPageInfo() から呼び出される
+
+        Args:
+            jikkyo_nicolive_id (str): ニコ生上の実況チャンネル/コミュニティ ID
+
+        Returns:
+            dict[str, bool | str]: 番組 ID (program_id) と視聴セッションの WebSocket URL (session) or エラーメッセージが含まれる辞書
+        """
 
         # ニコ生の視聴ページの HTML を取得する
         ## 結構重いんだけど、ログインなしで視聴セッションを取るには視聴ページのスクレイピングしかない（はず）
         ## 3秒応答がなかったらタイムアウト
-        watch_page_url = f'https://live.nicovideo.jp/watch/{self.jikkyo_nicolive_id}'
+        watch_page_url = f'{cls.NICONICO_LIVE_URL}/watch/{jikkyo_nicolive_id}'
         try:
             watch_page_response = await asyncio.to_thread(requests.get, watch_page_url, headers=API_REQUEST_HEADERS, timeout=3)
         except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
@@ -274,6 +388,32 @@ class Jikkyo:
         if session == '':
             return {'is_success': False, 'detail': '視聴セッションを取得できませんでした。'}
 
+        return {'is_success': True, 'program_id': embedded_data['program']['nicoliveProgramId'], 'session': session}
+
+
+    async def fetchJikkyoSession(self, current_user: User | None = None) -> dict[str, bool | str]:
+        """
+        ニコニコ実況（ニコ生）の視聴セッション情報を取得する
+
+        Args:
+            current_user (User | None): ログイン中のユーザーのモデルオブジェクト or None
+
+        Returns:
+            dict[str, bool | str]: 視聴セッション情報 or エラーメッセージが含まれる辞書
+        """
+
+        # 廃止されたなどの理由でニコ生上の実況チャンネル/コミュニティ ID が取得できていない
+        if self.jikkyo_nicolive_id is None:
+            return {'is_success': False, 'detail': 'このチャンネルはニコニコ実況に対応していません。'}
+
+        # ニコ生の視聴ページから、現在放送中の番組の番組 ID と視聴セッションの WebSocket URL を取得する
+        ## 同じチャンネルの視聴ページの取得は、同時に行われたものを1つにまとめた上で、取得結果を WATCH_PAGE_CACHE_TTL 秒間キャッシュする
+        watch_page_info = await self.getWatchPageInfo(self.jikkyo_nicolive_id)
+        if watch_page_info['is_success'] is False:
+            return dict(watch_page_info)
+        program_id = watch_page_info['program_id']
+        session = watch_page_info['session']
+
         # ログイン中でかつニコニコアカウントと連携している場合のみ、OAuth API (wsendpoint) から視聴セッションを取得する
         ## wsendpoint から視聴セッションを取得すると、アクセストークンに紐づくユーザーとしてコメントできる
         ## wsendpoint ではニコニコチャンネルやニコニコミュニティの ID を直接指定できず、事前に放送中の番組 ID を取得しておく必要がある
@@ -290,8 +430,8 @@ class Jikkyo:
                 # 視聴セッションの WebSocket URL を取得する
                 ## レスポンスで取得できる WebSocket に接続すると、ログイン中のユーザーに紐づくニコニコアカウントでコメントできる
                 session_api_url = (
-                    'https://api.live2.nicovideo.jp/api/v1/wsendpoint?'
-                    f'nicoliveProgramId={embedded_data["program"]["nicoliveProgramId"]}&userId={current_user.niconico_user_id}'
+                    f'{self.NICONICO_LIVE_API_URL}/api/v1/wsendpoint?'
+                    f'nicoliveProgramId={program_id}&userId={current_user.niconico_user_id}'
                 )
 
                 async def getSession():  # 使い回せるように関数化
@@ -373,16 +513,31 @@ class Jikkyo:
 
         # getchannels API から実況チャンネルのステータスを取得する
         ## 3秒応答がなかったらタイムアウト
+        ## 前回のレスポンスに ETag や Last-Modified があれば条件付きリクエストを行う
+        getchannels_api_headers = {**API_REQUEST_HEADERS}
+        if cls.jikkyo_channels_status != {}:
+            if cls.__getchannels_etag is not None:
+                getchannels_api_headers['If-None-Match'] = cls.__getchannels_etag
+            if cls.__getchannels_last_modified is not None:
+                getchannels_api_headers['If-Modified-Since'] = cls.__getchannels_last_modified
         try:
             getchannels_api_url = 'https://jikkyo.tsukumijima.net/namami/api/v2/getchannels'
-            getchannels_api_response = await asyncio.to_thread(requests.get, getchannels_api_url, headers=API_REQUEST_HEADERS, timeout=3)
+            getchannels_api_response = await asyncio.to_thread(requests.get, getchannels_api_url, headers=getchannels_api_headers, timeout=3)
         except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):  # 接続エラー（サーバー再起動やタイムアウトなど）
             return # ステータス更新を中断
 
+        # 前回からステータスが変わっていない
+        if getchannels_api_response.status_code == 304:
+            return
+
         # ステータスコードが 200 以外
         if getchannels_api_response.status_code != 200:
             return  # ステータス更新を中断
 
+        # 次回の条件付きリクエストのために ETag と Last-Modified を保存
+        cls.__getchannels_etag = getchannels_api_response.headers.get('ETag')
+        cls.__getchannels_last_modified = getchannels_api_response.headers.get('Last-Modified')
+
         # XML をパース
         channels = ET.fromstring(getchannels_api_response.text)
 
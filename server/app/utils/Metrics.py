@@ -0,0 +1,243 @@
+# Type Hints を指定できるように
+# ref: https://stackoverflow.com/a/33533514/17124142
+from __future__ import annotations
+
+import asyncio
+import bisect
+import time
+from typing import ClassVar, Literal
+
+
+class MetricFamily:
+    """
+    Prometheus のテキスト形式で出力するメトリクスを表すクラス
+    ラベルの値の組み合わせごとに値を保持する
+    """
+
+    # 全てのメトリクスのインスタンスが格納されるリスト (出力順)
+    instances: ClassVar[list[MetricFamily]] = []
+
+
+    def __init__(self, name: str, help: str, type: Literal['counter', 'gauge', 'histogram'], label_names: tuple[str, ...] = ()) -> None:
+        """
+        メトリクスを初期化し、出力対象として登録する
+
+        Args:
+            name (str): メトリクス名
+            help (str): メトリクスの説明
+            type (Literal['counter', 'gauge', 'histogram']): メトリクスの種類
+            label_names (tuple[str, ...]): ラベル名
+        """
+
+        self.name: str = name
+        self.help: str = help
+        self.type: Literal['counter', 'gauge', 'histogram'] = type
+        self.label_names: tuple[str, ...] = label_names
+        MetricFamily.instances.append(self)
+
+
+    def render(self) -> list[str]:
+        """
+        メトリクスを Prometheus のテキスト形式の行のリストに変換する
+
+        Returns:
+            list[str]: Prometheus のテキスト形式の行のリスト
+        """
+
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+
+
+    def formatLabels(self, label_values: tuple[str, ...], extra: tuple[tuple[str, str], ...] = ()) -> str:
+        """
+        ラベルの値の組み合わせを Prometheus のテキスト形式に変換する
+
+        Args:
+            label_values (tuple[str, ...]): ラベルの値
+            extra (tuple[tuple[str, str], ...]): 追加のラベル (ヒストグラムの le など)
+
+        Returns:
+            str: {key="value",...} 形式の文字列 (ラベルがない場合は空文字列)
+        """
+
+        pairs = [*zip(self.label_names, label_values), *extra]
+        if len(pairs) == 0:
+            return ''
+        escaped = [(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for key, value in pairs]
+        return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+class Counter(MetricFamily):
+    """ 増加のみするメトリクス """
+
+    def __init__(self, name: str, help: str, label_names: tuple[str, ...] = ()) -> None:
+        super().__init__(name, help, 'counter', label_names)
+        self.values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, value: float = 1) -> None:
+        self.values[label_values] = self.values.get(label_values, 0) + value
+
+    def set(self, *label_values: str, value: float) -> None:
+        # 他のオブジェクトが保持している累計値を、出力時にそのまま反映する
+        self.values[label_values] = value
+
+    def render(self) -> list[str]:
+        return super().render() + [f'{self.name}{self.formatLabels(key)} {value}' for key, value in self.values.items()]
+
+
+class Gauge(MetricFamily):
+    """ 増減するメトリクス (出力時に値を集計して設定することが多い) """
+
+    def __init__(self, name: str, help: str, label_names: tuple[str, ...] = ()) -> None:
+        super().__init__(name, help, 'gauge', label_names)
+        self.values: dict[tuple[str, ...], float] = {}
+
+    def set(self, *label_values: str, value: float) -> None:
+        self.values[label_values] = value
+
+    def clear(self) -> None:
+        self.values.clear()
+
+    def render(self) -> list[str]:
+        return super().render() + [f'{self.name}{self.formatLabels(key)} {value}' for key, value in self.values.items()]
+
+
+class Histogram(MetricFamily):
+    """ 値の分布を記録するメトリクス """
+
+    # デフォルトのバケットの上限 (秒)
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, name: str, help: str, label_names: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, help, 'histogram', label_names)
+        self.buckets: tuple[float, ...] = buckets
+        # ラベルの値の組み合わせごとの [バケットごとの件数 (累積ではない)..., +Inf の件数], 合計値
+        self.values: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, *label_values: str, value: float) -> None:
+        counts, total = self.values.get(label_values) or self.values.setdefault(label_values, ([0] * (len(self.buckets) + 1), [0.0]))
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        for key, (counts, total) in self.values.items():
+            cumulative = 0
+            for bucket, count in zip((*[str(bucket) for bucket in self.buckets], '+Inf'), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{self.formatLabels(key, (("le", bucket),))} {cumulative}')
+            lines.append(f'{self.name}_sum{self.formatLabels(key)} {total[0]}')
+            lines.append(f'{self.name}_count{self.formatLabels(key)} {cumulative}')
+        return lines
+
+
+class Metrics:
+    """
+    KonomiTV サーバーのメトリクスを保持し、Prometheus のテキスト形式で出力するクラス
+    メトリクスの記録はホットパスからも呼ばれるため、辞書の更新程度の処理しか行わない
+    ライブストリームごとの値は出力時に集計する (ライブストリーム側ではただの整数のカウンターを増やすだけにしている)
+    """
+
+    # ライブストリームごとのメトリクス (/api/metrics へのリクエスト時に集計する)
+    LIVESTREAM_WRITTEN_BYTES = Counter(
+        'konomitv_livestream_written_bytes_total', 'Bytes written to live stream clients through writeStreamData.', ('livestream_id',))
+    LIVESTREAM_CLIENTS = Gauge(
+        'konomitv_livestream_clients', 'Number of clients connected to the live stream.', ('livestream_id', 'client_type'))
+    LIVESTREAM_CLIENT_QUEUE_DEPTH = Gauge(
+        'konomitv_livestream_client_queue_depth', 'Maximum number of chunks waiting in a mpegts client queue.', ('livestream_id',))
+    LIVESTREAM_CLIENT_LAG = Gauge(
+        'konomitv_livestream_client_lag_seconds', 'Maximum time since a client last read stream data.', ('livestream_id',))
+    LIVESTREAM_TIMEOUT_EVICTIONS = Counter(
+        'konomitv_livestream_timeout_evictions_total', 'Number of clients disconnected due to read timeout.', ('livestream_id',))
+    LIVESTREAM_RESTARTS = Counter(
+        'konomitv_livestream_restarts_total', 'Number of encode task restarts by reason.', ('livestream_id', 'reason'))
+    LIVESTREAM_HOT_RESTARTS = Counter(
+        'konomitv_livestream_hot_restarts_total', 'Number of encoder hot restarts that kept clients and the tuner attached, by reason.',
+        ('livestream_id', 'reason'))
+    LIVESTREAM_QUALITY_CHANGES = Counter(
+        'konomitv_livestream_quality_changes_total', 'Number of automatic encode quality changes by direction and new quality.',
+        ('livestream_id', 'direction', 'quality'))
+    LIVESTREAM_GOP_CACHE_BYTES = Gauge(
+        'konomitv_livestream_gop_cache_bytes', 'Bytes held in the GOP cache sent to newly connected mpegts clients.', ('livestream_id',))
+    LIVESTREAM_GOP_CACHE_HITS = Counter(
+        'konomitv_livestream_gop_cache_hits_total', 'Number of mpegts clients started from the GOP cache.', ('livestream_id',))
+    LIVESTREAM_TIMESHIFT_SECONDS = Gauge(
+        'konomitv_livestream_timeshift_seconds', 'Seconds of stream data held in the timeshift buffer.', ('livestream_id',))
+
+    LIVESTREAM_STARTUP_PHASE_DURATION = Histogram(
+        'konomitv_livestream_startup_phase_duration_seconds', 'Duration of each phase from a tune request to the first byte.',
+        ('kind', 'backend', 'encoder', 'quality', 'phase'), buckets = (0.05, 0.1, 0.25, 0.5, 1, 2, 3, 5, 8, 10, 15, 30))
+
+    # エンコードタスクのアドミッション制御のメトリクス
+    ADMISSION_BUDGET = Gauge(
+        'konomitv_admission_budget', 'Total encode cost (in CPU cores) allowed to run at the same time.')
+    ADMISSION_BUDGET_USED = Gauge(
+        'konomitv_admission_budget_used', 'Total encode cost (in CPU cores) of the running encode tasks.')
+    ADMISSION_QUEUE_LENGTH = Gauge(
+        'konomitv_admission_queue_length', 'Number of encode tasks waiting for the encode budget.')
+    ADMISSION_DECISIONS = Counter(
+        'konomitv_admission_decisions_total', 'Number of admission decisions for encode tasks by decision.', ('decision',))
+
+    # チューナーの先行選局のメトリクス
+    TUNER_PRETUNED_CHANNELS = Gauge(
+        'konomitv_tuner_pretuned_channels', 'Number of channels tuned in advance without encoding.')
+    TUNER_PRETUNE_HITS = Counter(
+        'konomitv_tuner_pretune_hits_total', 'Number of encode tasks started on a tuner that was tuned in advance.')
+
+    # LL-HLS Segmenter のメトリクス
+    SEGMENTER_PARTS = Counter(
+        'konomitv_segmenter_parts_total', 'Number of LL-HLS partial segments produced.')
+    SEGMENTER_SEGMENTS = Counter(
+        'konomitv_segmenter_segments_total', 'Number of LL-HLS segments produced.')
+    SEGMENTER_PART_INTERVAL = Histogram(
+        'konomitv_segmenter_part_interval_seconds', 'Wall clock time between two LL-HLS partial segments.',
+        buckets = (0.05, 0.1, 0.15, 0.2, 0.3, 0.5, 1, 2, 5))
+    SEGMENTER_SEGMENT_INTERVAL = Histogram(
+        'konomitv_segmenter_segment_interval_seconds', 'Wall clock time between two LL-HLS segments.',
+        buckets = (0.5, 1, 2, 3, 5, 8, 10, 15, 30))
+
+    # チャンネル情報・番組情報の更新のメトリクス
+    UPDATE_DURATION = Histogram(
+        'konomitv_update_duration_seconds', 'Duration of Channel.update() and Program.update().', ('target',),
+        buckets = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300))
+    UPDATE_ROWS = Gauge(
+        'konomitv_update_rows', 'Number of rows in the table after the last update.', ('target',))
+
+    # Mirakurun / EDCB への外部呼び出しのメトリクス
+    BACKEND_REQUEST_DURATION = Histogram(
+        'konomitv_backend_request_duration_seconds', 'Latency of requests to Mirakurun or EDCB.', ('backend', 'operation', 'result'))
+
+    # イベントループの遅延のメトリクス
+    EVENT_LOOP_LAG = Histogram(
+        'konomitv_event_loop_lag_seconds', 'Delay of the event loop measured by a periodic timer.',
+        buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5))
+
+    # イベントループの遅延を計測する間隔 (秒)
+    EVENT_LOOP_LAG_INTERVAL = 0.5
+
+
+    @classmethod
+    def render(cls) -> str:
+        """
+        全てのメトリクスを Prometheus のテキスト形式で出力する
+
+        Returns:
+            str: Prometheus のテキスト形式のメトリクス
+        """
+
+        lines: list[str] = []
+        for metric in MetricFamily.instances:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+    @classmethod
+    async def monitorEventLoopLag(cls) -> None:
+        """
+        一定間隔で待機し、予定時刻からどれだけ遅れて再開されたかをイベントループの遅延として記録する
+        サーバーの起動時にタスクとして実行し、以降は終了しない
+        """
+
+        while True:
+            scheduled_at = time.monotonic() + cls.EVENT_LOOP_LAG_INTERVAL
+            await asyncio.sleep(cls.EVENT_LOOP_LAG_INTERVAL)
+            cls.EVENT_LOOP_LAG.observe(value=max(0, time.monotonic() - scheduled_at))
@@ -0,0 +1,180 @@
+# Type Hints を指定できるように
+# ref: https://stackoverflow.com/a/33533514/17124142
+from __future__ import annotations
+
+import time
+from typing import Any, ClassVar, cast
+
+from app.constants import CONFIG
+from app.utils import Logging
+from app.utils.Metrics import Metrics
+from app.utils.TunerSession import TunerSession
+
+
+class PreTuner:
+    """
+    視聴中のチャンネルから次に切り替えられそうなチャンネルを予測し、空いているチューナーで先行して選局しておくクラス
+    先行選局したチャンネルではエンコードは行わず、チューナーセッションが直近の放送波をバッファに貯めておくだけ
+    そのチャンネルに切り替えられたときは、チューナーの起動を待たずに受信中の放送波でエンコードを始められる
+    """
+
+    # 先行選局するチャンネルを見直す間隔 (秒)
+    UPDATE_INTERVAL = 2
+
+    # チューナーの起動に失敗したチャンネルを、次に先行選局しようとするまでの時間 (秒)
+    ## チューナーが足りない状態で先行選局を繰り返し試みないようにする
+    FAILURE_COOLDOWN = 60
+
+    # 前回視聴を始めたチャンネルから、この時間以内に別のチャンネルの視聴を始めた場合にチャンネル切り替えとして記録する (秒)
+    ZAPPING_WINDOW = 10 * 60
+
+    # 先行選局中のチューナーセッションが入る、チャンネル ID をキーとした辞書
+    __sessions: ClassVar[dict[str, TunerSession]] = {}
+
+    # チューナーの起動に失敗したチャンネルの、次に先行選局を試みてよい時刻 (単調増加時間) が入る、チャンネル ID をキーとした辞書
+    __cooldowns: ClassVar[dict[str, float]] = {}
+
+    # チャンネル切り替えの履歴 (切り替え元のチャンネル ID → 切り替え先のチャンネル ID → 回数)
+    __zapping_history: ClassVar[dict[str, dict[str, int]]] = {}
+
+    # 最後に視聴を始めたチャンネルの ID と、その時刻 (単調増加時間)
+    __last_watched: ClassVar[tuple[str, float] | None] = None
+
+
+    @classmethod
+    def recordWatch(cls, display_channel_id: str) -> None:
+        """
+        チャンネルの視聴が始まったことを記録し、直前に視聴を始めたチャンネルからの切り替えとしてチャンネル切り替えの履歴に加える
+
+        Args:
+            display_channel_id (str): 視聴を始めたチャンネルの ID
+        """
+
+        now = time.monotonic()
+        if cls.__last_watched is not None:
+            last_display_channel_id, last_watched_at = cls.__last_watched
+            if last_display_channel_id != display_channel_id and now - last_watched_at <= cls.ZAPPING_WINDOW:
+                history = cls.__zapping_history.setdefault(last_display_channel_id, {})
+                history[display_channel_id] = history.get(display_channel_id, 0) + 1
+        cls.__last_watched = (display_channel_id, now)
+
+
+    @classmethod
+    async def update(cls) -> None:
+        """
+        視聴中のチャンネルに応じて、先行選局するチャンネルを見直す
+        UPDATE_INTERVAL 秒ごとに呼び出す
+        """
+
+        # 相互に依存し合っているため、モジュールの初回参照時にインポートされないようにする
+        from app.models import ChannelRegistry
+        from app.models import LiveStream
+
+        # 視聴者がいなくなったチャンネルの先行選局や、視聴者のチューナーの起動に再利用された (EDCB) ・
+        # 優先度の高い要求に中断された (Mirakurun) チューナーセッションを先行選局の対象から外す
+        ## 先行選局したチャンネルに切り替えられた場合は、チューナーセッションはそのままエンコードタスクに引き継がれている
+        for display_channel_id, session in list(cls.__sessions.items()):
+            if (session.isPretuned() is False or session.state != 'Running' or session.isDisconnected() is True or
+                (session.tuner is not None and session.tuner.delegated is True)):
+                cls.__sessions.pop(display_channel_id)
+                await session.cancelPretune()
+
+        # 視聴中 (視聴者がいて Standby か ONAir) のチャンネルを、視聴を始めた時刻が新しい順に取得する
+        watching_livestreams = sorted(
+            [livestream for livestream in LiveStream.getStandbyLiveStreams() + LiveStream.getONAirLiveStreams()
+                if livestream.getStatus()['client_count'] > 0],
+            key = lambda livestream: livestream.getStatus()['started_at'],
+            reverse = True,
+        )
+        watching_channel_ids = list(dict.fromkeys(livestream.display_channel_id for livestream in watching_livestreams))
+
+        # 先行選局するチャンネルを決める
+        target_channels: list[Any] = []
+        if CONFIG['tv']['pretune_channels'] > 0 and len(watching_channel_ids) > 0:
+
+            # 視聴できるチャンネルを、チャンネルレジストリからチャンネル番号順に取得する
+            channels = [channel for channel in await ChannelRegistry.getAll() if channel.is_watchable is True]
+            channels_by_id = {channel.display_channel_id: channel for channel in channels}
+
+            # 視聴中のチャンネルごとに、チャンネル切り替えの履歴で多く切り替えられた順、チャンネル番号順で前後のチャンネルの順に候補を挙げる
+            ## サブチャンネルとラジオチャンネルは、チャンネル切り替えで選ばれることが少ないため先行選局しない
+            candidates_list: list[list[Any]] = []
+            for display_channel_id in watching_channel_ids:
+                watching_channel = channels_by_id.get(display_channel_id)
+                if watching_channel is None:
+                    continue
+                same_type_channels = [channel for channel in await ChannelRegistry.getByType(watching_channel.type) if channel.is_watchable is True and
+                    (channel is watching_channel or (channel.is_subchannel is False and channel.is_radiochannel is False))]
+                index = same_type_channels.index(watching_channel)
+                history = cls.__zapping_history.get(display_channel_id, {})
+                candidates = [channels_by_id[channel_id] for channel_id, _ in
+                    sorted(history.items(), key=lambda item: item[1], reverse=True) if channel_id in channels_by_id]
+                if index + 1 < len(same_type_channels):
+                    candidates.append(same_type_channels[index + 1])
+                if index - 1 >= 0:
+                    candidates.append(same_type_channels[index - 1])
+                candidates_list.append(candidates)
+
+            # 視聴中のチャンネルの候補から順番に1つずつ、最大 tv.pretune_channels 個まで選ぶ
+            ## 視聴中のチャンネルや、チューナーの起動に失敗したばかりのチャンネルは選ばない
+            now = time.monotonic()
+            while len(target_channels) < CONFIG['tv']['pretune_channels'] and any(len(candidates) > 0 for candidates in candidates_list):
+                for candidates in candidates_list:
+                    while len(candidates) > 0:
+                        channel = candidates.pop(0)
+                        if (channel.display_channel_id in watching_channel_ids or channel in target_channels or
+                            cls.__cooldowns.get(channel.display_channel_id, 0) > now):
+                            continue
+                        target_channels.append(channel)
+                        break
+                    if len(target_channels) >= CONFIG['tv']['pretune_channels']:
+                        break
+
+        # 先行選局の対象から外れたチャンネルの先行選局を終了する
+        ## 新しく先行選局するチャンネルより先にチューナーを解放し、チューナーを空けておく
+        target_channel_ids = [channel.display_channel_id for channel in target_channels]
+        for display_channel_id, session in list(cls.__sessions.items()):
+            if display_channel_id not in target_channel_ids:
+                cls.__sessions.pop(display_channel_id)
+                await session.cancelPretune()
+                Logging.info(f'[PreTuner] Stopped pre-tuning {display_channel_id}.')
+
+        # 新たに先行選局するチャンネルのチューナーを起動する
+        for channel in target_channels:
+            if channel.display_channel_id in cls.__sessions:
+                continue
+
+            # 既に同じチャンネルのチューナーが起動している (Idling のライブストリームなどがある) 場合は、先行選局しなくてもすぐに視聴を始められる
+            session = TunerSession.get(channel.network_id, channel.service_id, cast(int, channel.transport_stream_id))
+            if session.state == 'Running' and session.isPretuned() is False:
+                continue
+
+            # チューナーを起動する
+            ## 視聴者がいなくなった場合に備えて、起動が終わった時点で視聴中のチャンネルが変わっていないかは次回の見直しで確認する
+            if await session.pretune() is True:
+                cls.__sessions[channel.display_channel_id] = session
+                Logging.info(f'[PreTuner] Pre-tuned {channel.display_channel_id}.')
+            else:
+                cls.__cooldowns[channel.display_channel_id] = time.monotonic() + cls.FAILURE_COOLDOWN
+                Logging.info(f'[PreTuner] Failed to pre-tune {channel.display_channel_id}. Retry after {cls.FAILURE_COOLDOWN} seconds.')
+
+        Metrics.TUNER_PRETUNED_CHANNELS.set(value=len(cls.__sessions))
+
+
+    @classmethod
+    async def releaseAll(cls) -> bool:
+        """
+        すべてのチャンネルの先行選局を終了し、チューナーを解放する
+        視聴者のチューナーの起動に失敗した場合や、サーバーの終了時に呼び出す
+
+        Returns:
+            bool: 先行選局を終了したチャンネルがあったかどうか
+        """
+
+        sessions = list(cls.__sessions.values())
+        cls.__sessions.clear()
+        for session in sessions:
+            await session.cancelPretune()
+        Metrics.TUNER_PRETUNED_CHANNELS.set(value=0)
+
+        return len(sessions) > 0
@@ -0,0 +1,208 @@
+# Type Hints を指定できるように
+# ref: https://stackoverflow.com/a/33533514/17124142
+from __future__ import annotations
+
+import time
+from collections import deque
+from typing import Any, ClassVar, Literal, TypedDict
+
+from app.utils.Metrics import Metrics
+
+
+class StartupTraceSpan(TypedDict):
+    """ ライブストリームの起動処理の1フェーズを表す辞書の型定義 (時刻はトレース開始からの経過秒数) """
+    name: str
+    start: float
+    end: float | None
+
+
+class StartupTrace:
+    """
+    ライブストリームの起動 (エンコードタスクの開始からクライアントへの最初のストリームデータの書き込みまで) にかかった時間を、
+    フェーズごとに記録するクラス
+    チャンネル切り替えが遅い場合に、どのフェーズがボトルネックになっているかを調べるために使う
+    エンコーダーのホットリスタート (クライアントとチューナーを維持したままエンコーダーだけを再起動する) からの復帰にかかった時間も、同じ形式で記録する
+    """
+
+    # 記録するフェーズ
+    ## channel_query: チャンネル情報と現在の番組情報の取得
+    ## admission: サーバーのエンコード能力 (予算) に空きができるまでの待ち時間 (空きがあれば 0 秒)
+    ## encoder_spawn: tsreadex・エンコーダーの起動 (エンコーダーノードへの割り振りを含む)
+    ## tuner_open: チューナーの起動と接続 (Mirakurun の Service Stream API へのリクエスト / EDCB の open()・connect())
+    ## encoder_warmup: チューナーに接続してから、エンコーダーが最初の進捗ログを出力して ONAir に移行するまで
+    ## first_byte: チューナーに接続してから、最初のストリームデータをライブストリームに書き込むまで
+    PHASES: ClassVar[tuple[str, ...]] = ('channel_query', 'admission', 'encoder_spawn', 'tuner_open', 'encoder_warmup', 'first_byte')
+
+    # エンコーダーのホットリスタート時に記録するフェーズ
+    ## encoder_teardown: 停止したエンコーダーの終了と、ストリームデータの読み込みタスクの終了待ち
+    ## encoder_spawn / encoder_warmup / first_byte: 起動時と同じ (チューナーは起動したままなので、tuner_open はない)
+    HOT_RESTART_PHASES: ClassVar[tuple[str, ...]] = ('encoder_teardown', 'encoder_spawn', 'encoder_warmup', 'first_byte')
+
+    # 保持する直近のトレースの最大数
+    MAX_TRACES = 50
+
+    # パーセンタイルの算出のために、トレースの種類・バックエンド・エンコーダー・画質・フェーズの組み合わせごとに保持する所要時間の最大数
+    MAX_SAMPLES = 500
+
+    # 直近のトレースのリスト (古い順)
+    __traces: ClassVar[deque[dict[str, Any]]] = deque(maxlen=MAX_TRACES)
+
+    # トレースの種類・バックエンド・エンコーダー・画質・フェーズの組み合わせごとの所要時間のリスト
+    __samples: ClassVar[dict[tuple[str, str, str, str, str], deque[float]]] = {}
+
+
+    def __init__(self, livestream_id: str, backend: str, encoder_type: str, quality: str,
+        kind: Literal['Startup', 'HotRestart'] = 'Startup') -> None:
+        """
+        ライブストリームの起動のトレースを開始する
+
+        Args:
+            livestream_id (str): ライブストリーム ID
+            backend (str): バックエンドの種類 (Mirakurun or EDCB)
+            encoder_type (str): エンコーダーの種類 (エンコーダーが決まった後に変更してもよい)
+            quality (str): 映像の品質
+            kind (Literal['Startup', 'HotRestart']): トレースの種類 (起動時 or エンコーダーのホットリスタート時)
+        """
+
+        self.kind: Literal['Startup', 'HotRestart'] = kind
+        self.phases: tuple[str, ...] = self.PHASES if kind == 'Startup' else self.HOT_RESTART_PHASES
+        self.livestream_id: str = livestream_id
+        self.backend: str = backend
+        self.encoder_type: str = encoder_type
+        self.quality: str = quality
+
+        # トレースの開始時刻 (Unix Time) と、経過時間の算出に使う単調増加時間
+        self.started_at: float = time.time()
+        self.__started_monotonic_time: float = time.monotonic()
+
+        # フェーズごとの開始・終了時刻
+        self.spans: dict[str, StartupTraceSpan] = {}
+
+        # トレースに付加する追加情報 (チューナーを再利用したかどうかなど)
+        self.attributes: dict[str, Any] = {}
+
+        # トレースが終了しているかどうか
+        self.finished: bool = False
+
+
+    def begin(self, name: str) -> None:
+        """
+        フェーズの開始を記録する
+
+        Args:
+            name (str): フェーズ名
+        """
+
+        if self.finished is True:
+            return
+        self.spans[name] = {'name': name, 'start': time.monotonic() - self.__started_monotonic_time, 'end': None}
+
+
+    def end(self, name: str) -> None:
+        """
+        フェーズの終了を記録する
+        すべてのフェーズの終了が記録された時点で、トレースを終了する
+
+        Args:
+            name (str): フェーズ名
+        """
+
+        span = self.spans.get(name)
+        if self.finished is True or span is None or span['end'] is not None:
+            return
+        span['end'] = time.monotonic() - self.__started_monotonic_time
+
+        if all(phase in self.spans and self.spans[phase]['end'] is not None for phase in self.phases):
+            self.finish('ONAir')
+
+
+    def getElapsedTime(self) -> float:
+        """
+        トレースの開始からの経過時間を取得する
+
+        Returns:
+            float: トレースの開始からの経過秒数
+        """
+
+        return time.monotonic() - self.__started_monotonic_time
+
+
+    def finish(self, result: str) -> None:
+        """
+        トレースを終了し、直近のトレースとフェーズごとの所要時間の統計に追加する
+        起動に失敗した場合など、すべてのフェーズが記録される前に呼ばれた場合は、終了したフェーズの所要時間だけが統計に追加される
+
+        Args:
+            result (str): 起動の結果 (ONAir / Offline / Restart など)
+        """
+
+        if self.finished is True:
+            return
+        self.finished = True
+
+        # 終了したフェーズの所要時間を統計に追加する
+        for span in self.spans.values():
+            if span['end'] is None:
+                continue
+            duration = span['end'] - span['start']
+            key = (self.kind, self.backend, self.encoder_type, self.quality, span['name'])
+            StartupTrace.__samples.setdefault(key, deque(maxlen=self.MAX_SAMPLES)).append(duration)
+            Metrics.LIVESTREAM_STARTUP_PHASE_DURATION.observe(*key, value=duration)
+
+        StartupTrace.__traces.append({
+            'kind': self.kind,
+            'livestream_id': self.livestream_id,
+            'backend': self.backend,
+            'encoder_type': self.encoder_type,
+            'quality': self.quality,
+            'result': result,
+            'started_at': self.started_at,
+            'total_duration': time.monotonic() - self.__started_monotonic_time,
+            'spans': list(self.spans.values()),
+            'attributes': self.attributes,
+        })
+
+
+    @classmethod
+    def getTraces(cls) -> list[dict[str, Any]]:
+        """
+        直近のトレースを新しい順に取得する
+
+        Returns:
+            list[dict[str, Any]]: 直近のトレースのリスト
+        """
+
+        return list(reversed(cls.__traces))
+
+
+    @classmethod
+    def getSummary(cls) -> list[dict[str, Any]]:
+        """
+        トレースの種類・バックエンド・エンコーダー・画質・フェーズの組み合わせごとに、所要時間のパーセンタイルを算出する
+
+        Returns:
+            list[dict[str, Any]]: 組み合わせごとの所要時間の件数・p50・p90・p99・最大値のリスト
+        """
+
+        def Percentile(sorted_durations: list[float], percentile: float) -> float:
+            # 最近傍順位法でパーセンタイルを求める
+            index = max(0, min(len(sorted_durations) - 1, round(percentile / 100 * len(sorted_durations) + 0.5) - 1))
+            return sorted_durations[index]
+
+        summary: list[dict[str, Any]] = []
+        for (kind, backend, encoder_type, quality, phase), durations in sorted(cls.__samples.items()):
+            sorted_durations = sorted(durations)
+            summary.append({
+                'kind': kind,
+                'backend': backend,
+                'encoder_type': encoder_type,
+                'quality': quality,
+                'phase': phase,
+                'count': len(sorted_durations),
+                'p50': Percentile(sorted_durations, 50),
+                'p90': Percentile(sorted_durations, 90),
+                'p99': Percentile(sorted_durations, 99),
+                'max': sorted_durations[-1],
+            })
+
+        return summary
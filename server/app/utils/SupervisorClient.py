@@ -0,0 +1,231 @@
+
+# Type Hints を指定できるように
+# ref: https://stackoverflow.com/a/33533514/17124142
+from __future__ import annotations
+
+import asyncio
+import json
+import time
+from collections.abc import AsyncIterator
+from fastapi import HTTPException
+from fastapi import Request
+from fastapi import status
+from fastapi.responses import StreamingResponse
+from typing import ClassVar
+
+from app.constants import CONFIG
+from app.utils import Logging
+
+
+class SupervisorClient:
+    """
+    API ワーカープロセスから、チューナー・エンコードタスク・ライブストリームを管理するストリーム管理プロセス (supervisor) に
+    アクセスするためのクライアント
+    server.workers に 2 以上が指定されているときのみ利用される
+
+    ライブストリームの状態やストリームデータはストリーム管理プロセスにしか存在しないため、API ワーカーは
+    ライブストリーム関連の HTTP リクエストをループバック接続でストリーム管理プロセスにそのまま中継する
+    外部ライブラリに依存しないよう、HTTP/1.1 の最低限のクライアント実装を asyncio の Stream で行っている
+    """
+
+    # ストリーム管理プロセスがリッスンしているアドレスとポート
+    ## 外部からは Akebi を経由して API ワーカー (ポート + 10) にしかアクセスできず、ストリーム管理プロセスはポート + 11 でリッスンする
+    HOST: ClassVar[str] = '127.0.0.77'
+    PORT: ClassVar[int] = CONFIG['server']['port'] + 11
+
+    # 中継時に転送しないヘッダー (ホップバイホップヘッダー)
+    ## ref: https://datatracker.ietf.org/doc/html/rfc2616#section-13.5.1
+    HOP_BY_HOP_HEADERS: ClassVar[set[str]] = {
+        'connection', 'content-length', 'host', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+        'te', 'trailers', 'transfer-encoding', 'upgrade',
+    }
+
+    # ストリーム管理プロセスから視聴者数を取得する間隔の最小値と最大値 (秒)
+    ## 視聴者数が変わらない間は取得するたびに間隔を2倍に延ばし、変わったら最小値に戻す
+    ## すべての API ワーカーがストリーム管理プロセスに問い合わせるため、視聴者数の変化がない間は問い合わせを減らす
+    VIEWER_COUNTS_MIN_INTERVAL: ClassVar[float] = 1
+    VIEWER_COUNTS_MAX_INTERVAL: ClassVar[float] = 8
+
+    # ストリーム管理プロセスから取得した、チャンネルごとの視聴者数
+    __viewer_counts: ClassVar[dict[str, int]] = {}
+
+    # 現在の視聴者数の取得間隔 (秒) と、最後に視聴者数を取得した時刻 (単調増加時間)
+    __viewer_counts_interval: ClassVar[float] = VIEWER_COUNTS_MIN_INTERVAL
+    __viewer_counts_fetched_at: ClassVar[float] = 0
+
+
+    @classmethod
+    async def request(cls,
+        method: str,
+        path: str,
+        headers: list[tuple[str, str]] | None = None,
+        body: bytes = b'',
+    ) -> tuple[int, list[tuple[str, str]], AsyncIterator[bytes]]:
+        """
+        ストリーム管理プロセスに HTTP リクエストを送信する
+        レスポンスボディは随時読み取れるように非同期イテレーターとして返す (イテレーターを最後まで読むか閉じると接続が切断される)
+
+        Args:
+            method (str): HTTP メソッド
+            path (str): クエリ文字列を含むリクエストパス
+            headers (list[tuple[str, str]] | None): 追加で送信するリクエストヘッダー
+            body (bytes): リクエストボディ
+
+        Returns:
+            tuple[int, list[tuple[str, str]], AsyncIterator[bytes]]: ステータスコード・レスポンスヘッダー・レスポンスボディ
+        """
+
+        # ストリーム管理プロセスに接続する
+        ## 接続できなかった場合はストリーム管理プロセスが起動していないか、再起動中とみなす
+        try:
+            reader, writer = await asyncio.open_connection(cls.HOST, cls.PORT)
+        except OSError:
+            Logging.error(f'[SupervisorClient][request] Failed to connect to the supervisor [path: {path}]')
+            raise HTTPException(
+                status_code = status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail = 'Live stream supervisor is not available',
+            )
+
+        # リクエストヘッダーを組み立てて送信する
+        ## レスポンスの終端を判定しやすくするため、Keep-Alive は使わず毎回接続を閉じる
+        request_head = f'{method} {path} HTTP/1.1\r\nHost: {cls.HOST}:{cls.PORT}\r\nConnection: close\r\n'
+        for key, value in (headers or []):
+            if key.lower() not in cls.HOP_BY_HOP_HEADERS:
+                request_head += f'{key}: {value}\r\n'
+        if len(body) > 0:
+            request_head += f'Content-Length: {len(body)}\r\n'
+        writer.write(request_head.encode('latin-1') + b'\r\n' + body)
+        await writer.drain()
+
+        # ステータス行とレスポンスヘッダーを読み取る
+        try:
+            status_line = await reader.readline()
+            status_code = int(status_line.split(b' ')[1])
+            response_headers: list[tuple[str, str]] = []
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                key, value = line.decode('latin-1').split(':', 1)
+                response_headers.append((key.strip(), value.strip()))
+        except (ConnectionError, IndexError, ValueError):
+            writer.close()
+            Logging.error(f'[SupervisorClient][request] Invalid response from the supervisor [path: {path}]')
+            raise HTTPException(
+                status_code = status.HTTP_502_BAD_GATEWAY,
+                detail = 'Invalid response from live stream supervisor',
+            )
+
+        # レスポンスボディを読み取るイテレーター
+        async def iterate_body() -> AsyncIterator[bytes]:
+            header_dict = {key.lower(): value for key, value in response_headers}
+            try:
+                # チャンク転送エンコーディング (StreamingResponse や EventSourceResponse)
+                if header_dict.get('transfer-encoding', '').lower() == 'chunked':
+                    while True:
+                        chunk_size = int((await reader.readline()).split(b';')[0].strip(), 16)
+                        if chunk_size == 0:
+                            break
+                        yield await reader.readexactly(chunk_size)
+                        await reader.readexactly(2)  # チャンク末尾の \r\n
+                # Content-Length が指定されている
+                elif 'content-length' in header_dict:
+                    content_length = int(header_dict['content-length'])
+                    if content_length > 0:
+                        yield await reader.readexactly(content_length)
+                # いずれも指定されていなければ、接続が閉じられるまで読み取る
+                else:
+                    while True:
+                        chunk = await reader.read(65536)
+                        if chunk == b'':
+                            break
+                        yield chunk
+            except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+                # 途中でストリーム管理プロセスとの接続が切れた
+                pass
+            finally:
+                # クライアントが切断されたときもここで接続を閉じ、ストリーム管理プロセス側に切断を伝える
+                writer.close()
+
+        return status_code, response_headers, iterate_body()
+
+
+    @classmethod
+    async def relay(cls, request: Request) -> StreamingResponse:
+        """
+        API ワーカーが受け取った HTTP リクエストを、そのままストリーム管理プロセスに中継する
+
+        Args:
+            request (Request): API ワーカーが受け取ったリクエスト
+
+        Returns:
+            StreamingResponse: ストリーム管理プロセスから返されたレスポンスを随時出力するレスポンス
+        """
+
+        # クエリ文字列を含むリクエストパス
+        path = request.url.path
+        if request.url.query != '':
+            path += f'?{request.url.query}'
+
+        # ライブストリームへの接続の中継であれば視聴者数が変わるため、次回から視聴者数を最小の間隔で取得し直す
+        if request.url.path.endswith(('/mpegts', '/ll-hls')):
+            cls.__viewer_counts_interval = cls.VIEWER_COUNTS_MIN_INTERVAL
+
+        status_code, response_headers, body = await cls.request(
+            method = request.method,
+            path = path,
+            headers = list(request.headers.items()),
+            body = await request.body(),
+        )
+
+        # ホップバイホップヘッダーを除いたレスポンスヘッダーをそのまま返す
+        return StreamingResponse(
+            content = body,
+            status_code = status_code,
+            headers = {key: value for key, value in response_headers if key.lower() not in cls.HOP_BY_HOP_HEADERS},
+        )
+
+
+    @classmethod
+    async def updateViewerCounts(cls) -> None:
+        """
+        ストリーム管理プロセスから、チャンネルごとの視聴者数だけを取得して更新する
+        API ワーカーはライブストリームを持たないため、チャンネル情報 API などの視聴者数はここで取得した値を使う
+        1秒ごとに呼び出されるが、前回の取得から現在の取得間隔が経過していなければ何もしない
+        """
+
+        # 前回の取得から現在の取得間隔が経過していない
+        if time.monotonic() - cls.__viewer_counts_fetched_at < cls.__viewer_counts_interval:
+            return
+        cls.__viewer_counts_fetched_at = time.monotonic()
+
+        try:
+            status_code, _, body = await cls.request('GET', '/api/streams/live/viewer-counts')
+            response = b''.join([chunk async for chunk in body])
+        except HTTPException:
+            return
+        if status_code != 200:
+            return
+
+        # 視聴者数が変わっていなければ、次回の取得間隔を延ばす
+        viewer_counts: dict[str, int] = json.loads(response)['viewer_counts']
+        if viewer_counts == cls.__viewer_counts:
+            cls.__viewer_counts_interval = min(cls.__viewer_counts_interval * 2, cls.VIEWER_COUNTS_MAX_INTERVAL)
+        else:
+            cls.__viewer_counts_interval = cls.VIEWER_COUNTS_MIN_INTERVAL
+        cls.__viewer_counts = viewer_counts
+
+
+    @classmethod
+    def getViewerCount(cls, display_channel_id: str) -> int:
+        """
+        ストリーム管理プロセスから最後に取得した、指定されたチャンネルの視聴者数を取得する
+
+        Args:
+            display_channel_id (str): チャンネルID
+
+        Returns:
+            int: 視聴者数
+        """
+
+        return cls.__viewer_counts.get(display_channel_id, 0)
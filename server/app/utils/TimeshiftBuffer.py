@@ -0,0 +1,388 @@
+# Type Hints を指定できるように
+# ref: https://stackoverflow.com/a/33533514/17124142
+from __future__ import annotations
+
+import asyncio
+import math
+import mmap
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import AsyncIterator
+
+from app.constants import TIMESHIFT_DIR
+from app.utils import Logging
+
+
+class TimeshiftSegment:
+    """ タイムシフトバッファに保持しているセグメント (キーフレームから始まる MPEG-TS のまとまり) を表すクラス """
+
+    __slots__ = ('sequence', 'start', 'end', 'started_at', 'duration', 'discontinuity', 'psi')
+
+    def __init__(self, sequence: int, start: int, started_at: float, discontinuity: bool, psi: bytes) -> None:
+        """
+        セグメントを初期化する
+
+        Args:
+            sequence (int): セグメントの通し番号 (HLS の Media Sequence Number)
+            start (int): セグメントの先頭の、タイムシフトバッファへの累計書き込みバイト数で表した位置
+            started_at (float): セグメントの先頭が書き込まれた時刻 (UNIX 時間)
+            discontinuity (bool): 直前のセグメントとタイムスタンプが連続していない (エンコーダーが再起動された) かどうか
+            psi (bytes): セグメントの先頭が書き込まれた時点の PAT・PMT の TS パケット
+        """
+
+        self.sequence: int = sequence
+        self.start: int = start
+        # セグメントの末尾の位置 (書き込み中のセグメントでは、書き込まれるたびに更新される)
+        self.end: int = start
+        self.started_at: float = started_at
+        # セグメントの再生時間 (秒) (書き込み中のセグメントでは None)
+        self.duration: float | None = None
+        self.discontinuity: bool = discontinuity
+        self.psi: bytes = psi
+
+
+class TimeshiftBuffer:
+    """
+    ライブストリームに書き込まれた MPEG-TS を、直近の一定時間・一定サイズ分だけディスク上のリングファイルに保持するクラス
+    保持したデータは、キーフレームごとに区切ったセグメントとして HLS のプレイリストから参照したり、
+    任意のセグメントから mpegts のストリームとして読み出したりでき、放送中の番組を巻き戻して視聴できるようにする
+    リングファイルはメモリマップして読み書きするため、データはページキャッシュ上にしか置かれず、保持する時間を長くしてもメモリ使用量は増えない
+    """
+
+    # 1つのセグメントの最短の再生時間 (秒)
+    ## キーフレームの間隔がこれより短い場合は、複数の GOP を1つのセグメントにまとめる
+    MIN_SEGMENT_DURATION = 2
+
+    # mpegts のストリームとして読み出す際に、一度に読み出す最大のサイズ (188 バイトの TS パケット 1024 個分)
+    READ_CHUNK_SIZE = 188 * 1024
+
+    # mpegts のストリームとして読み出す際に、新しいデータが書き込まれるのを待つ最大の時間 (秒)
+    ## これを過ぎても書き込まれない場合は、エンコーダーが停止したとみなして読み出しを終了する
+    READ_TIMEOUT = 20
+
+
+    def __init__(self, livestream_id: str, max_duration: float, max_size: int) -> None:
+        """
+        タイムシフトバッファを初期化し、リングファイルを作成する
+
+        Args:
+            livestream_id (str): ライブストリーム ID (リングファイルのファイル名に使う)
+            max_duration (float): 保持するデータの最大の再生時間 (秒)
+            max_size (int): 保持するデータの最大サイズ (リングファイルのサイズ) (バイト)
+        """
+
+        self.__max_duration = max_duration
+        self.__size = max_size
+
+        # リングファイルを作成してメモリマップする
+        ## ファイルは疎なファイルとして作成されるため、実際にディスクが使われるのは書き込んだ分だけ
+        ## 前回異常終了した際に残っていたファイルは上書きする
+        TIMESHIFT_DIR.mkdir(parents=True, exist_ok=True)
+        self.__path = TIMESHIFT_DIR / f'{livestream_id}.ts'
+        self.__file = open(self.__path, 'w+b')
+        self.__file.truncate(max_size)
+        self.__mmap = mmap.mmap(self.__file.fileno(), max_size)
+
+        # これまでにリングファイルに書き込んだ累計バイト数
+        ## リングファイル上の書き込み位置は、累計バイト数をリングファイルのサイズで割った余りになる
+        ## セグメントの位置はすべて累計バイト数で表し、リングファイルのサイズ分より前の位置のデータは上書きされている
+        self.__written: int = 0
+
+        # 保持しているセグメントのリスト (古い順)
+        ## 最後のセグメントは書き込み中のセグメントの場合がある
+        self.__segments: deque[TimeshiftSegment] = deque()
+
+        # 書き込み中のセグメント (最初のキーフレームが来るまでや、エンコーダーの再起動直後は None)
+        self.__current_segment: TimeshiftSegment | None = None
+
+        # 次のセグメントの通し番号
+        self.__next_sequence: int = 0
+
+        # 次のセグメントの前で、タイムスタンプが連続しなくなるかどうか
+        self.__discontinuity: bool = False
+
+        # 破棄したセグメントのうち、直前のセグメントとタイムスタンプが連続していなかったセグメントの数 (HLS の Discontinuity Sequence Number)
+        self.__discontinuity_sequence: int = 0
+
+        # 新しいデータが書き込まれたときにセットされるイベント (書き込まれるたびに新しいイベントに置き換える)
+        self.__written_event: asyncio.Event = asyncio.Event()
+
+        # タイムシフトバッファが閉じられたかどうか
+        self.__closed: bool = False
+
+
+    def push(self, chunk: bytes, keyframe_position: int | None, psi: bytes | None) -> None:
+        """
+        ライブストリームに書き込まれたチャンクを追加する
+        チャンクは TS パケット (188 バイト) の境界で区切られている必要がある
+
+        Args:
+            chunk (bytes): ライブストリームに書き込まれたチャンク
+            keyframe_position (int | None): チャンク内で最後に見つかったキーフレームの TS パケットの位置 (GOPCache.push() の戻り値)
+            psi (bytes | None): 最新の PAT・PMT の TS パケット (キーフレームが見つかった場合のみ必要)
+        """
+
+        if self.__closed is True:
+            return
+
+        now = time.time()
+        data = memoryview(chunk)
+        current_segment = self.__current_segment
+
+        # キーフレームが見つかり、書き込み中のセグメントが十分な長さになっていれば、キーフレームから新しいセグメントを始める
+        if (keyframe_position is not None and psi is not None and
+            (current_segment is None or now - current_segment.started_at >= self.MIN_SEGMENT_DURATION)):
+
+            # キーフレームより前のデータは、書き込み中のセグメントの末尾に追加してからセグメントを完成させる
+            if current_segment is not None:
+                if keyframe_position > 0:
+                    self.__write(data[:keyframe_position])
+                    current_segment.end = self.__written
+                current_segment.duration = now - current_segment.started_at
+
+            # 新しいセグメントを始める
+            current_segment = TimeshiftSegment(self.__next_sequence, self.__written, now, self.__discontinuity, psi)
+            self.__next_sequence += 1
+            self.__discontinuity = False
+            self.__segments.append(current_segment)
+            self.__current_segment = current_segment
+            self.__write(data[keyframe_position:])
+            current_segment.end = self.__written
+
+        # 書き込み中のセグメントがあれば、その末尾に追加する
+        ## 最初のキーフレームが来るまでのデータは、どこからも再生を始められないので保持しない
+        elif current_segment is not None:
+            self.__write(data)
+            current_segment.end = self.__written
+
+        else:
+            return
+
+        # 上書きされたセグメントと、保持する時間を過ぎたセグメントを破棄する
+        oldest_position = self.__written - self.__size
+        while len(self.__segments) > 0:
+            segment = self.__segments[0]
+            if segment.start >= oldest_position and (segment.duration is None or now - segment.started_at - segment.duration <= self.__max_duration):
+                break
+            self.__segments.popleft()
+            if segment.discontinuity is True:
+                self.__discontinuity_sequence += 1
+            if segment is self.__current_segment:
+                self.__current_segment = None
+
+        # 新しいデータを待っている読み出しを再開させる
+        self.__written_event.set()
+        self.__written_event = asyncio.Event()
+
+
+    def markDiscontinuity(self) -> None:
+        """
+        エンコーダーが再起動されたなどの理由で、以降に書き込まれるデータのタイムスタンプが連続しなくなることを記録する
+        書き込み中のセグメントはここで完成させ、次のキーフレームから新しいセグメントを始める
+        """
+
+        if self.__current_segment is not None:
+            self.__current_segment.duration = time.time() - self.__current_segment.started_at
+            self.__current_segment = None
+        self.__discontinuity = True
+
+
+    def getBufferedDuration(self) -> float:
+        """
+        保持しているデータの再生時間を取得する
+
+        Returns:
+            float: 保持している最も古いセグメントの先頭から現在までの時間 (秒)
+        """
+
+        if len(self.__segments) == 0:
+            return 0
+        return time.time() - self.__segments[0].started_at
+
+
+    def getPlaylist(self) -> str:
+        """
+        保持している (書き込みが完了した) すべてのセグメントを含む HLS のプレイリスト (m3u8) を生成する
+        古いセグメントは随時破棄されるため、EXT-X-PLAYLIST-TYPE:EVENT ではなく、保持している期間全体を範囲とするライブ配信のプレイリストになる
+
+        Returns:
+            str: プレイリスト (m3u8)
+        """
+
+        segments = [segment for segment in self.__segments if segment.duration is not None]
+        target_duration = max([math.ceil(segment.duration or 0) for segment in segments] + [self.MIN_SEGMENT_DURATION])
+        lines = [
+            '#EXTM3U',
+            '#EXT-X-VERSION:3',
+            f'#EXT-X-TARGETDURATION:{target_duration}',
+            f'#EXT-X-MEDIA-SEQUENCE:{segments[0].sequence if len(segments) > 0 else self.__next_sequence}',
+            f'#EXT-X-DISCONTINUITY-SEQUENCE:{self.__discontinuity_sequence}',
+        ]
+        for segment in segments:
+            if segment.discontinuity is True:
+                lines.append('#EXT-X-DISCONTINUITY')
+            lines.append(f'#EXT-X-PROGRAM-DATE-TIME:{datetime.fromtimestamp(segment.started_at, timezone.utc).isoformat(timespec="milliseconds")}')
+            lines.append(f'#EXTINF:{segment.duration:.3f},')
+            lines.append(f'segment?msn={segment.sequence}')
+
+        return '\n'.join(lines) + '\n'
+
+
+    def getSegment(self, sequence: int) -> bytes | None:
+        """
+        指定された通し番号のセグメントのデータを、先頭に PAT・PMT を付けて取得する
+
+        Args:
+            sequence (int): セグメントの通し番号
+
+        Returns:
+            bytes | None: セグメントのデータ (破棄されたか、まだ書き込みが完了していない場合は None)
+        """
+
+        segment = self.__findSegmentBySequence(sequence)
+        if segment is None or segment.duration is None:
+            return None
+        return segment.psi + self.__read(segment.start, segment.end)
+
+
+    def findSegment(self, seconds_ago: float) -> TimeshiftSegment | None:
+        """
+        指定された時間だけ前の時点を含むセグメントを探す
+
+        Args:
+            seconds_ago (float): 現在から何秒前の時点か
+
+        Returns:
+            TimeshiftSegment | None: 指定された時点を含むセグメント (保持している範囲より前の時点なら最も古いセグメント、セグメントがなければ None)
+        """
+
+        target = time.time() - seconds_ago
+        found: TimeshiftSegment | None = None
+        for segment in self.__segments:
+            if found is not None and segment.started_at > target:
+                break
+            found = segment
+        return found
+
+
+    async def stream(self, segment: TimeshiftSegment) -> AsyncIterator[bytes]:
+        """
+        指定されたセグメントの先頭から、保持しているデータを mpegts のストリームとして順に読み出す
+        保持しているデータの末尾に追いついたら、新しいデータが書き込まれるのを待って読み出し続ける
+
+        Args:
+            segment (TimeshiftSegment): 読み出しを始めるセグメント (findSegment() で取得したもの)
+
+        Yields:
+            bytes: 読み出したデータ
+        """
+
+        yield segment.psi
+        position = segment.start
+
+        while self.__closed is False:
+
+            # 読み出す前に上書きされてしまった場合は、保持している最も古いセグメントから読み出し直す
+            if position < self.__written - self.__size:
+                if len(self.__segments) == 0:
+                    return
+                Logging.warning(f'[TimeshiftBuffer] Reader fell behind the buffer. Skipped to the oldest segment. [path: {self.__path.name}]')
+                yield self.__segments[0].psi
+                position = self.__segments[0].start
+                continue
+
+            # 新しいデータがあれば読み出す
+            if position < self.__written:
+                end = min(self.__written, position + self.READ_CHUNK_SIZE)
+                data = self.__read(position, end)
+                position = end
+                yield data
+                continue
+
+            # 新しいデータが書き込まれるまで待つ
+            try:
+                await asyncio.wait_for(self.__written_event.wait(), timeout=self.READ_TIMEOUT)
+            except asyncio.TimeoutError:
+                return
+
+
+    def close(self) -> None:
+        """
+        タイムシフトバッファを閉じ、リングファイルを削除する
+        読み出し中のストリームは、次の読み出しの時点で終了する
+        """
+
+        if self.__closed is True:
+            return
+        self.__closed = True
+        self.__segments.clear()
+        self.__current_segment = None
+        self.__written_event.set()
+
+        self.__mmap.close()
+        self.__file.close()
+        try:
+            self.__path.unlink(missing_ok=True)
+        except OSError as ex:
+            Logging.warning(f'[TimeshiftBuffer] Failed to delete {self.__path}: {ex}')
+
+
+    def __findSegmentBySequence(self, sequence: int) -> TimeshiftSegment | None:
+        """
+        指定された通し番号のセグメントを取得する
+
+        Args:
+            sequence (int): セグメントの通し番号
+
+        Returns:
+            TimeshiftSegment | None: セグメント (破棄されたか、まだ存在しない場合は None)
+        """
+
+        if len(self.__segments) == 0:
+            return None
+        index = sequence - self.__segments[0].sequence
+        if index < 0 or index >= len(self.__segments):
+            return None
+        return self.__segments[index]
+
+
+    def __write(self, data: memoryview) -> None:
+        """
+        リングファイルにデータを書き込む (末尾に達したら先頭に戻って書き込む)
+
+        Args:
+            data (memoryview): 書き込むデータ
+        """
+
+        # リングファイルより大きいデータは、末尾のリングファイルのサイズ分だけ書き込む
+        if len(data) > self.__size:
+            self.__written += len(data) - self.__size
+            data = data[-self.__size:]
+
+        offset = self.__written % self.__size
+        first_length = min(len(data), self.__size - offset)
+        self.__mmap[offset:offset + first_length] = data[:first_length]
+        if first_length < len(data):
+            self.__mmap[0:len(data) - first_length] = data[first_length:]
+        self.__written += len(data)
+
+
+    def __read(self, start: int, end: int) -> bytes:
+        """
+        リングファイルからデータを読み出す (末尾に達したら先頭に戻って読み出す)
+
+        Args:
+            start (int): 読み出す範囲の先頭の位置 (累計書き込みバイト数で表した位置)
+            end (int): 読み出す範囲の末尾の位置 (累計書き込みバイト数で表した位置)
+
+        Returns:
+            bytes: 読み出したデータ
+        """
+
+        offset = start % self.__size
+        length = end - start
+        first_length = min(length, self.__size - offset)
+        if first_length == length:
+            return self.__mmap[offset:offset + length]
+        return self.__mmap[offset:offset + first_length] + self.__mmap[0:length - first_length]
@@ -0,0 +1,938 @@
+# Type Hints を指定できるように
+# ref: https://stackoverflow.com/a/33533514/17124142
+from __future__ import annotations
+
+import asyncio
+import os
+import queue
+import select
+import socket
+import ssl
+import stat
+import threading
+import time
+import urllib.parse
+from collections import deque
+from typing import Any, BinaryIO, cast, ClassVar, Literal
+
+from app.constants import API_REQUEST_HEADERS, CONFIG
+from app.utils import Logging
+from app.utils.EDCB import EDCBTuner
+from app.utils.Metrics import Metrics
+
+
+class TunerSession:
+    """
+    チャンネル (サービス) ごとにチューナーを共有するためのセッションを管理するクラス
+    同じチャンネルを複数の画質で視聴している場合でもチューナーは1つだけ起動し、受信した放送波を各画質のエンコードタスクに分配する
+    """
+
+    # 全てのチューナーセッションのインスタンスが格納される辞書
+    ## キーは (ネットワーク ID, サービス ID)
+    __instances: ClassVar[dict[tuple[int, int], TunerSession]] = {}
+
+    # 最後の購読者が購読を終了してから、実際にチューナーを終了するまでの猶予時間 (秒)
+    ## 猶予時間内に同じチャンネルのエンコードタスクが購読を開始した場合 (エンコードタスクの再起動時など) は、チューナーをそのまま再利用する
+    ## EDCB バックエンドでは猶予時間の間チューナーをアンロックしておき、チャンネル切り替え時にもチューナーが再利用されるようにする
+    CLOSE_GRACE_PERIOD = 3
+
+    # チューナーから一度に読み取る放送波のサイズ
+    ## R/W バッファ: 188B (TS Packet Size) * 256 = 48128B
+    CHUNK_SIZE = 48128
+
+    # 先行選局中に受信した放送波のうち、最初の購読者に引き継ぐ直近のチャンク数
+    ## 48128B * 64 = 約 3MB (地デジなら 1.5 秒分程度)
+    ## エンコーダーが映像の解析とキーフレームからのデコードをすぐに始められるだけの量があればよい
+    PRETUNE_BUFFERED_CHUNKS = 64
+
+
+    def __init__(self, network_id: int, service_id: int, transport_stream_id: int) -> None:
+        """
+        チューナーセッションを初期化する
+        直接インスタンス化せず、TunerSession.get() から取得すること
+
+        Args:
+            network_id (int): ネットワーク ID
+            service_id (int): サービス ID
+            transport_stream_id (int): トランスポートストリーム ID
+        """
+
+        # NID・SID・TSID を設定
+        self.network_id: int = network_id
+        self.service_id: int = service_id
+        self.transport_stream_id: int = transport_stream_id
+
+        # チューナーセッションの状態
+        ## Opening: チューナーをまだ起動していない (最初の購読者の購読開始時に起動する)
+        ## Running: チューナーから放送波を受信している
+        ## Closed: チューナーが終了したか、チューナーの起動に失敗した
+        self.state: Literal['Opening', 'Running', 'Closed'] = 'Opening'
+
+        # チューナーの起動に失敗した場合のエラーの種類
+        self.error: Literal['ConnectionFailed', 'TunerShortage', 'UnknownError'] | None = None
+
+        # EDCB のチューナーインスタンス (Mirakurun バックエンド利用時は常に None)
+        self.tuner: EDCBTuner | None = None
+
+        # 放送波を受信する EDCB の TCP ソケットまたは名前付きパイプ
+        self.__pipe_or_socket: BinaryIO | socket.socket | None = None
+
+        # Mirakurun の Service Stream API の接続と、レスポンスボディを読み取るタスク
+        self.__stream_reader: asyncio.StreamReader | None = None
+        self.__stream_writer: asyncio.StreamWriter | None = None
+        self.__stream_task: asyncio.Task[None] | None = None
+
+        # Mirakurun の Service Stream API に要求した優先度 (X-Mirakurun-Priority)
+        ## 先行選局中は -1 、視聴者が購読している間は 0 になる
+        self.__stream_priority: int = 0
+
+        # このチューナーセッションを購読しているエンコードタスクのリスト
+        self.__subscribers: list[TunerSessionSubscriber] = []
+
+        # チューナーの起動処理の排他ロック
+        ## 複数の画質のエンコードタスクがほぼ同時に購読を開始した場合でも、チューナーを1回だけ起動するために必要
+        self.__open_lock = asyncio.Lock()
+
+        # チューナーから読み取った放送波 TS の累計バイト数
+        ## Reader からしか書き換えないので、ロックを取らずに読み書きできる
+        ## 放送波を読み取るたびに時刻を取得してロック付きで更新するのは無駄が大きいため、
+        ## 最終読み取り時刻は getTSReadAt() が呼ばれたときに、前回から累計バイト数が増えているかどうかで判定する
+        self.__read_bytes: int = 0
+        self.__read_bytes_checked: int = 0
+
+        # チューナーからの放送波 TS の最終読み取り時刻 (単調増加時間)
+        ## 単に時刻を比較する用途でしか使わないので、time.monotonic() から取得した単調増加時間が入る
+        self.__ts_read_at: float = time.monotonic()
+
+        # チューナーとの接続が切断されたかどうか
+        self.__disconnected: bool = False
+
+        # 先行選局中に受信した直近の放送波のバッファ
+        ## 先行選局中 (購読者がいない状態でチューナーを起動している間) のみ deque が入り、それ以外は None
+        self.__pretune_buffer: deque[bytes] | None = None
+
+
+    @classmethod
+    def get(cls, network_id: int, service_id: int, transport_stream_id: int) -> TunerSession:
+        """
+        チャンネルに対応するチューナーセッションを取得する
+        チューナーセッションが存在しない場合 (既に終了している場合を含む) は、新しく生成する
+
+        Args:
+            network_id (int): ネットワーク ID
+            service_id (int): サービス ID
+            transport_stream_id (int): トランスポートストリーム ID
+
+        Returns:
+            TunerSession: チューナーセッションのインスタンス
+        """
+
+        session = cls.__instances.get((network_id, service_id))
+
+        # チューナーセッションが存在しないか、既に終了している
+        ## アンロック中に別のチャンネルのチューナーインスタンスへ制御権限が委譲された (=別のチャンネルに切り替えられた) 場合も、
+        ## このチューナーセッションからはもう視聴対象のチャンネルの放送波を受信できないため、新しいチューナーセッションを生成する
+        if (session is None or session.state == 'Closed' or session.isDisconnected() is True or
+            (session.tuner is not None and session.tuner.delegated is True)):
+            session = TunerSession(network_id, service_id, transport_stream_id)
+            cls.__instances[(network_id, service_id)] = session
+
+        return session
+
+
+    async def subscribe(self, stdin: Any) -> TunerSessionSubscriber | None:
+        """
+        チューナーセッションの購読を開始する
+        チューナーがまだ起動していなければ起動し、受信した放送波を stdin (tsreadex の標準入力) に随時書き込む
+
+        Args:
+            stdin (Any): 放送波を書き込むファイルライクオブジェクト (tsreadex の標準入力)
+
+        Returns:
+            TunerSessionSubscriber | None: 購読者のインスタンス (チューナーの起動に失敗した場合は None)
+        """
+
+        async with self.__open_lock:
+
+            # まだチューナーを起動していなければ起動する
+            if self.state == 'Opening':
+                await self.__open()
+
+            # チューナーの起動に失敗したか、既にチューナーが終了している
+            if self.state != 'Running':
+                return None
+
+            # 既に放送波を受信しているチューナーを再利用する場合
+            if len(self.__subscribers) > 0:
+                Logging.info(f'[Tuner: NID{self.network_id}-SID{self.service_id}] '
+                             f'Reusing the running tuner. ({len(self.__subscribers) + 1} subscribers)')
+
+            # 先行選局中のチューナーであれば先行選局を終了し、貯めておいた直近の放送波を最初に書き込む
+            ## チューナーの起動を待たずに、すぐにエンコーダーに放送波を渡せる
+            buffered_chunks: list[bytes] | None = None
+            if self.__pretune_buffer is not None:
+
+                # Mirakurun の先行選局の放送波は優先度 -1 で要求しているため、視聴者に渡す前に通常の優先度で要求し直す
+                ## 優先度 -1 のままでは、ほかのクライアント (別のチャンネルを視聴している KonomiTV を含む) の要求で視聴中にチューナーを奪われてしまう
+                ## 先行選局中に貯めた放送波は、新しい接続から放送波を受信し始めるまでを埋めるためだけに使う
+                if self.__stream_priority < 0:
+                    await self.__reopenMirakurunStream()
+                    if self.state != 'Running':
+                        self.__pretune_buffer = None
+                        return None
+
+                buffered_chunks = list(self.__pretune_buffer)
+                self.__pretune_buffer = None
+                Metrics.TUNER_PRETUNE_HITS.inc()
+                Logging.info(f'[Tuner: NID{self.network_id}-SID{self.service_id}] '
+                             f'Using the pre-tuned tuner. ({len(buffered_chunks)} buffered chunks)')
+
+            # 購読者を登録する
+            subscriber = TunerSessionSubscriber(self, stdin, buffered_chunks)
+            self.__subscribers.append(subscriber)
+            self.updateLock()
+
+        return subscriber
+
+
+    async def pretune(self) -> bool:
+        """
+        購読者がいない状態でチューナーを先行して起動し、受信した直近の放送波だけをバッファに貯めておく (先行選局)
+        このチャンネルに切り替えられた際に、チューナーの起動を待たずにエンコードを始められるようにするために使う
+        視聴者のチューナーの利用を妨げないよう、Mirakurun では優先度を下げて放送波を要求し、
+        EDCB では起動中のほかのチューナーを再利用せずに起動した上で、アンロックしたままにする (視聴者のチューナーの起動時に再利用される)
+
+        Returns:
+            bool: 先行選局を開始できたかどうか (チューナーの起動に失敗したか、既に購読者がいる場合は False)
+        """
+
+        async with self.__open_lock:
+
+            # 購読者の購読終了後の猶予時間の間であれば、起動中のチューナーをそのまま先行選局に使う
+            if self.state == 'Running' and len(self.__subscribers) == 0 and self.__disconnected is False:
+                if self.__pretune_buffer is None:
+                    self.__pretune_buffer = deque(maxlen=self.PRETUNE_BUFFERED_CHUNKS)
+                return True
+
+            # 既にチューナーが起動しているか、既に終了している
+            if self.state != 'Opening':
+                return False
+
+            # 放送波の受信を始める前にバッファを用意しておき、受信した放送波を最初から貯められるようにする
+            self.__pretune_buffer = deque(maxlen=self.PRETUNE_BUFFERED_CHUNKS)
+            await self.__open()
+            if self.state != 'Running':
+                self.__pretune_buffer = None
+                return False
+
+            # 購読者がいないのでアンロックされる (EDCB バックエンドのみ)
+            self.updateLock()
+            Logging.info(f'[Tuner: NID{self.network_id}-SID{self.service_id}] Pre-tuned the tuner.')
+
+        return True
+
+
+    async def cancelPretune(self) -> None:
+        """
+        先行選局を終了する
+        既に購読者がいる (先行選局したチャンネルに切り替えられた) 場合は何もしない
+        """
+
+        if self.__pretune_buffer is None:
+            return
+        self.__pretune_buffer = None
+
+        # 購読者がいなければチューナーを終了する
+        if len(self.__subscribers) == 0:
+            await self.close()
+
+
+    def isPretuned(self) -> bool:
+        """
+        先行選局中 (購読者がいない状態でチューナーを起動している) かどうかを取得する
+
+        Returns:
+            bool: 先行選局中かどうか
+        """
+
+        return self.__pretune_buffer is not None
+
+
+    def resubscribe(self, subscriber: TunerSessionSubscriber, stdin: Any) -> TunerSessionSubscriber | None:
+        """
+        購読者の放送波の書き込み先を、新しく起動した tsreadex の標準入力に切り替える (エンコーダーのホットリスタート時に使う)
+        チューナーは起動したまま購読者を入れ替え、まだ tsreadex に書き込まれていない放送波は新しい購読者に引き継ぐ
+
+        Args:
+            subscriber (TunerSessionSubscriber): 入れ替える購読者のインスタンス
+            stdin (Any): 放送波を書き込むファイルライクオブジェクト (新しい tsreadex の標準入力)
+
+        Returns:
+            TunerSessionSubscriber | None: 新しい購読者のインスタンス (チューナーが終了しているか、チューナーとの接続が切断されている場合は None)
+        """
+
+        # チューナーが終了しているか、チューナーとの接続が切断されている
+        if self.state != 'Running' or self.__disconnected is True or subscriber not in self.__subscribers:
+            return None
+
+        # 古い購読者への書き込みを終了し、書き込まれていない放送波を引き継いだ新しい購読者に入れ替える
+        ## 購読者のリストから外すと購読者がいなくなりチューナーが終了されかねないため、リスト内の同じ位置で入れ替える
+        new_subscriber = TunerSessionSubscriber(self, stdin, subscriber.detach())
+        new_subscriber.idling = subscriber.idling
+        self.__subscribers[self.__subscribers.index(subscriber)] = new_subscriber
+        Logging.info(f'[Tuner: NID{self.network_id}-SID{self.service_id}] Switched the subscriber to the restarted encoder.')
+
+        return new_subscriber
+
+
+    async def unsubscribe(self, subscriber: TunerSessionSubscriber) -> None:
+        """
+        チューナーセッションの購読を終了する
+        購読者がいなくなり、猶予時間内に新たな購読者が現れなかった場合はチューナーを終了する
+
+        Args:
+            subscriber (TunerSessionSubscriber): 購読を終了する購読者のインスタンス
+        """
+
+        # 購読者への放送波の書き込みを終了する
+        subscriber.close()
+        if subscriber in self.__subscribers:
+            self.__subscribers.remove(subscriber)
+
+        # まだ他の購読者がいる場合は、チューナーを起動したままにする
+        if len(self.__subscribers) > 0:
+            self.updateLock()
+            return
+
+        # EDCB バックエンドの場合はチューナーをアンロックし、チャンネル切り替え時に新しいエンコードタスクで再利用できるようにする
+        if self.tuner is not None:
+            self.tuner.unlock()
+
+        # 猶予時間の間に新たな購読者が現れるのを待つ
+        ## 猶予時間の間にチューナーの制御権限が別のチャンネルのチューナーインスタンスに委譲されれば、実際にチューナーが閉じられることはない
+        ## 猶予時間の間に先行選局に使われた場合も、チューナーを起動したままにする
+        await asyncio.sleep(self.CLOSE_GRACE_PERIOD)
+        if len(self.__subscribers) > 0 or self.__pretune_buffer is not None:
+            return
+
+        # チューナーを終了する
+        await self.close()
+
+
+    async def close(self) -> None:
+        """
+        チューナーセッションを終了し、チューナーを終了する
+        """
+
+        # 既に終了している
+        if self.state == 'Closed':
+            return
+
+        # 状態を Closed に設定し、Reader を終了させる
+        self.state = 'Closed'
+        if TunerSession.__instances.get((self.network_id, self.service_id)) is self:
+            TunerSession.__instances.pop((self.network_id, self.service_id))
+
+        # 残っている購読者がいれば書き込みを終了する
+        for subscriber in self.__subscribers:
+            subscriber.close()
+        self.__subscribers.clear()
+
+        # Mirakurun の Service Stream API の接続を閉じ、レスポンスボディを読み取るタスクを終了させる
+        if self.__stream_writer is not None:
+            self.__stream_writer.close()
+
+        # チューナーを終了する (EDCB バックエンドのみ)
+        # Idling に移行しアンロック状態になっている間にチューナーが再利用された場合、制御権限をもう持っていないため実際には何も起こらない
+        if self.tuner is not None:
+            await self.tuner.close()
+
+
+    def updateLock(self) -> None:
+        """
+        購読者の状態に応じて、チューナーをロック/アンロックする (EDCB バックエンドのみ)
+        購読しているエンコードタスクのうち1つでも Idling でなければロックし、すべて Idling になったらアンロックする
+        """
+
+        if self.tuner is None:
+            return
+
+        if all(subscriber.idling is True for subscriber in self.__subscribers):
+            self.tuner.unlock()
+        else:
+            self.tuner.lock()
+
+
+    def getTSReadAt(self) -> float:
+        """
+        チューナーからの放送波 TS の最終読み取り時刻 (単調増加時間) を取得する
+
+        Returns:
+            float: 放送波 TS の最終読み取り時刻 (time.monotonic() の値)
+        """
+
+        # 前回の呼び出しから累計バイト数が増えていれば、放送波 TS を読み取れているとみなして最終読み取り時刻を更新する
+        ## イベントループ上からのみ呼び出されるため、最終読み取り時刻の更新にロックは不要
+        read_bytes = self.__read_bytes
+        if read_bytes != self.__read_bytes_checked:
+            self.__read_bytes_checked = read_bytes
+            self.__ts_read_at = time.monotonic()
+        return self.__ts_read_at
+
+
+    def getReadBytes(self) -> int:
+        """
+        チューナーから読み取った放送波 TS の累計バイト数を取得する
+
+        Returns:
+            int: 放送波 TS の累計バイト数
+        """
+
+        return self.__read_bytes
+
+
+    def isDisconnected(self) -> bool:
+        """
+        チューナーとの接続が切断されたかどうかを取得する
+
+        Returns:
+            bool: チューナーとの接続が切断されたかどうか
+        """
+
+        return self.__disconnected
+
+
+    async def __open(self) -> None:
+        """
+        チューナーを起動して放送波の受信を開始する
+        起動に失敗した場合は、状態を Closed に設定し、エラーの種類を self.error に設定する
+        """
+
+        # 先行選局のためにチューナーを起動するかどうか
+        is_pretune = self.__pretune_buffer is not None
+
+        # Mirakurun バックエンド
+        if CONFIG['general']['backend'] == 'Mirakurun':
+
+            # 先行選局では、視聴者のチューナーの利用を妨げないよう優先度を下げて放送波を要求する
+            if await self.__openMirakurunStream(-1 if is_pretune is True else 0) is True:
+                self.state = 'Running'
+            return
+
+        # EDCB バックエンド
+        elif CONFIG['general']['backend'] == 'EDCB':
+
+            # チューナーインスタンスを初期化
+            ## 先行選局では、Idling のライブストリームや他の先行選局のアンロック状態のチューナーを奪わないよう、チューナーを再利用しない
+            self.tuner = EDCBTuner(self.network_id, self.service_id, self.transport_stream_id, reuse=not is_pretune)
+
+            # チューナーを起動する
+            # アンロック状態のチューナーインスタンスがあれば、自動的にそのチューナーが再利用される
+            # 成功時は tuner.close() するか予約などに割り込まれるまで起動しつづけるので注意
+            if await self.tuner.open() is False:
+                await self.tuner.close()
+                self.__fail('TunerShortage')
+                return
+
+            # チューナーをロックする
+            # ロックしないと途中でチューナーの制御を横取りされてしまう
+            self.tuner.lock()
+
+            # チューナーに接続する
+            # 放送波が送信される TCP ソケットまたは名前付きパイプを取得する
+            self.__pipe_or_socket = await self.tuner.connect()
+            if self.__pipe_or_socket is None:
+                await self.tuner.close()
+                self.__fail('ConnectionFailed')
+                return
+
+        # 放送波の受信を開始する
+        self.state = 'Running'
+
+        # threading を使うのが重要、asyncio.to_thread() を使うとボトルネックになる
+        threading.Thread(target=self.__reader, daemon=True).start()
+
+
+    async def __openMirakurunStream(self, priority: int) -> bool:
+        """
+        Mirakurun の Service Stream API に放送波を要求し、受信を開始する
+        要求に失敗した場合は、状態を Closed に設定し、エラーの種類を self.error に設定する
+
+        Args:
+            priority (int): チューナーの優先度 (X-Mirakurun-Priority)
+
+        Returns:
+            bool: 放送波の受信を開始できたかどうか
+        """
+
+        # Mirakurun 形式のサービス ID
+        # NID と SID を 5 桁でゼロ埋めした上で int に変換する
+        mirakurun_service_id = int(str(self.network_id).zfill(5) + str(self.service_id).zfill(5))
+        # Mirakurun の Service Stream API の URL を作成
+        mirakurun_url = urllib.parse.urlsplit(CONFIG['general']['mirakurun_url'])
+        mirakurun_stream_api_path = f'{mirakurun_url.path.rstrip("/")}/api/services/{mirakurun_service_id}/stream'
+
+        # Mirakurun の Service Stream API へ HTTP リクエストを開始
+        ## requests を別スレッドで動かすとチャンクごとにスレッドとの受け渡しが発生するため、asyncio のストリームで直接受信する
+        ## レスポンスヘッダーを受信した時点で処理を進め、レスポンスボディは __mirakurunReader() で随時受信する
+        request_started_at = time.monotonic()
+        try:
+            self.__stream_reader, self.__stream_writer, status_code, response_headers = await asyncio.wait_for(
+                self.__requestMirakurun(mirakurun_url, mirakurun_stream_api_path, priority),
+                timeout = 15,
+            )
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            Metrics.BACKEND_REQUEST_DURATION.observe('Mirakurun', 'GET /api/services/stream', 'error', value=time.monotonic() - request_started_at)
+            self.__fail('ConnectionFailed')
+            return False
+        except (IndexError, ValueError):
+            Metrics.BACKEND_REQUEST_DURATION.observe('Mirakurun', 'GET /api/services/stream', 'error', value=time.monotonic() - request_started_at)
+            self.__fail('UnknownError')
+            return False
+        Metrics.BACKEND_REQUEST_DURATION.observe('Mirakurun', 'GET /api/services/stream', str(status_code), value=time.monotonic() - request_started_at)
+
+        # Mirakurun の Service Stream API からエラーが返された
+        if status_code != 200:
+            self.__stream_writer.close()
+            self.__fail('TunerShortage' if status_code == 503 else 'UnknownError')
+            return False
+
+        # 放送波の受信を開始する
+        self.__stream_priority = priority
+        self.__stream_task = asyncio.create_task(self.__mirakurunReader(
+            self.__stream_reader, self.__stream_writer, response_headers.get('transfer-encoding', '').lower() == 'chunked'))
+        return True
+
+
+    async def __reopenMirakurunStream(self) -> None:
+        """
+        先行選局のために優先度を下げて要求した Mirakurun の Service Stream API の放送波を、通常の優先度で要求し直す
+        通常の優先度の接続で受信を始めてから、先行選局の接続を閉じる (同じチャンネルのため、Mirakurun では同じチューナーが使われる)
+        要求し直せなかった場合は、先行選局の接続も閉じて状態を Closed に設定する
+        """
+
+        pretune_writer = self.__stream_writer
+        if await self.__openMirakurunStream(0) is True:
+            Logging.info(f'[Tuner: NID{self.network_id}-SID{self.service_id}] Re-requested the pre-tuned stream at the normal priority.')
+
+        # 先行選局の接続を閉じる
+        ## 先行選局の接続の __mirakurunReader() は、自身の接続が使われなくなったことを検知して終了する
+        if pretune_writer is not None:
+            pretune_writer.close()
+
+
+    def __fail(self, error: Literal['ConnectionFailed', 'TunerShortage', 'UnknownError']) -> None:
+        """
+        チューナーの起動に失敗したときに、チューナーセッションを終了状態にする
+
+        Args:
+            error (Literal['ConnectionFailed', 'TunerShortage', 'UnknownError']): エラーの種類
+        """
+
+        self.state = 'Closed'
+        self.error = error
+        if TunerSession.__instances.get((self.network_id, self.service_id)) is self:
+            TunerSession.__instances.pop((self.network_id, self.service_id))
+
+
+    async def __requestMirakurun(self, url: urllib.parse.SplitResult, path: str, priority: int) -> tuple[asyncio.StreamReader, asyncio.StreamWriter, int, dict[str, str]]:
+        """
+        Mirakurun に HTTP リクエストを送信し、ステータス行とレスポンスヘッダーまでを受信する
+
+        Args:
+            url (urllib.parse.SplitResult): Mirakurun の URL
+            path (str): リクエストパス
+            priority (int): チューナーの優先度 (X-Mirakurun-Priority) 、チューナーが足りない場合は優先度の低い要求から中断される
+
+        Returns:
+            tuple[asyncio.StreamReader, asyncio.StreamWriter, int, dict[str, str]]: 接続・ステータスコード・レスポンスヘッダー (キーは小文字)
+        """
+
+        # Mirakurun に接続する
+        is_https = url.scheme == 'https'
+        reader, writer = await asyncio.open_connection(
+            cast(str, url.hostname),
+            url.port or (443 if is_https else 80),
+            ssl = ssl.create_default_context() if is_https else None,
+        )
+
+        try:
+
+            # リクエストヘッダーを組み立てて送信する
+            ## レスポンスの終端を判定しやすくするため、Keep-Alive は使わず接続を閉じる
+            request_head = f'GET {path} HTTP/1.1\r\nHost: {url.netloc}\r\nConnection: close\r\nX-Mirakurun-Priority: {priority}\r\n'
+            for key, value in API_REQUEST_HEADERS.items():
+                request_head += f'{key}: {value}\r\n'
+            writer.write(request_head.encode('latin-1') + b'\r\n')
+            await writer.drain()
+
+            # ステータス行とレスポンスヘッダーを読み取る
+            status_line = await reader.readline()
+            status_code = int(status_line.split(b' ')[1])
+            response_headers: dict[str, str] = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                key, value = line.decode('latin-1').split(':', 1)
+                response_headers[key.strip().lower()] = value.strip()
+
+        # 途中で失敗した場合やタイムアウトでキャンセルされた場合は、接続を閉じてから例外を送出する
+        except BaseException:
+            writer.close()
+            raise
+
+        return reader, writer, status_code, response_headers
+
+
+    async def __mirakurunReader(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, is_chunked: bool) -> None:
+        """
+        Mirakurun の Service Stream API のレスポンスボディから放送波を読み取り、すべての購読者に分配する
+        優先度を変えて放送波を要求し直した (このチューナーセッションの接続が入れ替わった) 場合は、古い接続の受信を終了する
+
+        Args:
+            reader (asyncio.StreamReader): Service Stream API の接続のストリーム
+            writer (asyncio.StreamWriter): Service Stream API の接続のストリーム
+            is_chunked (bool): レスポンスボディがチャンク転送エンコーディングかどうか
+        """
+
+        # Mirakurun から受信した放送波を随時すべての購読者に分配する
+        try:
+            while self.state != 'Closed' and self.__stream_writer is writer:
+
+                # チャンク転送エンコーディング
+                ## 1つのチャンクが大きい場合は CHUNK_SIZE ごとに分割して分配する
+                if is_chunked is True:
+                    chunk_size = int((await reader.readline()).split(b';')[0].strip(), 16)
+                    if chunk_size == 0:
+                        break
+                    while chunk_size > 0 and self.state != 'Closed' and self.__stream_writer is writer:
+                        chunk = await reader.readexactly(min(chunk_size, self.CHUNK_SIZE))
+                        chunk_size -= len(chunk)
+                        self.__distribute(chunk)
+                    await reader.readexactly(2)  # チャンク末尾の \r\n
+
+                # 接続が閉じられるまで読み取る
+                else:
+                    chunk = await reader.read(self.CHUNK_SIZE)
+                    if chunk == b'':
+                        break
+                    self.__distribute(chunk)
+
+        except (OSError, asyncio.IncompleteReadError, ValueError):
+            pass
+
+        # チューナーセッションの終了や接続の入れ替え以外の要因で受信が終了した場合は、チューナーとの接続が切断されたものとする
+        if self.state != 'Closed' and self.__stream_writer is writer:
+            self.__disconnected = True
+            Logging.warning(f'[Tuner: NID{self.network_id}-SID{self.service_id}] The connection to the tuner was lost.')
+
+        # タスクを終える前に、Mirakurun との接続を明示的に閉じる
+        writer.close()
+
+
+    def __reader(self) -> None:
+        """
+        EDCB のチューナーから放送波を読み取り、すべての購読者に分配する (別スレッドで実行される)
+        """
+
+        pipe_or_socket = self.__pipe_or_socket
+
+        # 放送波を読み取るバッファ
+        ## チャンクごとに bytes を確保しないよう、同じバッファを使い回して recv_into() / readinto() で読み取る
+        buffer = bytearray(self.CHUNK_SIZE)
+        view = memoryview(buffer)
+
+        # 放送波の読み取り関数と、os.splice() でカーネル内で直接転送できる場合の読み取り元のファイルディスクリプタ
+        ## os.splice() は Linux でしか使えない
+        ## 名前付きパイプはバッファ付きのファイルオブジェクトで読み取るため、バッファとの順序が崩れないよう直接転送はしない
+        source_fileno: int | None = None
+        source_timeout: float | None = None
+        if type(pipe_or_socket) is socket.socket:
+            # EDCB の TCP ソケットから受信
+            read_into = pipe_or_socket.recv_into
+            if hasattr(os, 'splice'):
+                source_fileno = pipe_or_socket.fileno()
+                source_timeout = pipe_or_socket.gettimeout()
+        else:
+            # EDCB の名前付きパイプから受信
+            read_into = cast(Any, pipe_or_socket).readinto
+
+        # 直接転送中の購読者と、直接転送先の tsreadex の標準入力を複製したファイルディスクリプタ
+        splice_subscriber: TunerSessionSubscriber | None = None
+        splice_fileno: int = -1
+
+        # EDCB から受信した放送波を随時すべての購読者に分配する
+        try:
+            while self.state != 'Closed':
+
+                # 購読者が1つだけでかつ tsreadex の標準入力がパイプであれば、カーネル内で直接転送する
+                ## 購読者が複数いる場合は、購読者ごとのバッファに積むために1回だけコピーが必要になる
+                subscribers = tuple(self.__subscribers)
+                target = subscribers[0] if source_fileno is not None and len(subscribers) == 1 else None
+                if target is not splice_subscriber or (splice_subscriber is not None and splice_subscriber.isClosed() is True):
+                    if splice_subscriber is not None:
+                        os.close(splice_fileno)
+                        splice_subscriber = None
+                    if target is not None:
+                        fileno = target.dupSpliceFileno()
+                        if fileno is not None:
+                            splice_subscriber = target
+                            splice_fileno = fileno
+
+                # カーネル内で直接 tsreadex の標準入力に転送する
+                if splice_subscriber is not None:
+                    try:
+                        length = os.splice(cast(int, source_fileno), splice_fileno, self.CHUNK_SIZE)
+                    except BlockingIOError:
+                        # タイムアウトが設定されたソケットはノンブロッキングモードになっているため、受信できるまで待つ
+                        ## recv() と同様に、タイムアウトまでに受信できなければチューナーとの接続が切断されたものとする
+                        if len(select.select([cast(int, source_fileno)], [], [], source_timeout)[0]) == 0:
+                            break
+                        continue
+                    except BrokenPipeError:
+                        # tsreadex が終了しているため、この購読者への書き込みを終了する
+                        splice_subscriber.close()
+                        continue
+                    if length == 0:
+                        break
+                    self.__read_bytes += length
+
+                # 受信した放送波を各購読者のバッファに積む
+                ## 実際の tsreadex への書き込みは購読者ごとのスレッドで行うため、1つのエンコーダーが詰まっても他の画質には影響しない
+                else:
+                    length = read_into(view)
+                    if not length:
+                        break
+                    self.__distribute(view[:length].tobytes(), subscribers)
+
+        except OSError:
+            pass
+
+        finally:
+            if splice_subscriber is not None:
+                os.close(splice_fileno)
+
+        # チューナーセッションの終了以外の要因で受信が終了した場合は、チューナーとの接続が切断されたものとする
+        if self.state != 'Closed':
+            self.__disconnected = True
+            Logging.warning(f'[Tuner: NID{self.network_id}-SID{self.service_id}] The connection to the tuner was lost.')
+
+        # スレッドを終える前に、チューナーとの接続を明示的に閉じる
+        if pipe_or_socket is not None:
+            pipe_or_socket.close()
+
+
+    def __distribute(self, chunk: bytes, subscribers: tuple[TunerSessionSubscriber, ...] | None = None) -> None:
+        """
+        受信した放送波をすべての購読者のバッファに積む
+
+        Args:
+            chunk (bytes): 受信した放送波
+            subscribers (tuple[TunerSessionSubscriber, ...] | None): 分配先の購読者 (省略時は現在のすべての購読者)
+        """
+
+        self.__read_bytes += len(chunk)
+
+        # 先行選局中であれば、直近の放送波だけをバッファに貯めておく
+        pretune_buffer = self.__pretune_buffer
+        if pretune_buffer is not None:
+            pretune_buffer.append(chunk)
+
+        for subscriber in (subscribers if subscribers is not None else tuple(self.__subscribers)):
+            subscriber.push(chunk)
+
+
+class TunerSessionSubscriber:
+    """ チューナーセッションから分配される放送波を、1つのエンコードタスクの tsreadex に書き込むクラス """
+
+    # 購読者ごとのバッファに貯められる最大チャンク数
+    ## 48128B * 256 = 約 12MB (放送波の最大ビットレートでも 5 秒分程度)
+    ## エンコーダーが詰まってバッファが溢れた場合は、メモリを使い果たさないように新しいチャンクを破棄する
+    MAX_BUFFERED_CHUNKS = 256
+
+
+    def __init__(self, session: TunerSession, stdin: Any, buffered_chunks: list[bytes] | None = None) -> None:
+        """
+        購読者を初期化し、tsreadex への書き込みスレッドを開始する
+
+        Args:
+            session (TunerSession): 購読するチューナーセッション
+            stdin (Any): 放送波を書き込むファイルライクオブジェクト (tsreadex の標準入力)
+            buffered_chunks (list[bytes] | None): 最初に書き込む放送波 (入れ替える前の購読者から引き継いだもの)
+        """
+
+        # 購読しているチューナーセッション
+        self.session: TunerSession = session
+
+        # 購読しているエンコードタスクのライブストリームが Idling かどうか
+        ## 全ての購読者が Idling になった場合のみ、チューナーがアンロックされる
+        self.idling: bool = False
+
+        # 放送波を書き込む tsreadex の標準入力
+        self.__stdin = stdin
+
+        # tsreadex の標準入力がパイプの場合は、そのファイルディスクリプタ
+        ## チューナーセッションの購読者がこの購読者だけのときは、チューナーから os.splice() で直接転送するために使う
+        ## エンコーダーノードの標準入力 (RemoteEncoder.Stdin) のようにファイルディスクリプタを持たない場合は None
+        self.__stdin_fileno: int | None = None
+        try:
+            stdin_fileno = stdin.fileno()
+            if stat.S_ISFIFO(os.fstat(stdin_fileno).st_mode):
+                self.__stdin_fileno = stdin_fileno
+        except (AttributeError, OSError, ValueError):
+            pass
+
+        # tsreadex の標準入力を閉じる処理と、直接転送用にファイルディスクリプタを複製する処理の排他ロック
+        ## 閉じられたファイルディスクリプタの番号が再利用され、別のファイルに書き込んでしまうのを防ぐ
+        self.__stdin_lock = threading.Lock()
+
+        # tsreadex に書き込む前の放送波を貯めるバッファ
+        ## None は書き込みスレッドを終了させるための番兵
+        self.__queue: queue.Queue[bytes | None] = queue.Queue(maxsize=self.MAX_BUFFERED_CHUNKS)
+        for chunk in (buffered_chunks or [])[-self.MAX_BUFFERED_CHUNKS:]:
+            self.__queue.put_nowait(chunk)
+
+        # 購読を終了したかどうか
+        self.__closed: bool = False
+
+        # バッファが溢れて破棄したチャンクの数
+        self.__dropped_chunks: int = 0
+
+        # threading を使うのが重要、asyncio.to_thread() を使うとボトルネックになる
+        threading.Thread(target=self.__writer, daemon=True).start()
+
+
+    def push(self, chunk: bytes) -> None:
+        """
+        チューナーから受信した放送波をバッファに積む (チューナーセッションの Reader スレッドから呼ばれる)
+
+        Args:
+            chunk (bytes): 受信した放送波
+        """
+
+        if self.__closed is True:
+            return
+
+        try:
+            self.__queue.put_nowait(chunk)
+        except queue.Full:
+            # 最初に溢れたときと、以降 256 チャンクごとにログを出力する
+            if self.__dropped_chunks % self.MAX_BUFFERED_CHUNKS == 0:
+                Logging.warning(f'[Tuner: NID{self.session.network_id}-SID{self.session.service_id}] '
+                                f'The encoder is not consuming the stream fast enough. Dropped {self.__dropped_chunks + 1} chunks.')
+            self.__dropped_chunks += 1
+
+
+    def isClosed(self) -> bool:
+        """
+        購読を終了したかどうかを取得する
+
+        Returns:
+            bool: 購読を終了したかどうか
+        """
+
+        return self.__closed
+
+
+    def dupSpliceFileno(self) -> int | None:
+        """
+        チューナーから os.splice() で直接転送するために、tsreadex の標準入力のファイルディスクリプタを複製して返す (チューナーセッションの Reader スレッドから呼ばれる)
+        バッファに書き込み待ちの放送波が残っている場合は、順序が崩れるため直接転送できない
+        複製したファイルディスクリプタは、呼び出し元で閉じる必要がある
+
+        Returns:
+            int | None: 複製したファイルディスクリプタ (直接転送できない場合は None)
+        """
+
+        # 放送波を読み取るたびに呼ばれるため、直接転送できないことが明らかな場合はロックを取らずに返す
+        if self.__stdin_fileno is None or self.__queue.unfinished_tasks > 0:
+            return None
+
+        with self.__stdin_lock:
+            if self.__closed is True:
+                return None
+            # 書き込みスレッドでバッファリングされたまま残っている放送波を先に書き出す
+            try:
+                self.__stdin.flush()
+                return os.dup(self.__stdin_fileno)
+            except (OSError, ValueError):
+                return None
+
+
+    def setIdling(self, idling: bool) -> None:
+        """
+        購読しているエンコードタスクのライブストリームが Idling かどうかを設定し、チューナーのロック状態に反映する
+
+        Args:
+            idling (bool): Idling かどうか
+        """
+
+        self.idling = idling
+        self.session.updateLock()
+
+
+    def close(self) -> None:
+        """
+        tsreadex への書き込みを終了する
+        バッファに残っている放送波は破棄され、tsreadex の標準入力が閉じられる
+        """
+
+        self.detach()
+
+
+    def detach(self) -> list[bytes]:
+        """
+        tsreadex への書き込みを終了し、バッファに残っている (まだ tsreadex に書き込まれていない) 放送波を返す
+        tsreadex の標準入力は閉じられる
+
+        Returns:
+            list[bytes]: バッファに残っていた放送波のリスト (既に書き込みを終了している場合は空のリスト)
+        """
+
+        if self.__closed is True:
+            return []
+        self.__closed = True
+
+        # バッファを空にしてから番兵を積み、書き込みスレッドを終了させる
+        chunks: list[bytes] = []
+        try:
+            while True:
+                chunk = self.__queue.get_nowait()
+                if chunk is not None:
+                    chunks.append(chunk)
+        except queue.Empty:
+            pass
+        self.__queue.put_nowait(None)
+
+        return chunks
+
+
+    def __writer(self) -> None:
+        """
+        バッファに積まれた放送波を tsreadex の標準入力に書き込む (別スレッドで実行される)
+        """
+
+        while True:
+
+            chunk = self.__queue.get()
+            if chunk is None:
+                break
+
+            # ストリームデータを tsreadex の標準入力に書き込む
+            ## BrokenPipeError や OSError が発生した場合は回復不可能なため、書き込みを終了
+            ## 書き込み待ちの放送波が残っていないかを dupSpliceFileno() で判定するため、書き込み後に task_done() を呼ぶ
+            try:
+                self.__stdin.write(chunk)
+            except OSError:
+                self.__closed = True
+                break
+            finally:
+                self.__queue.task_done()
+
+        # スレッドを終える前に、tsreadex の標準入力を明示的に閉じる
+        with self.__stdin_lock:
+            try:
+                self.__stdin.close()
+            except OSError:
+                pass
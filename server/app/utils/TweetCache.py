@@ -0,0 +1,186 @@
+# Type Hints を指定できるように
+# ref: https://stackoverflow.com/a/33533514/17124142
+from __future__ import annotations
+
+import asyncio
+import time
+import weakref
+from collections import OrderedDict
+from typing import Awaitable, Callable, ClassVar, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from app import schemas
+
+
+class TweetCache:
+    """
+    Twitter API から取得したホームタイムラインと検索結果をキャッシュするクラス
+    ホームタイムラインは Twitter アカウントごとに直近のツイートを保持し、差分だけを Twitter API から取得して先頭に追加していく
+    検索結果は同じ Twitter アカウントで同じ検索クエリ (番組のハッシュタグなど) を繰り返し検索したときに使い回す
+    検索結果には検索したアカウントからしか見えない鍵アカウントのツイートや、そのアカウントでのリツイート済み・いいね済みかどうかが含まれるため、
+    ホームタイムラインと同様に Twitter アカウントごとにキャッシュし、他のアカウントとは共有しない
+    """
+
+    # ホームタイムラインを Twitter API から取得し直さずに、キャッシュから返す時間 (秒)
+    TIMELINE_TTL = 10
+
+    # キャッシュしたホームタイムラインを破棄し、最新のツイートから取得し直すまでの時間 (秒)
+    ## 差分だけを取得していると、キャッシュしたツイートのリツイート数やいいね数などが更新されないため
+    TIMELINE_MAX_AGE = 5 * 60
+
+    # Twitter アカウントごとにキャッシュするツイートの最大数 (Twitter API で一度に取得できる最大数と同じ)
+    MAX_TIMELINE_TWEETS = 200
+
+    # 同じ Twitter アカウント・同じ検索クエリの検索結果を Twitter API から取得し直さずに、キャッシュから返す時間 (秒)
+    SEARCH_TTL = 10
+
+    # 検索結果をキャッシュする Twitter アカウントと検索クエリの組み合わせの最大数
+    ## 上限を超えた場合は、最も長く使われていない組み合わせの検索結果から破棄する
+    MAX_SEARCH_QUERIES = 64
+
+    # Twitter アカウントの ID をキーとした、差分を取得した時刻・最新のツイートから取得し直した時刻 (どちらも単調増加時間) と、
+    # 新しい順に並んだツイートのリストのタプルの辞書
+    __timelines: ClassVar[dict[int, tuple[float, float, list[schemas.Tweet]]]] = {}
+
+    # Twitter アカウントの ID と検索クエリのタプルをキーとした、検索した時刻 (単調増加時間) と検索結果のツイートのリストのタプルの辞書
+    ## 最近使われた順に末尾に並ぶ
+    __search_results: ClassVar[OrderedDict[tuple[int, str], tuple[float, list[schemas.Tweet]]]] = OrderedDict()
+
+    # キャッシュを破棄するたびに増やす世代番号
+    ## Twitter API から取得している間にキャッシュが破棄された (リツイート・いいねされたなど) 場合は、取得結果が古い可能性があるためキャッシュしない
+    __generation: ClassVar[int] = 0
+
+    # Twitter アカウントの ID または Twitter アカウントの ID と検索クエリのタプルをキーとした、Twitter API へのリクエストを1つにまとめるためのロックの辞書
+    ## 同時に同じホームタイムラインや検索結果を取得しようとした場合は、後から来た方は先に来た方の取得結果をキャッシュから返す
+    ## ロックを待っているリクエストがなくなったら自動的に破棄されるよう、弱参照で保持する
+    __locks: ClassVar[weakref.WeakValueDictionary[int | tuple[int, str], asyncio.Lock]] = weakref.WeakValueDictionary()
+
+
+    @classmethod
+    def __getLock(cls, key: int | tuple[int, str]) -> asyncio.Lock:
+        """
+        指定されたキーのロックを取得する (存在しなければ作成する)
+
+        Args:
+            key (int | tuple[int, str]): Twitter アカウントの ID または Twitter アカウントの ID と検索クエリのタプル
+
+        Returns:
+            asyncio.Lock: ロック
+        """
+
+        lock = cls.__locks.get(key)
+        if lock is None:
+            lock = asyncio.Lock()
+            cls.__locks[key] = lock
+        return lock
+
+
+    @classmethod
+    async def getTimeline(
+        cls,
+        twitter_account_id: int,
+        since_tweet_id: str | None,
+        fetch: Callable[[str | None], Awaitable[list[schemas.Tweet]]],
+    ) -> list[schemas.Tweet]:
+        """
+        ホームタイムラインを取得する
+        キャッシュの有効期間内であればキャッシュから返し、有効期間が過ぎていればキャッシュした最新のツイートより新しいツイートだけを取得して先頭に追加する
+
+        Args:
+            twitter_account_id (int): Twitter アカウントの ID (データベース上の ID)
+            since_tweet_id (str | None): このツイート ID より新しいツイートだけを返す (None の場合はキャッシュしたすべてのツイートを返す)
+            fetch (Callable[[str | None], Awaitable[list[schemas.Tweet]]]): 引数のツイート ID より新しいツイートを Twitter API から取得する関数
+
+        Returns:
+            list[schemas.Tweet]: 新しい順に並んだツイートのリスト
+        """
+
+        async with cls.__getLock(twitter_account_id):
+
+            now = time.monotonic()
+            generation = cls.__generation
+            timeline = cls.__timelines.get(twitter_account_id)
+
+            # キャッシュがないか、キャッシュしてから時間が経ちすぎている場合は、最新のツイートから取得し直す
+            ## リクエストされた since_tweet_id に関わらず最新のツイートから取得することで、キャッシュが常に直近のツイートを網羅するようにする
+            if timeline is None or now - timeline[1] > cls.TIMELINE_MAX_AGE:
+                tweets = await fetch(None)
+                fetched_at = time.monotonic()
+                timeline = (fetched_at, fetched_at, tweets[:cls.MAX_TIMELINE_TWEETS])
+                if generation == cls.__generation:
+                    cls.__timelines[twitter_account_id] = timeline
+
+            # キャッシュの有効期間が過ぎている場合は、キャッシュした最新のツイートより新しいツイートだけを取得して先頭に追加する
+            elif now - timeline[0] > cls.TIMELINE_TTL:
+                _, refreshed_at, tweets = timeline
+                new_tweets = await fetch(tweets[0].id if len(tweets) > 0 else None)
+                timeline = (time.monotonic(), refreshed_at, (new_tweets + tweets)[:cls.MAX_TIMELINE_TWEETS])
+                if generation == cls.__generation:
+                    cls.__timelines[twitter_account_id] = timeline
+
+            tweets = timeline[2]
+
+        # since_tweet_id より新しいツイートに絞り込む
+        if since_tweet_id is None:
+            return list(tweets)
+        return [tweet for tweet in tweets if int(tweet.id) > int(since_tweet_id)]
+
+
+    @classmethod
+    async def search(
+        cls,
+        twitter_account_id: int,
+        query: str,
+        fetch: Callable[[], Awaitable[list[schemas.Tweet]]],
+    ) -> list[schemas.Tweet]:
+        """
+        ツイートを検索する
+        同じ Twitter アカウントでの同じ検索クエリの検索結果がキャッシュの有効期間内であれば、キャッシュから返す
+
+        Args:
+            twitter_account_id (int): 検索に使う Twitter アカウントの ID (データベース上の ID)
+            query (str): 検索クエリ
+            fetch (Callable[[], Awaitable[list[schemas.Tweet]]]): 検索クエリでツイートを Twitter API から検索する関数
+
+        Returns:
+            list[schemas.Tweet]: 新しい順に並んだ検索結果のツイートのリスト
+        """
+
+        key = (twitter_account_id, query)
+        async with cls.__getLock(key):
+
+            cached = cls.__search_results.get(key)
+            if cached is not None and time.monotonic() - cached[0] <= cls.SEARCH_TTL:
+                cls.__search_results.move_to_end(key)
+                return list(cached[1])
+
+            generation = cls.__generation
+            tweets = await fetch()
+            if generation == cls.__generation:
+                cls.__search_results[key] = (time.monotonic(), tweets)
+                cls.__search_results.move_to_end(key)
+                while len(cls.__search_results) > cls.MAX_SEARCH_QUERIES:
+                    cls.__search_results.popitem(last=False)
+
+        return list(tweets)
+
+
+    @classmethod
+    def invalidate(cls, twitter_account_id: int | None = None) -> None:
+        """
+        キャッシュしたホームタイムラインと検索結果を破棄する
+        リツイートやいいねをした後は、キャッシュしたツイートのリツイート済み・いいね済みかどうかが古くなるため、そのアカウントのキャッシュを破棄する
+        (差分の取得では新しいツイートしか取得しないため、破棄しないと TIMELINE_MAX_AGE が過ぎるまで古いまま返してしまう)
+
+        Args:
+            twitter_account_id (int | None, optional): キャッシュを破棄する Twitter アカウントの ID (None の場合はすべて破棄する). Defaults to None.
+        """
+
+        cls.__generation += 1
+        if twitter_account_id is None:
+            cls.__timelines.clear()
+            cls.__search_results.clear()
+        else:
+            cls.__timelines.pop(twitter_account_id, None)
+            for key in [key for key in cls.__search_results if key[0] == twitter_account_id]:
+                del cls.__search_results[key]
@@ -0,0 +1,117 @@
+# Type Hints を指定できるように
+# ref: https://stackoverflow.com/a/33533514/17124142
+from __future__ import annotations
+
+import copy
+import time
+from collections import OrderedDict
+from typing import ClassVar, TYPE_CHECKING
+
+from app.constants import IS_USER_CACHE_DISABLED
+
+if TYPE_CHECKING:
+    from app.models import User
+
+
+class UserCache:
+    """
+    アクセストークンに紐づくユーザー情報 (連携している Twitter アカウントを含む) を、ユーザー ID ごとに短時間キャッシュするクラス (LRU + TTL)
+    認証が必要な API へのリクエストのたびに、ユーザー情報と Twitter アカウントの情報をデータベースから取得し直さずに済むようにする
+    ユーザー情報や Twitter アカウント・ニコニコアカウントの連携状態を変更した場合は、必ず invalidate() を呼び出すこと
+    """
+
+    # キャッシュの有効期間 (秒)
+    ## server.workers が 2 以上の場合、他の API ワーカープロセスで行われた変更はこのプロセスのキャッシュに反映されないため、
+    ## 変更が他のプロセスに反映されるまでの時間の上限として、短めに設定している
+    TTL = 5
+
+    # キャッシュするユーザー情報の最大数
+    ## 上限を超えた場合は、最も長く使われていないユーザー情報から破棄する
+    MAX_SIZE = 128
+
+    # ユーザー ID をキーとした、キャッシュした時刻 (単調増加時間) とユーザー情報のタプルの辞書 (最近使われた順に末尾に並ぶ)
+    __users: ClassVar[OrderedDict[int, tuple[float, User]]] = OrderedDict()
+
+    # キャッシュの無効化が行われるたびに増える世代番号
+    ## データベースからの取得中にユーザー情報が変更された場合に、変更前のユーザー情報をキャッシュしないようにするために使う
+    __generation: ClassVar[int] = 0
+
+
+    @classmethod
+    def get(cls, user_id: int) -> User | None:
+        """
+        キャッシュからユーザー情報を取得する
+        返されるユーザー情報はキャッシュのコピーなので、呼び出し元で自由に変更できる
+
+        Args:
+            user_id (int): ユーザー ID
+
+        Returns:
+            User | None: ユーザー情報 (キャッシュされていないか、有効期間が過ぎている場合は None)
+        """
+
+        if IS_USER_CACHE_DISABLED is True:
+            return None
+
+        cached = cls.__users.get(user_id)
+        if cached is None:
+            return None
+
+        # 有効期間が過ぎていれば破棄する
+        cached_at, user = cached
+        if time.monotonic() - cached_at > cls.TTL:
+            cls.__users.pop(user_id, None)
+            return None
+
+        cls.__users.move_to_end(user_id)
+        return copy.copy(user)
+
+
+    @classmethod
+    def getGeneration(cls) -> int:
+        """
+        現在の世代番号を取得する
+        データベースからユーザー情報を取得する前に呼び出し、取得後に set() に渡す
+
+        Returns:
+            int: 現在の世代番号
+        """
+
+        return cls.__generation
+
+
+    @classmethod
+    def set(cls, user: User, generation: int) -> None:
+        """
+        データベースから取得したユーザー情報をキャッシュする
+        取得を始めてから invalidate() が呼ばれていた (世代番号が変わっていた) 場合は、変更前の可能性があるためキャッシュしない
+
+        Args:
+            user (User): データベースから取得したユーザー情報
+            generation (int): データベースからの取得前に getGeneration() で取得した世代番号
+        """
+
+        if IS_USER_CACHE_DISABLED is True or generation != cls.__generation:
+            return
+
+        # 呼び出し元がユーザー情報を変更してもキャッシュに影響しないよう、コピーをキャッシュする
+        cls.__users[user.id] = (time.monotonic(), copy.copy(user))
+        cls.__users.move_to_end(user.id)
+        while len(cls.__users) > cls.MAX_SIZE:
+            cls.__users.popitem(last=False)
+
+
+    @classmethod
+    def invalidate(cls, user_id: int | None = None) -> None:
+        """
+        キャッシュしたユーザー情報を破棄する
+
+        Args:
+            user_id (int | None, optional): 破棄するユーザー情報のユーザー ID (None の場合はすべて破棄する). Defaults to None.
+        """
+
+        cls.__generation += 1
+        if user_id is None:
+            cls.__users.clear()
+        else:
+            cls.__users.pop(user_id, None)
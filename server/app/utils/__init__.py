@@ -1,11 +1,37 @@
 
+import importlib
+
 # ユーティリティをモジュールとして登録
-from .HLSLiveSegmenter import HLSLiveSegmenter
 from .Jikkyo import Jikkyo
-from .OAuthCallbackResponse import OAuthCallbackResponse
-from .ServerManager import ServerManager
 from .TSInformation import TSInformation
 
+# 初回参照時に遅延インポートするクラスと、その定義元のサブモジュール名
+## これらは FastAPI・Uvicorn・biim などの重いモジュールに依存しているが、番組情報更新用のワーカープロセスでは使わないため、
+## 実際に参照されるまで読み込まない
+__LAZY_IMPORTS = {
+    'HLSLiveSegmenter': 'HLSLiveSegmenter',
+    'OAuthCallbackResponse': 'OAuthCallbackResponse',
+    'ServerManager': 'ServerManager',
+    'SupervisorClient': 'SupervisorClient',
+}
+
+
+def __getattr__(name: str):
+    """
+    遅延インポート対象のクラスを初回参照時にインポートして返す
+    ref: https://peps.python.org/pep-0562/
+    """
+
+    if name not in __LAZY_IMPORTS:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+    # サブモジュールとクラス名が同じ場合、インポート時にサブモジュールがパッケージの属性にセットされてしまうため、
+    # インポート後にクラスで上書きする
+    module = importlib.import_module(f'{__name__}.{__LAZY_IMPORTS[name]}')
+    value = getattr(module, name)
+    globals()[name] = value
+    return value
+
 
 def Interlaced(n: int):
     import app.constants,codecs
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+# Usage: pipenv run python -m misc.EDCBBenchmark [--services 40] [--events 200] [--iterations 5] [--tune-delay 0.5]
+
+# misc.EDCBEmulator を別プロセスで起動し、EDCB バックエンドのチャンネル情報の更新 (Channel.updateFromEDCB)・
+# 番組情報の更新 (Program.updateFromEDCB)・チューナーの起動から最初の TS を受信するまでの時間を計測する
+# Windows の EpgTimerSrv がない Linux 環境でも、EDCB バックエンドの処理をサービス数 × 番組数を変えて計測できる
+# config.yaml が配置されている必要がある (内容は問わない: バックエンドとデータベースはベンチマーク用に上書きする)
+# データベースは一時ディレクトリに作成するため、普段使っている KonomiTV のデータベースには影響しない
+
+import argparse
+import asyncio
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from tortoise import Tortoise
+
+from app.constants import CONFIG, DATABASE_CONFIG
+
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+EMULATOR_HOST = '127.0.0.1'
+
+
+def start_emulator(args: argparse.Namespace) -> subprocess.Popen:
+    """ EDCB エミュレーターを起動し、接続を受け付けられるようになるまで待つ """
+
+    process = subprocess.Popen([
+        sys.executable, '-m', 'misc.EDCBEmulator',
+        '--host', EMULATOR_HOST,
+        '--port', str(args.port),
+        '--services', str(args.services),
+        '--events', str(args.events),
+        '--recorded', str(args.recorded),
+        '--tuners', str(args.tuners),
+        '--tune-delay', str(args.tune_delay),
+    ], cwd=BASE_DIR)
+    for _ in range(300):
+        try:
+            socket.create_connection((EMULATOR_HOST, args.port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError('EDCB emulator did not start.')
+
+
+def format_durations(durations: list[float]) -> str:
+    durations = sorted(durations)
+    return (f'mean: {statistics.mean(durations) * 1000:>8.1f} ms  p50: {statistics.median(durations) * 1000:>8.1f} ms  '
+            f'max: {durations[-1] * 1000:>8.1f} ms')
+
+
+async def benchmark(args: argparse.Namespace) -> None:
+
+    # app.models・app.utils.EDCB は CONFIG を書き換えた後にインポートする
+    from app.models import Channel
+    from app.models import Program
+    from app.utils.EDCB import CtrlCmdUtil, EDCBTuner
+
+    await Tortoise.init(config=DATABASE_CONFIG)
+    await Tortoise.generate_schemas()
+    try:
+
+        # チャンネル情報の更新
+        channel_durations: list[float] = []
+        for _ in range(args.iterations):
+            started_at = time.monotonic()
+            await Channel.updateFromEDCB()
+            channel_durations.append(time.monotonic() - started_at)
+        channel_count = await Channel.filter(is_watchable=True).count()
+
+        # 番組情報の更新
+        ## 2回目以降は更新不要な番組情報が多くなるため、初回と2回目以降の両方を記録する
+        program_durations: list[float] = []
+        for _ in range(args.iterations):
+            started_at = time.monotonic()
+            await Program.updateFromEDCB()
+            program_durations.append(time.monotonic() - started_at)
+        program_count = await Program.all().count()
+
+        # チューナーの起動 (NwTVIDSetCh) から、View アプリのストリームの転送 (RelayViewStream) で最初の TS を受信するまで
+        services = await CtrlCmdUtil().sendEnumService() or []
+        if len(services) == 0:
+            raise RuntimeError('EDCB emulator returned no services.')
+        service = services[0]
+        open_durations: list[float] = []
+        first_byte_durations: list[float] = []
+        for _ in range(args.iterations):
+            tuner = EDCBTuner(service['onid'], service['sid'], service['tsid'])
+            started_at = time.monotonic()
+            if await tuner.open() is False:
+                raise RuntimeError('Failed to open the tuner.')
+            open_durations.append(time.monotonic() - started_at)
+            sock = await tuner.connect()
+            if not isinstance(sock, socket.socket):
+                raise RuntimeError('Failed to connect to the tuner.')
+            await asyncio.to_thread(sock.recv, 188)
+            first_byte_durations.append(time.monotonic() - started_at)
+            sock.close()
+            await tuner.close()
+
+    finally:
+        await Tortoise.close_connections()
+
+    print(f'{"-" * 80}\nResults ({args.services} services x {args.events} events, {args.iterations} iterations, '
+          f'tune delay {args.tune_delay} sec)\n{"-" * 80}')
+    print(f'Channel.updateFromEDCB ({channel_count} channels):'.ljust(44) + format_durations(channel_durations))
+    print(f'Program.updateFromEDCB ({program_count} programs):'.ljust(44) + format_durations(program_durations))
+    print(f'  first run: {program_durations[0] * 1000:.1f} ms')
+    print('Tuner open (NwTVIDSetCh):'.ljust(44) + format_durations(open_durations))
+    print('Tuner open to first TS byte:'.ljust(44) + format_durations(first_byte_durations))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Benchmark the EDCB backend paths of KonomiTV against the CtrlCmd emulator.')
+    parser.add_argument('--services', type=int, default=40, help='number of services generated by the emulator')
+    parser.add_argument('--events', type=int, default=200, help='number of events per service generated by the emulator')
+    parser.add_argument('--recorded', type=int, default=100, help='number of recorded programs generated by the emulator')
+    parser.add_argument('--tuners', type=int, default=4, help='number of tuners of the emulator')
+    parser.add_argument('--tune-delay', type=float, default=0.5, help='seconds the emulator waits when a tuner is opened')
+    parser.add_argument('--iterations', type=int, default=5, help='number of iterations of each benchmark')
+    parser.add_argument('--port', type=int, default=4520, help='listen port of the emulator')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='konomitv-edcb-benchmark-') as data_dir:
+
+        # バックエンドをエミュレーターに、データベースを一時ディレクトリに向ける
+        CONFIG['general']['backend'] = 'EDCB'
+        CONFIG['general']['edcb_url'] = f'tcp://{EMULATOR_HOST}:{args.port}'
+        DATABASE_CONFIG['connections']['default'] = f'sqlite://{str(Path(data_dir) / "database.sqlite")}'
+
+        print(f'Starting EDCB emulator ({args.services} services x {args.events} events)...')
+        emulator = start_emulator(args)
+        try:
+            asyncio.run(benchmark(args))
+        finally:
+            emulator.terminate()
+            emulator.wait()
+
+
+if __name__ == '__main__':
+    main()
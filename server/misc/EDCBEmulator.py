@@ -0,0 +1,517 @@
+#!/usr/bin/env python3
+
+# Usage: pipenv run python -m misc.EDCBEmulator [--port 4520] [--services 40] [--events 200] [--recorded 100] [--tuners 4] [--ts /path/to/recorded.ts]
+
+# Windows の EpgTimerSrv がない環境で EDCB バックエンドの処理を動かすための、CtrlCmd インターフェイス (TCP API) のエミュレーター
+# KonomiTV が利用するコマンド (EnumService・EnumPgInfoEx・EnumPgArc・FileCopy・FileCopy2・NwTVIDSetCh・NwTVIDClose・
+# EnumRecInfoBasic2・GetRecInfo2・RelayViewStream) を、app.utils.EDCB.CtrlCmdUtil と同じワイヤーフォーマットで応答する
+# サービス数 × 番組数・録画番組数・チューナー数は引数で指定でき、応答は起動時に一度だけシリアライズしておく
+# (エミュレーター側の処理時間がベンチマーク結果に影響しないようにするため)
+# EDCBEmulator クラスは単体で起動でき、misc.EDCBBenchmark などから asyncio のサーバーとしても使える
+
+import argparse
+import asyncio
+import datetime
+import time
+from pathlib import Path
+
+
+# EDCB/EpgTimer の CtrlCmd.cs より
+CMD_SUCCESS = 1
+CMD_ERR = 0
+CMD_VER = 5
+CMD_EPG_SRV_RELAY_VIEW_STREAM = 301
+CMD_EPG_SRV_ENUM_SERVICE = 1021
+CMD_EPG_SRV_ENUM_PG_INFO_EX = 1029
+CMD_EPG_SRV_ENUM_PG_ARC = 1030
+CMD_EPG_SRV_FILE_COPY = 1060
+CMD_EPG_SRV_NWTV_ID_SET_CH = 1073
+CMD_EPG_SRV_NWTV_ID_CLOSE = 1074
+CMD_EPG_SRV_ENUM_RECINFO_BASIC2 = 2020
+CMD_EPG_SRV_GET_RECINFO2 = 2024
+CMD_EPG_SRV_FILE_COPY2 = 2060
+
+# EDCB の日付は OS のタイムゾーンに関わらず常に UTC+9
+JST = datetime.timezone(datetime.timedelta(hours = 9), 'JST')
+
+
+# 以下、CtrlCmdUtil のリーダーに対応するライター
+# 各構造体のフィールドの並びは CtrlCmdUtil の __read* と同じ
+
+def write_byte(buf: bytearray, v: int) -> None:
+    buf.extend(v.to_bytes(1, 'little'))
+
+def write_ushort(buf: bytearray, v: int) -> None:
+    buf.extend(v.to_bytes(2, 'little'))
+
+def write_int(buf: bytearray, v: int) -> None:
+    buf.extend(v.to_bytes(4, 'little', signed = True))
+
+def write_long(buf: bytearray, v: int) -> None:
+    buf.extend(v.to_bytes(8, 'little', signed = True))
+
+def write_system_time(buf: bytearray, v: datetime.datetime) -> None:
+    for field in (v.year, v.month, v.isoweekday() % 7, v.day, v.hour, v.minute, v.second, v.microsecond // 1000):
+        write_ushort(buf, field)
+
+def write_string(buf: bytearray, v: str) -> None:
+    vv = v.encode('utf_16_le')
+    write_int(buf, 6 + len(vv))
+    buf.extend(vv)
+    write_ushort(buf, 0)
+
+def write_vector(write_func, buf: bytearray, v: list) -> None:
+    pos = len(buf)
+    write_int(buf, 0)
+    write_int(buf, len(v))
+    for e in v:
+        write_func(buf, e)
+    buf[pos:pos + 4] = (len(buf) - pos).to_bytes(4, 'little', signed = True)
+
+def write_struct(buf: bytearray, write_fields) -> None:
+    """ 先頭に構造体のサイズを書き込む構造体を書き込む """
+    pos = len(buf)
+    write_int(buf, 0)
+    write_fields(buf)
+    buf[pos:pos + 4] = (len(buf) - pos).to_bytes(4, 'little', signed = True)
+
+def write_optional_struct(buf: bytearray, write_func, v: dict | None) -> None:
+    """ 省略可能な構造体を書き込む (省略時はサイズ 4 の空の構造体になる) """
+    if v is None:
+        write_int(buf, 4)
+    else:
+        write_func(buf, v)
+
+def write_service_info(buf: bytearray, v: dict) -> None:
+    def fields(buf: bytearray) -> None:
+        write_ushort(buf, v['onid'])
+        write_ushort(buf, v['tsid'])
+        write_ushort(buf, v['sid'])
+        write_byte(buf, v['service_type'])
+        write_byte(buf, v['partial_reception_flag'])
+        write_string(buf, v['service_provider_name'])
+        write_string(buf, v['service_name'])
+        write_string(buf, v['network_name'])
+        write_string(buf, v['ts_name'])
+        write_byte(buf, v['remote_control_key_id'])
+    write_struct(buf, fields)
+
+def write_short_event_info(buf: bytearray, v: dict) -> None:
+    def fields(buf: bytearray) -> None:
+        write_string(buf, v['event_name'])
+        write_string(buf, v['text_char'])
+    write_struct(buf, fields)
+
+def write_extended_event_info(buf: bytearray, v: dict) -> None:
+    write_struct(buf, lambda buf: write_string(buf, v['text_char']))
+
+def write_content_data(buf: bytearray, v: dict) -> None:
+    def fields(buf: bytearray) -> None:
+        # CtrlCmdUtil 側でバイトスワップされるため、上位バイトから順に書き込む
+        buf.extend(v['content_nibble'].to_bytes(2, 'big'))
+        buf.extend(v['user_nibble'].to_bytes(2, 'big'))
+    write_struct(buf, fields)
+
+def write_content_info(buf: bytearray, v: dict) -> None:
+    write_struct(buf, lambda buf: write_vector(write_content_data, buf, v['nibble_list']))
+
+def write_component_info(buf: bytearray, v: dict) -> None:
+    def fields(buf: bytearray) -> None:
+        write_byte(buf, v['stream_content'])
+        write_byte(buf, v['component_type'])
+        write_byte(buf, v['component_tag'])
+        write_string(buf, v['text_char'])
+    write_struct(buf, fields)
+
+def write_audio_component_info_data(buf: bytearray, v: dict) -> None:
+    def fields(buf: bytearray) -> None:
+        for key in ('stream_content', 'component_type', 'component_tag', 'stream_type', 'simulcast_group_tag',
+                    'es_multi_lingual_flag', 'main_component_flag', 'quality_indicator', 'sampling_rate'):
+            write_byte(buf, v[key])
+        write_string(buf, v['text_char'])
+    write_struct(buf, fields)
+
+def write_audio_component_info(buf: bytearray, v: dict) -> None:
+    write_struct(buf, lambda buf: write_vector(write_audio_component_info_data, buf, v['component_list']))
+
+def write_event_data(buf: bytearray, v: dict) -> None:
+    def fields(buf: bytearray) -> None:
+        for key in ('onid', 'tsid', 'sid', 'eid'):
+            write_ushort(buf, v[key])
+    write_struct(buf, fields)
+
+def write_event_group_info(buf: bytearray, v: dict) -> None:
+    def fields(buf: bytearray) -> None:
+        write_byte(buf, v['group_type'])
+        write_vector(write_event_data, buf, v['event_data_list'])
+    write_struct(buf, fields)
+
+def write_event_info(buf: bytearray, v: dict) -> None:
+    def fields(buf: bytearray) -> None:
+        for key in ('onid', 'tsid', 'sid', 'eid'):
+            write_ushort(buf, v[key])
+        write_byte(buf, 1 if 'start_time' in v else 0)
+        write_system_time(buf, v.get('start_time', datetime.datetime(2000, 1, 1, tzinfo=JST)))
+        write_byte(buf, 1 if 'duration_sec' in v else 0)
+        write_int(buf, v.get('duration_sec', 0))
+        write_optional_struct(buf, write_short_event_info, v.get('short_info'))
+        write_optional_struct(buf, write_extended_event_info, v.get('ext_info'))
+        write_optional_struct(buf, write_content_info, v.get('content_info'))
+        write_optional_struct(buf, write_component_info, v.get('component_info'))
+        write_optional_struct(buf, write_audio_component_info, v.get('audio_info'))
+        write_optional_struct(buf, write_event_group_info, v.get('event_group_info'))
+        write_optional_struct(buf, write_event_group_info, v.get('event_relay_info'))
+        write_byte(buf, v['free_ca_flag'])
+    write_struct(buf, fields)
+
+def write_service_event_info(buf: bytearray, v: dict) -> None:
+    def fields(buf: bytearray) -> None:
+        write_service_info(buf, v['service_info'])
+        write_vector(write_event_info, buf, v['event_list'])
+    write_struct(buf, fields)
+
+def write_file_data(buf: bytearray, v: dict) -> None:
+    def fields(buf: bytearray) -> None:
+        write_string(buf, v['name'])
+        write_int(buf, len(v['data']))
+        write_int(buf, 0)
+        buf.extend(v['data'])
+    write_struct(buf, fields)
+
+def write_rec_file_info(buf: bytearray, v: dict) -> None:
+    def fields(buf: bytearray) -> None:
+        write_int(buf, v['id'])
+        write_string(buf, v['rec_file_path'])
+        write_string(buf, v['title'])
+        write_system_time(buf, v['start_time'])
+        write_int(buf, v['duration_sec'])
+        write_string(buf, v['service_name'])
+        for key in ('onid', 'tsid', 'sid', 'eid'):
+            write_ushort(buf, v[key])
+        write_long(buf, v['drops'])
+        write_long(buf, v['scrambles'])
+        write_int(buf, v['rec_status'])
+        write_system_time(buf, v['start_time_epg'])
+        write_string(buf, v['comment'])
+        write_string(buf, v['program_info'])
+        write_string(buf, v['err_info'])
+        write_byte(buf, v['protect_flag'])
+    write_struct(buf, fields)
+
+
+class EDCBEmulator:
+    """ EpgTimerSrv の CtrlCmd インターフェイス (TCP API) をエミュレートするサーバー """
+
+    # 1回に送信する TS のサイズ (188 バイトの TS パケット 256 個分)
+    CHUNK_SIZE = 188 * 256
+
+    def __init__(self, services: int = 40, events: int = 200, recorded: int = 100, tuners: int = 4,
+        tune_delay: float = 0.5, ts_path: Path | None = None, bitrate: float = 17.0) -> None:
+        """
+        Args:
+            services (int): 生成するサービスの数 (地デジと BS を交互に生成する)
+            events (int): サービスごとに生成する番組の数 (30 分ごと)
+            recorded (int): 生成する録画番組の数
+            tuners (int): 同時に起動できるチューナー (NetworkTV モードの EpgDataCap_Bon) の数
+            tune_delay (float): NwTVIDSetCh でチューナーを新たに起動したときに応答を遅らせる秒数
+            ts_path (Path | None): RelayViewStream で送信する TS (None の場合は NULL パケットを送信する)
+            bitrate (float): RelayViewStream で送信する TS のビットレート (Mbps)
+        """
+
+        self.tuners = tuners
+        self.tune_delay = tune_delay
+        self.ts_path = ts_path
+        self.bitrate = bitrate
+        self.port: int | None = None
+        self.server: asyncio.Server | None = None
+
+        # 起動中のチューナー (NetworkTV ID をキー、プロセス ID を値とする)
+        self.networktv_processes: dict[int, int] = {}
+        self.next_process_id = 10000
+
+        # コマンドごとの受信回数
+        self.command_counts: dict[int, int] = {}
+
+        # サービス・番組・録画番組のデータを生成し、応答をシリアライズしておく
+        self.service_list = self.generateServices(services)
+        self.service_event_list = [
+            {'service_info': service, 'event_list': self.generateEvents(service, events)} for service in self.service_list]
+        self.rec_file_list = self.generateRecordedPrograms(recorded)
+        self.enum_service_response = bytearray()
+        write_vector(write_service_info, self.enum_service_response, self.service_list)
+        self.enum_pg_info_ex_response = bytearray()
+        write_vector(write_service_event_info, self.enum_pg_info_ex_response, self.service_event_list)
+        self.enum_rec_info_basic2_response = bytearray()
+        write_ushort(self.enum_rec_info_basic2_response, CMD_VER)
+        write_vector(write_rec_file_info, self.enum_rec_info_basic2_response,
+            [{**rec_file, 'program_info': '', 'err_info': ''} for rec_file in self.rec_file_list])
+        self.files: dict[str, bytes] = {
+            'ChSet5.txt': self.generateChSet5(),
+            'LogoData.ini': b'',
+        }
+
+    @staticmethod
+    def generateServices(count: int) -> list[dict]:
+        services: list[dict] = []
+        for index in range(count):
+            if index % 2 == 0:
+                # 地デジ: ネットワーク ID が 0x7880 ~ 0x7FE8 の範囲に収まるように、ネットワークごとに1サービスを割り当てる
+                onid = 0x7FE0 - index // 2
+                tsid = onid
+                sid = 1024 + (index // 2) * 8
+                services.append({
+                    'onid': onid, 'tsid': tsid, 'sid': sid, 'service_type': 0x01, 'partial_reception_flag': 0,
+                    'service_provider_name': 'エミュレーター', 'service_name': f'エミュレーター地デジ{index // 2 + 1}',
+                    'network_name': f'エミュレーター地デジ{index // 2 + 1}', 'ts_name': f'エミュレーター地デジ{index // 2 + 1}',
+                    'remote_control_key_id': (index // 2) % 12 + 1,
+                })
+            else:
+                # BS: 放送終了したサービス ID (238・241・258) は KonomiTV 側で除外されるため避ける
+                sid = 101 + (index // 2) * 2
+                if sid in (238, 241, 258):
+                    sid += 1
+                services.append({
+                    'onid': 4, 'tsid': 16400 + index, 'sid': sid, 'service_type': 0x01, 'partial_reception_flag': 0,
+                    'service_provider_name': 'エミュレーター', 'service_name': f'エミュレーターBS{sid}',
+                    'network_name': 'BS Digital', 'ts_name': f'BS{sid}', 'remote_control_key_id': 0,
+                })
+        return services
+
+    @staticmethod
+    def generateEvents(service: dict, count: int) -> list[dict]:
+        # 現在時刻の1時間前から、30分ごとの番組情報を生成する
+        now = datetime.datetime.now(JST).replace(second=0, microsecond=0)
+        first_start_time = now.replace(minute=(now.minute // 30) * 30) - datetime.timedelta(hours=1)
+        events: list[dict] = []
+        for index in range(count):
+            events.append({
+                'onid': service['onid'], 'tsid': service['tsid'], 'sid': service['sid'], 'eid': 1000 + index,
+                'start_time': first_start_time + datetime.timedelta(minutes=30 * index),
+                'duration_sec': 30 * 60,
+                'short_info': {
+                    'event_name': f'エミュレーター番組 #{index + 1}',
+                    'text_char': 'misc.EDCBEmulator が生成したダミーの番組情報です。',
+                },
+                'ext_info': {'text_char': '- 番組内容\r\nダミーの番組内容です。\r\n- 出演者\r\nダミーの出演者'},
+                'content_info': {'nibble_list': [{'content_nibble': (index % 12) << 8, 'user_nibble': 0}]},
+                'component_info': {'stream_content': 0x01, 'component_type': 0xb3, 'component_tag': 0x00, 'text_char': ''},
+                'audio_info': {'component_list': [{
+                    'stream_content': 0x02, 'component_type': 0x03, 'component_tag': 0x10, 'stream_type': 0x0f,
+                    'simulcast_group_tag': 0xff, 'es_multi_lingual_flag': 0, 'main_component_flag': 1,
+                    'quality_indicator': 3, 'sampling_rate': 7, 'text_char': '',
+                }]},
+                'free_ca_flag': 0,
+            })
+        return events
+
+    def generateRecordedPrograms(self, count: int) -> list[dict]:
+        rec_files: list[dict] = []
+        start_time = datetime.datetime.now(JST).replace(minute=0, second=0, microsecond=0) - datetime.timedelta(days=1)
+        for index in range(count):
+            service = self.service_list[index % len(self.service_list)] if len(self.service_list) > 0 else \
+                {'onid': 0, 'tsid': 0, 'sid': 0, 'service_name': ''}
+            recorded_at = start_time - datetime.timedelta(minutes=30 * index)
+            rec_files.append({
+                'id': index + 1,
+                'rec_file_path': f'C:\\Recorded\\{recorded_at:%Y%m%d%H%M}_{service["sid"]}.ts',
+                'title': f'エミュレーター録画番組 #{index + 1}',
+                'start_time': recorded_at,
+                'duration_sec': 30 * 60,
+                'service_name': service['service_name'],
+                'onid': service['onid'], 'tsid': service['tsid'], 'sid': service['sid'], 'eid': 1000 + index,
+                'drops': 0,
+                'scrambles': 0,
+                'rec_status': 1,
+                'start_time_epg': recorded_at,
+                'comment': '',
+                'program_info': f'{recorded_at:%Y/%m/%d %H:%M}～\r\n{service["service_name"]}\r\nエミュレーター録画番組 #{index + 1}\r\n',
+                'err_info': '',
+                'protect_flag': 0,
+            })
+        return rec_files
+
+    def generateChSet5(self) -> bytes:
+        lines = [
+            f'{service["service_name"]}\t{service["network_name"]}\t{service["onid"]}\t{service["tsid"]}\t{service["sid"]}\t'
+            f'{service["service_type"]}\t{service["partial_reception_flag"]}\t1\t1' for service in self.service_list]
+        return b'\xef\xbb\xbf' + ('\r\n'.join(lines) + '\r\n').encode('utf-8')
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> int:
+        """ サーバーを起動し、リッスンしているポートを返す (port に 0 を指定すると空いているポートが使われる) """
+        self.server = await asyncio.start_server(self.handle, host, port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def close(self) -> None:
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """ 1つの接続につき1つのコマンドを処理する (CtrlCmdUtil はコマンドごとに接続し直す) """
+
+        try:
+            header = await reader.readexactly(8)
+            command = int.from_bytes(header[0:4], 'little', signed=True)
+            size = int.from_bytes(header[4:8], 'little', signed=True)
+            body = memoryview(await reader.readexactly(size))
+            self.command_counts[command] = self.command_counts.get(command, 0) + 1
+
+            # View アプリのストリームの転送は、応答後も接続を維持して TS を送信し続ける
+            if command == CMD_EPG_SRV_RELAY_VIEW_STREAM:
+                await self.relayViewStream(int.from_bytes(body[0:4], 'little', signed=True), writer)
+                return
+
+            ret, response = await self.dispatch(command, body)
+            writer.write(ret.to_bytes(4, 'little', signed=True) + len(response).to_bytes(4, 'little', signed=True) + response)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, command: int, body: memoryview) -> tuple[int, bytes]:
+        """ コマンドを処理し、結果コードと応答のボディを返す """
+
+        if command == CMD_EPG_SRV_ENUM_SERVICE:
+            return CMD_SUCCESS, bytes(self.enum_service_response)
+
+        # サービス・期間の指定は無視して、すべての番組情報を返す (KonomiTV は常に全番組・全期間を指定する)
+        if command == CMD_EPG_SRV_ENUM_PG_INFO_EX:
+            return CMD_SUCCESS, bytes(self.enum_pg_info_ex_response)
+
+        # 過去番組情報は保持していない
+        if command == CMD_EPG_SRV_ENUM_PG_ARC:
+            response = bytearray()
+            write_vector(write_service_event_info, response, [])
+            return CMD_SUCCESS, bytes(response)
+
+        if command == CMD_EPG_SRV_FILE_COPY:
+            name = self.readString(body, 0)
+            if name not in self.files:
+                return CMD_ERR, b''
+            return CMD_SUCCESS, self.files[name]
+
+        if command == CMD_EPG_SRV_FILE_COPY2:
+            # 先頭の ushort はクライアントの CMD_VER、続いて文字列のベクター
+            count = int.from_bytes(body[6:10], 'little', signed=True)
+            pos = 10
+            file_data_list: list[dict] = []
+            for _ in range(count):
+                name = self.readString(body, pos)
+                pos += int.from_bytes(body[pos:pos + 4], 'little', signed=True)
+                file_data_list.append({'name': name, 'data': self.files.get(name, b'')})
+            response = bytearray()
+            write_ushort(response, CMD_VER)
+            write_vector(write_file_data, response, file_data_list)
+            return CMD_SUCCESS, bytes(response)
+
+        if command == CMD_EPG_SRV_NWTV_ID_SET_CH:
+            # SetChInfo: size, use_sid, onid, tsid, sid, use_bon_ch, space_or_id (NetworkTV ID), ch_or_mode
+            networktv_id = int.from_bytes(body[18:22], 'little', signed=True) if len(body) >= 26 else 0
+            if networktv_id in self.networktv_processes:
+                # 起動中の EpgDataCap_Bon のチャンネル切り替え
+                return CMD_SUCCESS, self.networktv_processes[networktv_id].to_bytes(4, 'little', signed=True)
+            if len(self.networktv_processes) >= self.tuners:
+                return CMD_ERR, b''
+            # EpgDataCap_Bon の起動とチューニングにかかる時間を再現する
+            await asyncio.sleep(self.tune_delay)
+            self.next_process_id += 1
+            self.networktv_processes[networktv_id] = self.next_process_id
+            return CMD_SUCCESS, self.next_process_id.to_bytes(4, 'little', signed=True)
+
+        if command == CMD_EPG_SRV_NWTV_ID_CLOSE:
+            networktv_id = int.from_bytes(body[0:4], 'little', signed=True)
+            if self.networktv_processes.pop(networktv_id, None) is None:
+                return CMD_ERR, b''
+            return CMD_SUCCESS, b''
+
+        if command == CMD_EPG_SRV_ENUM_RECINFO_BASIC2:
+            return CMD_SUCCESS, bytes(self.enum_rec_info_basic2_response)
+
+        if command == CMD_EPG_SRV_GET_RECINFO2:
+            info_id = int.from_bytes(body[2:6], 'little', signed=True)
+            rec_file = next((rec_file for rec_file in self.rec_file_list if rec_file['id'] == info_id), None)
+            if rec_file is None:
+                return CMD_ERR, b''
+            response = bytearray()
+            write_ushort(response, CMD_VER)
+            write_rec_file_info(response, rec_file)
+            return CMD_SUCCESS, bytes(response)
+
+        # 未対応のコマンド
+        return CMD_ERR, b''
+
+    @staticmethod
+    def readString(body: memoryview, pos: int) -> str:
+        size = int.from_bytes(body[pos:pos + 4], 'little', signed=True)
+        return str(body[pos + 4:pos + size - 2], 'utf_16_le')
+
+    async def relayViewStream(self, process_id: int, writer: asyncio.StreamWriter) -> None:
+        """ 起動中のチューナーの TS を、チューナーが終了するかクライアントが切断するまで指定されたビットレートで送信する """
+
+        if process_id not in self.networktv_processes.values():
+            writer.write(CMD_ERR.to_bytes(4, 'little', signed=True) + (0).to_bytes(4, 'little'))
+            await writer.drain()
+            return
+        writer.write(CMD_SUCCESS.to_bytes(4, 'little', signed=True) + (0).to_bytes(4, 'little'))
+
+        # NULL パケット (PID 0x1FFF) で埋めたチャンク
+        null_chunk = (b'\x47\x1f\xff\x10' + b'\xff' * 184) * (self.CHUNK_SIZE // 188)
+        file = open(self.ts_path, 'rb') if self.ts_path is not None else None
+        try:
+            started_at = time.monotonic()
+            sent_bytes = 0
+            bytes_per_second = self.bitrate * 1000 * 1000 / 8
+            while process_id in self.networktv_processes.values():
+                chunk = null_chunk
+                if file is not None:
+                    chunk = file.read(self.CHUNK_SIZE)
+                    if len(chunk) < self.CHUNK_SIZE:
+                        file.seek(0)  # 末尾まで読んだら先頭に戻る
+                        if len(chunk) == 0:
+                            continue
+                writer.write(chunk)
+                await writer.drain()
+                sent_bytes += len(chunk)
+                wait = sent_bytes / bytes_per_second - (time.monotonic() - started_at)
+                if wait > 0:
+                    await asyncio.sleep(wait)
+        finally:
+            if file is not None:
+                file.close()
+
+
+async def serve(emulator: EDCBEmulator, host: str, port: int) -> None:
+    await emulator.start(host, port)
+    print(f'EDCB emulator is listening on tcp://{host}:{emulator.port}/ '
+          f'({len(emulator.service_list)} services, {sum(len(s["event_list"]) for s in emulator.service_event_list)} events, '
+          f'{len(emulator.rec_file_list)} recorded programs, {emulator.tuners} tuners)', flush=True)
+    assert emulator.server is not None
+    async with emulator.server:
+        await emulator.server.serve_forever()
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Emulate the EpgTimerSrv CtrlCmd TCP interface with generated data.')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='listen address')
+    parser.add_argument('--port', type=int, default=4520, help='listen port')
+    parser.add_argument('--services', type=int, default=40, help='number of services to generate')
+    parser.add_argument('--events', type=int, default=200, help='number of events per service to generate')
+    parser.add_argument('--recorded', type=int, default=100, help='number of recorded programs to generate')
+    parser.add_argument('--tuners', type=int, default=4, help='number of tuners that can be opened at the same time')
+    parser.add_argument('--tune-delay', type=float, default=0.5, help='seconds to wait when a tuner is opened')
+    parser.add_argument('--ts', type=Path, default=None, help='TS file looped on the view stream relay (null packets if omitted)')
+    parser.add_argument('--bitrate', type=float, default=17.0, help='bitrate of the view stream relay in Mbps')
+    args = parser.parse_args()
+
+    emulator = EDCBEmulator(args.services, args.events, args.recorded, args.tuners, args.tune_delay, args.ts, args.bitrate)
+    try:
+        asyncio.run(serve(emulator, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+# Usage: pipenv run python -m misc.EncoderNodeTester --ts-path /path/to/test.ts [--spawn 2] [--capacity 1] [--jobs 3] [--quality 720p]
+
+# localhost 上でエンコーダーノードを起動し、エンコーダーノードの通信プロトコルと空き状況に応じた割り振りを確認する
+# 指定された TS ファイルを 1 倍速程度で各ジョブに送信し、エンコード後の TS のサイズと割り振られたノードを表示する
+# --spawn 0 を指定すると、エンコーダーノードを起動せずに --node で指定した既存のエンコーダーノードを使う
+# 起動するエンコーダーノードも同じ config.yaml を読み込むため、config.yaml の tv.encoder_node_secret を設定しておく必要がある
+
+import argparse
+import asyncio
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any, cast
+
+from app.constants import CONFIG
+from app.utils.EncoderNode import EncoderNodeUtil
+
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+
+async def run_job(index: int, ts_path: str, quality: str, duration: float) -> None:
+
+    # tsreadex・FFmpeg のオプションは、通常のライブストリームと同じくエンコーダーノードが組み立てる
+    ## TS ファイルのサービス ID は分からないため、デバッグモードと同じく tsreadex が最初のサービスを選ぶ -1 を指定する
+    remote_encoder = await EncoderNodeUtil.openRemoteEncoder(
+        livestream_id = f'test-{index}',
+        encoder_type = 'FFmpeg',
+        quality = cast(Any, quality),
+        service_id = -1,
+        is_fullhd_channel = False,
+        is_sphd_channel = False,
+        is_radiochannel = False,
+        retry_count = 0,
+    )
+    if remote_encoder is None:
+        print(f'Job {index}: rejected (no encoder node has free capacity)')
+        return
+
+    # TS ファイルをおおよそ 1 倍速 (2350KB/s) で送信する
+    def Reader():
+        with open(ts_path, 'rb') as file:
+            start = time.monotonic()
+            sent = 0
+            for chunk in iter(lambda: file.read(48128), b''):
+                if time.monotonic() - start > duration:
+                    break
+                try:
+                    remote_encoder.stdin.write(chunk)
+                except OSError:
+                    break
+                sent += len(chunk)
+                time.sleep(max(0, sent / (2350 * 1024) - (time.monotonic() - start)))
+        try:
+            remote_encoder.stdin.close()
+        except OSError:
+            pass
+
+    reader_task = asyncio.create_task(asyncio.to_thread(Reader))
+    received = 0
+    first_packet_at = None
+    start = time.monotonic()
+    while True:
+        chunk = await remote_encoder.stdout.read(65536)
+        if chunk == b'':
+            break
+        if first_packet_at is None:
+            first_packet_at = time.monotonic() - start
+        received += len(chunk)
+    await reader_task
+    await asyncio.sleep(0.1)
+    remote_encoder.kill()
+
+    print(f'Job {index}: received {received / 1024 / 1024:.1f} MB, '
+          f'first output after {first_packet_at if first_packet_at is not None else -1:.2f} s, returncode: {remote_encoder.returncode}')
+
+
+async def main_async(args: argparse.Namespace) -> None:
+
+    # 各ジョブの開始をずらし、空き状況が反映された状態で次のノードが選ばれることを確認する
+    tasks = []
+    for index in range(args.jobs):
+        tasks.append(asyncio.create_task(run_job(index, args.ts_path, args.quality, args.duration)))
+        await asyncio.sleep(1)
+        statuses = await asyncio.gather(*[EncoderNodeUtil.getNodeStatus(node_url) for node_url in CONFIG['tv']['encoder_nodes']])
+        for node_url, node_status in zip(CONFIG['tv']['encoder_nodes'], statuses):
+            print(f'  {node_url}: {node_status}')
+    await asyncio.gather(*tasks)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Test KonomiTV encoder nodes on localhost.')
+    parser.add_argument('--ts-path', type=str, required=True, help='TS file to encode')
+    parser.add_argument('--spawn', type=int, default=2, help='number of encoder nodes to spawn on localhost')
+    parser.add_argument('--capacity', type=int, default=1, help='capacity of each spawned encoder node')
+    parser.add_argument('--node', type=str, action='append', default=[], help='existing encoder node URL (tcp://host:port)')
+    parser.add_argument('--jobs', type=int, default=3, help='number of concurrent encode jobs')
+    parser.add_argument('--quality', type=str, default='720p', help='quality of the encode jobs')
+    parser.add_argument('--duration', type=float, default=10, help='duration of each job in seconds')
+    args = parser.parse_args()
+
+    if not CONFIG['tv']['encoder_node_secret']:
+        print('Set tv.encoder_node_secret in config.yaml before running this test.')
+        sys.exit(1)
+
+    # localhost でエンコーダーノードを起動する
+    processes: list[subprocess.Popen] = []
+    node_urls: list[str] = list(args.node)
+    for index in range(args.spawn):
+        port = 17010 + index
+        processes.append(subprocess.Popen(
+            [sys.executable, 'EncoderNode.py', '--host', '127.0.0.1', '--port', str(port),
+             '--capacity', str(args.capacity), '--encoder', 'FFmpeg'],
+            cwd = BASE_DIR,
+        ))
+        node_urls.append(f'tcp://127.0.0.1:{port}/')
+    CONFIG['tv']['encoder_nodes'] = node_urls
+    time.sleep(3)
+
+    try:
+        asyncio.run(main_async(args))
+    finally:
+        for process in processes:
+            process.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+
+# Usage: pipenv run python -m misc.FakeMirakurun --ts /path/to/recorded.ts [--port 40773] [--network-id 32736] [--service-id 1024]
+
+# チューナーのない環境で KonomiTV を動かすための、Mirakurun 互換の API を持つ最小限のダミーサーバー
+# チャンネル情報 (/api/services)・番組情報 (/api/programs) と、録画済みの TS をループ再生する
+# Service Stream API (/api/services/{id}/stream) を提供する
+# 指定する TS には、--network-id と --service-id で指定したサービスが含まれている必要がある
+# (KonomiTV 側の tsreadex でサービスを選択して出力するため)
+# misc.LoadTest から負荷試験のバックエンドとして起動されるが、単体でも実行できる
+
+import argparse
+import asyncio
+import json
+import time
+from pathlib import Path
+
+
+class FakeMirakurun:
+    """ 録画済みの TS をループ再生する Mirakurun 互換のダミーサーバー """
+
+    # 1回に送信する TS のサイズ (188 バイトの TS パケット 256 個分)
+    CHUNK_SIZE = 188 * 256
+
+    def __init__(self, ts_path: Path, network_id: int, service_id: int, remote_control_key_id: int, bitrate: float) -> None:
+        self.ts_path = ts_path
+        self.network_id = network_id
+        self.service_id = service_id
+        self.remote_control_key_id = remote_control_key_id
+        self.bitrate = bitrate  # Mbps
+        # ループ再生中の Service Stream API の接続数と、これまでの接続数
+        self.stream_count = 0
+        self.total_stream_count = 0
+        # ループ再生中の Service Stream API の接続ごとの優先度 (X-Mirakurun-Priority)
+        self.stream_priorities: list[int] = []
+
+    @property
+    def mirakurun_service_id(self) -> int:
+        # Mirakurun のサービス ID はネットワーク ID とサービス ID から算出される
+        return self.network_id * 100000 + self.service_id
+
+    def getServices(self) -> list[dict]:
+        return [{
+            'id': self.mirakurun_service_id,
+            'serviceId': self.service_id,
+            'networkId': self.network_id,
+            'name': 'ＫｏｎｏｍｉＴＶ負荷試験',
+            'type': 0x01,
+            'remoteControlKeyId': self.remote_control_key_id,
+            'channel': {'type': 'GR', 'channel': '27'},
+        }]
+
+    def getPrograms(self) -> list[dict]:
+        # 現在時刻の1時間前から12時間後まで、30分ごとの番組情報を生成する
+        programs: list[dict] = []
+        slot = 30 * 60 * 1000
+        first_start_at = (int(time.time() * 1000) // slot - 2) * slot
+        for index in range(26):
+            event_id = 10000 + index
+            programs.append({
+                'id': self.mirakurun_service_id * 100000 + event_id,
+                'eventId': event_id,
+                'serviceId': self.service_id,
+                'networkId': self.network_id,
+                'startAt': first_start_at + index * slot,
+                'duration': slot,
+                'isFree': True,
+                'name': f'負荷試験番組 #{index + 1}',
+                'description': 'misc.FakeMirakurun が生成したダミーの番組情報です。',
+                'extended': {},
+                'video': {'type': 'mpeg2', 'resolution': '1080i', 'streamContent': 0x01, 'componentType': 0xb3},
+                'audios': [{'componentType': 0x03, 'isMain': True, 'samplingRate': 48000, 'langs': ['jpn']}],
+                'genres': [{'lv1': 0x0f, 'lv2': 0x0f, 'un1': 0x0f, 'un2': 0x0f}],
+            })
+        return programs
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """ HTTP/1.1 のリクエストを1つだけ処理して接続を閉じる (Connection: close) """
+
+        try:
+            request_line = (await reader.readline()).decode('latin-1').strip()
+            priority = 0
+            while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                key, _, value = line.decode('latin-1').partition(':')
+                if key.strip().lower() == 'x-mirakurun-priority':
+                    priority = int(value.strip())
+            if request_line == '':
+                return
+            method, path, _ = request_line.split(' ', 2)
+            path = path.split('?', 1)[0].rstrip('/')
+
+            if method == 'GET' and path == '/api/version':
+                await self.writeJSON(writer, {'current': '3.9.0-fake', 'latest': '3.9.0-fake'})
+            elif method == 'GET' and path == '/api/services':
+                await self.writeJSON(writer, self.getServices())
+            elif method == 'GET' and path == '/api/programs':
+                await self.writeJSON(writer, self.getPrograms())
+            elif method == 'GET' and path == f'/api/services/{self.mirakurun_service_id}/stream':
+                await self.writeStream(writer, priority)
+            else:
+                writer.write(b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                await writer.drain()
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def writeJSON(self, writer: asyncio.StreamWriter, data: object) -> None:
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        writer.write(
+            b'HTTP/1.1 200 OK\r\nContent-Type: application/json; charset=utf-8\r\n'
+            b'Content-Length: ' + str(len(body)).encode() + b'\r\nConnection: close\r\n\r\n' + body)
+        await writer.drain()
+
+    async def writeStream(self, writer: asyncio.StreamWriter, priority: int = 0) -> None:
+        """ TS を指定されたビットレートでループ再生し、クライアントが切断するまで送信し続ける """
+
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: video/mp2t\r\nConnection: close\r\n\r\n')
+        self.stream_count += 1
+        self.total_stream_count += 1
+        self.stream_priorities.append(priority)
+        try:
+            # 送信したバイト数からあるべき経過時間を求め、実際の経過時間より先行している分だけ待つ
+            started_at = time.monotonic()
+            sent_bytes = 0
+            bytes_per_second = self.bitrate * 1000 * 1000 / 8
+            with open(self.ts_path, 'rb') as file:
+                while True:
+                    chunk = file.read(self.CHUNK_SIZE)
+                    if len(chunk) < self.CHUNK_SIZE:
+                        file.seek(0)  # 末尾まで読んだら先頭に戻る
+                        if len(chunk) == 0:
+                            continue
+                    writer.write(chunk)
+                    await writer.drain()
+                    sent_bytes += len(chunk)
+                    wait = sent_bytes / bytes_per_second - (time.monotonic() - started_at)
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+        finally:
+            self.stream_count -= 1
+            self.stream_priorities.remove(priority)
+
+
+async def serve(fake_mirakurun: FakeMirakurun, host: str, port: int) -> None:
+    server = await asyncio.start_server(fake_mirakurun.handle, host, port)
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Serve a recorded TS file through a minimal Mirakurun-compatible API.')
+    parser.add_argument('--ts', type=Path, required=True, help='recorded TS file to loop on the service stream API')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='listen address')
+    parser.add_argument('--port', type=int, default=40773, help='listen port')
+    parser.add_argument('--network-id', type=int, default=32736, help='network ID of the service contained in the TS')
+    parser.add_argument('--service-id', type=int, default=1024, help='service ID of the service contained in the TS')
+    parser.add_argument('--remote-control-key-id', type=int, default=1, help='remote control key ID of the service')
+    parser.add_argument('--bitrate', type=float, default=17.0, help='playback bitrate of the TS in Mbps')
+    args = parser.parse_args()
+
+    if args.ts.is_file() is False:
+        parser.error(f'{args.ts} does not exist.')
+
+    fake_mirakurun = FakeMirakurun(args.ts, args.network_id, args.service_id, args.remote_control_key_id, args.bitrate)
+    print(f'Fake Mirakurun is listening on http://{args.host}:{args.port}/ (service: {fake_mirakurun.mirakurun_service_id})')
+    try:
+        asyncio.run(serve(fake_mirakurun, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+# Usage: pipenv run python -m misc.FakeNiconicoAPI [--port 7020] [--watch-page-delay 0.5]
+
+# ニコニコ実況の視聴セッションの取得に使う、ニコ生・ニコニコ OAuth などの API を模した最小限のダミーサーバー
+# ニコ生の視聴ページ (/watch/{id})・wsendpoint (/api/v1/wsendpoint)・アクセストークンの更新 (/oauth2/token)・
+# ユーザー情報 (/v1/users/{id}) を1つのサーバーで提供し、API ごとのリクエスト回数を /fake/stats で返す
+# KonomiTV を環境変数 KONOMITV_NICONICO_API_URL=http://127.0.0.1:7020 を指定して起動すると、ニコニコの代わりにこのサーバーを使う
+# misc.JikkyoSessionTest からテスト用のバックエンドとして起動されるが、単体でも実行できる
+
+import argparse
+import asyncio
+import html
+import json
+import time
+from urllib.parse import parse_qs, urlparse
+
+
+class FakeNiconicoAPI:
+    """ ニコニコ実況の視聴セッションの取得に使う API を模したダミーサーバー """
+
+    def __init__(self, watch_page_delay: float, token_api_delay: float) -> None:
+        self.watch_page_delay = watch_page_delay
+        self.token_api_delay = token_api_delay
+        # 現在有効なアクセストークンとリフレッシュトークン (すべてのユーザーで共通)
+        ## アクセストークンを更新するたびに番号を進め、更新前のリフレッシュトークンは使えなくする
+        self.token_generation = 0
+        # API ごとのリクエスト回数
+        self.stats: dict[str, int] = {'watch': 0, 'wsendpoint': 0, 'wsendpoint_unauthorized': 0, 'token': 0, 'token_failed': 0, 'users': 0}
+
+    @property
+    def access_token(self) -> str:
+        return f'fake-access-token-{self.token_generation}'
+
+    @property
+    def refresh_token(self) -> str:
+        return f'fake-refresh-token-{self.token_generation}'
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """ HTTP/1.1 のリクエストを1つだけ処理して接続を閉じる (Connection: close) """
+
+        try:
+            request_line = (await reader.readline()).decode('latin-1').strip()
+            headers: dict[str, str] = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            if request_line == '':
+                return
+            method, target, _ = request_line.split(' ', 2)
+            url = urlparse(target)
+            path = url.path.rstrip('/')
+            query = {key: values[0] for key, values in parse_qs(url.query).items()}
+            body = b''
+            if 'content-length' in headers:
+                body = await reader.readexactly(int(headers['content-length']))
+
+            if method == 'GET' and path.startswith('/watch/'):
+                await self.handleWatchPage(writer, path.removeprefix('/watch/'))
+            elif method == 'GET' and path == '/api/v1/wsendpoint':
+                await self.handleWsEndpoint(writer, query, headers.get('authorization', ''))
+            elif method == 'POST' and path == '/oauth2/token':
+                await self.handleToken(writer, {key: values[0] for key, values in parse_qs(body.decode('utf-8')).items()})
+            elif method == 'GET' and path.startswith('/v1/users/'):
+                self.stats['users'] += 1
+                await self.writeJSON(writer, 200, {'data': {'user': {'nickname': 'KonomiTV テストユーザー', 'isPremium': False}}})
+            elif method == 'GET' and path == '/fake/stats':
+                await self.writeJSON(writer, 200, self.stats)
+            else:
+                await self.writeJSON(writer, 404, {'meta': {'status': 404, 'errorCode': 'NOT_FOUND'}})
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def handleWatchPage(self, writer: asyncio.StreamWriter, nicolive_id: str) -> None:
+        """ 常に放送中の番組がある状態の、ニコ生の視聴ページ (embedded-data のみ) を返す """
+
+        self.stats['watch'] += 1
+        # 視聴ページの生成が重いことを再現する
+        await asyncio.sleep(self.watch_page_delay)
+        program_id = f'lv{int(time.time()) // 86400}'
+        embedded_data = {
+            'program': {'nicoliveProgramId': program_id, 'status': 'ON_AIR'},
+            'site': {'relive': {'webSocketUrl': f'wss://fake.nicovideo.invalid/{nicolive_id}/{program_id}?audience_token=anonymous'}},
+        }
+        page = f'<html><body><script id="embedded-data" data-props="{html.escape(json.dumps(embedded_data))}"></script></body></html>'
+        await self.write(writer, 200, 'text/html; charset=utf-8', page.encode('utf-8'))
+
+    async def handleWsEndpoint(self, writer: asyncio.StreamWriter, query: dict[str, str], authorization: str) -> None:
+        """ 現在有効なアクセストークンが指定されていれば視聴セッションの WebSocket URL を、そうでなければ 401 を返す """
+
+        self.stats['wsendpoint'] += 1
+        if authorization != f'Bearer {self.access_token}':
+            self.stats['wsendpoint_unauthorized'] += 1
+            await self.writeJSON(writer, 401, {'meta': {'status': 401, 'errorCode': 'UNAUTHORIZED'}})
+            return
+        url = f'wss://fake.nicovideo.invalid/{query.get("nicoliveProgramId")}?user_id={query.get("userId")}'
+        await self.writeJSON(writer, 200, {'meta': {'status': 200}, 'data': {'url': url}})
+
+    async def handleToken(self, writer: asyncio.StreamWriter, form: dict[str, str]) -> None:
+        """ 現在有効なリフレッシュトークンが指定されていれば、アクセストークンとリフレッシュトークンを更新して返す """
+
+        self.stats['token'] += 1
+        await asyncio.sleep(self.token_api_delay)
+        if form.get('grant_type') != 'refresh_token' or form.get('refresh_token') != self.refresh_token:
+            self.stats['token_failed'] += 1
+            await self.writeJSON(writer, 400, {'error': 'invalid_grant'})
+            return
+        self.token_generation += 1
+        await self.writeJSON(writer, 200, {
+            'access_token': self.access_token,
+            'refresh_token': self.refresh_token,
+            'token_type': 'Bearer',
+            'expires_in': 3600,
+        })
+
+    async def writeJSON(self, writer: asyncio.StreamWriter, status: int, data: object) -> None:
+        await self.write(writer, status, 'application/json; charset=utf-8', json.dumps(data, ensure_ascii=False).encode('utf-8'))
+
+    async def write(self, writer: asyncio.StreamWriter, status: int, content_type: str, body: bytes) -> None:
+        reasons = {200: 'OK', 400: 'Bad Request', 401: 'Unauthorized', 404: 'Not Found'}
+        writer.write(
+            f'HTTP/1.1 {status} {reasons.get(status, "Unknown")}\r\nContent-Type: {content_type}\r\n'
+            f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode('latin-1') + body)
+        await writer.drain()
+
+
+async def serve(fake_niconico_api: FakeNiconicoAPI, host: str, port: int) -> None:
+    server = await asyncio.start_server(fake_niconico_api.handle, host, port)
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Serve a minimal fake of the Niconico APIs used to fetch Niconico Jikkyo sessions.')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='listen address')
+    parser.add_argument('--port', type=int, default=7020, help='listen port')
+    parser.add_argument('--watch-page-delay', type=float, default=0.5, help='seconds to wait before returning a watch page')
+    parser.add_argument('--token-api-delay', type=float, default=0.2, help='seconds to wait before returning a token API response')
+    args = parser.parse_args()
+
+    fake_niconico_api = FakeNiconicoAPI(args.watch_page_delay, args.token_api_delay)
+    print(f'Fake Niconico API is listening on http://{args.host}:{args.port}/')
+    print(f'Initial tokens: access_token={fake_niconico_api.access_token} refresh_token={fake_niconico_api.refresh_token}')
+    try:
+        asyncio.run(serve(fake_niconico_api, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
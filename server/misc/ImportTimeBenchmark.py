@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+# Usage: pipenv run python -m misc.ImportTimeBenchmark [--save-baseline] [--top N]
+
+# サーバー本体 (app.app) と番組情報更新用のワーカープロセス (app.models.Program) のインポート時間を
+# python -X importtime で計測し、ベースライン (misc/ImportTimeBaseline.json) と比較する
+# 重いモジュールの遅延インポートが崩れていないかを確認するために使う
+# 依存関係のパッケージ (tweepy・ariblib など) ごとに、そのパッケージ自身のモジュールの読み込みにかかった時間 (self) を集計して表示する
+# ベースラインは Python 3.11 + Pipfile.lock の依存関係の環境で --save-baseline を実行して作成し、リポジトリに含める
+# 依存関係を更新した場合や、意図してインポートするモジュールを増やした場合も --save-baseline で更新する
+# Pipfile.lock とバージョンが異なるパッケージがインストールされている環境では、ベースラインを保存できない
+
+import argparse
+import importlib.metadata
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+BASELINE_PATH = Path(__file__).resolve().parent / 'ImportTimeBaseline.json'
+PIPFILE_LOCK_PATH = BASE_DIR / 'Pipfile.lock'
+REPEAT = 5
+
+# 計測対象のインポートパス (表示名と、実際に実行するコード)
+## app.app はインポート時に実行中のイベントループを取得するため、Uvicorn と同じくイベントループ上でインポートする
+TARGETS = {
+    'server': ('import app.app', 'import asyncio\nasync def main():\n    import app.app\nasyncio.run(main())'),
+    'worker': ('import app.models.Program', 'import app.models.Program'),
+}
+
+# 各インポートパスで読み込まれてはならない重いモジュール
+## サーバー本体でも、Twitter 連携 (tweepy)・LL-HLS の配信 (biim)・画像の処理 (PIL・puremagic) は実際に使われるまで読み込まない
+FORBIDDEN_MODULES = {
+    'server': ['biim', 'PIL', 'puremagic', 'tweepy', 'tweepy_authlib'],
+    'worker': ['biim', 'fastapi', 'hashids', 'PIL', 'puremagic', 'sse_starlette', 'tweepy', 'tweepy_authlib'],
+}
+
+
+def measure(statement: str) -> tuple[int, dict[str, int], set[str]]:
+    """
+    -X importtime の出力を集計し、合計時間 (us)・トップレベルパッケージごとの読み込み時間 (us)・
+    読み込まれたすべてのパッケージ名を返す
+    パッケージごとの読み込み時間は、インポートの深さに関わらずそのパッケージのモジュール自身の時間 (self) を合計したもので、
+    app から読み込まれた依存関係のパッケージの時間は、app ではなくそれぞれのパッケージに計上される
+    合計時間は、トップレベルのインポートの累積時間 (cumulative) の合計
+    """
+
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', statement],
+        cwd = BASE_DIR,
+        capture_output = True,
+        text = True,
+    )
+    if result.returncode != 0:
+        print(result.stderr, file=sys.stderr)
+        raise RuntimeError(f'Failed to run: {statement}')
+
+    total = 0
+    packages: dict[str, int] = {}
+    loaded: set[str] = set()
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_time, cumulative, name = line[len('import time:'):].split('|')
+        package = name.strip().split('.')[0]
+        loaded.add(package)
+        packages[package] = packages.get(package, 0) + int(self_time)
+        # インデントされていない行がトップレベルのインポート
+        ## 配下のインポートの時間を含む累積時間は、二重に数えないようトップレベルのものだけを合計する
+        if name.startswith(' ') and not name.startswith('  '):
+            total += int(cumulative)
+
+    return total, packages, loaded
+
+
+def checkPinnedVersions() -> list[str]:
+    """
+    実行中の Python と、インストールされているパッケージのバージョンが Pipfile.lock と一致しているかを確認し、
+    一致しないものの一覧を返す
+    環境マーカーが付いたパッケージ (pywin32・uvloop など) がインストールされていない場合は、この環境では使われないものとして扱う
+    """
+
+    lock = json.loads(PIPFILE_LOCK_PATH.read_text(encoding='utf-8'))
+    mismatches: list[str] = []
+
+    python_version = f'{sys.version_info.major}.{sys.version_info.minor}'
+    if python_version != lock['_meta']['requires']['python_version']:
+        mismatches.append(f'python {python_version} (locked: {lock["_meta"]["requires"]["python_version"]})')
+
+    for name, entry in lock['default'].items():
+        locked_version = entry.get('version', '').removeprefix('==')
+        try:
+            installed_version = importlib.metadata.version(name)
+        except importlib.metadata.PackageNotFoundError:
+            if 'markers' not in entry:
+                mismatches.append(f'{name} not installed (locked: {locked_version})')
+            continue
+        if installed_version != locked_version:
+            mismatches.append(f'{name} {installed_version} (locked: {locked_version})')
+
+    return mismatches
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Measure import time of KonomiTV server and worker processes.')
+    parser.add_argument('--save-baseline', action='store_true', help='save the result as the new baseline')
+    parser.add_argument('--top', type=int, default=15, help='number of packages to show')
+    args = parser.parse_args()
+
+    baseline: dict[str, dict] = {}
+    if BASELINE_PATH.exists():
+        baseline = json.loads(BASELINE_PATH.read_text(encoding='utf-8'))
+
+    results: dict[str, dict] = {}
+    for target, (description, statement) in TARGETS.items():
+
+        # キャッシュ状態による揺れを抑えるため、複数回計測した中央値を採用する
+        samples = sorted((measure(statement) for _ in range(REPEAT)), key=lambda sample: sample[0])
+        total, packages, loaded = samples[len(samples) // 2]
+        results[target] = {'total_us': total, 'packages_self_us': packages, 'loaded': sorted(loaded)}
+
+        print(f'{"-" * 50}\n{target}: {description}\n{"-" * 50}')
+        print(f'Total (cumulative): {total / 1000:.1f} ms', end='')
+        if target in baseline:
+            baseline_total = baseline[target]['total_us']
+            print(f' (baseline: {baseline_total / 1000:.1f} ms, {(total - baseline_total) / baseline_total * 100:+.1f}%)', end='')
+        print()
+        print('Self time by package:')
+        baseline_packages: dict[str, int] = baseline.get(target, {}).get('packages_self_us', {})
+        for package, self_time in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+            print(f'  {package:<24} {self_time / 1000:>8.1f} ms', end='')
+            if package in baseline_packages:
+                print(f'  (baseline: {baseline_packages[package] / 1000:.1f} ms)', end='')
+            print()
+
+    # サーバー本体・ワーカープロセスに重いモジュールが紛れ込んでいないかを確認
+    for target, forbidden_modules in FORBIDDEN_MODULES.items():
+        leaked = [module for module in forbidden_modules if module in results[target]['loaded']]
+        if len(leaked) > 0:
+            print(f'\nWARNING: {target} import path loads heavy modules: {", ".join(leaked)}')
+
+    if args.save_baseline is True:
+
+        # Pipfile.lock と異なる環境で計測したベースラインは、実際に配布される環境のインポート時間を表さないため保存しない
+        mismatches = checkPinnedVersions()
+        if len(mismatches) > 0:
+            print('\nThe baseline was not saved because this environment does not match Pipfile.lock:')
+            for mismatch in mismatches:
+                print(f'  {mismatch}')
+            sys.exit(1)
+
+        BASELINE_PATH.write_text(json.dumps(results, indent=4, ensure_ascii=False) + '\n', encoding='utf-8')
+        print(f'\nBaseline saved to {BASELINE_PATH}')
+
+
+if __name__ == '__main__':
+    main()
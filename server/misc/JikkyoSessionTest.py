@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+# Usage: pipenv run python -m misc.JikkyoSessionTest [--viewers 10] [--port 7020]
+
+# ニコニコ実況の視聴セッションの取得 (Jikkyo.fetchJikkyoSession()) を、ダミーのニコニコ API (misc.FakeNiconicoAPI) に対して実行し、
+# 同じチャンネルを複数の視聴者が同時に開いたときに、ニコニコ側へのリクエストが1つにまとめられているかを確かめる
+# - ログインしていない視聴者が同時に視聴セッションを取得したとき、視聴ページへのリクエストが1回だけになること
+# - 取得結果のキャッシュが切れた後に、アクセストークンの有効期限が切れた同じユーザーで同時に視聴セッションを取得したとき、
+#   アクセストークンの更新が1回だけ行われ、すべての視聴者が視聴セッションを取得できること
+# データベースにはメモリ上の SQLite を使うため、KonomiTV 本体のデータベースには影響しない
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from typing import Any
+
+
+async def run(port: int, viewers: int) -> bool:
+
+    # ダミーのニコニコ API に向けてから KonomiTV のモジュールをインポートする
+    os.environ['KONOMITV_NICONICO_API_URL'] = f'http://127.0.0.1:{port}'
+    from tortoise import Tortoise
+    from app.constants import DATABASE_CONFIG
+    from app.models import User
+    from app.utils.Jikkyo import Jikkyo
+    from misc.FakeNiconicoAPI import FakeNiconicoAPI
+
+    fake_niconico_api = FakeNiconicoAPI(watch_page_delay=0.5, token_api_delay=0.2)
+    server = await asyncio.start_server(fake_niconico_api.handle, '127.0.0.1', port)
+    await Tortoise.init(config={
+        **DATABASE_CONFIG,
+        'connections': {'default': 'sqlite://:memory:'},
+        'apps': {'models': {'models': ['app.models'], 'default_connection': 'default'}},
+    })
+    await Tortoise.generate_schemas()
+
+    results: list[tuple[str, bool]] = []
+    def check(name: str, passed: bool, detail: Any) -> None:
+        results.append((name, passed))
+        print(f'  [{"PASS" if passed else "FAIL"}] {name}: {detail}')
+
+    try:
+        # NHK総合 (jk1) のニコニコ実況
+        jikkyo = Jikkyo(32736, 1024)
+
+        # ログインしていない視聴者が同時に視聴セッションを取得する
+        print(f'{viewers} anonymous viewers:')
+        start = time.monotonic()
+        sessions = await asyncio.gather(*[jikkyo.fetchJikkyoSession(None) for _ in range(viewers)])
+        elapsed = time.monotonic() - start
+        check('all viewers got a session', all(session['is_success'] is True for session in sessions),
+            f'{sum(session["is_success"] is True for session in sessions)}/{viewers} in {elapsed:.2f}s')
+        check('watch page requested once', fake_niconico_api.stats['watch'] == 1, f'{fake_niconico_api.stats["watch"]} request(s)')
+
+        # キャッシュの有効期間内であれば、視聴ページにリクエストしない
+        await jikkyo.fetchJikkyoSession(None)
+        check('watch page cached', fake_niconico_api.stats['watch'] == 1, f'{fake_niconico_api.stats["watch"]} request(s)')
+
+        # アクセストークンの有効期限が切れたユーザーが同時に視聴セッションを取得する
+        ## キャッシュが切れるまで待ち、視聴ページへのリクエストもまとめられることを確かめる
+        await asyncio.sleep(Jikkyo.WATCH_PAGE_CACHE_TTL + 0.5)
+        user = await User.create(
+            name = 'jikkyo-session-test',
+            password = '',
+            is_admin = False,
+            client_settings = {},
+            niconico_user_id = 12345678,
+            niconico_user_name = 'KonomiTV テストユーザー',
+            niconico_user_premium = False,
+            niconico_access_token = 'expired-access-token',
+            niconico_refresh_token = fake_niconico_api.refresh_token,
+        )
+        print(f'{viewers} viewers logged in as the same user with an expired access token:')
+        start = time.monotonic()
+        users = [await User.get(id=user.id) for _ in range(viewers)]
+        sessions = await asyncio.gather(*[jikkyo.fetchJikkyoSession(user) for user in users])
+        elapsed = time.monotonic() - start
+        check('all viewers got a session', all(session['is_success'] is True for session in sessions),
+            f'{sum(session["is_success"] is True for session in sessions)}/{viewers} in {elapsed:.2f}s ' +
+            str([session['detail'] for session in sessions if session['is_success'] is False][:1]))
+        check('watch page requested once', fake_niconico_api.stats['watch'] == 2, f'{fake_niconico_api.stats["watch"] - 1} request(s)')
+        check('access token refreshed once', fake_niconico_api.stats['token'] == 1 and fake_niconico_api.stats['token_failed'] == 0,
+            f'{fake_niconico_api.stats["token"]} request(s), {fake_niconico_api.stats["token_failed"]} failed')
+        await user.refresh_from_db()
+        check('refreshed access token saved', user.niconico_access_token == fake_niconico_api.access_token, user.niconico_access_token)
+
+    finally:
+        await Tortoise.close_connections()
+        server.close()
+        await server.wait_closed()
+
+    print(f'{"-" * 60}\n{sum(passed for _, passed in results)}/{len(results)} checks passed. (requests: {fake_niconico_api.stats})')
+    return all(passed for _, passed in results)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Test Niconico Jikkyo session lookups against a local fake Niconico API.')
+    parser.add_argument('--viewers', type=int, default=10, help='number of viewers opening the same channel at the same time')
+    parser.add_argument('--port', type=int, default=7020, help='port to run the fake Niconico API on')
+    args = parser.parse_args()
+
+    sys.exit(0 if asyncio.run(run(args.port, args.viewers)) is True else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+
+# Usage: pipenv run python -m misc.LoadTest --ts /path/to/recorded.ts [--mpegts 4] [--slow-mpegts 1] [--ll-hls 2] [--duration 60] [--output result.json]
+
+# チューナーや GPU のない環境 (CI など) で、KonomiTV のライブストリーミングに End-to-End で負荷をかける負荷試験ツール
+# misc.FakeMirakurun で録画済みの TS をループ再生するダミーの Mirakurun を起動し、それをバックエンドとした KonomiTV を
+# FFmpeg (ソフトウェアエンコード) で起動したうえで、指定された数の mpegts クライアント (読み込みの遅いクライアントを含む) と
+# LL-HLS クライアントを同時に接続させる
+# 結果 (スループット・最初のデータを受信するまでの時間・LL-HLS の部分セグメントの配信レイテンシ・サーバーの CPU 使用率と RSS・
+# イベントループの遅延) は JSON で出力する
+#
+# config.yaml が配置されている必要がある (内容は問わない: バックエンド・エンコーダー・データベースは負荷試験用に上書きする)
+# データベースは一時ディレクトリに作成するため、普段使っている KonomiTV のデータベースには影響しない
+# tsreadex はサードパーティーライブラリのものを使う (FFmpeg は --ffmpeg でシステムのものを指定することもできる)
+
+import argparse
+import json
+import os
+import psutil
+import re
+import requests
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any
+
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+LOADTEST_HOST = '127.0.0.78'
+
+
+def serve(args: argparse.Namespace) -> None:
+    """ 負荷試験用に設定を上書きした KonomiTV サーバーを、このプロセスで起動する (--serve 指定時) """
+
+    import uvicorn
+    from app.constants import CONFIG, DATABASE_CONFIG, LIBRARY_PATH
+
+    # バックエンドをダミーの Mirakurun に、エンコーダーを FFmpeg に固定する
+    ## app.app をインポートする前に書き換えておく必要がある
+    CONFIG['general']['backend'] = 'Mirakurun'
+    CONFIG['general']['mirakurun_url'] = args.mirakurun_url.rstrip('/')
+    CONFIG['general']['encoder'] = 'FFmpeg'
+    CONFIG['server']['workers'] = 1
+    CONFIG['tv']['encoder_nodes'] = []
+    CONFIG['tv']['debug_mode_ts_path'] = None
+    DATABASE_CONFIG['connections']['default'] = f'sqlite://{str(Path(args.data_dir) / "database.sqlite")}'
+    if args.ffmpeg is not None:
+        LIBRARY_PATH['FFmpeg'] = args.ffmpeg
+    if args.tsreadex is not None:
+        LIBRARY_PATH['tsreadex'] = args.tsreadex
+
+    uvicorn.run(
+        'app.app:app',
+        host = LOADTEST_HOST,
+        port = args.port,
+        http = 'httptools',
+        loop = ('asyncio' if os.name == 'nt' else 'uvloop'),
+        log_level = 'warning',
+        access_log = False,
+    )
+
+
+def start_process(command: list[str], ready_url: str, timeout: float = 60) -> subprocess.Popen:
+    """ プロセスを起動し、指定された URL にアクセスできるようになるまで待つ """
+
+    process = subprocess.Popen(command, cwd=BASE_DIR)
+    end_at = time.monotonic() + timeout
+    while time.monotonic() < end_at:
+        if process.poll() is not None:
+            raise RuntimeError(f'{" ".join(command)} exited with code {process.returncode}.')
+        try:
+            requests.get(ready_url, timeout=1)
+            return process
+        except requests.exceptions.ConnectionError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f'{" ".join(command)} did not start.')
+
+
+def percentiles(values: list[float]) -> dict[str, float | None]:
+    """ 値のリストから p50・p90・p99・最大値を求める """
+
+    if len(values) == 0:
+        return {'p50': None, 'p90': None, 'p99': None, 'max': None}
+    values = sorted(values)
+    pick = lambda percentile: values[min(len(values) - 1, max(0, int(len(values) * percentile / 100 + 0.5) - 1))]
+    return {'p50': pick(50), 'p90': pick(90), 'p99': pick(99), 'max': values[-1]}
+
+
+def run_mpegts_client(base_url: str, duration: float, read_rate: float | None) -> dict[str, Any]:
+    """
+    mpegts のライブストリームを指定秒数受信し続ける
+    read_rate (バイト/秒) が指定されたときは、読み込みの遅いクライアントとして読み込み速度を制限する
+    """
+
+    started_at = time.monotonic()
+    ttfb: float | None = None
+    received_bytes = 0
+    disconnected = False
+    try:
+        with requests.get(f'{base_url}/mpegts', stream=True, timeout=30) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size=65536):
+                now = time.monotonic()
+                if ttfb is None:
+                    ttfb = now - started_at
+                received_bytes += len(chunk)
+                if read_rate is not None:
+                    wait = received_bytes / read_rate - (now - started_at - ttfb)
+                    if wait > 0:
+                        time.sleep(wait)
+                if time.monotonic() - started_at >= duration:
+                    break
+            else:
+                # 指定秒数が経つ前にサーバーから切断された
+                disconnected = True
+    except requests.exceptions.RequestException:
+        disconnected = True
+
+    elapsed = time.monotonic() - started_at
+    return {
+        'client_type': 'mpegts' if read_rate is None else 'slow-mpegts',
+        'ttfb': ttfb,
+        'received_bytes': received_bytes,
+        'throughput': received_bytes / max(elapsed - (ttfb or 0), 0.001),
+        'disconnected': disconnected,
+    }
+
+
+def run_llhls_client(base_url: str, duration: float) -> dict[str, Any]:
+    """
+    LL-HLS のライブストリームに接続し、プレイリストの EXT-X-PRELOAD-HINT で予告された部分セグメントを指定秒数取得し続ける
+    部分セグメントのリクエストから受信完了までの時間を、部分セグメントの配信レイテンシとして記録する
+    """
+
+    session = requests.Session()
+    started_at = time.monotonic()
+    ttfb: float | None = None
+    received_bytes = 0
+    part_latencies: list[float] = []
+    errors = 0
+
+    client_id = session.post(f'{base_url}/ll-hls', timeout=30).json()['client_id']
+    playlist_url = f'{base_url}/ll-hls/{client_id}/primary-audio/playlist.m3u8'
+    params: dict[str, str] = {}
+    try:
+        while time.monotonic() - started_at < duration:
+
+            # 前回取得した部分セグメントまでがプレイリストに含まれるまで待つ (LL-HLS のブロッキングリクエスト)
+            playlist = session.get(playlist_url, params=params, timeout=30)
+            if playlist.status_code != 200:
+                errors += 1
+                time.sleep(0.1)
+                continue
+            hint = re.search(r'#EXT-X-PRELOAD-HINT:TYPE=PART,URI="([^"]+)"', playlist.text)
+            if hint is None:
+                time.sleep(0.1)
+                continue
+
+            # 予告された部分セグメントを取得する (生成されるまでレスポンスが返らない)
+            part_url = urllib.parse.urljoin(playlist_url, hint.group(1))
+            requested_at = time.monotonic()
+            part = session.get(part_url, timeout=30)
+            if part.status_code != 200:
+                errors += 1
+                continue
+            now = time.monotonic()
+            part_latencies.append(now - requested_at)
+            received_bytes += len(part.content)
+            if ttfb is None:
+                ttfb = now - started_at
+
+            query = urllib.parse.parse_qs(urllib.parse.urlsplit(part_url).query)
+            params = {'_HLS_msn': query['msn'][0], '_HLS_part': query.get('part', ['0'])[0] or '0'}
+    except requests.exceptions.RequestException:
+        errors += 1
+    finally:
+        try:
+            session.delete(f'{base_url}/ll-hls/{client_id}', timeout=5)
+        except requests.exceptions.RequestException:
+            pass
+
+    elapsed = time.monotonic() - started_at
+    return {
+        'client_type': 'll-hls',
+        'ttfb': ttfb,
+        'received_bytes': received_bytes,
+        'throughput': received_bytes / max(elapsed - (ttfb or 0), 0.001),
+        'part_latencies': part_latencies,
+        'errors': errors,
+    }
+
+
+class ResourceSampler(threading.Thread):
+    """ KonomiTV サーバーと、その子プロセス (tsreadex・FFmpeg) の CPU 使用率と RSS を1秒ごとに記録する """
+
+    def __init__(self, pid: int) -> None:
+        super().__init__(daemon=True)
+        self.process = psutil.Process(pid)
+        self.stop_event = threading.Event()
+        self.server_rss: list[int] = []
+        self.children_rss: list[int] = []
+        self.server_cpu_seconds = 0.0
+        self.children_cpu_seconds = 0.0
+        self.started_at = time.monotonic()
+        self.server_cpu_started = sum(self.process.cpu_times()[:2])
+        self.children_cpu: dict[int, float] = {}
+
+    def run(self) -> None:
+        while self.stop_event.wait(1) is False:
+            try:
+                self.server_rss.append(self.process.memory_info().rss)
+                self.server_cpu_seconds = sum(self.process.cpu_times()[:2]) - self.server_cpu_started
+                children_rss = 0
+                for child in self.process.children(recursive=True):
+                    try:
+                        children_rss += child.memory_info().rss
+                        self.children_cpu[child.pid] = sum(child.cpu_times()[:2])
+                    except psutil.NoSuchProcess:
+                        pass
+                self.children_rss.append(children_rss)
+            except psutil.NoSuchProcess:
+                break
+
+    def stop(self) -> dict[str, Any]:
+        self.stop_event.set()
+        self.join()
+        elapsed = time.monotonic() - self.started_at
+        return {
+            'server_cpu_percent': self.server_cpu_seconds / elapsed * 100,
+            'server_rss_max_bytes': max(self.server_rss, default=0),
+            'server_rss_mean_bytes': statistics.mean(self.server_rss) if len(self.server_rss) > 0 else 0,
+            'encoders_cpu_percent': sum(self.children_cpu.values()) / elapsed * 100,
+            'encoders_rss_max_bytes': max(self.children_rss, default=0),
+        }
+
+
+def get_event_loop_lag(server_url: str) -> dict[str, float | None]:
+    """ /api/metrics のイベントループの遅延のヒストグラムから、平均値と p99 (が含まれるバケットの上限) を求める """
+
+    metrics = requests.get(f'{server_url}/api/metrics', timeout=10).text
+    buckets: list[tuple[float, float]] = []
+    total = count = 0.0
+    for line in metrics.splitlines():
+        if line.startswith('konomitv_event_loop_lag_seconds_bucket'):
+            le = re.search(r'le="([^"]+)"', line)
+            if le is not None:
+                buckets.append((float(le.group(1)), float(line.rsplit(' ', 1)[1])))
+        elif line.startswith('konomitv_event_loop_lag_seconds_sum'):
+            total = float(line.rsplit(' ', 1)[1])
+        elif line.startswith('konomitv_event_loop_lag_seconds_count'):
+            count = float(line.rsplit(' ', 1)[1])
+    if count == 0:
+        return {'mean': None, 'p99_upper_bound': None}
+    p99 = next((le for le, cumulative in buckets if cumulative >= count * 0.99), None)
+    return {'mean': total / count, 'p99_upper_bound': p99}
+
+
+def summarize(results: list[dict[str, Any]], client_type: str) -> dict[str, Any]:
+    clients = [result for result in results if result['client_type'] == client_type]
+    summary: dict[str, Any] = {
+        'clients': len(clients),
+        'ttfb': percentiles([client['ttfb'] for client in clients if client['ttfb'] is not None]),
+        'no_data_clients': len([client for client in clients if client['ttfb'] is None]),
+        'throughput_mean': statistics.mean([client['throughput'] for client in clients]) if len(clients) > 0 else None,
+        'received_bytes': sum(client['received_bytes'] for client in clients),
+    }
+    if client_type == 'll-hls':
+        summary['part_latency'] = percentiles([latency for client in clients for latency in client['part_latencies']])
+        summary['errors'] = sum(client['errors'] for client in clients)
+    else:
+        summary['disconnected_clients'] = len([client for client in clients if client['disconnected'] is True])
+    return summary
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Run an end-to-end load test of KonomiTV live streaming against a fake Mirakurun.')
+    parser.add_argument('--ts', type=Path, help='recorded TS file looped by the fake Mirakurun')
+    parser.add_argument('--network-id', type=int, default=32736, help='network ID of the service contained in the TS')
+    parser.add_argument('--service-id', type=int, default=1024, help='service ID of the service contained in the TS')
+    parser.add_argument('--bitrate', type=float, default=17.0, help='playback bitrate of the TS in Mbps')
+    parser.add_argument('--channel', type=str, default='gr011', help='display channel ID of the service in KonomiTV')
+    parser.add_argument('--quality', type=str, default='240p', help='quality of the live stream to request')
+    parser.add_argument('--mpegts', type=int, default=4, help='number of mpegts clients')
+    parser.add_argument('--slow-mpegts', type=int, default=1, help='number of mpegts clients reading slower than the stream bitrate')
+    parser.add_argument('--slow-read-rate', type=float, default=16, help='read rate of the slow mpegts clients in KB/s')
+    parser.add_argument('--ll-hls', type=int, default=2, help='number of LL-HLS clients')
+    parser.add_argument('--duration', type=float, default=60, help='duration of each client in seconds')
+    parser.add_argument('--port', type=int, default=7090, help='listen port of the KonomiTV server under test')
+    parser.add_argument('--mirakurun-port', type=int, default=40773, help='listen port of the fake Mirakurun')
+    parser.add_argument('--ffmpeg', type=str, default=None, help='FFmpeg executable to use instead of the bundled one')
+    parser.add_argument('--tsreadex', type=str, default=None, help='tsreadex executable to use instead of the bundled one')
+    parser.add_argument('--output', type=Path, default=None, help='write the JSON result to this file instead of stdout')
+    ## 負荷試験用の KonomiTV サーバーとして起動する (このスクリプト自身がサブプロセスとして起動する)
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--mirakurun-url', type=str, help=argparse.SUPPRESS)
+    parser.add_argument('--data-dir', type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve is True:
+        serve(args)
+        return
+
+    if args.ts is None or args.ts.is_file() is False:
+        parser.error('--ts must point to an existing recorded TS file.')
+
+    mirakurun_url = f'http://127.0.0.1:{args.mirakurun_port}'
+    server_url = f'http://{LOADTEST_HOST}:{args.port}'
+    base_url = f'{server_url}/api/streams/live/{args.channel}/{args.quality}'
+
+    with tempfile.TemporaryDirectory(prefix='konomitv-loadtest-') as data_dir:
+
+        # ダミーの Mirakurun と、それをバックエンドとした KonomiTV サーバーを起動する
+        print('Starting fake Mirakurun and KonomiTV...', file=sys.stderr)
+        fake_mirakurun = start_process([
+            sys.executable, '-m', 'misc.FakeMirakurun',
+            '--ts', str(args.ts.resolve()),
+            '--port', str(args.mirakurun_port),
+            '--network-id', str(args.network_id),
+            '--service-id', str(args.service_id),
+            '--bitrate', str(args.bitrate),
+        ], f'{mirakurun_url}/api/version')
+        server: subprocess.Popen | None = None
+        try:
+            server = start_process([
+                sys.executable, '-m', 'misc.LoadTest', '--serve',
+                '--port', str(args.port),
+                '--mirakurun-url', mirakurun_url,
+                '--data-dir', data_dir,
+                *(['--ffmpeg', args.ffmpeg] if args.ffmpeg is not None else []),
+                *(['--tsreadex', args.tsreadex] if args.tsreadex is not None else []),
+            ], f'{server_url}/api/version', timeout=120)
+
+            # すべてのクライアントを同時に接続させる
+            print(f'Running {args.mpegts} mpegts, {args.slow_mpegts} slow mpegts and {args.ll_hls} LL-HLS clients '
+                  f'for {args.duration} seconds...', file=sys.stderr)
+            sampler = ResourceSampler(server.pid)
+            sampler.start()
+            with ThreadPoolExecutor(max_workers=args.mpegts + args.slow_mpegts + args.ll_hls) as executor:
+                futures = [
+                    *[executor.submit(run_mpegts_client, base_url, args.duration, None) for _ in range(args.mpegts)],
+                    *[executor.submit(run_mpegts_client, base_url, args.duration, args.slow_read_rate * 1024) for _ in range(args.slow_mpegts)],
+                    *[executor.submit(run_llhls_client, base_url, args.duration) for _ in range(args.ll_hls)],
+                ]
+                results = [future.result() for future in futures]
+            resources = sampler.stop()
+            event_loop_lag = get_event_loop_lag(server_url)
+
+        finally:
+            for process in (server, fake_mirakurun):
+                if process is not None:
+                    process.terminate()
+                    process.wait()
+
+    report = {
+        'config': {
+            'channel': args.channel,
+            'quality': args.quality,
+            'duration': args.duration,
+            'ts_bitrate_mbps': args.bitrate,
+        },
+        'mpegts': summarize(results, 'mpegts'),
+        'slow_mpegts': summarize(results, 'slow-mpegts'),
+        'll_hls': summarize(results, 'll-hls'),
+        'resources': resources,
+        'event_loop_lag': event_loop_lag,
+    }
+    output = json.dumps(report, indent=4)
+    if args.output is not None:
+        args.output.write_text(output + '\n', encoding='utf-8')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
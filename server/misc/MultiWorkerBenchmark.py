@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+# Usage: pipenv run python -m misc.MultiWorkerBenchmark [--workers 1 2 4] [--duration 15] [--path /api/channels]
+
+# API ワーカープロセスの数ごとに KonomiTV の API サーバーを起動し、同時リクエスト時のスループットとレイテンシを計測する
+# KonomiTV 本体 (ストリーム管理プロセス) を server.workers: 2 以上で起動した状態で実行すること
+# (データベースの初期化と、中継先のストリーム管理プロセスの起動が必要なため)
+# ベンチマーク用の API サーバーは、本体とは別のポート (server.port + 20) で起動する
+
+import argparse
+import os
+import requests
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+from app.constants import CONFIG
+
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+BENCHMARK_HOST = '127.0.0.77'
+BENCHMARK_PORT = CONFIG['server']['port'] + 20
+
+
+def start_api_workers(workers: int) -> subprocess.Popen:
+    """ 指定された数の API ワーカープロセスを起動し、リクエストを受け付けられるようになるまで待つ """
+
+    process = subprocess.Popen(
+        [
+            sys.executable, '-m', 'uvicorn', 'app.app:app',
+            '--host', BENCHMARK_HOST,
+            '--port', str(BENCHMARK_PORT),
+            '--workers', str(workers),
+            '--http', 'httptools',
+            '--loop', ('asyncio' if os.name == 'nt' else 'uvloop'),
+            '--log-level', 'warning',
+            '--no-access-log',
+        ],
+        cwd = BASE_DIR,
+        env = {**os.environ, 'KONOMITV_API_WORKER': '1'},
+    )
+
+    # すべてのワーカーが起動するまで少し余裕を持って待つ
+    for _ in range(300):
+        try:
+            requests.get(f'http://{BENCHMARK_HOST}:{BENCHMARK_PORT}/api/version', timeout=1)
+            time.sleep(2)
+            return process
+        except requests.exceptions.ConnectionError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError('API workers did not start.')
+
+
+def run_client(paths: list[str], threads: int, duration: float) -> list[float]:
+    """ 1つのクライアントプロセス内で複数スレッドからリクエストを送り続け、成功したリクエストのレイテンシ (秒) を返す """
+
+    def worker() -> list[float]:
+        latencies: list[float] = []
+        session = requests.Session()
+        end_at = time.monotonic() + duration
+        index = 0
+        while time.monotonic() < end_at:
+            start = time.monotonic()
+            response = session.get(f'http://{BENCHMARK_HOST}:{BENCHMARK_PORT}{paths[index % len(paths)]}')
+            if response.status_code == 200:
+                latencies.append(time.monotonic() - start)
+            index += 1
+        return latencies
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        results = list(executor.map(lambda _: worker(), range(threads)))
+    return [latency for latencies in results for latency in latencies]
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Measure API throughput scaling with the number of KonomiTV API workers.')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help='numbers of API workers to benchmark')
+    parser.add_argument('--duration', type=float, default=15, help='duration of each run in seconds')
+    parser.add_argument('--clients', type=int, default=4, help='number of load generator processes')
+    parser.add_argument('--threads', type=int, default=16, help='number of threads per load generator process')
+    parser.add_argument('--path', type=str, nargs='+', default=['/api/channels', '/api/streams/live'], help='API paths to request')
+    args = parser.parse_args()
+
+    results: list[tuple[int, float, float, float]] = []
+    for workers in args.workers:
+
+        print(f'Benchmarking {workers} API worker(s)...')
+        process = start_api_workers(workers)
+        try:
+            # 負荷をかける側が先にボトルネックにならないよう、複数プロセスからリクエストを送る
+            with ProcessPoolExecutor(max_workers=args.clients) as executor:
+                futures = [executor.submit(run_client, args.path, args.threads, args.duration) for _ in range(args.clients)]
+                latencies = sorted(latency for future in futures for latency in future.result())
+        finally:
+            process.terminate()
+            process.wait()
+
+        if len(latencies) == 0:
+            print('  No successful requests.')
+            continue
+        throughput = len(latencies) / args.duration
+        p50 = statistics.median(latencies) * 1000
+        p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000
+        results.append((workers, throughput, p50, p99))
+
+    print(f'{"-" * 60}\nResults ({", ".join(args.path)})\n{"-" * 60}')
+    for workers, throughput, p50, p99 in results:
+        scaling = throughput / results[0][1]
+        print(f'{workers:>2} worker(s): {throughput:>8.1f} req/s (x{scaling:.2f})  p50: {p50:>7.1f} ms  p99: {p99:>7.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
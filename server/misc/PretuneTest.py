@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+# Usage: pipenv run python -m misc.PretuneTest
+
+# ダミーの Mirakurun (misc.FakeMirakurun) に対してチャンネルを先行選局し、そのチャンネルを視聴し始めたときの
+# Service Stream API の接続の優先度 (X-Mirakurun-Priority) を確かめる
+# - 先行選局中は、視聴者のチューナーの利用を妨げないよう優先度 -1 で放送波を要求していること
+# - 視聴者が購読を始めたら通常の優先度 (0) で放送波を要求し直し、優先度 -1 の接続は閉じられていること
+# - 先行選局中に貯めた放送波が最初に書き込まれ、その後も新しい接続から放送波が書き込まれ続けること
+
+import asyncio
+import sys
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any
+
+from app.constants import CONFIG
+from app.utils.TunerSession import TunerSession
+from misc.FakeMirakurun import FakeMirakurun
+
+
+class CollectingStdin:
+    """ tsreadex の標準入力の代わりに、書き込まれた放送波のバイト数を数えるダミー """
+
+    def __init__(self) -> None:
+        self.written_bytes = 0
+        self.lock = threading.Lock()
+
+    def write(self, chunk: bytes) -> None:
+        with self.lock:
+            self.written_bytes += len(chunk)
+
+    def close(self) -> None:
+        pass
+
+
+async def run() -> bool:
+
+    results: list[tuple[str, bool]] = []
+    def check(name: str, passed: bool, detail: Any) -> None:
+        results.append((name, passed))
+        print(f'  [{"PASS" if passed else "FAIL"}] {name}: {detail}')
+
+    # NULL パケットだけの TS をループ再生するダミーの Mirakurun を起動する
+    ## TunerSession は放送波の中身を解析しないため、放送波の中身は何でもよい
+    with tempfile.TemporaryDirectory() as temp_dir:
+        ts_path = Path(temp_dir) / 'null.ts'
+        ts_path.write_bytes((b'\x47\x1f\xff\x10' + b'\xff' * 184) * 256 * 16)
+        fake_mirakurun = FakeMirakurun(ts_path, 32736, 1024, 1, 8.0)
+        server = await asyncio.start_server(fake_mirakurun.handle, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        CONFIG['general']['backend'] = 'Mirakurun'
+        CONFIG['general']['mirakurun_url'] = f'http://127.0.0.1:{port}/'
+
+        async with server:
+
+            # チャンネルを先行選局する
+            print('Pre-tuning the channel:')
+            session = TunerSession.get(32736, 1024, 32736)
+            pretuned = await session.pretune()
+            await asyncio.sleep(1)
+            check('pre-tune started', pretuned is True and session.isPretuned() is True, f'state={session.state}')
+            check('pre-tune stream requested at priority -1', fake_mirakurun.stream_priorities == [-1], fake_mirakurun.stream_priorities)
+
+            # 先行選局したチャンネルの視聴を始める
+            print('A viewer subscribes to the pre-tuned channel:')
+            stdin = CollectingStdin()
+            subscriber = await TunerSession.get(32736, 1024, 32736).subscribe(stdin)
+            await asyncio.sleep(0.5)
+            prefilled_bytes = stdin.written_bytes
+            check('viewer subscribed to the pre-tuned session', subscriber is not None and subscriber.session is session, f'state={session.state}')
+            check('viewer stream requested at priority 0', fake_mirakurun.stream_priorities == [0], fake_mirakurun.stream_priorities)
+            check('pre-tune buffer used as prefill', prefilled_bytes >= TunerSession.CHUNK_SIZE, f'{prefilled_bytes} bytes written')
+
+            # 優先度 -1 の接続を閉じた後も、新しい接続から放送波を受信し続ける
+            await asyncio.sleep(1)
+            check('stream keeps flowing after the switch', stdin.written_bytes > prefilled_bytes and session.isDisconnected() is False,
+                f'{stdin.written_bytes - prefilled_bytes} bytes written, disconnected={session.isDisconnected()}')
+
+            # 同じチャンネルを別の画質で視聴しても、放送波を要求し直さない
+            print('Another quality subscribes to the same channel:')
+            second_subscriber = await TunerSession.get(32736, 1024, 32736).subscribe(CollectingStdin())
+            check('running stream reused', second_subscriber is not None and fake_mirakurun.total_stream_count == 2,
+                f'{fake_mirakurun.total_stream_count} stream request(s) in total, priorities={fake_mirakurun.stream_priorities}')
+
+            # チューナーセッションを終了し、ダミーの Mirakurun が切断を検知して送信を終えるのを待つ
+            await session.close()
+            await asyncio.sleep(0.5)
+
+    print(f'{"-" * 60}\n{sum(passed for _, passed in results)}/{len(results)} checks passed.')
+    return all(passed for _, passed in results)
+
+
+def main():
+
+    sys.exit(0 if asyncio.run(run()) is True else 1)
+
+
+if __name__ == '__main__':
+    main()
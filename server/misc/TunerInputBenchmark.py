@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+# Usage: pipenv run python -m misc.TunerInputBenchmark [--duration 10] [--bitrate 0] [--mode legacy --mode queue --mode splice]
+
+# チューナー (EDCB の TCP ソケット) から tsreadex の標準入力までの放送波の受け渡しの性能を計測する (Linux 専用)
+# 子プロセスからソケットペア経由で TS を送信し、tsreadex の代わりに wc -c の標準入力に書き込んで、持続スループットとこのプロセスの CPU 使用率を表示する
+# legacy: recv() → bytes() → ロック付きで最終読み取り時刻を更新 → 標準入力に write() する従来の方法
+# queue: TunerSession の Reader から購読者のバッファを経由して書き込む方法 (複数画質で同じチューナーを共有している場合)
+# splice: TunerSession の Reader から os.splice() でカーネル内で直接転送する方法 (購読者が1つの場合)
+# --bitrate (Mbps) を指定すると放送波と同程度の速度で送信し、1 ストリームあたりの CPU 使用率を比較できる (0 の場合は全速力で送信する)
+
+import argparse
+import os
+import resource
+import socket
+import subprocess
+import threading
+import time
+from typing import Any, cast
+
+from app.utils.TunerSession import TunerSession, TunerSessionSubscriber
+
+
+CHUNK_SIZE = 48128
+
+
+def send_source(sock: socket.socket, duration: float, bitrate: float) -> None:
+
+    # 送信するダミーの TS パケット (0x47 で始まる 188 バイトのパケットを並べたもの)
+    packet = b'\x47' + b'\xff' * 187
+    data = memoryview(packet * (CHUNK_SIZE // 188) * 16)
+
+    start = time.monotonic()
+    sent = 0
+    while time.monotonic() - start < duration:
+        try:
+            sock.sendall(data)
+        except OSError:
+            break
+        sent += len(data)
+        if bitrate > 0:
+            time.sleep(max(0, sent * 8 / (bitrate * 1000 * 1000) - (time.monotonic() - start)))
+    sock.close()
+
+
+class StdinWithoutFileno:
+    """ ファイルディスクリプタを隠し、TunerSession に直接転送させないための標準入力のラッパー """
+
+    def __init__(self, stdin: Any) -> None:
+        self.__stdin = stdin
+
+    def write(self, data: bytes) -> None:
+        self.__stdin.write(data)
+
+    def flush(self) -> None:
+        self.__stdin.flush()
+
+    def close(self) -> None:
+        self.__stdin.close()
+
+
+def run_legacy(sock: socket.socket, stdin: Any) -> None:
+
+    ts_read_at = time.monotonic()
+    ts_read_at_lock = threading.Lock()
+    for chunk in iter(lambda: sock.recv(CHUNK_SIZE), b''):
+        with ts_read_at_lock:
+            ts_read_at = time.monotonic()
+        stdin.write(bytes(chunk))
+    stdin.close()
+    del ts_read_at
+
+
+def run_tuner_session(sock: socket.socket, stdin: Any) -> None:
+
+    # チューナーを起動せずに、受信済みのソケットを渡して TunerSession の Reader だけを動かす
+    session = TunerSession(0, 0, 0)
+    session_any = cast(Any, session)
+    session_any._TunerSession__pipe_or_socket = sock
+    session.state = 'Running'
+    subscriber = TunerSessionSubscriber(session, stdin)
+    session_any._TunerSession__subscribers.append(subscriber)
+
+    reader = threading.Thread(target=session_any._TunerSession__reader)
+    reader.start()
+    reader.join()
+
+    # バッファに残っている放送波を書き終えてから購読を終了する
+    cast(Any, subscriber)._TunerSessionSubscriber__queue.join()
+    subscriber.close()
+
+
+def run(mode: str, duration: float, bitrate: float) -> None:
+
+    source_sock, sink_sock = socket.socketpair()
+    # EDCB の TCP ソケットと同様にタイムアウトを設定する (ソケットはノンブロッキングモードになる)
+    sink_sock.settimeout(15)
+
+    # 送信側は CPU 使用率に含めないよう子プロセスで動かす
+    pid = os.fork()
+    if pid == 0:
+        sink_sock.close()
+        send_source(source_sock, duration, bitrate)
+        os._exit(0)
+    source_sock.close()
+
+    # tsreadex の代わりに、受け取ったバイト数を数えるだけのプロセスを起動する
+    process = subprocess.Popen(['wc', '-c'], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    assert process.stdin is not None and process.stdout is not None
+
+    usage_start = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.monotonic()
+    if mode == 'legacy':
+        run_legacy(sink_sock, process.stdin)
+    elif mode == 'queue':
+        run_tuner_session(sink_sock, StdinWithoutFileno(process.stdin))
+    else:
+        run_tuner_session(sink_sock, process.stdin)
+    received = int(process.stdout.read())
+    elapsed = time.monotonic() - start
+    usage_end = resource.getrusage(resource.RUSAGE_SELF)
+    process.wait()
+    os.waitpid(pid, 0)
+
+    cpu_time = (usage_end.ru_utime - usage_start.ru_utime) + (usage_end.ru_stime - usage_start.ru_stime)
+    print(f'{mode:>6}: {received / elapsed / 1024 / 1024:8.1f} MB/s, '
+          f'CPU {cpu_time / elapsed * 100:5.1f} % '
+          f'(user {usage_end.ru_utime - usage_start.ru_utime:.2f} s, system {usage_end.ru_stime - usage_start.ru_stime:.2f} s), '
+          f'{received / 1024 / 1024:.0f} MB in {elapsed:.1f} s')
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Benchmark the input path from the tuner to tsreadex.')
+    parser.add_argument('--duration', type=float, default=10, help='duration of each mode in seconds')
+    parser.add_argument('--bitrate', type=float, default=0, help='send bitrate in Mbps (0: as fast as possible)')
+    parser.add_argument('--mode', type=str, action='append', choices=['legacy', 'queue', 'splice'], help='modes to run (default: all)')
+    args = parser.parse_args()
+
+    if hasattr(os, 'splice') is False:
+        print('os.splice() is not available on this platform. The splice mode falls back to the queue mode.')
+
+    for mode in (args.mode or ['legacy', 'queue', 'splice']):
+        run(mode, args.duration, args.bitrate)
+
+
+if __name__ == '__main__':
+    main()
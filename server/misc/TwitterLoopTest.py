@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+
+# Usage: pipenv run python -m misc.TwitterLoopTest [--delay 1.0] [--viewers 10]
+
+# ホームタイムライン取得 API・ツイート検索 API を、応答の遅いダミーの Twitter API に対して同時に実行し、
+# Twitter API の応答を待っている間もイベントループ (ライブストリームの配信など) が止まらないことを確かめる
+# - 10ms ごとに起きるハートビートの遅れが、Twitter API の応答時間に関わらず小さいままであること
+# - 同じアカウントのホームタイムライン・同じ検索クエリの検索が同時に行われたとき、Twitter API へのリクエストが1回にまとめられること
+# - キャッシュの有効期間が過ぎた後のホームタイムラインの取得では、新しいツイートの差分だけを Twitter API から取得すること
+# - 検索結果は Twitter アカウントごとにキャッシュされ、他のアカウントには共有されないこと
+# - いいねした後のホームタイムラインの取得では、キャッシュを使わずに最新のツイートから取得し直すこと
+# 比較のため、以前と同じくイベントループ上で直接 Twitter API を呼び出した場合のハートビートの遅れも計測する
+
+import argparse
+import asyncio
+import sys
+import time
+from email.utils import format_datetime
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Any
+
+import tweepy.models
+
+from app.routers.TwitterRouter import TwitterFavoriteAPI, TwitterSearchAPI, TwitterTimelineAPI
+from app.utils.TweetCache import TweetCache
+
+
+class SlowTwitterAPI:
+    """ 応答に時間がかかる Twitter API を模した、tweepy.API と同じメソッドを持つダミー """
+
+    def __init__(self, delay: float) -> None:
+        self.delay = delay
+        # 最新のツイートの ID (新しいツイートが投稿されるたびに増やす)
+        self.latest_tweet_id = 1000
+        # メソッドごとの呼び出し回数と、最後に指定された since_id
+        self.calls: dict[str, int] = {'home_timeline': 0, 'search_tweets': 0, 'create_favorite': 0}
+        self.last_since_id: str | None = None
+
+    def post(self, count: int) -> None:
+        self.latest_tweet_id += count
+
+    def generateStatuses(self, count: int, since_id: str | None, text: str) -> list[tweepy.models.Status]:
+        oldest_tweet_id = max(int(since_id) + 1 if since_id is not None else 0, self.latest_tweet_id - count + 1)
+        return [tweepy.models.Status.parse(None, {
+            'id': tweet_id,
+            'id_str': str(tweet_id),
+            'created_at': format_datetime(datetime.now(timezone.utc)),
+            'full_text': f'{text} #{tweet_id}',
+            'lang': 'ja',
+            'source': '<a href="https://example.com/">KonomiTV</a>',
+            'retweet_count': 0,
+            'favorite_count': 0,
+            'retweeted': False,
+            'favorited': True,
+            'entities': {'urls': []},
+            'user': {
+                'id': 1,
+                'id_str': '1',
+                'name': 'KonomiTV',
+                'screen_name': 'konomitv',
+                'profile_image_url_https': 'https://pbs.twimg.com/profile_images/1/icon_normal.jpg',
+            },
+        }) for tweet_id in range(self.latest_tweet_id, oldest_tweet_id - 1, -1)]
+
+    def home_timeline(self, count: int, since_id: str | None = None, **kwargs: Any) -> list[tweepy.models.Status]:
+        self.calls['home_timeline'] += 1
+        self.last_since_id = since_id
+        time.sleep(self.delay)  # 同期的な HTTP リクエストの待ち時間を再現する
+        return self.generateStatuses(count, since_id, 'タイムラインのツイート')
+
+    def search_tweets(self, q: str, count: int, **kwargs: Any) -> list[tweepy.models.Status]:
+        self.calls['search_tweets'] += 1
+        time.sleep(self.delay)
+        return self.generateStatuses(count, None, f'{q} の検索結果')
+
+    def create_favorite(self, id: str) -> None:
+        self.calls['create_favorite'] += 1
+        time.sleep(self.delay)
+
+
+async def measure_lag(coroutine: Any) -> tuple[Any, float]:
+    """ コルーチンを実行している間の、10ms ごとに起きるハートビートの最大の遅れ (秒) を計測する """
+
+    max_lag = 0.0
+    done = asyncio.Event()
+
+    async def heartbeat() -> None:
+        nonlocal max_lag
+        while done.is_set() is False:
+            start = time.monotonic()
+            await asyncio.sleep(0.01)
+            max_lag = max(max_lag, time.monotonic() - start - 0.01)
+
+    heartbeat_task = asyncio.create_task(heartbeat())
+    await asyncio.sleep(0.05)
+    try:
+        result = await coroutine
+    finally:
+        done.set()
+        await heartbeat_task
+    return result, max_lag
+
+
+async def run(delay: float, viewers: int) -> bool:
+
+    api = SlowTwitterAPI(delay)
+    account = SimpleNamespace(id=1)
+    results: list[tuple[str, bool]] = []
+    def check(name: str, passed: bool, detail: Any) -> None:
+        results.append((name, passed))
+        print(f'  [{"PASS" if passed else "FAIL"}] {name}: {detail}')
+
+    # 比較のため、イベントループ上で直接 Twitter API を呼び出す (変更前の実装と同じ)
+    print('Blocking call on the event loop (previous implementation):')
+    async def blocking() -> None:
+        api.home_timeline(count=200)
+    _, lag = await measure_lag(blocking())
+    print(f'  max heartbeat lag: {lag * 1000:.1f} ms')
+
+    # 同じアカウントのホームタイムラインを同時に取得する
+    print(f'{viewers} concurrent timeline requests for the same account (Twitter API delay: {delay:.1f}s):')
+    api.calls['home_timeline'] = 0
+    timelines, lag = await measure_lag(asyncio.gather(*[
+        TwitterTimelineAPI(since_tweet_id=None, twitter_account=account, twitter_account_api=api) for _ in range(viewers)]))
+    check('event loop stayed responsive', lag < min(0.1, delay / 2), f'max heartbeat lag {lag * 1000:.1f} ms')
+    check('timeline fetched once', api.calls['home_timeline'] == 1, f'{api.calls["home_timeline"]} call(s)')
+    check('all requests got the timeline', all(len(timeline) == 200 for timeline in timelines), [len(timeline) for timeline in timelines])
+
+    # キャッシュの有効期間が過ぎた後に、クライアントが前回取得した最新のツイート以降のツイートを取得する
+    print('Polling the timeline after the cache expired:')
+    newest_tweet_id = timelines[0][0].id
+    api.post(3)
+    await asyncio.sleep(TweetCache.TIMELINE_TTL + 0.5)
+    new_tweets, lag = await measure_lag(TwitterTimelineAPI(since_tweet_id=newest_tweet_id, twitter_account=account, twitter_account_api=api))
+    check('only new tweets fetched', api.calls['home_timeline'] == 2 and api.last_since_id == newest_tweet_id,
+        f'{api.calls["home_timeline"]} call(s), since_id={api.last_since_id}')
+    check('new tweets returned', [tweet.id for tweet in new_tweets] == [str(api.latest_tweet_id - index) for index in range(3)],
+        [tweet.id for tweet in new_tweets])
+    full_timeline = await TwitterTimelineAPI(since_tweet_id=None, twitter_account=account, twitter_account_api=api)
+    check('cached head kept', len(full_timeline) == 200 and full_timeline[0].id == str(api.latest_tweet_id) and api.calls['home_timeline'] == 2,
+        f'{len(full_timeline)} tweets, newest {full_timeline[0].id}')
+
+    # 同じ検索クエリで同時に検索する
+    print(f'{viewers} concurrent searches for the same hashtag:')
+    _, lag = await measure_lag(asyncio.gather(*[
+        TwitterSearchAPI(query='#nhk', twitter_account=account, twitter_account_api=api) for _ in range(viewers)]))
+    check('event loop stayed responsive', lag < min(0.1, delay / 2), f'max heartbeat lag {lag * 1000:.1f} ms')
+    check('search requested once', api.calls['search_tweets'] == 1, f'{api.calls["search_tweets"]} call(s)')
+
+    # 別の Twitter アカウントで同じ検索クエリを検索する
+    ## 検索結果には検索したアカウントからしか見えないツイートが含まれうるため、キャッシュを共有せずに検索し直す
+    print('Same hashtag searched from another account:')
+    await TwitterSearchAPI(query='#nhk', twitter_account=SimpleNamespace(id=2), twitter_account_api=api)
+    check('search results not shared across accounts', api.calls['search_tweets'] == 2, f'{api.calls["search_tweets"]} call(s)')
+
+    # いいねした後にホームタイムラインを取得する
+    ## キャッシュしたツイートのいいね済みかどうかが古くなるため、最新のツイートから取得し直す
+    print('Polling the timeline after favoriting a tweet:')
+    calls = api.calls['home_timeline']
+    await TwitterFavoriteAPI(tweet_id=newest_tweet_id, twitter_account=account, twitter_account_api=api)
+    await TwitterTimelineAPI(since_tweet_id=None, twitter_account=account, twitter_account_api=api)
+    check('timeline refetched after favorite', api.calls['home_timeline'] == calls + 1 and api.last_since_id is None,
+        f'{api.calls["home_timeline"] - calls} call(s), since_id={api.last_since_id}')
+
+    print(f'{"-" * 60}\n{sum(passed for _, passed in results)}/{len(results)} checks passed.')
+    return all(passed for _, passed in results)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Check that Twitter timeline and search requests do not block the event loop.')
+    parser.add_argument('--delay', type=float, default=1.0, help='seconds the fake Twitter API takes to respond')
+    parser.add_argument('--viewers', type=int, default=10, help='number of concurrent requests')
+    args = parser.parse_args()
+
+    sys.exit(0 if asyncio.run(run(args.delay, args.viewers)) is True else 1)
+
+
+if __name__ == '__main__':
+    main()
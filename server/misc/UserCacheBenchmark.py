@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+# Usage: pipenv run python -m misc.UserCacheBenchmark --username admin --password password [--duration 15] [--path /api/users/me]
+
+# ログイン中のユーザー情報のキャッシュ (UserCache) を有効にした場合と無効にした場合のそれぞれで KonomiTV の API サーバーを起動し、
+# 認証が必要な API に同時にリクエストしたときのスループットとレイテンシを計測する
+# KonomiTV 本体を起動し、ユーザーアカウントを作成した状態で実行すること (データベースの初期化が必要なため)
+# ベンチマーク用の API サーバーは、本体とは別のポート (server.port + 21) で API ワーカープロセスとして起動する
+
+import argparse
+import os
+import requests
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+from app.constants import CONFIG
+
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+BENCHMARK_HOST = '127.0.0.77'
+BENCHMARK_PORT = CONFIG['server']['port'] + 21
+
+
+def start_api_server(cache_enabled: bool) -> subprocess.Popen:
+    """ ユーザー情報のキャッシュを有効 or 無効にした API サーバーを起動し、リクエストを受け付けられるようになるまで待つ """
+
+    process = subprocess.Popen(
+        [
+            sys.executable, '-m', 'uvicorn', 'app.app:app',
+            '--host', BENCHMARK_HOST,
+            '--port', str(BENCHMARK_PORT),
+            '--http', 'httptools',
+            '--loop', ('asyncio' if os.name == 'nt' else 'uvloop'),
+            '--log-level', 'warning',
+            '--no-access-log',
+        ],
+        cwd = BASE_DIR,
+        env = {
+            **os.environ,
+            'KONOMITV_API_WORKER': '1',
+            'KONOMITV_DISABLE_USER_CACHE': '0' if cache_enabled is True else '1',
+        },
+    )
+
+    for _ in range(300):
+        try:
+            requests.get(f'http://{BENCHMARK_HOST}:{BENCHMARK_PORT}/api/version', timeout=1)
+            time.sleep(1)
+            return process
+        except requests.exceptions.ConnectionError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError('API server did not start.')
+
+
+def get_access_token(username: str, password: str) -> str:
+    """ ユーザー名とパスワードでログインし、アクセストークンを取得する """
+
+    response = requests.post(
+        f'http://{BENCHMARK_HOST}:{BENCHMARK_PORT}/api/users/token',
+        data = {'username': username, 'password': password},
+        timeout = 10,
+    )
+    if response.status_code != 200:
+        raise RuntimeError(f'Failed to log in. (HTTP Error {response.status_code})')
+    return response.json()['access_token']
+
+
+def run_client(paths: list[str], access_token: str, threads: int, duration: float) -> list[float]:
+    """ 1つのクライアントプロセス内で複数スレッドからリクエストを送り続け、成功したリクエストのレイテンシ (秒) を返す """
+
+    def worker() -> list[float]:
+        latencies: list[float] = []
+        session = requests.Session()
+        session.headers['Authorization'] = f'Bearer {access_token}'
+        end_at = time.monotonic() + duration
+        index = 0
+        while time.monotonic() < end_at:
+            start = time.monotonic()
+            response = session.get(f'http://{BENCHMARK_HOST}:{BENCHMARK_PORT}{paths[index % len(paths)]}')
+            if response.status_code == 200:
+                latencies.append(time.monotonic() - start)
+            index += 1
+        return latencies
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        results = list(executor.map(lambda _: worker(), range(threads)))
+    return [latency for latencies in results for latency in latencies]
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Measure authenticated API throughput with and without the KonomiTV user cache.')
+    parser.add_argument('--username', type=str, required=True, help='username of the KonomiTV account to log in with')
+    parser.add_argument('--password', type=str, required=True, help='password of the KonomiTV account to log in with')
+    parser.add_argument('--duration', type=float, default=15, help='duration of each run in seconds')
+    parser.add_argument('--clients', type=int, default=4, help='number of load generator processes')
+    parser.add_argument('--threads', type=int, default=16, help='number of threads per load generator process')
+    parser.add_argument('--path', type=str, nargs='+', default=['/api/users/me', '/api/settings/client'], help='authenticated API paths to request')
+    args = parser.parse_args()
+
+    results: list[tuple[str, float, float, float]] = []
+    for cache_enabled in (False, True):
+
+        label = 'with cache' if cache_enabled is True else 'without cache'
+        print(f'Benchmarking {label}...')
+        process = start_api_server(cache_enabled)
+        try:
+            access_token = get_access_token(args.username, args.password)
+
+            # 負荷をかける側が先にボトルネックにならないよう、複数プロセスからリクエストを送る
+            with ProcessPoolExecutor(max_workers=args.clients) as executor:
+                futures = [executor.submit(run_client, args.path, access_token, args.threads, args.duration) for _ in range(args.clients)]
+                latencies = sorted(latency for future in futures for latency in future.result())
+        finally:
+            process.terminate()
+            process.wait()
+
+        if len(latencies) == 0:
+            print('  No successful requests.')
+            continue
+        throughput = len(latencies) / args.duration
+        p50 = statistics.median(latencies) * 1000
+        p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000
+        results.append((label, throughput, p50, p99))
+
+    print(f'{"-" * 60}\nResults ({", ".join(args.path)})\n{"-" * 60}')
+    for label, throughput, p50, p99 in results:
+        scaling = throughput / results[0][1]
+        print(f'{label:>13}: {throughput:>8.1f} req/s (x{scaling:.2f})  p50: {p50:>7.1f} ms  p99: {p99:>7.1f} ms')
+
+
+if __name__ == '__main__':
+    main()